@@ -12,17 +12,68 @@ import json
 import logging
 import re
 import sys
-from typing import Dict, Any, List, Set
-from urllib.parse import urlparse, parse_qs
-import requests
+import functools
+import threading
+from typing import Callable, Dict, Any, List, Optional, Union
 
 # 导入API模块
-from src.api.bilibili import get_at_messages, parse_at_messages, send_reply_comment
+from src.api.bilibili import send_reply_comment, get_bilibili_session, api_url, VIDEO_VIEW_URL
+from src.api.http_session import connection_stats, is_timeout_error
 from src.api.dify import DifyAPI
+from src.core.pipeline import Pipeline
+from src.core.dedupe_store import ProcessedMessageStore
+from src.core.at_poller import AtPoller, AtFeedError
+from src.core.poll_scheduler import AdaptivePollScheduler
+from src.core.verdict_cache import VerdictCache, make_cache_key
+from src.core.claim_index import ClaimIndex
+from src.core.uri_resolver import resolve_uri, TYPE_VIDEO, TYPE_ARTICLE, TYPE_DYNAMIC
+from src.core.deadline import (
+    DeadlineExceeded, current_time, get_timeout, record_timeout, stage_timeout, timeout_stats
+)
+from src.core.account_pool import AccountPool, STRATEGY_LRU
+from src.core.lease_store import LeaseStore
+from src.core.priority import MentionPrioritizer, STALE_DROP
+from src.core.depth_controller import DepthController
+from src.core.endpoint_pool import EndpointPool, STRATEGY_LEAST_OUTSTANDING
+from src.core.circuit_breaker import (
+    CircuitBreaker, UpstreamUnavailable, protect, STATE_OPEN, STATE_HALF_OPEN, UPSTREAM_DIFY, UPSTREAM_BILIBILI
+)
+from src.core.parking_lot import ParkingLot
+from src.core.triage import NaiveBayesClassifier, Triage, TRIAGE_SKIP, TRIAGE_TEMPLATE
+from src.core.rate_limiter import TokenBucket
+from src.core.reply_outbox import (
+    ReplyOutbox, classify_reply_result, REPLY_OK, REPLY_SWITCH_TYPE, REPLY_FATAL
+)
+from src.core import recorder, tracing
+from src.core.recorder import TrafficRecorder
+from src.core.tracing import Trace, TraceWriter, trace_span
+from src.core.metrics import (
+    REGISTRY, MetricsServer, record_dify_usage, POLL_SECONDS, DIFY_FIRST_TOKEN_SECONDS, DIFY_SECONDS,
+    REPLY_POST_SECONDS, END_TO_END_SECONDS, MESSAGES_TOTAL, QUEUE_DEPTH, OUTBOX_PENDING, DIFY_INFLIGHT,
+    TRIAGE_TOTAL, DIFY_DEPTH, PARKED_MESSAGES
+)
 
 # 导入配置
 from config import BILIBILI_CONFIG, DIFY_CONFIG, SYSTEM_CONFIG, LOG_CONFIG
 
+# 回复的最大字数，B站评论一般有字数限制
+REPLY_MAX_LENGTH = 2000
+
+# 网页链接中的BV号
+BV_PATH_PATTERN = re.compile(r"/video/(BV[0-9A-Za-z]+)")
+
+# 熔断器的默认配置，B站的风控通常持续数分钟，统计窗口和熔断时长更长
+BREAKER_DEFAULTS = {
+    UPSTREAM_DIFY: {"failure_rate": 0.5, "min_requests": 5, "window": 60, "open_seconds": 30},
+    UPSTREAM_BILIBILI: {"failure_rate": 0.5, "min_requests": 5, "window": 300, "open_seconds": 300},
+}
+
+# @消息内容类型对应的评论区类型
+ITEM_TYPE_IDS = {
+    "dynamic": TYPE_DYNAMIC,  # 动态评论区类型
+    "article": TYPE_ARTICLE,  # 文章评论区类型
+}
+
 # 设置日志
 def setup_logging():
     """设置日志配置"""
@@ -48,333 +99,1310 @@ def setup_logging():
     
     return logging.getLogger("FakeDetectionBot")
 
+# 数据文件路径
+def data_dir(config: Optional[Dict[str, Any]] = None) -> str:
+    """数据文件(数据库、处理时间线等)的目录，默认为log目录，可通过SYSTEM_CONFIG["DATA_DIR"]修改"""
+    config = SYSTEM_CONFIG if config is None else config
+    return config.get("DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "log")
+
+def data_path(name: str, config: Optional[Dict[str, Any]] = None) -> str:
+    """数据文件的路径"""
+    return os.path.join(data_dir(config), name)
+
+def instance_id(config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    多实例运行(配置了COORDINATION_DB)时本实例的标识，单实例运行时为None
+    
+    标识决定租约的归属和本实例数据文件(已处理消息、发件箱、暂存消息)的文件名，重启后必须不变，
+    否则上次运行的发件箱和暂存消息不会再被处理，因此多实例运行时必须配置INSTANCE_ID
+    
+    Raises:
+        ValueError: 配置了COORDINATION_DB但没有配置INSTANCE_ID
+    """
+    config = SYSTEM_CONFIG if config is None else config
+    if not config.get("COORDINATION_DB"):
+        return None
+    instance = config.get("INSTANCE_ID")
+    if not instance:
+        raise ValueError("配置了COORDINATION_DB时必须为每个实例设置固定且互不相同的INSTANCE_ID")
+    return str(instance)
+
+def instance_path(name: str, config: Optional[Dict[str, Any]] = None) -> str:
+    """只属于本实例的数据文件路径，多实例运行时在文件名后加上实例标识"""
+    instance = instance_id(config)
+    if instance is None:
+        return data_path(name, config)
+    stem, ext = os.path.splitext(name)
+    return data_path(f"{stem}_{re.sub(r'[^0-9A-Za-z_.-]', '_', instance)}{ext}", config)
+
 # 已处理的消息ID存储
-def load_processed_messages() -> Set[int]:
-    """加载已处理的消息ID列表"""
-    processed_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log/processed_messages.json")
-    if os.path.exists(processed_file):
+def load_processed_messages(config: Optional[Dict[str, Any]] = None) -> ProcessedMessageStore:
+    """打开已处理消息存储，首次运行时自动导入旧版 log/processed_messages.json"""
+    return ProcessedMessageStore(
+        instance_path("processed_messages.db", config),
+        legacy_json_path=data_path("processed_messages.json", config) if instance_id(config) is None else None
+    )
+
+def load_triage(logger: logging.Logger) -> Optional[Triage]:
+    """按DIFY_CONFIG创建本地分流，TRIAGE_ENABLED为False时返回None"""
+    if not DIFY_CONFIG.get("TRIAGE_ENABLED", True):
+        return None
+    classifier = None
+    model_path = DIFY_CONFIG.get("TRIAGE_MODEL")
+    if model_path:
         try:
-            with open(processed_file, "r", encoding="utf-8") as f:
-                return set(json.load(f))
-        except Exception as e:
-            logging.error(f"加载已处理消息列表出错: {e}")
-            return set()
-    else:
-        return set()
+            classifier = NaiveBayesClassifier.load(model_path)
+            logger.info(f"已加载本地分流模型: {model_path}")
+        except (OSError, ValueError) as e:
+            logger.error(f"加载本地分流模型出错，只使用规则分流: {str(e)}")
+    return Triage(
+        min_chars=DIFY_CONFIG.get("TRIAGE_MIN_CHARS", 3),
+        classifier=classifier,
+        threshold=DIFY_CONFIG.get("TRIAGE_THRESHOLD", 0.9),
+        templates=DIFY_CONFIG.get("TRIAGE_TEMPLATES")
+    )
 
-def save_processed_messages(message_ids: Set[int]):
-    """保存已处理的消息ID列表"""
-    processed_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log/processed_messages.json")
-    try:
-        with open(processed_file, "w", encoding="utf-8") as f:
-            json.dump(list(message_ids), f)
-    except Exception as e:
-        logging.error(f"保存已处理消息列表出错: {e}")
+def load_dify_client(logger: logging.Logger) -> Union[DifyAPI, EndpointPool]:
+    """按DIFY_CONFIG创建Dify客户端，配置了DIFY_ENDPOINTS时返回在多个服务之间分配请求的服务池"""
+    endpoints = DIFY_CONFIG.get("DIFY_ENDPOINTS") or []
+    if not endpoints:
+        return DifyAPI()
+    pool = EndpointPool(
+        endpoints,
+        strategy=DIFY_CONFIG.get("DIFY_ENDPOINT_STRATEGY", STRATEGY_LEAST_OUTSTANDING),
+        eject_after=DIFY_CONFIG.get("DIFY_EJECT_AFTER", 3),
+        eject_seconds=DIFY_CONFIG.get("DIFY_EJECT_SECONDS", 30),
+        acquire_timeout=get_timeout("dify_connect", SYSTEM_CONFIG.get("TIMEOUTS"))
+    )
+    logger.info(f"使用 {len(pool)} 个Dify服务: {', '.join(endpoint.name for endpoint in pool.endpoints)}")
+    return pool
+
+def load_depth_controller(clock: Callable[[], float] = time.time) -> Optional[DepthController]:
+    """按DIFY_CONFIG创建核查深度控制器，DEPTH_ADAPTIVE为False时返回None(使用Dify应用的默认深度)"""
+    if not DIFY_CONFIG.get("DEPTH_ADAPTIVE", True):
+        return None
+    return DepthController(
+        min_depth=DIFY_CONFIG.get("DEPTH_MIN", 1),
+        max_depth=DIFY_CONFIG.get("DEPTH_MAX", 5),
+        default_depth=DIFY_CONFIG.get("DEPTH_DEFAULT", 3),
+        target_latency=DIFY_CONFIG.get("DEPTH_TARGET_LATENCY", 120),
+        workers=BILIBILI_CONFIG.get("PIPELINE_STAGES", {}).get("verify", {}).get("workers", 4),
+        token_budget=DIFY_CONFIG.get("TOKEN_BUDGET_PER_HOUR"),
+        price_budget=DIFY_CONFIG.get("PRICE_BUDGET_PER_HOUR"),
+        clock=clock
+    )
+
+def load_prioritizer(clock: Callable[[], float] = time.time) -> MentionPrioritizer:
+    """按BILIBILI_CONFIG创建@消息优先级"""
+    return MentionPrioritizer(
+        freshness=BILIBILI_CONFIG.get("FRESHNESS_DEADLINE", 3600),
+        stale_policy=BILIBILI_CONFIG.get("STALE_POLICY", STALE_DROP),
+        hot_weight=BILIBILI_CONFIG.get("PRIORITY_HOT_WEIGHT", 60),
+        hot_window=BILIBILI_CONFIG.get("PRIORITY_HOT_WINDOW", 600),
+        cached_weight=BILIBILI_CONFIG.get("PRIORITY_CACHED_WEIGHT", 600),
+        clock=clock
+    )
 
-def extract_video_oid(uri: str) -> int:
+def load_breakers(clock: Callable[[], float] = time.monotonic,
+                  config: Optional[Dict[str, Any]] = None) -> Dict[str, CircuitBreaker]:
+    """按SYSTEM_CONFIG创建Dify和B站的熔断器，CIRCUIT_BREAKER_ENABLED为False时返回空字典"""
+    config = SYSTEM_CONFIG if config is None else config
+    if not config.get("CIRCUIT_BREAKER_ENABLED", True):
+        return {}
+    configs = config.get("CIRCUIT_BREAKERS", {})
+    breakers = {}
+    for upstream, defaults in BREAKER_DEFAULTS.items():
+        config = {**defaults, **configs.get(upstream, {})}
+        breakers[upstream] = CircuitBreaker(
+            upstream,
+            failure_rate=config["failure_rate"],
+            min_requests=config["min_requests"],
+            window=config["window"],
+            open_seconds=config["open_seconds"],
+            max_open_seconds=config.get("max_open_seconds", 600),
+            clock=clock
+        )
+    return breakers
+
+def extract_video_oid(uri: str, timeout: Optional[float] = None) -> int:
     """
     从视频URI中提取视频OID（用于评论API）
     B站的视频评论API使用AV号（数字ID）作为oid参数
     
     Args:
         uri: 视频链接
+        timeout: 请求B站API时的超时(秒)，默认为TIMEOUTS中的resolve
     
     Returns:
         视频的OID (AV号)
     """
     try:
-        # 直接提取所有可能的数字ID格式
-        # 尝试从subject_id参数提取
-        if "subject_id=" in uri:
-            subject_id_match = re.search(r'subject_id=(\d+)', uri)
-            if subject_id_match:
-                return int(subject_id_match.group(1))
-        
-        # 尝试从路径中提取AV号
-        av_match = re.search(r'/av(\d+)', uri) or re.search(r'av(\d+)', uri)
-        if av_match:
-            return int(av_match.group(1))
-            
-        # 尝试从URL中提取数字ID
-        numeric_id_match = re.search(r'/video/(\d+)', uri)
-        if numeric_id_match:
-            return int(numeric_id_match.group(1))
-
-        # 尝试提取B站特有的numeric_id
-        business_id = None
-        # 如果URI包含business_id字段，可能是评论区ID
-        if "business_id" in uri:
-            business_id = re.search(r'business_id=(\d+)', uri)
-            if business_id:
-                return int(business_id.group(1))
-        
-        # 解析URL
-        parsed_url = urlparse(uri)
-        path_parts = parsed_url.path.strip('/').split('/')
+        # 一次解析链接中的subject_id、路径ID（BV号在本地解码）、oid、business_id
+        oid = resolve_uri(uri).oid
+        if oid:
+            return oid
         
-        # 如果是BV号格式，需要从B站API获取av号
-        if path_parts and len(path_parts) >= 2 and path_parts[0] == 'video' and path_parts[1].startswith('BV'):
-            bv_id = path_parts[1]
-            # 调用B站API将BV号转为av号
+        # BV号格式异常、本地无法解码时，请求B站API确认
+        bv_match = BV_PATH_PATTERN.search(uri)
+        if bv_match:
+            bv_id = bv_match.group(1)
             try:
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Referer": "https://www.bilibili.com/",
-                }
-                view_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bv_id}"
-                response = requests.get(view_url, headers=headers)
+                view_url = f"{api_url(VIDEO_VIEW_URL)}?bvid={bv_id}"
+                if timeout is None:
+                    timeout = get_timeout("resolve", SYSTEM_CONFIG.get("TIMEOUTS"))
+                response = get_bilibili_session().get(view_url, timeout=timeout)
                 response.raise_for_status()
                 result = response.json()
                 if result.get("code") == 0 and "data" in result and "aid" in result["data"]:
                     logging.info(f"成功将BV号 {bv_id} 转换为av号: {result['data']['aid']}")
                     return result["data"]["aid"]
             except Exception as e:
+                if is_timeout_error(e):
+                    record_timeout("resolve")
                 logging.error(f"BV号转av号失败: {e}, BV: {bv_id}")
-                
-        # 如果是BV号格式但未从API获取成功，尝试从查询参数中获取相关ID
-        if path_parts and any(part.startswith('BV') for part in path_parts):
-            query_params = parse_qs(parsed_url.query)
-            if 'oid' in query_params:
-                return int(query_params['oid'][0])
-        
-        # 最后手段：从URI中提取任何看起来像ID的数字
-        # 优先检查以下模式:
-        # 1. video/{number}
-        # 2. 任何包含数字ID的路径段
-        for pattern in [r'/video/(\d+)', r'/(\d+)']:
-            id_match = re.search(pattern, uri)
-            if id_match:
-                return int(id_match.group(1))
         
-        # 如果URI中包含"oid="参数
-        oid_match = re.search(r'oid=(\d+)', uri)
-        if oid_match:
-            return int(oid_match.group(1))
-            
         # 如果所有方法都失败，返回0表示无法提取
         return 0
     except Exception as e:
         logging.error(f"从URI提取视频OID失败: {e}, URI: {uri}")
         return 0
 
-def process_at_message(message: Dict[str, Any], dify_client: DifyAPI, logger: logging.Logger) -> bool:
+def resolve_reply_target(message: Dict[str, Any], logger: logging.Logger,
+                         deadline: Optional[float] = None, trace: Optional[Trace] = None) -> Optional[Dict[str, int]]:
     """
-    处理单条@消息
+    解析@消息对应的回复目标
+    消息字段优先，缺失的字段从native_uri（客户端链接，直接带有oid和评论ID）和uri中补齐
+    
+    Args:
+        message: 解析后的@消息
+        logger: 日志记录器
+        deadline: 处理截止时间戳，None表示不限时
+        trace: 消息的处理时间线，None表示不记录
+    
+    Returns:
+        Optional[Dict[str, int]]: {"oid": 评论区对象ID, "type_id": 评论区类型, "root": 根评论ID, "parent": 父评论ID}，
+        无法获取有效oid时返回None
+    """
+    item = message["item"]
+    native_target = resolve_uri(item.get("native_uri", ""))
+    if native_target.oid:
+        uri_target = native_target
+    else:
+        uri_target = resolve_uri(item.get("uri", ""))
+    
+    # subject_id对应oid，没有时依次使用链接中的oid和business_id
+    oid = item.get("subject_id", 0) or uri_target.oid
+    if not oid and item.get("uri"):
+        # 链接中没有可用的ID时，BV号格式异常的情况由extract_video_oid请求B站API确认
+        with trace_span(trace, "bv_lookup"):
+            oid = extract_video_oid(item["uri"], timeout=stage_timeout("resolve", deadline, SYSTEM_CONFIG.get("TIMEOUTS")))
+    if not oid:
+        oid = item.get("business_id", 0)
+        logger.info(f"使用business_id作为oid: {oid}")
+    elif not item.get("subject_id", 0):
+        logger.info(f"从链接提取到oid: {oid}")
+    
+    # 如果仍然获取不到有效的oid，则无法回复
+    if not oid:
+        logger.error("无法获取有效的oid，无法回复评论")
+        return None
+    
+    # 判断评论类型，消息类型未知时使用链接类型，默认为视频评论类型
+    item_type = item.get("type", "")
+    type_id = ITEM_TYPE_IDS.get(item_type) or uri_target.type_id or TYPE_VIDEO
+    logger.info(f"评论类型: {item_type}, type_id: {type_id}")
+    
+    # target_id对应root (评论根ID)，source_id对应parent (回复评论的ID)
+    root_id = item.get("target_id", 0) or uri_target.root
+    parent_id = item.get("source_id", 0) or uri_target.parent
+    
+    return {"oid": oid, "type_id": type_id, "root": root_id, "parent": parent_id}
+
+def verify_message(message: Dict[str, Any], dify_client: DifyAPI, logger: logging.Logger,
+                   deadline: Optional[float] = None, trace: Optional[Trace] = None,
+                   depth_controller: Optional[DepthController] = None, backlog: int = 0,
+                   breaker: Optional[CircuitBreaker] = None) -> Optional[str]:
+    """
+    调用Dify API核查@消息的标题内容
     
     Args:
         message: 解析后的@消息
         dify_client: Dify API客户端
         logger: 日志记录器
+        deadline: 处理截止时间戳，会为发送回复预留reply_post的时间，None表示不限时
+        trace: 消息的处理时间线，None表示不记录
+        depth_controller: 核查深度控制器，按积压和预算选择Dify应用的depth，None表示使用Dify应用的默认深度
+        backlog: 排在这条消息之前或同时处理的消息数，用于选择深度
+        breaker: Dify熔断器，设置后熔断期间不请求Dify，请求失败时抛出UpstreamUnavailable而不是返回None
     
     Returns:
-        bool: 处理是否成功
+        Optional[str]: 核查结果文本，失败时返回None
+    
+    Raises:
+        DeadlineExceeded: 开始请求前处理时限已用完
+        CircuitOpenError: Dify熔断中，没有发出请求
+        UpstreamUnavailable: 设置了breaker且Dify请求失败，或没有等到Dify并发名额(attempted为False)
     """
-    try:
-        # 获取视频标题作为查询内容
-        title = message["item"]["title"]
-        if not title:
-            logger.warning(f"消息 {message['id']} 没有标题，跳过处理")
-            return False
+    # 获取视频标题作为查询内容
+    title = message["item"]["title"]
+    if not title:
+        logger.warning(f"消息 {message['id']} 没有标题，跳过处理")
+        return None
+    
+    # 连接和读取超时不超过剩余时限，并为发送回复预留时间
+    timeouts = SYSTEM_CONFIG.get("TIMEOUTS")
+    reserve = get_timeout("reply_post", timeouts) if deadline is not None else 0.0
+    timeout = (stage_timeout("dify_connect", deadline, timeouts, reserve),
+               stage_timeout("dify_idle", deadline, timeouts, reserve))
+    
+    # 调用Dify API进行查询，统计首段回答耗时、总耗时和进行中的请求数；请求结果报告给熔断器
+    started = time.monotonic()
+    with protect(breaker, UPSTREAM_DIFY) as call, DIFY_INFLIGHT.track(), DIFY_SECONDS.time():
+        # 积压多或预算紧张时浅查，空闲时深查
+        depth = depth_controller.choose(backlog) if depth_controller is not None else None
+        inputs = {"depth": depth} if depth is not None else None
+        if depth is not None:
+            DIFY_DEPTH.observe(depth)
         
-        logger.info(f"处理@消息 ID:{message['id']}, 标题: {title}")
+        logger.info(f"向Dify API发送查询: {title}" + (f" (深度 {depth}, 积压 {backlog})" if depth is not None else ""))
+        with trace_span(trace, "dify_request") as span:
+            if depth is not None:
+                span["depth"] = depth
+            response = dify_client.send_chat_message(query=title, inputs=inputs, timeout=timeout)
         
-        # 调用Dify API进行查询
-        logger.info(f"向Dify API发送查询: {title}")
-        response = dify_client.send_chat_message(query=title)
+        if response.get("saturated"):
+            # 本地并发名额已满，没有请求Dify，不计入熔断器，消息暂存后再试
+            logger.warning(f"消息 {message['id']} 没有等到Dify并发名额: {response['error']}")
+            if breaker is not None:
+                raise UpstreamUnavailable(UPSTREAM_DIFY, response["error"], attempted=False)
+            return None
         
         if "error" in response:
+            if response.get("timeout"):
+                record_timeout("dify_connect")
+            recorder.record(recorder.KIND_DIFY, query=title, error=response["error"])
             logger.error(f"Dify API返回错误: {response['error']}")
-            return False
+            call["ok"] = False
+            if breaker is not None:
+                raise UpstreamUnavailable(UPSTREAM_DIFY, response["error"])
+            return None
         
-        # 处理响应
+        # 录制流量时保存原始事件及其相对请求开始的时间
+        events = [] if recorder.is_recording() else None
+        
+        def on_event(event):
+            events.append([round(time.monotonic() - started, 4), event.data])
+        
+        # 处理响应，回答超过回复字数上限后不再保存超出部分(回复时也会被截掉)，默认继续读取到message_end以统计用量，
+        # 配置STOP_AT_REPLY_LIMIT时立即停止读取，不再为丢弃的内容消耗token
+        stop_at_limit = DIFY_CONFIG.get("STOP_AT_REPLY_LIMIT", False)
         if response.get("status") == "streaming":
-            result = dify_client.get_streaming_response(response["response"])
+            with trace_span(trace, "dify_stream") as span:
+                stream = dify_client.read_stream(
+                    response["response"],
+                    max_chars=REPLY_MAX_LENGTH,
+                    deadline=None if deadline is None else deadline - reserve,
+                    on_event=on_event if events is not None else None,
+                    stop_at_max_chars=stop_at_limit
+                )
+                if stream["first_chunk_at"] is not None:
+                    span["first_chunk"] = round(stream["first_chunk_at"] - started, 4)
+            if stream["first_chunk_at"] is not None:
+                DIFY_FIRST_TOKEN_SECONDS.observe(stream["first_chunk_at"] - started)
+            record_dify_usage(stream["usage"])
+            if events is not None:
+                recorder.record(recorder.KIND_DIFY, query=title, events=events)
+            if stream["timeout"]:
+                record_timeout("dify_idle")
+            if stream["error"] is not None:
+                logger.error(f"Dify API流式响应出错: {stream['error']}")
+                # 本条消息的处理时限用完与Dify是否正常无关
+                if deadline is not None and current_time() >= deadline - reserve:
+                    return None
+                call["ok"] = False
+                if breaker is not None:
+                    raise UpstreamUnavailable(UPSTREAM_DIFY, stream["error"])
+                return None
+            if depth is not None:
+                # 提前停止或截止时间前没读到message_end时按估计的消耗计入预算
+                depth_controller.record(depth, time.monotonic() - started, stream["usage"],
+                                        estimate=stream["truncated"])
+            if stream["truncated"]:
+                logger.info(f"回答已超过 {REPLY_MAX_LENGTH} 字，" + ("停止读取" if stop_at_limit else "超出部分不再保存"))
+            if stream["usage"]:
+                usage = stream["usage"]
+                logger.info(f"Dify用量: tokens={usage.get('total_tokens')}, 费用={usage.get('total_price')} {usage.get('currency', '')}, "
+                            f"耗时={usage.get('latency')}s")
+            result = stream["answer"]
+            call["ok"] = True
         else:
+            record_dify_usage(response.get("metadata", {}).get("usage"))
+            if depth is not None:
+                depth_controller.record(depth, time.monotonic() - started, response.get("metadata", {}).get("usage"))
+            if events is not None:
+                recorder.record(recorder.KIND_DIFY, query=title, response=response,
+                                elapsed=round(time.monotonic() - started, 4))
             result = response.get("answer", "无法获取回复内容")
-        
-        logger.info(f"Dify API返回结果: {result[:100]}...")
-        
-        # 根据用户提供的正确映射关系修改参数
-        # subject_id对应oid
-        oid = message["item"].get("subject_id", 0)
-        
-        # 如果没有subject_id，尝试提取
-        if not oid:
-            logger.debug("尝试从URI提取subject_id")
-            # 尝试从URI提取subject_id
-            uri = message["item"]["uri"]
-            if "subject_id=" in uri:
-                try:
-                    subject_id_match = re.search(r'subject_id=(\d+)', uri)
-                    if subject_id_match:
-                        oid = int(subject_id_match.group(1))
-                        logger.info(f"从URI提取到subject_id: {oid}")
-                except Exception as e:
-                    logger.error(f"从URI提取subject_id失败: {e}")
-            
-            # 如果还是无法获取oid，尝试使用business_id
-            if not oid:
-                oid = message["item"].get("business_id", 0)
-                logger.info(f"使用business_id作为oid: {oid}")
-        
-        # 如果仍然获取不到有效的oid，则无法回复
-        if not oid:
-            logger.error("无法获取有效的oid，无法回复评论")
+            call["ok"] = True
+    
+    # 读取流式响应出错时不回复错误信息，也避免被缓存
+    if not result or result.startswith("错误: "):
+        logger.error(f"Dify API未返回有效结果: {result}")
+        return None
+    
+    logger.info(f"Dify API返回结果: {result[:100]}...")
+    return result
+
+def truncate_reply(result: str) -> str:
+    """限制回复字数，B站评论一般有字数限制"""
+    if len(result) > REPLY_MAX_LENGTH:
+        return result[:REPLY_MAX_LENGTH - 3] + "..."
+    return result
+
+def post_reply(message: Dict[str, Any], target: Dict[str, int], result: str, logger: logging.Logger,
+               deadline: Optional[float] = None, trace: Optional[Trace] = None) -> bool:
+    """
+    将核查结果回复到@消息所在的评论区
+    
+    Args:
+        message: 解析后的@消息
+        target: resolve_reply_target返回的回复目标
+        result: 核查结果文本
+        logger: 日志记录器
+        deadline: 处理截止时间戳，超过后放弃重试，None表示不限时
+        trace: 消息的处理时间线，None表示不记录
+    
+    Returns:
+        bool: 是否回复成功
+    """
+    oid = target["oid"]
+    type_id = target["type_id"]
+    root_id = target["root"]
+    parent_id = target["parent"]
+    
+    # 回复评论
+    logger.info(f"回复评论, OID: {oid}, type_id: {type_id}, root_id: {root_id}, parent_id: {parent_id}")
+    
+    result = truncate_reply(result)
+    
+    # 发送回复
+    retry_count = 0
+    while retry_count < BILIBILI_CONFIG.get("RETRY_TIMES", 3):
+        try:
+            timeout = stage_timeout("reply_post", deadline, SYSTEM_CONFIG.get("TIMEOUTS"))
+        except DeadlineExceeded:
+            logger.error(f"消息 {message['id']} 已超过处理截止时间，放弃回复")
             return False
         
-        # 判断评论类型
-        type_id = 1  # 默认为视频评论类型
-        item_type = message["item"].get("type", "")
-        if item_type == "dynamic":
-            type_id = 17  # 动态评论区类型
-        elif item_type == "article":
-            type_id = 12  # 文章评论区类型
-        
-        logger.info(f"评论类型: {item_type}, type_id: {type_id}")
-        
-        # target_id对应root (评论根ID)
-        root_id = message["item"].get("target_id", 0)
-        if root_id == 0 and "comment_root_id" in message["item"]["uri"]:
-            try:
-                root_id = int(message["item"]["uri"].split("comment_root_id=")[1].split("&")[0])
-            except Exception:
-                logger.warning("无法从URI提取评论根ID")
-        
-        # source_id对应parent (回复评论的ID)
-        parent_id = message["item"].get("source_id", 0)
-        
-        # 回复评论
-        logger.info(f"回复评论, OID: {oid}, type_id: {type_id}, root_id: {root_id}, parent_id: {parent_id}")
-        
-        # 限制回复字数，B站评论一般有字数限制
-        if len(result) > 2000:
-            result = result[:1997] + "..."
-            
-        # 发送回复
-        retry_count = 0
-        while retry_count < BILIBILI_CONFIG.get("RETRY_TIMES", 3):
-            try:
+        try:
+            with REPLY_POST_SECONDS.time(), trace_span(trace, "reply_post", attempt=retry_count + 1):
                 reply_result = send_reply_comment(
                     oid=oid,
                     message=result,
                     root=root_id,
                     parent=parent_id,
-                    type_id=type_id
+                    type_id=type_id,
+                    timeout=timeout
                 )
+            
+            category = classify_reply_result(reply_result.get("code"), type_id)
+            if category == REPLY_OK:
+                logger.info(f"成功回复评论, 回复ID: {reply_result.get('data', {}).get('rpid', 'unknown')}")
+                return True
+            else:
+                logger.warning(f"回复评论失败, 错误码: {reply_result.get('code')}, 消息: {reply_result.get('message')}")
+                
+                # 评论区类型不对（如12002评论区已关闭），尝试动态评论类型
+                if category == REPLY_SWITCH_TYPE:
+                    logger.info("尝试使用动态评论类型...")
+                    type_id = TYPE_DYNAMIC
+                    continue
+                
+                # 重试也不会成功的错误
+                if category == REPLY_FATAL:
+                    return False
                 
-                if reply_result.get("code") == 0:
-                    logger.info(f"成功回复评论, 回复ID: {reply_result.get('data', {}).get('rpid', 'unknown')}")
-                    return True
-                else:
-                    logger.warning(f"回复评论失败, 错误码: {reply_result.get('code')}, 消息: {reply_result.get('message')}")
-                    
-                    # 错误码12002表示评论区已关闭，尝试其他评论类型
-                    if reply_result.get("code") == 12002 and type_id == 1:
-                        logger.info("尝试使用动态评论类型...")
-                        type_id = 17
-                        continue
-                    
-                    retry_count += 1
-                    time.sleep(BILIBILI_CONFIG.get("RETRY_INTERVAL", 60))
-            except Exception as e:
-                logger.error(f"回复评论时发生异常: {str(e)}")
                 retry_count += 1
-                time.sleep(BILIBILI_CONFIG.get("RETRY_INTERVAL", 60))
+        except Exception as e:
+            if is_timeout_error(e):
+                record_timeout("reply_post")
+            logger.error(f"回复评论时发生异常: {str(e)}")
+            retry_count += 1
+        
+        if retry_count >= BILIBILI_CONFIG.get("RETRY_TIMES", 3):
+            break
+        retry_interval = BILIBILI_CONFIG.get("RETRY_INTERVAL", 60)
+        if deadline is not None and current_time() + retry_interval >= deadline:
+            logger.error(f"消息 {message['id']} 重试将超过处理截止时间，放弃回复")
+            return False
+        time.sleep(retry_interval)
+    
+    logger.error(f"回复评论失败，已达到最大重试次数")
+    return False
+
+def process_at_message(message: Dict[str, Any], dify_client: DifyAPI, logger: logging.Logger,
+                       deadline: Optional[float] = None, trace: Optional[Trace] = None) -> bool:
+    """
+    处理单条@消息（依次执行解析目标、Dify核查、发送回复）
+    
+    Args:
+        message: 解析后的@消息
+        dify_client: Dify API客户端
+        logger: 日志记录器
+        deadline: 处理截止时间戳，超过后放弃剩余步骤，None表示不限时
+        trace: 消息的处理时间线，记录各步骤耗时，由调用方结束；None表示不记录
+    
+    Returns:
+        bool: 处理是否成功
+    """
+    try:
+        logger.info(f"处理@消息 ID:{message['id']}, 标题: {message['item']['title']}")
+        
+        with trace_span(trace, "resolve"):
+            target = resolve_reply_target(message, logger, deadline, trace)
+        if target is None:
+            return False
         
-        logger.error(f"回复评论失败，已达到最大重试次数")
+        with trace_span(trace, "verify"):
+            result = verify_message(message, dify_client, logger, deadline, trace)
+        if result is None:
+            return False
+        
+        with trace_span(trace, "post"):
+            return post_reply(message, target, result, logger, deadline, trace)
+    
+    except DeadlineExceeded as e:
+        logger.error(f"消息 {message['id']} {str(e)}")
         return False
-                
     except Exception as e:
         logger.error(f"处理@消息时发生异常: {str(e)}")
         return False
 
-def main():
-    """主函数，运行机器人"""
+def build_pipeline(dify_client: DifyAPI, logger: logging.Logger,
+                   verdict_cache: Optional[VerdictCache] = None,
+                   claim_index: Optional[ClaimIndex] = None,
+                   outbox: Optional[ReplyOutbox] = None,
+                   prioritizer: Optional[MentionPrioritizer] = None,
+                   depth_controller: Optional[DepthController] = None,
+                   dify_breaker: Optional[CircuitBreaker] = None) -> Pipeline:
+    """
+    创建@消息处理流水线：解析目标(resolve) → Dify核查(verify) → 发送回复(post)
+    拉取和解析@消息由主循环完成，各阶段的并发数和队列容量由PIPELINE_STAGES配置
+    
+    Args:
+        dify_client: Dify API客户端
+        logger: 日志记录器
+        verdict_cache: 核查结果缓存，同一评论区下相同内容的@共用一次Dify调用，None表示不缓存
+        claim_index: 相似说法索引，缓存未命中时复用相似说法的核查结果，None表示不查找
+        outbox: 回复发件箱，post阶段只把回复写入发件箱，由其后台线程限流发送和重试；None表示在post阶段直接发送
+        prioritizer: @消息优先级，resolve和verify阶段的队列按优先级取任务；None表示先进先出
+        depth_controller: 核查深度控制器，按resolve和verify阶段的积压选择Dify的核查深度；None表示使用Dify应用的默认深度
+        dify_breaker: Dify熔断器，熔断期间或Dify请求失败时消息以失败结束并在任务数据的"parked"中记录原因，
+            由完成回调暂存；None表示Dify请求失败时直接放弃该消息
+    
+    Returns:
+        Pipeline: 处理流水线，任务数据为 {"message": @消息, "target": 回复目标, "answer": 核查结果,
+        "trace": 处理时间线(可选), "triage": 本地分流结果(可选), "parked": 上游不可用的原因(可选)}
+    """
+    def abandon_on_deadline(name, handler):
+        """记录阶段耗时，处理时限用完时放弃该消息的剩余阶段，上游不可用时记录原因以便暂存"""
+        def wrapped(job: Dict[str, Any], deadline: float) -> bool:
+            with trace_span(job.get("trace"), name) as span:
+                try:
+                    span["ok"] = handler(job, deadline)
+                except DeadlineExceeded as e:
+                    logger.error(f"消息 {job['message']['id']} {str(e)}")
+                    span["ok"] = False
+                except UpstreamUnavailable as e:
+                    logger.warning(f"消息 {job['message']['id']} {str(e)}")
+                    job["parked"] = e
+                    span["ok"] = False
+                    span["parked"] = e.upstream
+                return span["ok"]
+        return wrapped
+    
+    def resolve_stage(job: Dict[str, Any], deadline: float) -> bool:
+        logger.info(f"处理@消息 ID:{job['message']['id']}, 标题: {job['message']['item']['title']}")
+        job["target"] = resolve_reply_target(job["message"], logger, deadline, job.get("trace"))
+        return job["target"] is not None
+    
+    def verify_with_index(message: Dict[str, Any], deadline: float, trace: Optional[Trace] = None) -> Optional[str]:
+        """先查找相似说法的核查结果，没有时再调用Dify，并把新结果加入索引"""
+        title = message["item"]["title"]
+        if claim_index is not None:
+            try:
+                with trace_span(trace, "claim_lookup") as span:
+                    match = claim_index.lookup(title)
+                    span["hit"] = match is not None
+            except Exception as e:
+                logger.error(f"查找相似说法出错: {str(e)}")
+                match = None
+            if match is not None:
+                logger.info(f"复用相似说法的核查结果(相似度 {match['similarity']:.2f}): {match['claim']}")
+                MESSAGES_TOTAL.inc("cached")
+                return match["verdict"]
+        
+        backlog = 0
+        if depth_controller is not None:
+            stages = pipeline.stats()
+            # 不计入当前这条消息
+            backlog = max(0, stages["resolve"]["pending"] + stages["verify"]["pending"] - 1)
+        answer = verify_message(message, dify_client, logger, deadline, trace, depth_controller, backlog,
+                                dify_breaker)
+        if answer is not None and claim_index is not None:
+            try:
+                claim_index.add(title, answer)
+            except Exception as e:
+                logger.error(f"保存相似说法索引出错: {str(e)}")
+        return answer
+    
+    def verify_stage(job: Dict[str, Any], deadline: float) -> bool:
+        trace = job.get("trace")
+        # 本地分流判断为没有可核查说法的消息直接回复模板，不调用Dify
+        triage = job.get("triage")
+        if triage is not None and triage.decision == TRIAGE_TEMPLATE:
+            logger.info(f"@消息 {job['message']['id']} 没有可核查的说法({triage.reason})，回复模板")
+            job["answer"] = triage.reply
+            return True
+        if verdict_cache is None:
+            job["answer"] = verify_with_index(job["message"], deadline, trace)
+        else:
+            key = make_cache_key(job["target"]["oid"], job["message"]["item"]["title"])
+            computed = []
+            
+            def compute() -> Optional[str]:
+                computed.append(True)
+                return verify_with_index(job["message"], deadline, trace)
+            
+            # 合并到其他消息的Dify调用时，发起调用的消息抛出的异常也抛给本条消息：
+            # Dify请求失败时与发起调用的消息一样暂存并计入失败次数，熔断中则暂存但不计入
+            with trace_span(trace, "verdict_cache") as span:
+                try:
+                    job["answer"] = verdict_cache.get_or_compute(key, compute,
+                                                                 timeout=max(0.0, deadline - current_time()))
+                except DeadlineExceeded:
+                    # 发起调用的消息的处理时限用完，与本条消息无关
+                    if computed or dify_breaker is None:
+                        raise
+                    raise UpstreamUnavailable(UPSTREAM_DIFY, "合并的Dify调用超过处理时限", attempted=False)
+                span["hit"] = not computed
+            # 命中缓存或合并到其他消息的Dify调用
+            if job["answer"] is not None and not computed:
+                MESSAGES_TOTAL.inc("cached")
+            # 合并到的调用没有结果但也没有失败(如发起调用的消息时限已到)，本条消息还有时间时暂存，不计入失败次数；
+            # 等待超时说明本条消息的时限已到，直接放弃
+            if (job["answer"] is None and not computed and dify_breaker is not None
+                    and current_time() < deadline):
+                raise UpstreamUnavailable(UPSTREAM_DIFY, "合并的Dify调用没有结果", attempted=False)
+        return job["answer"] is not None
+    
+    def post_stage(job: Dict[str, Any], deadline: float) -> bool:
+        mentioned_at = job["message"].get("at_time", 0)
+        if outbox is None:
+            success = post_reply(job["message"], job["target"], job["answer"], logger, deadline, job.get("trace"))
+            if success and mentioned_at:
+                END_TO_END_SECONDS.observe(max(0.0, time.time() - mentioned_at))
+            return success
+        if outbox.enqueue(job["message"]["id"], job["target"], truncate_reply(job["answer"]), mentioned_at):
+            logger.info(f"@消息 {job['message']['id']} 的回复已写入发件箱")
+        return True
+    
+    resolve_priority = verify_priority = None
+    if prioritizer is not None:
+        def resolve_priority(job: Dict[str, Any]) -> float:
+            return prioritizer.score(job["message"])
+        
+        def verify_priority(job: Dict[str, Any]) -> float:
+            # 已有缓存结果的消息不需要调用Dify，优先处理
+            cached = verdict_cache is not None and verdict_cache.get(
+                make_cache_key(job["target"]["oid"], job["message"]["item"]["title"])) is not None
+            return prioritizer.score(job["message"], cached=cached)
+    
+    stage_config = BILIBILI_CONFIG.get("PIPELINE_STAGES", {})
+    pipeline = Pipeline(name="at", deadline=BILIBILI_CONFIG.get("MESSAGE_DEADLINE", 900))
+    for name, handler, workers, queue_size, priority in [
+        ("resolve", resolve_stage, 2, 50, resolve_priority),
+        ("verify", verify_stage, 4, 20, verify_priority),
+        ("post", post_stage, 2, 50, None),
+    ]:
+        config = stage_config.get(name, {})
+        pipeline.add_stage(
+            name,
+            abandon_on_deadline(name, handler),
+            workers=config.get("workers", workers),
+            queue_size=config.get("queue_size", queue_size),
+            priority=priority
+        )
+    return pipeline
+
+class MentionDispatcher:
+    """
+    把@消息派发到处理流水线，并在消息结束时标记为已处理或暂存；main()和tools/replay.py共用
+    
+    - dispatch: 本地分流，Dify熔断期间暂存，按优先级计算截止时间后提交到流水线
+    - drop_if_stale: 放弃超过新鲜度时限的消息
+    - resume_parked: Dify恢复后重新派发暂存的消息
+    
+    消息结束时调用on_finished(消息ID, 结果)，结果为processed/failed/skipped/stale，
+    与指标fakebot_messages_total的标签一致；processed表示回复已写入发件箱，暂存的消息不算结束。
+    消息结束或暂存后调用on_settled(消息ID)，此后不再需要从@信息接口重新拉取该消息
+    """
+    
+    def __init__(self, pipeline: Pipeline, processed_messages: ProcessedMessageStore, logger: logging.Logger,
+                 prioritizer: MentionPrioritizer,
+                 triage: Optional[Triage] = None,
+                 depth_controller: Optional[DepthController] = None,
+                 breakers: Optional[Dict[str, CircuitBreaker]] = None,
+                 parking: Optional[ParkingLot] = None,
+                 leases: Optional[LeaseStore] = None,
+                 tracing_enabled: bool = False,
+                 on_finished: Optional[Callable[[int, str], None]] = None,
+                 on_settled: Optional[Callable[[int], None]] = None):
+        """
+        Args:
+            pipeline: build_pipeline创建的处理流水线
+            processed_messages: 已处理消息存储
+            logger: 日志记录器
+            prioritizer: @消息优先级
+            triage: 本地分流，None表示所有消息都调用Dify
+            depth_controller: 核查深度控制器，只用于统计
+            breakers: 各上游的熔断器
+            parking: 暂存的@消息，设置时必须有Dify熔断器
+            leases: 多实例协调的消息租约，None表示单实例运行
+            tracing_enabled: 是否记录每条消息的处理时间线
+            on_finished: 消息结束时的回调
+            on_settled: 消息结束或暂存后的回调，用于推进@消息的拉取高水位
+        """
+        self.pipeline = pipeline
+        self.processed_messages = processed_messages
+        self.logger = logger
+        self.prioritizer = prioritizer
+        self.triage = triage
+        self.depth_controller = depth_controller
+        self.breakers = breakers or {}
+        self.parking = parking
+        self.leases = leases
+        self.tracing_enabled = tracing_enabled
+        self.on_finished = on_finished
+        self.on_settled = on_settled
+    
+    def dispatch(self, message: Dict[str, Any], resumed: bool = False) -> bool:
+        """
+        交给流水线处理，完成后在回调中标记为已处理；本地分流判断为不需要回复的消息直接标记为已处理，
+        Dify熔断期间需要调用Dify的消息直接暂存
+        
+        Args:
+            message: @消息
+            resumed: 是否为重新派发的暂存消息
+        
+        Returns:
+            bool: 是否已接收，入口队列已满时返回False
+        """
+        message_id = message["id"]
+        verdict = self.triage.classify(message) if self.triage is not None else None
+        if verdict is not None:
+            TRIAGE_TOTAL.inc(verdict.decision, verdict.reason)
+            if verdict.decision == TRIAGE_SKIP:
+                self.logger.info(f"@消息 {message_id} 不需要回复({verdict.reason})，跳过")
+                self._finish(message_id, "skipped")
+                return True
+        
+        if (self.parking is not None and (verdict is None or verdict.decision != TRIAGE_TEMPLATE)
+                and self.breakers[UPSTREAM_DIFY].retry_after() > 0):
+            self.parking.park(message_id, message, UPSTREAM_DIFY, failed=False)
+            MESSAGES_TOTAL.inc("parked")
+            self.logger.info(f"Dify熔断中，@消息 {message_id} 已暂存")
+            self._settled(message_id)
+            return True
+        
+        trace = Trace(message_id, message.get("at_time")) if self.tracing_enabled else None
+        job = {"message": message, "target": None, "answer": None, "trace": trace, "triage": verdict,
+               "resumed": resumed}
+        deadline = self.prioritizer.deadline(message, current_time() + self.pipeline.deadline)
+        if not self.pipeline.submit(message_id, job,
+                                    on_done=functools.partial(self.on_message_done, trace=trace, job=job),
+                                    deadline=deadline):
+            if self.leases is not None:
+                self.leases.release(message_id)
+            return False
+        return True
+    
+    def drop_if_stale(self, message: Dict[str, Any]) -> bool:
+        """
+        超过新鲜度时限的消息不再调用Dify，直接标记为已处理
+        
+        Returns:
+            bool: 是否已放弃，STALE_POLICY为降级或消息未过期时返回False
+        """
+        if self.prioritizer.stale_policy != STALE_DROP or not self.prioritizer.is_stale(message):
+            return False
+        self.logger.warning(f"@消息 {message['id']} 被@已超过 {self.prioritizer.freshness:.0f} 秒，放弃处理")
+        self.prioritizer.record_dropped()
+        self._finish(message["id"], "stale")
+        return True
+    
+    def resume_parked(self) -> int:
+        """
+        Dify恢复后重新派发暂存的消息，熔断器half_open时只派发一条作为探测
+        
+        Returns:
+            int: 重新派发的消息数
+        """
+        if self.parking is None:
+            return 0
+        state = self.breakers[UPSTREAM_DIFY].state
+        if state == STATE_OPEN:
+            return 0
+        limit = 1 if state == STATE_HALF_OPEN else BILIBILI_CONFIG.get("POLL_PAGE_SIZE", 20)
+        messages = self.parking.take(UPSTREAM_DIFY, limit)
+        resumed = 0
+        for index, message in enumerate(messages):
+            message_id = message["id"]
+            if message_id in self.processed_messages or self.pipeline.is_pending(message_id):
+                self.parking.done(message_id)
+                continue
+            if self.drop_if_stale(message):
+                self.parking.done(message_id)
+                continue
+            # 暂存期间已由其他实例接手
+            if self.leases is not None and not self.leases.claim(message_id, message):
+                self.parking.done(message_id)
+                continue
+            if not self.dispatch(message, resumed=True):
+                for rest in messages[index:]:
+                    self.parking.park(rest["id"], rest, UPSTREAM_DIFY, failed=False)
+                break
+            resumed += 1
+        if resumed:
+            self.logger.info(f"重新派发了 {resumed} 条暂存的@消息")
+        return resumed
+    
+    def on_message_done(self, message_id: int, success: bool, trace: Optional[Trace] = None,
+                        job: Optional[Dict[str, Any]] = None):
+        """消息处理结束回调：无论成功与否都标记为已处理，防止重复处理；上游不可用的消息暂存，不标记为已处理"""
+        if self.parking is not None and job is not None:
+            error = job.get("parked")
+            if error is not None:
+                if self.parking.park(message_id, job["message"], error.upstream, failed=error.attempted):
+                    MESSAGES_TOTAL.inc("parked")
+                    tracing.finish(trace, False)
+                    self.logger.info(f"@消息 {message_id} 已暂存，{error.upstream} 恢复后重新处理")
+                    self._settled(message_id)
+                    return
+                self.logger.error(f"@消息 {message_id} 因 {error.upstream} 不可用已暂存 {self.parking.max_parks} 次，放弃处理")
+            elif job.get("resumed"):
+                self.parking.done(message_id)
+        # 排队或处理期间超过新鲜度时限而被放弃的消息计为stale，与派发前放弃的过期消息一致
+        if (not success and job is not None and self.prioritizer.stale_policy == STALE_DROP
+                and self.prioritizer.is_stale(job["message"])):
+            self.prioritizer.record_dropped()
+            self._finish(message_id, "stale")
+            tracing.finish(trace, False)
+            self.logger.warning(f"@消息 {message_id} 处理完成前已超过新鲜度时限，放弃处理")
+            return
+        # 成功的消息在发件箱发送回复后才完成租约
+        self._finish(message_id, "processed" if success else "failed", complete_lease=not success)
+        tracing.finish(trace, success)
+        self.logger.info(f"@消息 {message_id} 处理{'成功' if success else '失败'}")
+    
+    def _finish(self, message_id: int, result: str, complete_lease: bool = True):
+        # 每条消息立即追加写入，确保即使程序中断也能记住已处理的消息
+        self.processed_messages.add(message_id)
+        if self.leases is not None and complete_lease:
+            self.leases.complete(message_id)
+        MESSAGES_TOTAL.inc(result)
+        if self.on_finished is not None:
+            self.on_finished(message_id, result)
+        self._settled(message_id)
+    
+    def _settled(self, message_id: int):
+        if self.on_settled is not None:
+            self.on_settled(message_id)
+
+def build_dispatcher(dify_client: DifyAPI, logger: logging.Logger,
+                     processed_messages: ProcessedMessageStore,
+                     outbox: Optional[ReplyOutbox] = None,
+                     verdict_cache: Optional[VerdictCache] = None,
+                     claim_index: Optional[ClaimIndex] = None,
+                     breakers: Optional[Dict[str, CircuitBreaker]] = None,
+                     parking: Optional[ParkingLot] = None,
+                     leases: Optional[LeaseStore] = None,
+                     tracing_enabled: bool = False,
+                     on_finished: Optional[Callable[[int, str], None]] = None,
+                     on_settled: Optional[Callable[[int], None]] = None,
+                     clock: Callable[[], float] = time.time) -> MentionDispatcher:
+    """
+    按配置创建本地分流、@消息优先级、核查深度控制器和处理流水线，main()和tools/replay.py共用，
+    参数见build_pipeline和MentionDispatcher
+    
+    Args:
+        clock: 优先级和深度控制器使用的时钟，回放时为虚拟时钟
+    
+    Returns:
+        MentionDispatcher: 派发器，流水线为其pipeline属性
+    """
+    breakers = breakers or {}
+    prioritizer = load_prioritizer(clock)
+    triage = load_triage(logger)
+    depth_controller = load_depth_controller(clock)
+    pipeline = build_pipeline(dify_client, logger, verdict_cache, claim_index, outbox, prioritizer, depth_controller,
+                              breakers.get(UPSTREAM_DIFY))
+    return MentionDispatcher(pipeline, processed_messages, logger, prioritizer, triage, depth_controller, breakers,
+                             parking, leases, tracing_enabled, on_finished, on_settled)
+
+class Runtime:
+    """
+    build_runtime创建的运行组件：存储、时间线和流量录制、熔断器、租约和暂存、发件箱、派发器和指标，
+    main()和tools/replay.py共用，close按依赖顺序关闭
+    """
+    
+    def __init__(self, logger: logging.Logger, dify_client: DifyAPI,
+                 processed_messages: ProcessedMessageStore,
+                 verdict_cache: VerdictCache,
+                 outbox: ReplyOutbox,
+                 dispatcher: MentionDispatcher,
+                 poller: AtPoller,
+                 breakers: Dict[str, CircuitBreaker],
+                 claim_index: Optional[ClaimIndex] = None,
+                 reply_accounts: Optional[AccountPool] = None,
+                 leases: Optional[LeaseStore] = None,
+                 parking: Optional[ParkingLot] = None,
+                 trace_writer: Optional[TraceWriter] = None,
+                 traffic_recorder: Optional[TrafficRecorder] = None,
+                 metrics_server: Optional[MetricsServer] = None):
+        self.logger = logger
+        self.dify_client = dify_client
+        self.processed_messages = processed_messages
+        self.verdict_cache = verdict_cache
+        self.outbox = outbox
+        self.dispatcher = dispatcher
+        self.poller = poller
+        self.breakers = breakers
+        self.claim_index = claim_index
+        self.reply_accounts = reply_accounts
+        self.leases = leases
+        self.parking = parking
+        self.trace_writer = trace_writer
+        self.traffic_recorder = traffic_recorder
+        self.metrics_server = metrics_server
+    
+    @property
+    def pipeline(self) -> Pipeline:
+        return self.dispatcher.pipeline
+    
+    def refresh_gauges(self):
+        """采集指标前更新队列深度、发件箱和暂存消息数"""
+        for stage, stage_stats in self.pipeline.stats().items():
+            QUEUE_DEPTH.set(stage_stats["pending"], stage)
+        OUTBOX_PENDING.set(self.outbox.stats()["pending"])
+        if self.parking is not None:
+            PARKED_MESSAGES.set(self.parking.count())
+    
+    def stats(self) -> Dict[str, Any]:
+        """各组件的统计，指标服务的/stats返回"""
+        dispatcher = self.dispatcher
+        return {
+            "pipeline": self.pipeline.stats(),
+            "connections": connection_stats(),
+            "verdict_cache": self.verdict_cache.stats(),
+            "claim_index": self.claim_index.stats() if self.claim_index is not None else None,
+            "timeouts": timeout_stats(),
+            "outbox": self.outbox.stats(),
+            "reply_accounts": self.reply_accounts.stats() if self.reply_accounts is not None else None,
+            "leases": self.leases.stats() if self.leases is not None else None,
+            "priority": dispatcher.prioritizer.stats(),
+            "depth": dispatcher.depth_controller.stats() if dispatcher.depth_controller is not None else None,
+            "dify_endpoints": self.dify_client.stats() if isinstance(self.dify_client, EndpointPool) else None,
+            "triage": dispatcher.triage.stats() if dispatcher.triage is not None else None,
+            "breakers": {upstream: breaker.stats() for upstream, breaker in self.breakers.items()} or None,
+            "parked": self.parking.stats() if self.parking is not None else None,
+            "traces": self.trace_writer.stats() if self.trace_writer is not None else None,
+        }
+    
+    def compact(self, retention_days: int = 0):
+        """压缩已处理消息存储，清理过期的相似说法和租约"""
+        self.processed_messages.compact(retention_days)
+        if self.claim_index is not None:
+            self.claim_index.prune()
+        if self.leases is not None:
+            self.leases.prune()
+    
+    def close(self, timeout: float = 30):
+        """
+        等待已派发的消息处理完毕，然后停止指标服务、发件箱和续租，写完时间线并关闭所有存储
+        
+        Args:
+            timeout: 等待流水线处理完毕的最长时间(秒)
+        """
+        logger = self.logger
+        self.pipeline.shutdown(wait=True, timeout=timeout)
+        
+        # 停止指标服务
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        REGISTRY.remove_hook(self.refresh_gauges)
+        
+        # 停止发件箱，未发送的回复下次启动后继续发送
+        self.outbox.close()
+        logger.info(f"发件箱统计: {self.outbox.stats()}, "
+                    f"回复账号统计: {self.reply_accounts.stats() if self.reply_accounts is not None else None}")
+        
+        # 停止续租，未完成的消息在租约过期后由其他实例接手
+        if self.leases is not None:
+            self.leases.close()
+            logger.info(f"消息租约统计: {self.leases.stats()}")
+        
+        # 暂存的消息下次启动后继续处理
+        if self.parking is not None:
+            logger.info(f"熔断器统计: {', '.join(f'{name}={breaker.stats()}' for name, breaker in self.breakers.items())}, "
+                        f"暂存消息统计: {self.parking.stats()}")
+            self.parking.close()
+        
+        # 写完剩余的处理时间线
+        if self.trace_writer is not None:
+            tracing.configure(None)
+            self.trace_writer.close()
+            logger.info(f"处理时间线统计: {self.trace_writer.stats()}")
+        if self.traffic_recorder is not None:
+            recorder.configure(None)
+            self.traffic_recorder.close()
+            logger.info(f"流量录制统计: {self.traffic_recorder.stats()}")
+        
+        # 关闭已处理消息存储和核查结果缓存
+        self.processed_messages.close()
+        self.verdict_cache.close()
+        logger.info(f"HTTP连接复用统计: {connection_stats()}")
+        logger.info(f"核查结果缓存统计: {self.verdict_cache.stats()}")
+        logger.info(f"各阶段超时次数: {timeout_stats()}")
+        if self.dispatcher.depth_controller is not None:
+            logger.info(f"核查深度统计: {self.dispatcher.depth_controller.stats()}")
+        if isinstance(self.dify_client, EndpointPool):
+            logger.info(f"Dify服务统计: {self.dify_client.stats()}")
+        if self.claim_index is not None:
+            self.claim_index.close()
+            logger.info(f"相似说法复用统计: {self.claim_index.stats()}")
+
+def build_runtime(config: Dict[str, Any], logger: logging.Logger,
+                  dify_client: Optional[DifyAPI] = None,
+                  persistent: bool = True,
+                  send: Callable[..., Dict[str, Any]] = send_reply_comment,
+                  bucket: Optional[TokenBucket] = None,
+                  on_reply: Optional[Callable[[int, bool], None]] = None,
+                  on_finished: Optional[Callable[[int, str], None]] = None,
+                  on_response: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  clock: Optional[Callable[[], float]] = None) -> Runtime:
+    """
+    按配置创建机器人运行所需的组件，main()和tools/replay.py共用
+    
+    Args:
+        config: 系统配置(SYSTEM_CONFIG结构)，决定数据目录、时间线、流量录制、多实例协调、熔断和指标服务
+        logger: 日志记录器
+        dify_client: Dify客户端，默认按DIFY_CONFIG创建
+        persistent: 是否把已处理消息、核查缓存、相似说法索引、发件箱和暂存消息保存到数据目录，
+            False时只保存在内存中(回放用)
+        send: 发件箱的发送函数，参数同send_reply_comment
+        bucket: 发件箱的发送限流，设置后不使用回复账号池
+        on_reply: 回复最终发送成功或放弃时的回调 (消息ID, 是否成功)
+        on_finished: 消息结束时的回调，见MentionDispatcher
+        on_response: 收到@信息接口原始响应后的回调，见AtPoller
+        clock: 熔断器、暂存消息、优先级和深度控制器使用的时钟，回放时为虚拟时钟；
+            默认熔断器使用time.monotonic，其他使用time.time
+    
+    Returns:
+        Runtime: 运行组件，用完后调用close
+    """
+    def store_path(name: str) -> str:
+        return instance_path(name, config) if persistent else ":memory:"
+    
+    # 创建Dify API客户端，配置了多个Dify服务时在服务之间分配请求
+    dify_client = dify_client or load_dify_client(logger)
+    
+    # 加载已处理消息列表
+    processed_messages = load_processed_messages(config) if persistent else ProcessedMessageStore(":memory:")
+    logger.info(f"已打开已处理消息存储: {processed_messages.path}")
+    
+    # 处理时间线，后台线程写入 log/trace_YYYYMMDD.jsonl
+    trace_writer = None
+    if config.get("TRACE_ENABLED", True):
+        trace_writer = TraceWriter(data_dir(config))
+        tracing.configure(trace_writer)
+    
+    # 流量录制，原始@消息响应和Dify事件写入 traffic/ 下的压缩归档，可用 tools/replay.py 回放
+    traffic_recorder = None
+    if config.get("RECORD_TRAFFIC", False):
+        traffic_recorder = TrafficRecorder(
+            data_path("traffic", config),
+            max_bytes=config.get("RECORD_MAX_BYTES", 64 * 1024 * 1024)
+        )
+        recorder.configure(traffic_recorder)
+    
+    # 多实例协调：各实例在共享的SQLite文件中领取消息租约，同一条@消息只由一个实例处理，
+    # 实例停止续租(崩溃)后租约过期，由其他实例接手
+    leases = None
+    if config.get("COORDINATION_DB"):
+        leases = LeaseStore(
+            config["COORDINATION_DB"],
+            owner=instance_id(config),
+            lease_seconds=config.get("LEASE_SECONDS", 60)
+        )
+        logger.info(f"多实例运行，实例标识: {leases.owner}, 协调存储: {leases.path}")
+    
+    # 上游熔断：Dify熔断或请求失败的@消息暂存到本实例的数据库，恢复后重新派发；B站熔断期间回复留在发件箱中
+    breakers = load_breakers(clock or time.monotonic, config)
+    parking = None
+    if breakers:
+        parking = ParkingLot(store_path("parked_messages.db"), max_parks=config.get("PARK_MAX_TIMES", 5),
+                             clock=clock or time.time)
+    
+    # 核查结果缓存
+    verdict_cache = VerdictCache(
+        data_path("verdict_cache.db", config) if persistent else None,
+        ttl=DIFY_CONFIG.get("VERDICT_CACHE_TTL", 86400),
+        max_entries=DIFY_CONFIG.get("VERDICT_CACHE_SIZE", 5000)
+    )
+    
+    # 相似说法索引，跨评论区复用换了说法的同一谣言的核查结果
+    claim_index = None
+    if DIFY_CONFIG.get("CLAIM_INDEX_ENABLED", True):
+        claim_index = ClaimIndex(
+            data_path("claim_index.db", config) if persistent else ":memory:",
+            threshold=DIFY_CONFIG.get("CLAIM_SIMILARITY_THRESHOLD", 0.8),
+            max_age=DIFY_CONFIG.get("CLAIM_INDEX_MAX_AGE", 7 * 86400)
+        )
+    
+    # 回复账号池：每个回复账号各自限流，触发风控时只冷却该账号；未配置REPLY_ACCOUNTS时使用主账号
+    reply_accounts = None
+    if bucket is None:
+        reply_accounts = AccountPool(
+            BILIBILI_CONFIG.get("REPLY_ACCOUNTS", []),
+            rate=BILIBILI_CONFIG.get("REPLY_RATE_PER_MINUTE", 10) / 60,
+            burst=BILIBILI_CONFIG.get("REPLY_BURST", 3),
+            cooldown=BILIBILI_CONFIG.get("RISK_CONTROL_BACKOFF", 300),
+            strategy=BILIBILI_CONFIG.get("REPLY_ACCOUNT_STRATEGY", STRATEGY_LRU)
+        )
+        logger.info(f"回复账号: {', '.join(account.name for account in reply_accounts.accounts)}")
+    
+    # 回复发送成功或放弃后才完成租约
+    def on_reply_result(message_id: int, success: bool):
+        if leases is not None:
+            leases.complete(message_id)
+        if on_reply is not None:
+            on_reply(message_id, success)
+    
+    # 回复发件箱：持久化待发送回复，限流发送，失败后按错误码退避重试，重启后继续发送
+    outbox = ReplyOutbox(
+        store_path("reply_outbox.db"),
+        send=send,
+        bucket=bucket,
+        accounts=reply_accounts,
+        on_result=on_reply_result if leases is not None or on_reply is not None else None,
+        claim=leases.claim if leases is not None else None,
+        breaker=breakers.get(UPSTREAM_BILIBILI),
+        max_attempts=BILIBILI_CONFIG.get("RETRY_TIMES", 3),
+        base_delay=BILIBILI_CONFIG.get("RETRY_INTERVAL", 60),
+        max_delay=BILIBILI_CONFIG.get("RETRY_MAX_INTERVAL", 1800),
+        max_age=BILIBILI_CONFIG.get("REPLY_MAX_AGE", 86400),
+        risk_backoff=BILIBILI_CONFIG.get("RISK_CONTROL_BACKOFF", 300)
+    )
+    
+    # 创建增量轮询器，高水位保存在已处理消息存储中
+    poller = AtPoller(
+        processed_messages,
+        probe_page_size=BILIBILI_CONFIG.get("POLL_PROBE_PAGE_SIZE", 5),
+        page_size=BILIBILI_CONFIG.get("POLL_PAGE_SIZE", 20),
+        max_pages=BILIBILI_CONFIG.get("POLL_MAX_PAGES", 50),
+        on_response=on_response
+    )
+    
+    # 创建处理流水线，轮询循环只负责拉取和派发消息：
+    # - @消息优先级：新被@的、同一评论区被@多次的、已有缓存结果的消息优先，超过新鲜度时限的消息放弃或降级
+    # - 本地分流：垃圾消息不回复，没有可核查说法的消息回复模板，只有可能包含事实性说法的消息调用Dify
+    # - 核查深度：积压多或预算紧张时浅查，空闲时深查
+    # - 消息结束或暂存后才推进拉取高水位，停止时还在排队的消息下次启动后重新拉取
+    dispatcher = build_dispatcher(dify_client, logger, processed_messages, outbox, verdict_cache, claim_index,
+                                  breakers, parking, leases, tracing_enabled=trace_writer is not None,
+                                  on_finished=on_finished, on_settled=poller.complete, clock=clock or time.time)
+    
+    runtime = Runtime(logger, dify_client, processed_messages, verdict_cache, outbox, dispatcher, poller, breakers,
+                      claim_index, reply_accounts, leases, parking, trace_writer, traffic_recorder)
+    
+    # 运行指标和统计服务，只在本机监听，METRICS_PORT为None时不启动
+    REGISTRY.add_hook(runtime.refresh_gauges)
+    if config.get("METRICS_PORT", 9108) is not None:
+        try:
+            runtime.metrics_server = MetricsServer(
+                host=config.get("METRICS_HOST", "127.0.0.1"),
+                port=config.get("METRICS_PORT", 9108),
+                stats=runtime.stats
+            ).start()
+        except OSError as e:
+            logger.error(f"指标服务启动失败: {str(e)}")
+    return runtime
+
+def main(stop_event: Optional[threading.Event] = None):
+    """
+    主函数，运行机器人
+    
+    Args:
+        stop_event: 设置后在本轮轮询结束时停止运行，None表示一直运行到收到终止信号
+    """
+    stop_event = stop_event or threading.Event()
     # 设置日志
     logger = setup_logging()
     logger.info("FakeDetection机器人启动")
     
-    # 创建Dify API客户端
-    dify_client = DifyAPI()
+    # 录制原始响应，保存最近一次响应到日志文件（调试用）
+    def dump_response(response: Dict[str, Any]):
+        recorder.record(recorder.KIND_POLL, response=response)
+        if SYSTEM_CONFIG.get("DEBUG_MODE", False):
+            with open(data_path("response.json"), "w", encoding="utf-8") as f:
+                json.dump(response, f, ensure_ascii=False)
     
-    # 加载已处理消息列表
-    processed_messages = load_processed_messages()
-    logger.info(f"已加载 {len(processed_messages)} 条已处理消息记录")
+    # 存储、时间线、熔断、租约、发件箱、处理流水线和指标服务
+    runtime = build_runtime(SYSTEM_CONFIG, logger, on_response=dump_response)
+    processed_messages, poller, dispatcher = runtime.processed_messages, runtime.poller, runtime.dispatcher
+    pipeline, prioritizer, leases = runtime.pipeline, dispatcher.prioritizer, runtime.leases
     
-    # 首次获取消息，用于标记现有消息为已处理
+    # 首次运行时将现有消息标记为已处理，之后从高水位继续
     try:
-        logger.info("初始化：获取当前所有@消息并标记为已处理...")
-        initial_response = get_at_messages(page_size=50, page_num=1)
-        initial_messages = parse_at_messages(initial_response)
-        
-        # 将所有现有消息标记为已处理
-        initial_ids = set()
-        for msg in initial_messages:
-            initial_ids.add(msg["id"])
+        logger.info("初始化：确定@消息拉取起点...")
+        initial_messages = poller.initialize()
         
-        # 更新已处理消息集合
-        processed_messages.update(initial_ids)
-        save_processed_messages(processed_messages)
-        
-        logger.info(f"已将 {len(initial_ids)} 条现有消息标记为已处理，将只响应新消息")
+        if initial_messages:
+            # 将所有现有消息标记为已处理
+            processed_messages.update(msg["id"] for msg in initial_messages)
+            logger.info(f"已将 {len(initial_messages)} 条现有消息标记为已处理，将只响应新消息")
     except Exception as e:
         logger.error(f"初始化过程中出错: {str(e)}")
     
+    # 根据@消息到达速率调整轮询间隔
+    scheduler = AdaptivePollScheduler(
+        min_interval=BILIBILI_CONFIG.get("MIN_CHECK_INTERVAL", 10),
+        max_interval=BILIBILI_CONFIG.get("MAX_CHECK_INTERVAL", 60),
+        initial_interval=BILIBILI_CONFIG.get("CHECK_INTERVAL", 10),
+        hot_window=BILIBILI_CONFIG.get("HOT_WINDOW", 120),
+        risk_backoff=BILIBILI_CONFIG.get("RISK_CONTROL_BACKOFF", 300)
+    )
+    check_interval = scheduler.interval
+    
     # 主循环
+    last_compact_time = time.time()
+    last_poll_time = None
     try:
-        while True:
+        while not stop_event.is_set():
+            poll_started = time.time()
+            poll_record = {"kind": tracing.KIND_POLL, "ts": round(poll_started, 4),
+                           "gap": round(poll_started - last_poll_time, 4) if last_poll_time else None}
+            last_poll_time = poll_started
             try:
-                # 获取最新@信息
+                # 拉取高水位之后的新@信息，按时间从旧到新排列
                 logger.debug("正在获取最新@信息...")
-                at_response = get_at_messages(page_size=20, page_num=1)
-                
-                # 保存原始响应到日志文件（调试用）
-                if SYSTEM_CONFIG.get("DEBUG_MODE", False):
-                    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "log/response.json"), "w", encoding="utf-8") as f:
-                        json.dump(at_response, f, ensure_ascii=False)
+                with POLL_SECONDS.time():
+                    messages = poller.poll()
+                poll_record["dur"] = round(time.time() - poll_started, 4)
+                poll_record["messages"] = len(messages)
+                logger.debug(f"获取到 {len(messages)} 条新@信息")
+                check_interval = scheduler.record_poll(len(messages))
                 
-                # 解析@信息
-                messages = parse_at_messages(at_response)
-                logger.debug(f"获取到 {len(messages)} 条@信息")
+                # 先统计本批消息所在评论区的热度，再按优先级派发
+                for message in messages:
+                    prioritizer.observe(message)
                 
                 # 处理未处理的消息
                 new_messages = 0
                 for message in messages:
                     message_id = message["id"]
                     
-                    # 跳过已处理的消息
-                    if message_id in processed_messages:
+                    # 跳过已处理或正在处理的消息
+                    if message_id in processed_messages or pipeline.is_pending(message_id):
+                        MESSAGES_TOTAL.inc("deduped")
+                        poller.advance(message)
                         continue
                     
-                    new_messages += 1
-                    logger.info(f"发现新@消息: ID={message_id}, 用户={message['user']['uname']}")
+                    # 超过新鲜度时限的消息不再调用Dify
+                    if dispatcher.drop_if_stale(message):
+                        poller.advance(message)
+                        continue
                     
-                    # 处理消息并记录
-                    success = process_at_message(message, dify_client, logger)
+                    # 其他实例正在处理或已处理完成
+                    if leases is not None and not leases.claim(message_id, message):
+                        MESSAGES_TOTAL.inc("deduped")
+                        poller.advance(message)
+                        continue
                     
-                    # 无论成功与否都标记为已处理，防止重复处理
-                    processed_messages.add(message_id)
+                    # 处理结束或暂存后才推进高水位
+                    poller.begin(message)
+                    if not dispatcher.dispatch(message):
+                        # 剩余消息下次轮询重新拉取
+                        poller.cancel(message_id)
+                        logger.warning(f"流水线入口队列已满，@消息 {message_id} 及之后的消息留待下次轮询处理")
+                        break
                     
-                    # 处理完一条消息后保存，确保即使程序中断也能记住已处理的消息
-                    save_processed_messages(processed_messages)
+                    new_messages += 1
+                    logger.info(f"发现新@消息: ID={message_id}, 用户={message['user']['uname']}")
+                
+                # 接手其他实例租约过期的消息
+                if leases is not None:
+                    reclaimed = leases.reclaim_expired(limit=BILIBILI_CONFIG.get("POLL_PAGE_SIZE", 20))
+                    for index, message in enumerate(reclaimed):
+                        if pipeline.is_pending(message["id"]):
+                            continue
+                        if not dispatcher.dispatch(message):
+                            for rest in reclaimed[index + 1:]:
+                                leases.release(rest["id"])
+                            break
+                        new_messages += 1
+                    poll_record["reclaimed"] = len(reclaimed)
+                
+                # 重新派发Dify恢复后的暂存消息
+                if runtime.parking is not None:
+                    poll_record["resumed"] = dispatcher.resume_parked()
+                    new_messages += poll_record["resumed"]
                 
+                poll_record["dispatched"] = new_messages
                 if new_messages > 0:
-                    logger.info(f"本次处理了 {new_messages} 条新@消息")
+                    logger.info(f"本次派发了 {new_messages} 条新@消息, 各阶段队列: {pipeline.format_stats()}")
+                else:
+                    logger.debug(f"各阶段队列: {pipeline.format_stats()}, 连接复用: {connection_stats()}, "
+                                 f"核查缓存: {runtime.verdict_cache.stats()}, 超时次数: {timeout_stats()}, "
+                                 f"发件箱: {runtime.outbox.stats()}")
                 
+            except AtFeedError as e:
+                poll_record["error"] = e.code
+                logger.error(str(e))
+                check_interval = scheduler.record_error(e.code)
             except Exception as e:
+                if is_timeout_error(e):
+                    record_timeout("poll")
+                poll_record["error"] = type(e).__name__
                 logger.error(f"处理@信息时发生异常: {str(e)}")
+                # HTTP 412 是B站风控拦截
+                status_code = getattr(getattr(e, "response", None), "status_code", None)
+                check_interval = scheduler.record_error(-412 if status_code == 412 else None)
             
-            # 等待下一次检查
-            logger.debug(f"等待 {BILIBILI_CONFIG.get('CHECK_INTERVAL', 10)} 秒后进行下一次检查...")
-            time.sleep(BILIBILI_CONFIG.get("CHECK_INTERVAL", 10))
+            poll_record["interval"] = round(check_interval, 3)
+            tracing.emit(poll_record)
             
+            # 定期压缩已处理消息存储
+            if time.time() - last_compact_time >= SYSTEM_CONFIG.get("PROCESSED_COMPACT_INTERVAL", 3600):
+                try:
+                    runtime.compact(SYSTEM_CONFIG.get("PROCESSED_RETENTION_DAYS", 0))
+                except Exception as e:
+                    logger.error(f"压缩已处理消息存储出错: {str(e)}")
+                last_compact_time = time.time()
+            
+            # 等待下一次检查
+            logger.debug(f"等待 {check_interval:.1f} 秒后进行下一次检查...")
+            stop_event.wait(check_interval)
+        
+        logger.info("收到停止请求，机器人停止运行")
     except KeyboardInterrupt:
         logger.info("接收到终止信号，机器人停止运行")
     except Exception as e:
         logger.critical(f"机器人运行时发生严重错误: {str(e)}")
     finally:
-        # 保存已处理消息记录
-        save_processed_messages(processed_messages)
+        # 等待已派发的消息处理完毕，然后关闭各组件
+        runtime.close(timeout=BILIBILI_CONFIG.get("SHUTDOWN_TIMEOUT", 30))
         logger.info("已保存处理记录，机器人停止运行")
 
 if __name__ == "__main__":
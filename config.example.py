@@ -11,26 +11,146 @@
 BILIBILI_CONFIG = {
     "SESSDATA": "你的SESSDATA",  # 登录B站后的Cookie中的SESSDATA值
     "BILI_JCT": "你的bili_jct",  # 登录B站后的Cookie中的bili_jct值
+    "API_BASE": None,  # B站接口地址，None表示 https://api.bilibili.com；压测时指向本地模拟服务
     
     # 机器人配置
     "BOT_NAME": "FakeDetectionBot",  # 机器人名称，用于检测@
     "BOT_UID": "你的机器人账号UID",   # 机器人账号的UID
     
     # 运行配置
-    "CHECK_INTERVAL": 10,  # 检查新@的时间间隔(秒)
-    "RETRY_TIMES": 3,       # 评论发送失败重试次数
-    "RETRY_INTERVAL": 60,   # 重试间隔(秒)
+    "CHECK_INTERVAL": 10,  # 启动时检查新@的时间间隔(秒)，之后根据@到达速率自动调整
+    "MIN_CHECK_INTERVAL": 10,      # 最小检查间隔(秒)，调小会在收到新@后更频繁地请求B站
+    "MAX_CHECK_INTERVAL": 60,      # 空闲或出错时的最大检查间隔(秒)
+    "HOT_WINDOW": 120,             # 收到新@后保持最小检查间隔的时长(秒)
+    "RISK_CONTROL_BACKOFF": 300,   # 触发风控错误码后的等待时间(秒)
+    "RETRY_TIMES": 3,       # 每条回复最多发送次数
+    "RETRY_INTERVAL": 60,   # 第一次重试前的等待时间(秒)，之后每次翻倍并加入随机抖动
+    "RETRY_MAX_INTERVAL": 1800,  # 重试等待时间上限(秒)
+    "REPLY_RATE_PER_MINUTE": 10, # 每分钟最多发送的回复数
+    "REPLY_BURST": 3,            # 允许连续发送的回复数
+    "REPLY_MAX_AGE": 86400,      # 回复写入发件箱(log/reply_outbox.db)后的最长保留时间(秒)，超过后放弃
+    
+    # 多账号回复配置，为空时用上面的主账号回复；拉取@消息始终使用主账号
+    # 每个账号单独按 REPLY_RATE_PER_MINUTE/REPLY_BURST 限流，触发风控时只冷却该账号
+    "REPLY_ACCOUNTS": [
+        # {"NAME": "回复账号1", "SESSDATA": "回复账号1的SESSDATA", "BILI_JCT": "回复账号1的bili_jct"},
+    ],
+    "REPLY_ACCOUNT_STRATEGY": "lru",  # 账号选择策略: lru 最久未使用优先, least_throttled 触发风控最少优先
+    
+    # 增量轮询配置
+    "POLL_PROBE_PAGE_SIZE": 5,  # 每次轮询第一页的大小，没有新@时只下载这么多条
+    "POLL_PAGE_SIZE": 20,       # 有积压时向前翻页的每页大小
+    "POLL_MAX_PAGES": 50,       # 单次轮询最多翻页数
+    
+    # 并发处理配置
+    # 处理流水线: 解析目标(resolve) → Dify核查(verify) → 发送回复(post)
+    # workers为该阶段的工作线程数，queue_size为进入该阶段的队列容量
+    "PIPELINE_STAGES": {
+        "resolve": {"workers": 2, "queue_size": 50},
+        "verify": {"workers": 4, "queue_size": 20},
+        "post": {"workers": 2, "queue_size": 50},
+    },
+    "MESSAGE_DEADLINE": 900,  # 单条@消息的处理时限(秒)，超时放弃
+    
+    # 优先级与新鲜度时限：新被@的、同一评论区被@多次的、已有缓存结果的消息优先处理
+    "FRESHNESS_DEADLINE": 3600,     # 被@超过这么久(秒)仍未回复的消息视为过期，None表示不限制
+    "STALE_POLICY": "drop",         # 过期消息的处理方式: drop 放弃, downgrade 排在未过期消息之后
+    "PRIORITY_HOT_WEIGHT": 60,      # 同一评论区每多一条近期的@，相当于晚被@这么多秒
+    "PRIORITY_HOT_WINDOW": 600,     # 统计同一评论区@数的时间窗口(秒)
+    "PRIORITY_CACHED_WEIGHT": 600,  # 已有缓存核查结果时相当于晚被@这么多秒
+    "SHUTDOWN_TIMEOUT": 30,   # 停止时等待进行中消息处理完毕的最长时间(秒)
 }
 
 # Dify API配置
 DIFY_CONFIG = {
     "API_KEY": "你的Dify API密钥",
     "API_URL": "https://api.dify.ai/v1",  # Dify API地址
+    
+    # 多个Dify服务(不同的API地址或API密钥)，配置后不再使用上面的API_KEY和API_URL，请求在服务之间分配
+    "DIFY_ENDPOINTS": [
+        # {"NAME": "cloud", "API_URL": "https://api.dify.ai/v1", "API_KEY": "密钥1", "MAX_CONCURRENCY": 2},
+        # {"NAME": "self-hosted", "API_URL": "http://127.0.0.1/v1", "API_KEY": "密钥2", "MAX_CONCURRENCY": 4},
+    ],
+    "DIFY_ENDPOINT_STRATEGY": "least_outstanding",  # 服务选择策略: least_outstanding 进行中请求最少优先, latency 延迟最低优先
+    "DIFY_EJECT_AFTER": 3,        # 服务连续失败多少次后暂时摘除
+    "DIFY_EJECT_SECONDS": 30,     # 第一次摘除的时长(秒)，探测失败后加倍，最长600秒
+    
+    # 核查结果缓存(log/verdict_cache.db)配置
+    "VERDICT_CACHE_TTL": 86400,   # 缓存有效期(秒)
+    "VERDICT_CACHE_SIZE": 5000,   # 最大缓存条数，超过后淘汰最久未使用的结果
+    "CLAIM_INDEX_ENABLED": True,  # 是否复用相似说法的核查结果
+    "CLAIM_SIMILARITY_THRESHOLD": 0.8,  # 复用所需的最低相似度(0~1)
+    "CLAIM_INDEX_MAX_AGE": 604800,  # 相似说法核查结果的可复用时长(秒)
+    
+    # 本地分流配置：调用Dify之前跳过垃圾消息，没有可核查说法的消息回复模板
+    "TRIAGE_ENABLED": True,       # 是否启用本地分流
+    "TRIAGE_MODEL": None,         # 分类器模型文件(tools/triage_eval.py train 生成)，None表示只使用规则
+    "TRIAGE_MIN_CHARS": 3,        # 标题去掉表情和标点后少于这么多字时回复模板，“地球是平的”只有5个字
+    "TRIAGE_THRESHOLD": 0.9,      # 分类器判断为skip/template所需的最低概率
+    "TRIAGE_TEMPLATES": {},       # 覆盖默认的模板回复，键为 too_short/chitchat/question/no_claim
+    
+    # 核查深度配置：按积压、耗时和预算选择Dify应用的depth(迭代搜索轮数)
+    "DEPTH_ADAPTIVE": True,       # 是否自适应选择深度，False时使用Dify应用的默认深度
+    "DEPTH_MIN": 1,               # 最小深度
+    "DEPTH_MAX": 5,               # 最大深度
+    "DEPTH_DEFAULT": 3,           # 还没有耗时数据时的深度
+    "DEPTH_TARGET_LATENCY": 120,  # 积压的消息完成核查的目标耗时(秒)
+    "TOKEN_BUDGET_PER_HOUR": None,  # 最近一小时的token预算，None表示不限制
+    "PRICE_BUDGET_PER_HOUR": None,  # 最近一小时的费用预算(Dify返回的币种)，None表示不限制
+    "STOP_AT_REPLY_LIMIT": False,  # 回答超过回复字数上限后是否立即停止读取：True节省token但没有用量信息(按估计计入预算)，
+                                   # False继续读取到结束以统计实际用量
 }
 
 # 系统配置
 SYSTEM_CONFIG = {
     "DEBUG_MODE": True,  # 在开发阶段启用调试模式
+    
+    # HTTP连接池配置，B站和Dify请求各自共用一个长连接会话
+    "HTTP_POOL_SIZE": 10,   # 每个主机保持的最大连接数
+    "HTTP_POOL_HOSTS": 4,   # 每个会话缓存连接池的主机数
+    
+    # 各阶段单次网络请求的超时上限(秒)，实际超时不超过消息剩余的处理时限(MESSAGE_DEADLINE)
+    "TIMEOUTS": {
+        "poll": 15,           # 拉取@信息
+        "resolve": 10,        # 解析回复目标时请求B站API
+        "dify_connect": 10,   # 连接Dify
+        "dify_idle": 120,     # Dify流式响应两次收到数据之间的最长间隔
+        "reply_post": 15,     # 发送回复，核查阶段会为其预留这么多时间
+    },
+    
+    # 运行指标服务，/metrics为Prometheus格式的指标，/stats为各组件统计的JSON
+    "METRICS_HOST": "127.0.0.1",  # 监听地址，默认只允许本机访问
+    "METRICS_PORT": 9108,         # 监听端口，None表示不启动
+    
+    # 数据文件(已处理消息、缓存、发件箱等数据库和处理时间线)的目录，None表示log目录
+    "DATA_DIR": None,
+    
+    # 每条@消息的处理时间线写入 log/trace_YYYYMMDD.jsonl，用 tools/trace_report.py 汇总
+    "TRACE_ENABLED": True,
+    
+    # 流量录制，原始@消息响应和Dify事件写入 log/traffic/ 下的gzip归档，可用 tools/replay.py 加速回放
+    "RECORD_TRAFFIC": False,
+    "RECORD_MAX_BYTES": 64 * 1024 * 1024,  # 单个归档文件的大小上限(字节)，超过后换下一个文件
+    
+    # 多实例运行：多个机器人进程共用同一个@消息流时，在共享的SQLite文件中按消息领取租约，
+    # 同一条@消息只由一个实例处理，实例崩溃后租约过期由其他实例接手。None表示单实例运行
+    "COORDINATION_DB": None,  # 共享的协调数据库路径，所有实例配置为同一个文件
+    "INSTANCE_ID": None,      # 本实例的标识，配置了COORDINATION_DB时必须设置，各实例互不相同且重启后保持不变
+    "LEASE_SECONDS": 60,      # 租约有效期(秒)，实例停止续租后经过这么久由其他实例接手
+    
+    # 上游熔断：时间窗口内失败率过高时暂停请求该上游，期间需要Dify的@消息暂存到 log/parked_messages.db，
+    # 待发送的回复留在发件箱中，上游恢复后继续处理。各项依次为失败率阈值、计算失败率的最少请求数、
+    # 统计窗口(秒)、第一次熔断的时长(秒，探测失败后加倍)
+    "CIRCUIT_BREAKER_ENABLED": True,
+    "CIRCUIT_BREAKERS": {
+        "dify": {"failure_rate": 0.5, "min_requests": 5, "window": 60, "open_seconds": 30},
+        "bilibili": {"failure_rate": 0.5, "min_requests": 5, "window": 300, "open_seconds": 300},
+    },
+    "PARK_MAX_TIMES": 5,      # 同一条@消息因上游失败最多暂存的次数，超过后放弃
+    
+    # 已处理消息存储(log/processed_messages.db)配置
+    "PROCESSED_COMPACT_INTERVAL": 3600,  # 压缩存储的时间间隔(秒)
+    "PROCESSED_RETENTION_DAYS": 0,       # 已处理消息记录的保留天数，0表示永久保留
 }
 
 # 日志配置
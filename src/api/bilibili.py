@@ -10,20 +10,68 @@ import requests
 import json
 import logging
 from typing import Dict, List, Optional, Any
+from urllib.parse import urlsplit
 
 # 导入配置信息
-from config import BILIBILI_CONFIG
+from config import BILIBILI_CONFIG, SYSTEM_CONFIG
+from src.api.http_session import get_session
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
-def get_at_messages(page_size: int = 20, page_num: int = 1) -> Dict[str, Any]:
+# 接口地址
+AT_MESSAGES_URL = "https://api.bilibili.com/x/msgfeed/at"
+REPLY_ADD_URL = "https://api.bilibili.com/x/v2/reply/add"
+VIDEO_VIEW_URL = "https://api.bilibili.com/x/web-interface/view"
+
+# 未配置SYSTEM_CONFIG["TIMEOUTS"]时的默认请求超时(秒)
+DEFAULT_TIMEOUT = 15
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+def default_headers(account: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    所有B站请求共用的请求头（登录Cookie、User-Agent、Referer），
+    在创建会话时计算一次，之后每个请求只需附加各自的请求头
+    
+    Args:
+        account (Dict[str, str], optional): 发送回复的账号 {"NAME", "SESSDATA", "BILI_JCT"}，None表示主账号
+    """
+    credentials = account or BILIBILI_CONFIG
+    return {
+        "Cookie": f"SESSDATA={credentials['SESSDATA']}; bili_jct={credentials['BILI_JCT']}",
+        "User-Agent": USER_AGENT,
+        "Referer": "https://www.bilibili.com/",
+    }
+
+def api_url(url: str) -> str:
+    """
+    配置了BILIBILI_CONFIG["API_BASE"]时，把接口地址的协议和主机替换为API_BASE，
+    用于连接本地模拟服务进行压测
+    """
+    base = BILIBILI_CONFIG.get("API_BASE")
+    if not base:
+        return url
+    return base.rstrip("/") + urlsplit(url).path
+
+def get_bilibili_session(account: Optional[Dict[str, str]] = None) -> requests.Session:
+    """获取B站请求共用的长连接会话，每个回复账号使用各自的会话"""
+    if account is None:
+        return get_session("bilibili", default_headers)
+    return get_session(f"bilibili:{account['NAME']}", lambda: default_headers(account))
+
+def get_at_messages(page_size: int = 20, page_num: int = 1,
+                    cursor_id: int = 0, cursor_time: int = 0,
+                    timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     获取Bilibili账号的@信息列表
     
     Args:
         page_size (int, optional): 每页显示的消息数量. 默认为20.
         page_num (int, optional): 页码, 从1开始. 默认为1.
+        cursor_id (int, optional): 上一页返回的data.cursor.id，不为0时返回该游标之前的更早消息. 默认为0.
+        cursor_time (int, optional): 上一页返回的data.cursor.time. 默认为0.
+        timeout (float, optional): 请求超时(秒)，默认为SYSTEM_CONFIG["TIMEOUTS"]["poll"]
     
     Returns:
         Dict[str, Any]: 包含@信息的字典，格式为:
@@ -31,9 +79,12 @@ def get_at_messages(page_size: int = 20, page_num: int = 1) -> Dict[str, Any]:
             "code": int,  # 状态码，0表示成功
             "message": str,  # 状态信息
             "data": {  # 数据
-                "items": List[Dict],  # @消息列表
-                "last_id": int,  # 最后一条消息ID
-                "has_more": bool  # 是否还有更多消息
+                "cursor": {  # 翻页游标，指向本页最早的一条消息
+                    "id": int,
+                    "time": int,
+                    "is_end": bool  # 是否已没有更早的消息
+                },
+                "items": List[Dict]  # @消息列表，按时间从新到旧排列
             }
         }
         
@@ -41,17 +92,19 @@ def get_at_messages(page_size: int = 20, page_num: int = 1) -> Dict[str, Any]:
         Exception: 请求失败时抛出异常
     """
     try:
-        url = f"https://api.bilibili.com/x/msgfeed/at?ps={page_size}&pn={page_num}"
+        url = f"{api_url(AT_MESSAGES_URL)}?ps={page_size}&pn={page_num}"
+        # 带游标时从游标位置继续向更早的消息翻页
+        if cursor_id:
+            url += f"&id={cursor_id}&at_time={cursor_time}"
         
+        # 公共请求头由会话提供，见 default_headers
         headers = {
-            "Cookie": f"SESSDATA={BILIBILI_CONFIG['SESSDATA']}; bili_jct={BILIBILI_CONFIG['BILI_JCT']}",
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://www.bilibili.com/",
-            "Accept": "application/json, text/plain, */*",
-            "Connection": "keep-alive"
+            "Accept": "application/json, text/plain, */*"
         }
         
-        response = requests.get(url, headers=headers, allow_redirects=True)
+        if timeout is None:
+            timeout = SYSTEM_CONFIG.get("TIMEOUTS", {}).get("poll", DEFAULT_TIMEOUT)
+        response = get_bilibili_session().get(url, headers=headers, allow_redirects=True, timeout=timeout)
         response.raise_for_status()  # 如果状态码不是200, 抛出异常
         
         data = response.json()
@@ -83,7 +136,9 @@ def parse_at_messages(response_data: Dict[str, Any]) -> List[Dict[str, Any]]:
                     "business_id": int,  # 业务ID
                     "title": str,  # 标题
                     "content": str,  # 内容
+                    "source_content": str,  # @所在评论的内容
                     "uri": str,  # 链接
+                    "native_uri": str,  # 客户端链接(bilibili://)，带有oid和评论ID
                     "subject_id": int,  # 评论区对应的对象ID (oid)
                     "target_id": int,  # 评论根ID (root)
                     "source_id": int   # 父评论ID (parent)
@@ -113,7 +168,9 @@ def parse_at_messages(response_data: Dict[str, Any]) -> List[Dict[str, Any]]:
                     "business_id": item.get("item", {}).get("business_id", 0),
                     "title": item.get("item", {}).get("title", ""),
                     "content": item.get("item", {}).get("content", ""),
+                    "source_content": item.get("item", {}).get("source_content", ""),
                     "uri": item.get("item", {}).get("uri", ""),
+                    "native_uri": item.get("item", {}).get("native_uri", ""),
                     # 添加重要的新字段
                     "subject_id": item.get("item", {}).get("subject_id", 0),
                     "target_id": item.get("item", {}).get("target_id", 0),
@@ -125,7 +182,27 @@ def parse_at_messages(response_data: Dict[str, Any]) -> List[Dict[str, Any]]:
     
     return result
 
-def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, type_id: int = 1) -> Dict[str, Any]:
+def parse_at_cursor(response_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    解析@信息列表响应中的翻页游标
+    
+    Args:
+        response_data (Dict[str, Any]): get_at_messages函数返回的原始响应数据
+    
+    Returns:
+        Optional[Dict[str, Any]]: {"id": int, "time": int, "is_end": bool}，响应中没有游标时返回None
+    """
+    cursor = (response_data.get("data") or {}).get("cursor")
+    if not cursor:
+        return None
+    return {
+        "id": cursor.get("id", 0),
+        "time": cursor.get("time", 0),
+        "is_end": bool(cursor.get("is_end", False))
+    }
+
+def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, type_id: int = 1,
+                       timeout: Optional[float] = None, account: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """
     发送评论回复
     
@@ -135,6 +212,8 @@ def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, t
         root (int, optional): 根评论ID，如果直接回复视频则为0
         parent (int, optional): 父评论ID，如果直接回复视频则为0
         type_id (int, optional): 评论区类型，1为视频，默认为1
+        timeout (float, optional): 请求超时(秒)，默认为SYSTEM_CONFIG["TIMEOUTS"]["reply_post"]
+        account (Dict[str, str], optional): 发送回复的账号 {"NAME", "SESSDATA", "BILI_JCT"}，None表示主账号
         
     Returns:
         Dict[str, Any]: 包含回复结果的字典，格式为:
@@ -155,12 +234,8 @@ def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, t
         Exception: 请求失败时抛出异常
     """
     try:
-        url = "https://api.bilibili.com/x/v2/reply/add"
-        
+        # 公共请求头由会话提供，见 default_headers
         headers = {
-            "Cookie": f"SESSDATA={BILIBILI_CONFIG['SESSDATA']}; bili_jct={BILIBILI_CONFIG['BILI_JCT']}",
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://www.bilibili.com/",
             "Content-Type": "application/x-www-form-urlencoded",
             "Origin": "https://www.bilibili.com"
         }
@@ -170,7 +245,7 @@ def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, t
             "type": type_id,
             "message": message,
             "plat": 1,
-            "csrf": BILIBILI_CONFIG['BILI_JCT']
+            "csrf": (account or BILIBILI_CONFIG)['BILI_JCT']
         }
         
         # 如果是回复评论而不是视频
@@ -179,11 +254,13 @@ def send_reply_comment(oid: int, message: str, root: int = 0, parent: int = 0, t
         if parent != 0:
             data["parent"] = parent
         
-        response = requests.post(url, headers=headers, data=data)
+        if timeout is None:
+            timeout = SYSTEM_CONFIG.get("TIMEOUTS", {}).get("reply_post", DEFAULT_TIMEOUT)
+        response = get_bilibili_session(account).post(api_url(REPLY_ADD_URL), headers=headers, data=data,
+                                                      timeout=timeout)
         response.raise_for_status()
         
         result = response.json()
-        
         if result["code"] == 0:
             logger.info(f"成功发送评论回复，评论ID：{result.get('data', {}).get('rpid', 'unknown')}")
         else:
@@ -8,31 +8,167 @@ Dify API 交互模块
 
 import requests
 import json
-from typing import Dict, Any, Optional
+import hashlib
+import time
+from typing import Dict, Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Union
 import sys
 import os
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from config import DIFY_CONFIG
+from config import DIFY_CONFIG, SYSTEM_CONFIG
+from src.api.http_session import get_session, is_timeout_error
+from src.core.deadline import current_time
+
+# 未配置SYSTEM_CONFIG["TIMEOUTS"]时的默认超时(秒): 连接超时、流式响应两次收到数据之间的最长间隔
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_IDLE_TIMEOUT = 120
+
+class StreamEvent(NamedTuple):
+    """
+    流式响应中的一个事件
+    
+    event: 事件类型，如 message、agent_message、message_replace、message_end、error、
+           workflow_started、node_started、node_finished、workflow_finished、ping
+    data: 事件的完整数据
+    """
+    event: str
+    data: Dict[str, Any]
+
+def iter_stream_events(lines: Iterable[Union[bytes, str]]) -> Iterator[StreamEvent]:
+    """
+    将流式响应的行逐个解析为事件，只解析"data: "行
+    
+    参数:
+        lines: 响应的行迭代器，如response.iter_lines()
+        
+    返回:
+        事件迭代器，按需读取，调用方停止迭代后不会再读取后续数据
+    """
+    for line in lines:
+        if not line:
+            continue
+        line_text = line.decode("utf-8") if isinstance(line, bytes) else line
+        line_text = line_text.strip()
+        # 移除"data: "前缀并解析JSON
+        if line_text.startswith("data: "):
+            data = json.loads(line_text[6:])
+            yield StreamEvent(data.get("event", "message"), data)
+
+class StreamCollector:
+    """
+    累积流式事件得到最终结果
+    
+    回答文本先保存为片段列表，结束时一次拼接；设置max_chars后，
+    回答长度超过max_chars时不再保存后续片段，但继续读取到message_end以取得用量信息；
+    设置stop_at_max_chars时feed返回False，调用方可以停止读取并关闭连接，不再为丢弃的内容消耗token
+    """
+    
+    def __init__(self, max_chars: Optional[int] = None, stop_at_max_chars: bool = False):
+        """
+        参数:
+            max_chars: 回答长度上限，超过后丢弃后续片段，None表示保存完整回答
+            stop_at_max_chars: 超过max_chars后是否停止读取，停止时没有用量信息
+        """
+        self.max_chars = max_chars
+        self.stop_at_max_chars = stop_at_max_chars
+        self.chunks: List[str] = []
+        self.length = 0
+        self.usage: Optional[Dict[str, Any]] = None
+        self.message_id = ""
+        self.conversation_id = ""
+        self.error: Optional[str] = None
+        self.finished = False
+        self.truncated = False
+        self.timed_out = False
+        self.first_chunk_at: Optional[float] = None
+    
+    def feed(self, event: StreamEvent) -> bool:
+        """
+        处理一个事件
+        
+        返回:
+            是否需要继续读取
+        """
+        data = event.data
+        if event.event in ("message", "agent_message"):
+            chunk = data.get("answer", "")
+            if chunk:
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.monotonic()
+                if not self.truncated:
+                    self.chunks.append(chunk)
+                    self.length += len(chunk)
+            self.message_id = data.get("message_id", self.message_id)
+            self.conversation_id = data.get("conversation_id", self.conversation_id)
+            if self.max_chars is not None and self.length > self.max_chars:
+                self.truncated = True
+                if self.stop_at_max_chars:
+                    return False
+        elif event.event == "message_replace":
+            # 内容审查替换了整段回答
+            self.chunks = [data.get("answer", "")]
+            self.length = len(self.chunks[0])
+        elif event.event == "message_end":
+            self.usage = data.get("metadata", {}).get("usage")
+            self.message_id = data.get("message_id", self.message_id)
+            self.conversation_id = data.get("conversation_id", self.conversation_id)
+            self.finished = True
+        elif event.event == "error":
+            self.error = f"{data.get('code', '')} {data.get('message', '')}".strip()
+            return False
+        elif event.event == "workflow_finished":
+            if data.get("data", {}).get("status") == "failed":
+                self.error = data.get("data", {}).get("error") or "工作流执行失败"
+                return False
+        return True
+    
+    def result(self) -> Dict[str, Any]:
+        """
+        返回:
+            {"answer": 回答文本, "usage": message_end中的用量信息(未收到时为None),
+             "message_id": str, "conversation_id": str, "error": 错误信息(没有时为None),
+             "truncated": 是否因超过max_chars丢弃了后续片段或提前停止, "timeout": 是否因超时停止,
+             "first_chunk_at": 收到第一段回答时的time.monotonic()(未收到时为None)}
+        """
+        return {
+            "answer": "".join(self.chunks),
+            "usage": self.usage,
+            "message_id": self.message_id,
+            "conversation_id": self.conversation_id,
+            "error": self.error,
+            "truncated": self.truncated,
+            "timeout": self.timed_out,
+            "first_chunk_at": self.first_chunk_at,
+        }
 
 class DifyAPI:
-    def __init__(self):
-        """初始化Dify API客户端"""
-        self.api_key = DIFY_CONFIG["API_KEY"]
-        self.base_url = DIFY_CONFIG["API_URL"]
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None):
+        """
+        初始化Dify API客户端
+        
+        参数:
+            api_url: Dify API地址，默认为DIFY_CONFIG["API_URL"]
+            api_key: Dify API密钥，默认为DIFY_CONFIG["API_KEY"]
+        """
+        self.api_key = api_key or DIFY_CONFIG["API_KEY"]
+        self.base_url = api_url or DIFY_CONFIG["API_URL"]
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # 同一个API地址和密钥的客户端共用一个长连接会话，鉴权头在创建会话时设置
+        key_digest = hashlib.sha1(self.api_key.encode("utf-8")).hexdigest()[:8]
+        self.session = get_session(f"dify:{self.base_url}#{key_digest}", lambda: dict(self.headers))
     
     def send_chat_message(self, 
                            query: str, 
                            inputs: Dict = None, 
                            response_mode: str = "streaming", 
                            conversation_id: str = "", 
-                           user: str = "default_user") -> Dict[str, Any]:
+                           user: str = "default_user",
+                           timeout: Optional[Any] = None) -> Dict[str, Any]:
         """
         发送聊天消息到Dify API
         
@@ -42,14 +178,16 @@ class DifyAPI:
             response_mode: 响应模式，可选 "streaming" 或 "blocking"
             conversation_id: 对话ID，用于继续已有对话
             user: 用户标识
+            timeout: 超时(秒)，可以是(连接超时, 读取超时)；流式模式下读取超时即两次收到数据之间的最长间隔，
+                     默认为SYSTEM_CONFIG["TIMEOUTS"]中的dify_connect和dify_idle
             
         返回:
-            API响应结果
+            API响应结果，请求失败时为 {"error": 错误信息, "timeout": 是否为超时}
         """
+        url = f"{self.base_url}/chat-messages"
+        
         if inputs is None:
             inputs = {}
-            
-        url = f"{self.base_url}/chat-messages"
         
         payload = {
             "inputs": inputs,
@@ -58,9 +196,13 @@ class DifyAPI:
             "conversation_id": conversation_id,
             "user": user
         }
+        if timeout is None:
+            timeouts = SYSTEM_CONFIG.get("TIMEOUTS", {})
+            timeout = (timeouts.get("dify_connect", DEFAULT_CONNECT_TIMEOUT), timeouts.get("dify_idle", DEFAULT_IDLE_TIMEOUT))
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            # 流式模式下边收边解析，不等待整个响应下载完成
+            response = self.session.post(url, json=payload, stream=(response_mode != "blocking"), timeout=timeout)
             response.raise_for_status()
             
             if response_mode == "blocking":
@@ -71,36 +213,64 @@ class DifyAPI:
                 
         except requests.exceptions.RequestException as e:
             print(f"API请求错误: {e}")
-            return {"error": str(e)}
+            return {"error": str(e), "timeout": is_timeout_error(e)}
     
-    def get_streaming_response(self, response) -> str:
+    def read_stream(self, response, max_chars: Optional[int] = None,
+                    deadline: Optional[float] = None,
+                    on_event: Optional[Callable[[StreamEvent], None]] = None,
+                    stop_at_max_chars: bool = False) -> Dict[str, Any]:
         """
-        处理流式响应数据
+        读取流式响应，返回回答文本和元数据
         
         参数:
-            response: 流式响应对象
+            response: send_chat_message返回的流式响应对象
+            max_chars: 回答长度上限，超过后不再保存后续片段，但仍读取到message_end，None表示保存完整回答
+            deadline: 截止时间戳(按current_time()比较)，超过后停止读取并关闭连接，None表示不限时；
+                      回答已超过max_chars时不算出错，只是没有用量信息
+            on_event: 每收到一个事件时的回调，用于录制原始事件
+            stop_at_max_chars: 回答超过max_chars后立即停止读取并关闭连接，不等message_end，结果中没有用量信息
             
         返回:
-            完整的响应文本
+            StreamCollector.result()的结果，读取出错时error为错误信息，超时(含两次数据间隔超时)时timeout为True
         """
-        full_response = ""
+        collector = StreamCollector(max_chars, stop_at_max_chars)
         
         try:
-            for line in response.iter_lines():
-                if line:
-                    # 移除"data: "前缀并解析JSON
-                    line_text = line.decode('utf-8')
-                    if line_text.startswith("data: "):
-                        data = json.loads(line_text[6:])
-                        if "answer" in data:
-                            chunk = data.get("answer", "")
-                            full_response += chunk
-                            # 可在此处添加实时处理逻辑
-            
-            return full_response
+            for event in iter_stream_events(response.iter_lines()):
+                if on_event is not None:
+                    on_event(event)
+                if not collector.feed(event):
+                    break
+                if deadline is not None and current_time() >= deadline:
+                    if not collector.truncated:
+                        collector.error = "超过处理截止时间"
+                        collector.timed_out = True
+                    break
         except Exception as e:
             print(f"处理流式响应时出错: {e}")
-            return f"错误: {str(e)}"
+            collector.error = str(e)
+            collector.timed_out = is_timeout_error(e)
+        finally:
+            # 读完时把连接放回连接池，提前停止时直接关闭连接，不再下载剩余内容
+            response.close()
+        
+        return collector.result()
+    
+    def get_streaming_response(self, response, max_chars: Optional[int] = None) -> str:
+        """
+        处理流式响应数据
+        
+        参数:
+            response: 流式响应对象
+            max_chars: 回答长度上限，超过后不再保存后续片段，None表示保存完整回答
+            
+        返回:
+            完整的响应文本，出错时返回"错误: "开头的文本
+        """
+        result = self.read_stream(response, max_chars)
+        if result["error"] is not None:
+            return f"错误: {result['error']}"
+        return result["answer"]
 
 # 使用示例
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+共享HTTP会话模块
+为Bilibili和Dify的请求提供带连接池的长连接会话，并统计连接复用情况
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+# 导入配置信息
+from config import SYSTEM_CONFIG
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    """单个会话的请求数和新建连接数统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"requests": 请求数, "new_connections": 新建连接数, "reused": 复用连接的请求数}
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused": max(0, self.requests - self.new_connections),
+            }
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """在urllib3连接池上统计新建连接次数的HTTPAdapter"""
+
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                stats.record_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                stats.record_new_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+_sessions: Dict[str, requests.Session] = {}
+_stats: Dict[str, ConnectionStats] = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str, headers_factory: Optional[Callable[[], Dict[str, str]]] = None) -> requests.Session:
+    """
+    获取指定名称的共享会话，首次调用时创建
+
+    Args:
+        name (str): 会话名称，如"bilibili"
+        headers_factory (Callable, optional): 创建会话时调用一次，返回预先计算好的公共请求头（鉴权、Cookie等）
+
+    Returns:
+        requests.Session: 共享会话，线程安全地复用底层连接池
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+
+    with _lock:
+        if name not in _sessions:
+            pool_size = SYSTEM_CONFIG.get("HTTP_POOL_SIZE", 10)
+            stats = ConnectionStats()
+            adapter = PooledHTTPAdapter(
+                stats,
+                pool_connections=SYSTEM_CONFIG.get("HTTP_POOL_HOSTS", 4),
+                pool_maxsize=pool_size
+            )
+
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if headers_factory is not None:
+                session.headers.update(headers_factory())
+
+            _stats[name] = stats
+            _sessions[name] = session
+            logger.debug(f"创建共享HTTP会话: {name}, 每个主机的连接池大小: {pool_size}")
+        return _sessions[name]
+
+
+def connection_stats() -> Dict[str, Dict[str, int]]:
+    """
+    获取所有共享会话的连接复用统计
+
+    Returns:
+        Dict[str, Dict[str, int]]: {会话名称: ConnectionStats.snapshot()}
+    """
+    with _lock:
+        return {name: stats.snapshot() for name, stats in _stats.items()}
+
+
+def is_timeout_error(error: Exception) -> bool:
+    """
+    判断requests异常是否由超时引起
+    流式读取中的读超时会被requests包装为ConnectionError，需要检查原始异常
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(cause, (ReadTimeoutError, ConnectTimeoutError)) or "timed out" in str(error)
+
+
+def close_sessions():
+    """关闭所有共享会话并清空统计"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _stats.clear()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复账号池
+把回复分摊到多个B站账号发送，每个账号有各自的令牌桶，
+某个账号触发风控时只冷却该账号，其余账号继续发送。拉取@消息仍使用主账号
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.core.metrics import REPLY_ACCOUNT_TOTAL
+from src.core.rate_limiter import TokenBucket
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 账号选择策略
+STRATEGY_LRU = "lru"                          # 最久未使用的账号优先
+STRATEGY_LEAST_THROTTLED = "least_throttled"  # 触发风控次数最少的账号优先，相同时最久未使用的优先
+
+# 主账号在统计中的名称
+MAIN_ACCOUNT = "main"
+
+
+class ReplyAccount:
+    """一个回复账号及其限流状态和统计"""
+
+    def __init__(self, name: str, credentials: Optional[Dict[str, str]], bucket: TokenBucket):
+        """
+        Args:
+            name (str): 账号名称，用于日志和统计
+            credentials (Dict[str, str], optional): {"NAME", "SESSDATA", "BILI_JCT"}，None表示主账号
+            bucket (TokenBucket): 该账号的发送限流
+        """
+        self.name = name
+        self.credentials = credentials
+        self.bucket = bucket
+        self.last_used = 0.0
+        self.sent = 0
+        self.throttled = 0
+        self.failed = 0
+
+
+class AccountPool:
+    """
+    回复账号池
+
+    acquire按策略依次尝试各账号的令牌桶，取到令牌的账号用于本次发送；
+    发送后用report报告结果，触发风控的账号暂停发放令牌cooldown秒
+    """
+
+    def __init__(self,
+                 accounts: Optional[List[Dict[str, str]]] = None,
+                 rate: float = 1 / 6,
+                 burst: float = 3,
+                 cooldown: float = 300,
+                 strategy: str = STRATEGY_LRU,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            accounts (List[Dict[str, str]], optional): 回复账号列表 [{"NAME", "SESSDATA", "BILI_JCT"}]，为空时只使用主账号
+            rate (float, optional): 每个账号每秒补充的令牌数. 默认为每6秒1条.
+            burst (float, optional): 每个账号允许连续发送的回复数. 默认为3.
+            cooldown (float, optional): 账号触发风控后的冷却时间(秒). 默认为300.
+            strategy (str, optional): 账号选择策略 STRATEGY_LRU / STRATEGY_LEAST_THROTTLED. 默认为STRATEGY_LRU.
+            clock (Callable, optional): 时钟函数，默认为time.monotonic
+        """
+        if strategy not in (STRATEGY_LRU, STRATEGY_LEAST_THROTTLED):
+            raise ValueError(f"未知的账号选择策略: {strategy}")
+        self.cooldown = cooldown
+        self.strategy = strategy
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.accounts: List[ReplyAccount] = []
+        for credentials in accounts or []:
+            name = credentials.get("NAME")
+            if not name or not credentials.get("SESSDATA") or not credentials.get("BILI_JCT"):
+                raise ValueError("回复账号需要配置 NAME、SESSDATA 和 BILI_JCT")
+            if any(account.name == name for account in self.accounts):
+                raise ValueError(f"回复账号名称重复: {name}")
+            self.accounts.append(ReplyAccount(name, credentials, TokenBucket(rate, burst, clock=clock)))
+        if not self.accounts:
+            self.accounts.append(ReplyAccount(MAIN_ACCOUNT, None, TokenBucket(rate, burst, clock=clock)))
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def acquire(self) -> Tuple[Optional[ReplyAccount], float]:
+        """
+        选择一个有令牌的账号并取出令牌
+
+        Returns:
+            Tuple[Optional[ReplyAccount], float]: (账号, 0)；所有账号都没有令牌时为 (None, 最短等待秒数)
+        """
+        with self._lock:
+            if self.strategy == STRATEGY_LEAST_THROTTLED:
+                candidates = sorted(self.accounts, key=lambda account: (account.throttled, account.last_used))
+            else:
+                candidates = sorted(self.accounts, key=lambda account: account.last_used)
+            min_wait = None
+            for account in candidates:
+                wait = account.bucket.try_acquire()
+                if wait <= 0:
+                    account.last_used = self._clock()
+                    return account, 0.0
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+            return None, min_wait or 0.0
+
+    def report(self, account: ReplyAccount, success: bool, throttled: bool = False):
+        """
+        报告一次发送结果
+
+        Args:
+            account (ReplyAccount): acquire返回的账号
+            success (bool): 是否发送成功
+            throttled (bool, optional): 是否触发风控，为True时该账号冷却cooldown秒
+        """
+        with self._lock:
+            if success:
+                account.sent += 1
+            elif throttled:
+                account.throttled += 1
+            else:
+                account.failed += 1
+        if success:
+            REPLY_ACCOUNT_TOTAL.inc(account.name, "sent")
+        elif throttled:
+            REPLY_ACCOUNT_TOTAL.inc(account.name, "throttled")
+            account.bucket.pause(self.cooldown)
+            logger.warning(f"回复账号 {account.name} 触发风控，冷却 {self.cooldown:.0f} 秒")
+        else:
+            REPLY_ACCOUNT_TOTAL.inc(account.name, "failed")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns:
+            Dict[str, Dict[str, int]]: {账号名称: {"sent": 发送成功数, "throttled": 触发风控次数, "failed": 其他失败数}}
+        """
+        with self._lock:
+            return {
+                account.name: {"sent": account.sent, "throttled": account.throttled, "failed": account.failed}
+                for account in self.accounts
+            }
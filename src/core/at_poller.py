@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基于游标的@消息增量轮询
+记录已处理完的最新一条@消息(高水位)，每次轮询从最新消息开始向前翻页直到高水位，
+突发的大量@消息可以被完整拉取，没有新消息时只下载一个很小的探测页
+"""
+
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from src.api.bilibili import get_at_messages, parse_at_messages, parse_at_cursor
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 高水位在已处理消息存储中的键名
+CURSOR_META_KEY = "at_cursor"
+
+
+class AtFeedError(Exception):
+    """@信息接口返回非0错误码"""
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"获取@信息列表返回错误码: {code}, 消息: {message}")
+        self.code = code
+
+
+class AtPoller:
+    """
+    @消息增量轮询器
+
+    消息按 (at_time, id) 排序，高水位之前(含)的消息视为已处理完。
+    poll只返回高水位之后、还没有交给调用方的消息。调用方不需要处理的消息调用advance；
+    派发前调用begin，消息处理结束(或已暂存)后调用complete，派发失败时调用cancel。
+    高水位只推进到最早一条进行中的消息之前，停止时还在排队的消息下次启动后重新拉取，
+    未能派发的消息会在下次轮询时重新返回。
+    """
+
+    def __init__(self,
+                 store,
+                 probe_page_size: int = 5,
+                 page_size: int = 20,
+                 max_pages: int = 50,
+                 fetch: Callable[..., Dict[str, Any]] = get_at_messages,
+                 on_response: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            store: 保存高水位的存储，需提供get_meta/set_meta（见ProcessedMessageStore）
+            probe_page_size (int, optional): 第一页的大小，没有新消息时只下载这么多条. 默认为5.
+            page_size (int, optional): 向前翻页时每页的大小. 默认为20.
+            max_pages (int, optional): 单次轮询最多翻页数，超过后更早的消息不再拉取. 默认为50.
+            fetch (Callable, optional): 获取@信息的函数，参数同get_at_messages
+            on_response (Callable, optional): 收到每页原始响应后的回调（调试用）
+        """
+        self.store = store
+        self.probe_page_size = probe_page_size
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.fetch = fetch
+        self.on_response = on_response
+        self._lock = threading.Lock()
+        # 进行中的消息: 消息ID -> (at_time, id)
+        self._inflight: Dict[int, Tuple[int, int]] = {}
+        # 已处理完但还不能推进高水位(之前有进行中的消息)的消息
+        self._done: Set[Tuple[int, int]] = set()
+        self._high_water = self._load_high_water()
+
+    @property
+    def high_water(self) -> Optional[Tuple[int, int]]:
+        """当前高水位 (at_time, id)，尚未初始化时为None"""
+        return self._high_water
+
+    def initialize(self) -> List[Dict[str, Any]]:
+        """
+        首次运行时将当前最新的@消息设为高水位，只响应之后的新消息；
+        已有高水位时不做任何事，停机期间收到的@消息会在后续轮询中补齐
+
+        Returns:
+            List[Dict[str, Any]]: 首次运行时被跳过的现有消息，已有高水位时为空列表
+        """
+        if self._high_water is not None:
+            logger.info(f"从高水位 {self._high_water} 继续拉取@消息")
+            return []
+
+        response = self._fetch_page(self.page_size, 0, 0)
+        messages = parse_at_messages(response)
+        if messages:
+            self.advance(max(messages, key=self._order_key))
+        else:
+            self._set_high_water((0, 0))
+        return messages
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """
+        拉取高水位之后的所有新消息
+
+        Returns:
+            List[Dict[str, Any]]: parse_at_messages结构的消息列表，按时间从旧到新排列，不含进行中和已处理完的消息
+
+        Raises:
+            AtFeedError: 接口返回错误码时抛出
+        """
+        with self._lock:
+            high_water = self._high_water or (0, 0)
+            handed = set(self._inflight.values()) | self._done
+        new_messages = []
+        cursor_id, cursor_time = 0, 0
+        page_size = self.probe_page_size
+        pages = 0
+
+        for _ in range(self.max_pages):
+            pages += 1
+            response = self._fetch_page(page_size, cursor_id, cursor_time)
+            messages = parse_at_messages(response)
+
+            reached = False
+            for message in messages:
+                key = self._order_key(message)
+                if key <= high_water:
+                    reached = True
+                    break
+                if key not in handed:
+                    new_messages.append(message)
+
+            cursor = parse_at_cursor(response)
+            if reached or not messages or cursor is None or cursor["is_end"]:
+                break
+            cursor_id, cursor_time = cursor["id"], cursor["time"]
+            page_size = self.page_size
+        else:
+            logger.warning(f"单次轮询已翻页 {self.max_pages} 页仍未到达高水位，更早的@消息将被跳过")
+
+        if len(new_messages) > 0:
+            logger.debug(f"拉取到 {len(new_messages)} 条新@消息, 共 {pages} 页")
+        new_messages.reverse()
+        return new_messages
+
+    def advance(self, message: Dict[str, Any]):
+        """标记消息已处理完，高水位推进到最早一条进行中的消息之前（不会后退）"""
+        with self._lock:
+            self._done.add(self._order_key(message))
+            self._settle()
+
+    def begin(self, message: Dict[str, Any]):
+        """标记消息开始处理，处理结束前高水位不会越过它"""
+        with self._lock:
+            self._inflight[message["id"]] = self._order_key(message)
+
+    def complete(self, message_id: int):
+        """标记begin过的消息处理结束，其他消息ID(如重新派发的暂存消息)忽略"""
+        with self._lock:
+            key = self._inflight.pop(message_id, None)
+            if key is not None:
+                self._done.add(key)
+                self._settle()
+
+    def cancel(self, message_id: int):
+        """begin过的消息没有派发出去，下次轮询时重新返回"""
+        with self._lock:
+            self._inflight.pop(message_id, None)
+            self._settle()
+
+    def _settle(self):
+        """把早于所有进行中消息的已处理完消息计入高水位，调用方需持有锁"""
+        floor = min(self._inflight.values()) if self._inflight else None
+        ready = [key for key in self._done if floor is None or key < floor]
+        if not ready:
+            return
+        self._done.difference_update(ready)
+        key = max(ready)
+        if self._high_water is None or key > self._high_water:
+            self._set_high_water(key)
+
+    def _fetch_page(self, page_size: int, cursor_id: int, cursor_time: int) -> Dict[str, Any]:
+        """获取一页@信息，接口返回错误码时抛出AtFeedError"""
+        response = self.fetch(page_size=page_size, cursor_id=cursor_id, cursor_time=cursor_time)
+        if self.on_response is not None:
+            self.on_response(response)
+        if response.get("code") != 0:
+            raise AtFeedError(response.get("code"), response.get("message", ""))
+        return response
+
+    def _load_high_water(self) -> Optional[Tuple[int, int]]:
+        value = self.store.get_meta(CURSOR_META_KEY)
+        if value is None:
+            return None
+        try:
+            cursor = json.loads(value)
+            return (int(cursor["time"]), int(cursor["id"]))
+        except Exception as e:
+            logger.error(f"读取@消息高水位出错: {e}")
+            return None
+
+    def _set_high_water(self, key: Tuple[int, int]):
+        self._high_water = key
+        self.store.set_meta(CURSOR_META_KEY, json.dumps({"time": key[0], "id": key[1]}))
+
+    @staticmethod
+    def _order_key(message: Dict[str, Any]) -> Tuple[int, int]:
+        return (message.get("at_time", 0), message.get("id", 0))
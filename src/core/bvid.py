@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+BV号与AV号互转
+使用B站当前的BV号编码规则（支持2^51以内的AV号）在本地完成转换，不需要请求web-interface/view接口
+"""
+
+import logging
+import re
+from functools import lru_cache
+from typing import Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+_TABLE = "FcwAPNKTMug3GV5Lj7EJnHpWsx4tb8haYeviqBz6rkCy12mUSDQX9RdoZf"
+_INDEX = {char: i for i, char in enumerate(_TABLE)}
+_BASE = 58
+_XOR_CODE = 23442827791579
+_MASK_CODE = (1 << 51) - 1
+_MAX_AID = 1 << 51
+
+# "BV1" + 9位编码字符
+BVID_PATTERN = re.compile(r"^[Bb][Vv]1[%s]{9}$" % _TABLE)
+
+
+def _swap(chars: list) -> list:
+    """编码结果中第3/9位、第4/7位互换（互换两次即还原）"""
+    chars[3], chars[9] = chars[9], chars[3]
+    chars[4], chars[7] = chars[7], chars[4]
+    return chars
+
+
+@lru_cache(maxsize=4096)
+def bv_to_av(bvid: str) -> Optional[int]:
+    """
+    将BV号转换为AV号
+
+    Args:
+        bvid (str): BV号，如 "BV1Xb5LzUEqa"
+
+    Returns:
+        Optional[int]: AV号，格式不正确时返回None
+    """
+    if not bvid or not BVID_PATTERN.match(bvid):
+        return None
+    chars = _swap(list(bvid))
+    value = 0
+    for char in chars[3:]:
+        value = value * _BASE + _INDEX[char]
+    return (value & _MASK_CODE) ^ _XOR_CODE
+
+
+@lru_cache(maxsize=4096)
+def av_to_bv(aid: int) -> str:
+    """
+    将AV号转换为BV号
+
+    Args:
+        aid (int): AV号，范围 1 ~ 2^51-1
+
+    Returns:
+        str: BV号
+
+    Raises:
+        ValueError: AV号超出范围时抛出
+    """
+    if not 0 < aid < _MAX_AID:
+        raise ValueError(f"AV号超出范围: {aid}")
+    chars = ["B", "V", "1"] + [""] * 9
+    value = (_MAX_AID | aid) ^ _XOR_CODE
+    for i in range(len(chars) - 1, 2, -1):
+        chars[i] = _TABLE[value % _BASE]
+        value //= _BASE
+    return "".join(_swap(chars))
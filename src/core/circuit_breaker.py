@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游熔断器
+Dify或B站故障时继续请求只会浪费调用、加重风控，失败的@消息还会被标记为已处理而丢失。
+每个上游一个熔断器，按时间窗口内的失败率在三种状态之间切换：
+- closed: 正常请求，统计成功和失败
+- open: 失败率超过阈值后拒绝请求，调用方把工作暂存起来，open_seconds秒后进入half_open
+- half_open: 放行少量探测请求，成功则恢复closed，失败则重新open并加倍等待时间
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from src.core.metrics import CIRCUIT_STATE, CIRCUIT_OPENED_TOTAL
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 指标中的状态值
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+# 上游名称
+UPSTREAM_DIFY = "dify"
+UPSTREAM_BILIBILI = "bilibili"
+
+
+class UpstreamUnavailable(Exception):
+    """上游请求失败，调用方应暂存工作稍后重试，而不是直接放弃"""
+
+    def __init__(self, upstream: str, reason: str, attempted: bool = True):
+        """
+        Args:
+            upstream (str): 上游名称
+            reason (str): 失败原因
+            attempted (bool, optional): 是否实际发出了请求. 默认为True.
+        """
+        super().__init__(f"{upstream} 不可用: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.attempted = attempted
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """熔断器处于打开状态，请求没有发出"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, f"熔断中，{retry_after:.0f} 秒后重试", attempted=False)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    按时间窗口内失败率熔断的熔断器
+
+    调用前用allow()判断是否放行，放行后必须用record()报告结果：
+    True为成功，False为上游故障，None为与上游健康无关的结果(例如本地处理时限已到)
+    """
+
+    def __init__(self,
+                 name: str,
+                 failure_rate: float = 0.5,
+                 min_requests: int = 5,
+                 window: float = 60,
+                 open_seconds: float = 30,
+                 max_open_seconds: float = 600,
+                 half_open_requests: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            name (str): 上游名称，用于日志和指标
+            failure_rate (float, optional): 打开熔断的失败率阈值(0~1). 默认为0.5.
+            min_requests (int, optional): 窗口内至少有这么多次请求才计算失败率. 默认为5.
+            window (float, optional): 统计失败率的时间窗口(秒). 默认为60.
+            open_seconds (float, optional): 第一次打开后等待多久进入half_open(秒)，探测失败后加倍. 默认为30.
+            max_open_seconds (float, optional): 打开时长的上限(秒). 默认为600.
+            half_open_requests (int, optional): half_open时同时放行的探测请求数. 默认为1.
+            clock (Callable, optional): 时钟函数，默认为time.monotonic
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = max(1, min_requests)
+        self.window = window
+        self.initial_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_requests = max(1, half_open_requests)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._results: Deque[Tuple[float, bool]] = deque()
+        self._open_seconds = open_seconds
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[STATE_CLOSED], name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def allow(self) -> bool:
+        """
+        是否放行一次请求，half_open时占用一个探测名额
+
+        Returns:
+            bool: True表示可以请求，调用方随后必须调用record
+        """
+        with self._lock:
+            state = self._current_state(self._clock())
+            if state == STATE_CLOSED:
+                return True
+            if state == STATE_HALF_OPEN and self._probes < self.half_open_requests:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: Optional[bool]):
+        """
+        报告一次放行的请求的结果
+
+        Args:
+            success (Optional[bool]): True为成功，False为上游故障，None为与上游健康无关的结果(只释放探测名额)
+        """
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == STATE_HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success is True:
+                    self._close()
+                elif success is False:
+                    self._open(now, self._open_seconds * 2)
+                return
+            if success is None or state == STATE_OPEN:
+                return
+            self._results.append((now, success))
+            self._trim(now)
+            total = len(self._results)
+            failures = sum(1 for _, ok in self._results if not ok)
+            if not success and total >= self.min_requests and failures / total >= self.failure_rate:
+                self._open(now, self.initial_open_seconds)
+
+    def retry_after(self) -> float:
+        """距离进入half_open的秒数，不在open状态时为0"""
+        with self._lock:
+            now = self._clock()
+            if self._current_state(now) != STATE_OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._open_seconds - now)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: {"state", "requests": 窗口内请求数, "failures": 窗口内失败数,
+            "rejected": 熔断期间拒绝的请求数, "opened": 打开次数, "retry_after": 距离探测的秒数}
+        """
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            self._trim(now)
+            return {
+                "state": state,
+                "requests": len(self._results),
+                "failures": sum(1 for _, ok in self._results if not ok),
+                "rejected": self.rejected,
+                "opened": self.opened,
+                "retry_after": round(max(0.0, self._opened_at + self._open_seconds - now), 3)
+                if state == STATE_OPEN else 0.0,
+            }
+
+    def _current_state(self, now: float) -> str:
+        """open到期后转为half_open，调用方需持有锁"""
+        if self._state == STATE_OPEN and now >= self._opened_at + self._open_seconds:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+            CIRCUIT_STATE.set(_STATE_VALUES[STATE_HALF_OPEN], self.name)
+            logger.info(f"{self.name} 熔断到期，放行探测请求")
+        return self._state
+
+    def _open(self, now: float, seconds: float):
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._open_seconds = min(self.max_open_seconds, seconds)
+        self._results.clear()
+        self.opened += 1
+        CIRCUIT_STATE.set(_STATE_VALUES[STATE_OPEN], self.name)
+        CIRCUIT_OPENED_TOTAL.inc(self.name)
+        logger.warning(f"{self.name} 失败率过高，熔断 {self._open_seconds:g} 秒")
+
+    def _close(self):
+        self._state = STATE_CLOSED
+        self._open_seconds = self.initial_open_seconds
+        self._results.clear()
+        CIRCUIT_STATE.set(_STATE_VALUES[STATE_CLOSED], self.name)
+        logger.info(f"{self.name} 探测成功，恢复正常请求")
+
+    def _trim(self, now: float):
+        """清理时间窗口之外的结果，调用方需持有锁"""
+        cutoff = now - self.window
+        while self._results and self._results[0][0] < cutoff:
+            self._results.popleft()
+
+
+@contextmanager
+def protect(breaker: Optional[CircuitBreaker], upstream: str) -> Iterator[Dict[str, Optional[bool]]]:
+    """
+    用熔断器包裹一次上游请求：进入时熔断中则抛出CircuitOpenError，退出时按call["ok"]报告结果，
+    未设置或请求中抛出其他异常时视为与上游健康无关；breaker为None时不做检查
+
+    Raises:
+        CircuitOpenError: 熔断器拒绝了请求
+    """
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError(upstream, breaker.retry_after())
+    call: Dict[str, Optional[bool]] = {"ok": None}
+    try:
+        yield call
+    finally:
+        if breaker is not None:
+            breaker.record(call["ok"])
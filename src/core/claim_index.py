@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+相似说法索引
+对历史查询的中文字符n-gram计算MinHash签名，用LSH分桶保存在SQLite中，
+同一条谣言换了标点、加了“震惊！”之类前缀或删减了半句时，也能找到之前的核查结果直接复用
+"""
+
+import hashlib
+import logging
+import random
+import re
+import struct
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from src.core.sqlite_store import SQLiteStore
+from src.core.verdict_cache import normalize_claim
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# MinHash参数: NUM_BANDS个桶 × ROWS_PER_BAND行 = 签名长度
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+
+_MASK64 = (1 << 64) - 1
+
+# 固定种子生成multiply-shift哈希参数(a为奇数)，保证重启后签名一致
+_rng = random.Random(20250510)
+_PERMUTATIONS = [(_rng.randrange(1, 1 << 64) | 1, _rng.randrange(0, 1 << 64)) for _ in range(NUM_PERM)]
+
+# 标题党常见前缀，归一化时去掉
+_CLICKBAIT_PREFIX = re.compile(r"^(震惊|重磅|突发|紧急扩散|紧急通知|刚刚|速看|转发|注意|警惕|最新)+")
+
+
+def claim_shingles(text: str, n: int = 2) -> List[str]:
+    """
+    计算归一化后文本的字符n-gram集合
+
+    Args:
+        text (str): 原始查询内容
+        n (int, optional): n-gram长度. 默认为2.
+
+    Returns:
+        List[str]: 去重后的n-gram列表，文本短于n时为整段文本
+    """
+    text = _CLICKBAIT_PREFIX.sub("", normalize_claim(text))
+    if len(text) <= n:
+        return [text] if text else []
+    return list({text[i:i + n] for i in range(len(text) - n + 1)})
+
+
+# 否定词和数字：只差一个“不”或一位数字的两条说法相似度很高，结论却可能相反
+_NEGATION_PATTERN = re.compile(r"(尚未|并非|并不|并没|从未|绝非|不|没|未|非|无|别|勿)")
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def claim_markers(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    取出说法中的否定词和数字，两条说法的否定词和数字都相同才能复用核查结果
+
+    Returns:
+        Tuple[Tuple[str, ...], Tuple[str, ...]]: (排序后的否定词, 按出现顺序的数字)
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return tuple(sorted(_NEGATION_PATTERN.findall(text))), tuple(_NUMBER_PATTERN.findall(text))
+
+
+def minhash_signature(shingles: List[str]) -> List[int]:
+    """计算n-gram集合的MinHash签名，每个分量为32位整数"""
+    values = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    # 取高32位是单调变换，可以先求最小值再移位
+    return [min([(a * v + b) & _MASK64 for v in values]) >> 32 for a, b in _PERMUTATIONS]
+
+
+def signature_similarity(left: List[int], right: List[int]) -> float:
+    """用签名中相同位置相等的比例估计两个集合的Jaccard相似度"""
+    return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERM
+
+
+def _band_keys(signature: List[int]) -> List[int]:
+    """把签名切成NUM_BANDS段，每段哈希成一个有符号64位整数作为桶键"""
+    keys = []
+    for band in range(NUM_BANDS):
+        chunk = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f">H{ROWS_PER_BAND}I", band, *chunk), digest_size=8).digest()
+        keys.append(struct.unpack(">q", digest)[0])
+    return keys
+
+
+class ClaimIndex(SQLiteStore):
+    """
+    基于MinHash LSH的相似说法索引
+
+    签名和分桶都保存在SQLite中，只在查询时按桶键读取候选，数据量到百万级也不需要全部加载到内存
+    """
+
+    def __init__(self, path: str, threshold: float = 0.8, max_age: float = 7 * 86400):
+        """
+        Args:
+            path (str): SQLite文件路径，":memory:"表示只在内存中保存
+            threshold (float, optional): 复用核查结果所需的最低相似度(0~1). 默认为0.8.
+            max_age (float, optional): 可复用结果的最长保存时间(秒). 默认为7天.
+        """
+        super().__init__(path)
+        self.threshold = threshold
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            "id INTEGER PRIMARY KEY, claim TEXT NOT NULL, verdict TEXT NOT NULL, "
+            "signature BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS claim_bands ("
+            "band_key INTEGER NOT NULL, claim_id INTEGER NOT NULL, PRIMARY KEY (band_key, claim_id)) WITHOUT ROWID"
+        )
+
+    def add(self, claim: str, verdict: str) -> Optional[int]:
+        """
+        保存一条说法及其核查结果
+
+        Returns:
+            Optional[int]: 记录ID，说法归一化后为空时返回None
+        """
+        shingles = claim_shingles(claim)
+        if not shingles:
+            return None
+        signature = minhash_signature(shingles)
+        with self._lock, self._transaction() as conn:
+            claim_id = conn.execute(
+                "INSERT INTO claims (claim, verdict, signature, created_at) VALUES (?, ?, ?, ?)",
+                (claim, verdict, struct.pack(f">{NUM_PERM}I", *signature), time.time())
+            ).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO claim_bands (band_key, claim_id) VALUES (?, ?)",
+                [(key, claim_id) for key in _band_keys(signature)]
+            )
+        return claim_id
+
+    def lookup(self, claim: str) -> Optional[Dict]:
+        """
+        查找最相似且相似度不低于阈值的历史说法，否定词或数字不同的说法不复用
+
+        Returns:
+            Optional[Dict]: {"id": int, "claim": str, "verdict": str, "similarity": float}，没有时返回None
+        """
+        shingles = claim_shingles(claim)
+        if not shingles:
+            return None
+        signature = minhash_signature(shingles)
+        keys = _band_keys(signature)
+        markers = claim_markers(claim)
+        min_created_at = time.time() - self.max_age
+
+        best = None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, claim, verdict, signature FROM claims WHERE created_at >= ? AND id IN ("
+                f"SELECT claim_id FROM claim_bands WHERE band_key IN ({','.join('?' * len(keys))}))",
+                (min_created_at, *keys)
+            ).fetchall()
+            for claim_id, stored_claim, verdict, blob in rows:
+                similarity = signature_similarity(signature, struct.unpack(f">{NUM_PERM}I", blob))
+                if similarity < self.threshold or (best is not None and similarity <= best["similarity"]):
+                    continue
+                if claim_markers(stored_claim) == markers:
+                    best = {"id": claim_id, "claim": stored_claim, "verdict": verdict, "similarity": similarity}
+
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def prune(self) -> int:
+        """删除超过max_age的记录，返回删除条数"""
+        cutoff = time.time() - self.max_age
+        with self._lock, self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM claim_bands WHERE claim_id IN (SELECT id FROM claims WHERE created_at < ?)", (cutoff,)
+            )
+            removed = conn.execute("DELETE FROM claims WHERE created_at < ?", (cutoff,)).rowcount
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"hits": 复用次数, "misses": 未找到相似说法的次数}
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
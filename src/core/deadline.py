@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+处理时限与超时统计
+每条@消息从被拉取时开始计算处理时限，各阶段的网络请求超时取
+“阶段上限”和“剩余时限”中较小的一个；时限用完时放弃剩余工作，并按阶段累计超时次数，便于调整各阶段上限。
+截止时间戳都按current_time()计算和比较，回放录制的流量时改为虚拟时钟
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 各阶段单次请求的默认超时上限(秒)，可通过SYSTEM_CONFIG["TIMEOUTS"]覆盖
+DEFAULT_TIMEOUTS = {
+    "poll": 15,           # 拉取@信息
+    "resolve": 10,        # 解析回复目标时请求B站API
+    "dify_connect": 10,   # 连接Dify
+    "dify_idle": 120,     # Dify流式响应两次收到数据之间的最长间隔
+    "reply_post": 15,     # 发送回复
+}
+
+_counts: Counter = Counter()
+_lock = threading.Lock()
+_clock: Callable[[], float] = time.time
+
+
+class DeadlineExceeded(Exception):
+    """处理时限已用完"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"处理时限已用完，放弃阶段 {stage}")
+        self.stage = stage
+
+
+def configure_clock(clock: Optional[Callable[[], float]]):
+    """设置计算截止时间使用的时钟，None表示恢复为time.time"""
+    global _clock
+    _clock = clock or time.time
+
+
+def current_time() -> float:
+    """当前时间戳，与截止时间戳比较时使用"""
+    return _clock()
+
+
+def get_timeout(stage: str, timeouts: Optional[Dict[str, float]] = None) -> float:
+    """读取阶段的超时上限，未配置时使用DEFAULT_TIMEOUTS"""
+    return (timeouts or {}).get(stage, DEFAULT_TIMEOUTS[stage])
+
+
+def stage_timeout(stage: str, deadline: Optional[float], timeouts: Optional[Dict[str, float]] = None,
+                  reserve: float = 0.0) -> float:
+    """
+    计算本阶段单次请求可用的超时时间
+
+    Args:
+        stage (str): 阶段名，见DEFAULT_TIMEOUTS
+        deadline (float, optional): 消息的截止时间戳，None表示只使用阶段上限
+        timeouts (Dict[str, float], optional): 各阶段超时上限配置
+        reserve (float, optional): 为后续阶段预留的时间(秒). 默认为0.
+
+    Returns:
+        float: min(阶段上限, 剩余时限 - 预留时间)
+
+    Raises:
+        DeadlineExceeded: 剩余时限不足时记录一次该阶段超时并抛出
+    """
+    timeout = get_timeout(stage, timeouts)
+    if deadline is None:
+        return timeout
+    remaining = deadline - reserve - current_time()
+    if remaining <= 0:
+        record_timeout(stage)
+        raise DeadlineExceeded(stage)
+    return min(timeout, remaining)
+
+
+def record_timeout(stage: str):
+    """记录一次阶段超时"""
+    with _lock:
+        _counts[stage] += 1
+    logger.debug(f"阶段 {stage} 超时")
+
+
+def timeout_stats() -> Dict[str, int]:
+    """
+    Returns:
+        Dict[str, int]: {阶段名: 超时次数}
+    """
+    with _lock:
+        return dict(_counts)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+已处理消息存储
+基于SQLite(WAL模式)保存已处理的@消息ID，每条消息只追加一行，
+启动时不需要读取全部历史，进程崩溃也不会丢失已提交的记录
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+from src.core.sqlite_store import SQLiteStore
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class ProcessedMessageStore(SQLiteStore):
+    """
+    已处理@消息ID集合的持久化存储，支持 `in`、add、update、len 等集合操作，可在多个线程中共用
+
+    - 每次add写入一条记录并提交，WAL模式下提交只追加日志，由SQLite批量fsync
+    - 查询走主键索引，不需要在内存中保存全部ID
+    - compact定期将WAL合并回主文件，并可按保留天数清理旧记录
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None):
+        """
+        Args:
+            path (str): SQLite数据库文件路径
+            legacy_json_path (str, optional): 旧版processed_messages.json路径，文件存在时导入一次
+        """
+        super().__init__(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_messages ("
+            "id INTEGER PRIMARY KEY, processed_at INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_at ON processed_messages(processed_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+        if legacy_json_path:
+            self._migrate_legacy_json(legacy_json_path)
+
+    def __contains__(self, message_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM processed_messages WHERE id = ?", (int(message_id),)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_messages").fetchone()[0]
+
+    def add(self, message_id: int):
+        """记录一条已处理的消息ID"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO processed_messages (id, processed_at) VALUES (?, ?)",
+                (int(message_id), int(time.time()))
+            )
+
+    def update(self, message_ids: Iterable[int]):
+        """在一个事务中记录多条已处理的消息ID"""
+        now = int(time.time())
+        rows = [(int(message_id), now) for message_id in message_ids]
+        with self._lock, self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO processed_messages (id, processed_at) VALUES (?, ?)", rows
+            )
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """读取附加的键值信息"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key: str, value: str):
+        """写入附加的键值信息"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def compact(self, retention_days: int = 0) -> int:
+        """
+        压缩存储
+
+        Args:
+            retention_days (int, optional): 保留天数，大于0时删除更早处理的记录，0表示全部保留. 默认为0.
+
+        Returns:
+            int: 删除的记录数
+        """
+        removed = 0
+        with self._lock:
+            if retention_days > 0:
+                cutoff = int(time.time()) - retention_days * 86400
+                removed = self._conn.execute(
+                    "DELETE FROM processed_messages WHERE processed_at < ?", (cutoff,)
+                ).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if removed:
+            logger.info(f"已清理 {removed} 条超过 {retention_days} 天的已处理消息记录")
+        return removed
+
+    def close(self):
+        """合并WAL并关闭数据库"""
+        try:
+            with self._lock:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            super().close()
+
+    def _migrate_legacy_json(self, legacy_json_path: str):
+        """从旧版JSON文件导入已处理消息ID，导入后将文件重命名为 .migrated"""
+        if not os.path.exists(legacy_json_path):
+            return
+        try:
+            with open(legacy_json_path, "r", encoding="utf-8") as f:
+                message_ids = json.load(f)
+            self.update(message_ids)
+            os.replace(legacy_json_path, legacy_json_path + ".migrated")
+            logger.info(f"已从 {legacy_json_path} 导入 {len(message_ids)} 条已处理消息记录")
+        except Exception as e:
+            logger.error(f"导入旧版已处理消息列表出错: {e}")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自适应的核查深度
+Dify应用(src/dify/FakeDetection.yml)的开始节点有一个depth变量，决定迭代搜索的轮数：
+深度越大结果越可靠，但耗时和token消耗也大致成比例增加。
+每次调用Dify前按积压的消息数、近期每轮搜索的耗时和最近一小时的token/费用预算选择深度：
+突发时浅查，保证排在后面的消息也能在目标耗时内完成；空闲时深查；预算快用完时降低深度
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# Dify应用中depth为空时的默认值
+WORKFLOW_DEFAULT_DEPTH = 3
+
+
+class DepthController:
+    """
+    为每次Dify调用选择核查深度
+
+    - 耗时：按EWMA估计每轮搜索的耗时 t，积压 backlog 条消息、verify阶段 workers 个并发时，
+      新消息大约要等前面 backlog/workers 批消息完成，深度 d 满足 (backlog/workers + 1) × t × d ≤ target_latency
+    - 预算：按EWMA估计每轮搜索消耗的token和费用，最近 window 秒内剩余的预算平均分给积压的消息，
+      深度 d 满足 每轮消耗 × d ≤ 剩余预算 / (backlog + 1)
+
+    两者取较小值并限制在 [min_depth, max_depth]；还没有耗时样本时使用default_depth。
+    预算用完后仍以min_depth调用，因此预算在最低深度下是软上限
+    """
+
+    def __init__(self,
+                 min_depth: int = 1,
+                 max_depth: int = 5,
+                 default_depth: int = WORKFLOW_DEFAULT_DEPTH,
+                 target_latency: float = 120.0,
+                 workers: int = 1,
+                 token_budget: Optional[float] = None,
+                 price_budget: Optional[float] = None,
+                 window: float = 3600.0,
+                 alpha: float = 0.2,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            min_depth (int, optional): 最小深度. 默认为1.
+            max_depth (int, optional): 最大深度. 默认为5.
+            default_depth (int, optional): 还没有耗时样本时的深度. 默认为3.
+            target_latency (float, optional): 从进入积压到核查完成的目标耗时(秒). 默认为120.
+            workers (int, optional): 同时调用Dify的并发数. 默认为1.
+            token_budget (float, optional): window内的token预算，None表示不限制
+            price_budget (float, optional): window内的费用预算，None表示不限制
+            window (float, optional): 预算的滚动时间窗口(秒). 默认为3600.
+            alpha (float, optional): EWMA的平滑系数，越大越看重最近的样本. 默认为0.2.
+            clock (Callable, optional): 时钟函数，默认为time.time
+        """
+        if not 1 <= min_depth <= max_depth:
+            raise ValueError(f"核查深度范围无效: {min_depth}~{max_depth}")
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.default_depth = min(max(default_depth, min_depth), max_depth)
+        self.target_latency = target_latency
+        self.workers = max(1, workers)
+        self.token_budget = token_budget
+        self.price_budget = price_budget
+        self.window = window
+        self.alpha = alpha
+        self._clock = clock
+        self._lock = threading.Lock()
+        # 每轮搜索的耗时、token和费用的EWMA
+        self._seconds_per_level: Optional[float] = None
+        self._tokens_per_level: Optional[float] = None
+        self._price_per_level: Optional[float] = None
+        # 最近window内的 (时间, token数, 费用)
+        self._spending: Deque[Tuple[float, float, float]] = deque()
+        self._choices: Dict[int, int] = {}
+        self.limited_by_latency = 0
+        self.limited_by_budget = 0
+
+    def choose(self, backlog: int = 0) -> int:
+        """
+        选择一次Dify调用的深度
+
+        Args:
+            backlog (int, optional): 排在这条消息之前或同时处理的消息数. 默认为0.
+
+        Returns:
+            int: 核查深度
+        """
+        backlog = max(0, backlog)
+        with self._lock:
+            depth = self.max_depth if self._seconds_per_level is not None else self.default_depth
+            if self._seconds_per_level:
+                batches = backlog / self.workers + 1
+                by_latency = int(self.target_latency / (batches * self._seconds_per_level))
+                if by_latency < depth:
+                    depth = by_latency
+                    self.limited_by_latency += 1
+            by_budget = self._budget_depth(backlog)
+            if by_budget is not None and by_budget < depth:
+                depth = by_budget
+                self.limited_by_budget += 1
+            depth = min(max(depth, self.min_depth), self.max_depth)
+            self._choices[depth] = self._choices.get(depth, 0) + 1
+            return depth
+
+    def record(self, depth: int, latency: float, usage: Optional[Dict[str, Any]] = None,
+               estimate: bool = False):
+        """
+        记录一次完成的Dify调用
+
+        Args:
+            depth (int): 调用时使用的深度
+            latency (float): 调用耗时(秒)
+            usage (Dict, optional): message_end中的metadata.usage，没有时只更新耗时
+            estimate (bool, optional): 没有usage时按每轮消耗的EWMA估计本次消耗并计入预算，
+                用于已产生消耗但没读到message_end的调用. 默认为False.
+        """
+        depth = max(1, depth)
+        tokens, price = _usage_cost(usage)
+        with self._lock:
+            self._seconds_per_level = self._ewma(self._seconds_per_level, latency / depth)
+            now = self._clock()
+            if usage:
+                self._spending.append((now, tokens, price))
+                self._trim(now)
+                self._tokens_per_level = self._ewma(self._tokens_per_level, tokens / depth)
+                self._price_per_level = self._ewma(self._price_per_level, price / depth)
+            elif estimate and (self._tokens_per_level or self._price_per_level):
+                self._spending.append((now, (self._tokens_per_level or 0.0) * depth,
+                                       (self._price_per_level or 0.0) * depth))
+                self._trim(now)
+
+    def spent(self) -> Tuple[float, float]:
+        """
+        Returns:
+            Tuple[float, float]: 最近window内消耗的 (token数, 费用)
+        """
+        with self._lock:
+            self._trim(self._clock())
+            return self._spent()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: 各深度的选择次数、因耗时或预算降低深度的次数、每轮搜索的耗时估计和最近window内的消耗
+        """
+        with self._lock:
+            self._trim(self._clock())
+            tokens, price = self._spent()
+            return {
+                "choices": dict(sorted(self._choices.items())),
+                "limited_by_latency": self.limited_by_latency,
+                "limited_by_budget": self.limited_by_budget,
+                "seconds_per_level": self._seconds_per_level,
+                "tokens_spent": tokens,
+                "price_spent": round(price, 6),
+            }
+
+    def _budget_depth(self, backlog: int) -> Optional[int]:
+        """按剩余预算允许的深度，不限制预算或还不知道每轮消耗时返回None，调用方需持有锁"""
+        self._trim(self._clock())
+        tokens, price = self._spent()
+        limits = []
+        for budget, spent, per_level in ((self.token_budget, tokens, self._tokens_per_level),
+                                         (self.price_budget, price, self._price_per_level)):
+            if budget is None or not per_level:
+                continue
+            share = (budget - spent) / (backlog + 1)
+            limits.append(int(share / per_level) if share > 0 else 0)
+        return min(limits) if limits else None
+
+    def _spent(self) -> Tuple[float, float]:
+        return sum(item[1] for item in self._spending), sum(item[2] for item in self._spending)
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def _trim(self, now: float):
+        """清理时间窗口之外的消耗记录，调用方需持有锁"""
+        cutoff = now - self.window
+        while self._spending and self._spending[0][0] < cutoff:
+            self._spending.popleft()
+
+
+def _usage_cost(usage: Optional[Dict[str, Any]]) -> Tuple[float, float]:
+    """从metadata.usage中取出token数和费用"""
+    if not usage:
+        return 0.0, 0.0
+    try:
+        tokens = float(usage.get("total_tokens") or
+                       (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0))
+    except (TypeError, ValueError):
+        tokens = 0.0
+    try:
+        price = float(usage.get("total_price") or 0)
+    except (TypeError, ValueError):
+        price = 0.0
+    return tokens, price
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dify服务池
+把核查请求分摊到多个Dify服务(不同的API地址或API密钥，例如自建的Dify和云服务)，
+单个应用的并发上限不再限制整体吞吐量。按进行中的请求数或延迟选择服务，每个服务有各自的并发上限，
+连续失败的服务暂时摘除，过一段时间后放行一个探测请求，成功后恢复
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.api.dify import DifyAPI, StreamEvent
+from src.core.deadline import current_time
+from src.core.metrics import DIFY_ENDPOINT_TOTAL
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 服务选择策略
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"  # 进行中的请求最少的服务优先，相同时延迟低的优先
+STRATEGY_LATENCY = "latency"                      # 延迟EWMA × (进行中的请求数 + 1) 最小的服务优先
+
+# 服务状态
+STATE_HEALTHY = "healthy"
+STATE_EJECTED = "ejected"    # 已摘除，到期前不分配请求
+STATE_PROBING = "probing"    # 摘除到期，正在用一个请求探测
+
+
+class DifyEndpoint:
+    """一个Dify服务及其负载、延迟和健康状态"""
+
+    def __init__(self, name: str, client: Any, max_concurrency: Optional[int] = None):
+        """
+        Args:
+            name (str): 服务名称，用于日志和统计
+            client: 该服务的Dify API客户端
+            max_concurrency (int, optional): 最大并发请求数，None表示不限制
+        """
+        self.name = name
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = 0.0
+        self.probing = False
+        self.ok = 0
+        self.failed = 0
+        self.ejections = 0
+
+    def state(self, now: float) -> str:
+        if self.ejected_until > now:
+            return STATE_EJECTED
+        if self.ejected_until:
+            return STATE_PROBING
+        return STATE_HEALTHY
+
+    def available(self, now: float) -> bool:
+        """是否可以再分配一个请求，探测期间只允许一个请求"""
+        state = self.state(now)
+        if state == STATE_EJECTED:
+            return False
+        if state == STATE_PROBING:
+            return not self.probing
+        return self.max_concurrency is None or self.outstanding < self.max_concurrency
+
+
+class EndpointPool:
+    """
+    Dify服务池，接口与DifyAPI相同(send_chat_message/read_stream/get_streaming_response)，可直接替换
+
+    send_chat_message时按策略选择一个服务，流式响应在read_stream读完后才结束本次请求并记录结果；
+    所有服务都达到并发上限时等待最多acquire_timeout秒，仍没有空闲名额时返回带saturated标记的错误
+    (本地并发已满，没有请求Dify)，所有服务都被摘除时直接返回错误
+    """
+
+    def __init__(self,
+                 endpoints: List[Dict[str, Any]],
+                 strategy: str = STRATEGY_LEAST_OUTSTANDING,
+                 eject_after: int = 3,
+                 eject_seconds: float = 30,
+                 max_eject_seconds: float = 600,
+                 acquire_timeout: float = 10,
+                 alpha: float = 0.3,
+                 client_factory: Callable[[str, str], Any] = DifyAPI,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            endpoints (List[Dict]): 服务列表 [{"NAME", "API_URL", "API_KEY", "MAX_CONCURRENCY"(可选)}]
+            strategy (str, optional): 服务选择策略 STRATEGY_LEAST_OUTSTANDING / STRATEGY_LATENCY. 默认为STRATEGY_LEAST_OUTSTANDING.
+            eject_after (int, optional): 连续失败多少次后摘除服务. 默认为3.
+            eject_seconds (float, optional): 第一次摘除的时长(秒)，探测失败后加倍. 默认为30.
+            max_eject_seconds (float, optional): 摘除时长的上限(秒). 默认为600.
+            acquire_timeout (float, optional): 所有服务都达到并发上限时最多等待的秒数. 默认为10.
+            alpha (float, optional): 延迟EWMA的平滑系数. 默认为0.3.
+            client_factory (Callable, optional): 根据 (API地址, API密钥) 创建客户端，默认为DifyAPI
+            clock (Callable, optional): 时钟函数，默认为time.monotonic
+        """
+        if strategy not in (STRATEGY_LEAST_OUTSTANDING, STRATEGY_LATENCY):
+            raise ValueError(f"未知的Dify服务选择策略: {strategy}")
+        if not endpoints:
+            raise ValueError("至少需要配置一个Dify服务")
+        self.strategy = strategy
+        self.eject_after = max(1, eject_after)
+        self.initial_eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.acquire_timeout = acquire_timeout
+        self.alpha = alpha
+        self._clock = clock
+        self._condition = threading.Condition()
+        # 进行中的流式响应: id(响应对象) -> (服务, 开始时间)
+        self._streams: Dict[int, Tuple[DifyEndpoint, float]] = {}
+        self.endpoints: List[DifyEndpoint] = []
+        for config in endpoints:
+            name = config.get("NAME")
+            if not name or not config.get("API_URL") or not config.get("API_KEY"):
+                raise ValueError("Dify服务需要配置 NAME、API_URL 和 API_KEY")
+            if any(endpoint.name == name for endpoint in self.endpoints):
+                raise ValueError(f"Dify服务名称重复: {name}")
+            self.endpoints.append(DifyEndpoint(name, client_factory(config["API_URL"], config["API_KEY"]),
+                                               config.get("MAX_CONCURRENCY")))
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self, timeout: Optional[float] = None,
+                exclude: Tuple[DifyEndpoint, ...] = ()) -> Optional[DifyEndpoint]:
+        """
+        选择一个服务并占用一个并发名额
+
+        Args:
+            timeout (float, optional): 所有服务都达到并发上限时最多等待的秒数，默认为acquire_timeout
+            exclude (Tuple[DifyEndpoint, ...], optional): 不选择的服务，例如本次请求已经失败过的服务
+
+        Returns:
+            Optional[DifyEndpoint]: 选中的服务；所有服务都被摘除或等待超时时为None
+        """
+        wait_until = time.monotonic() + (self.acquire_timeout if timeout is None else timeout)
+        with self._condition:
+            while True:
+                now = self._clock()
+                endpoints = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+                candidates = [endpoint for endpoint in endpoints if endpoint.available(now)]
+                if candidates:
+                    endpoint = min(candidates, key=self._score)
+                    if endpoint.state(now) == STATE_PROBING:
+                        endpoint.probing = True
+                        logger.info(f"Dify服务 {endpoint.name} 摘除到期，发送探测请求")
+                    endpoint.outstanding += 1
+                    return endpoint
+                if all(endpoint.state(now) == STATE_EJECTED for endpoint in endpoints):
+                    return None
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def release(self, endpoint: DifyEndpoint, success: Optional[bool], latency: Optional[float] = None):
+        """
+        结束一次请求并记录结果
+
+        Args:
+            endpoint (DifyEndpoint): acquire返回的服务
+            success (Optional[bool]): 是否成功，None表示结果与服务是否正常无关(如调用方的处理时限已到)，
+                只结束请求，不计入成功或失败
+            latency (float, optional): 请求延迟(秒)，成功时用于更新EWMA
+        """
+        with self._condition:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            was_probing, endpoint.probing = endpoint.probing, False
+            if success is None:
+                # 探测请求没有得出结论，下一个请求继续探测
+                self._condition.notify_all()
+                return
+            if success:
+                endpoint.ok += 1
+                endpoint.consecutive_failures = 0
+                if latency is not None:
+                    endpoint.latency = latency if endpoint.latency is None else \
+                        endpoint.latency + self.alpha * (latency - endpoint.latency)
+                if endpoint.ejected_until:
+                    logger.info(f"Dify服务 {endpoint.name} 探测成功，恢复分配请求")
+                endpoint.ejected_until = 0.0
+                endpoint.eject_seconds = 0.0
+            else:
+                endpoint.failed += 1
+                endpoint.consecutive_failures += 1
+                if was_probing or (not endpoint.ejected_until and endpoint.consecutive_failures >= self.eject_after):
+                    self._eject(endpoint)
+            self._condition.notify_all()
+        DIFY_ENDPOINT_TOTAL.inc(endpoint.name, "ok" if success else "failed")
+
+    def send_chat_message(self, query: str, inputs: Dict = None, response_mode: str = "streaming",
+                          conversation_id: str = "", user: str = "default_user",
+                          timeout: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        选择一个服务发送聊天消息，参数和返回值与DifyAPI.send_chat_message相同，返回值另有endpoint为服务名称；
+        请求失败(还没有收到回答)时换其他服务重试，每个服务最多尝试一次。
+        还没有请求任何服务就因所有服务都达到并发上限而等待超时时，返回 {"error", "timeout": False, "saturated": True}，
+        调用方不应把它计为Dify故障
+        """
+        tried: Tuple[DifyEndpoint, ...] = ()
+        response = {"error": "没有可用的Dify服务", "timeout": False}
+        while len(tried) < len(self.endpoints):
+            endpoint = self.acquire(exclude=tried)
+            if endpoint is None:
+                if not tried and not self._all_ejected():
+                    response = {"error": "所有Dify服务都已达到并发上限", "timeout": False, "saturated": True}
+                break
+            tried += (endpoint,)
+            started = time.monotonic()
+            try:
+                response = endpoint.client.send_chat_message(query=query, inputs=inputs, response_mode=response_mode,
+                                                             conversation_id=conversation_id, user=user,
+                                                             timeout=timeout)
+            except Exception:
+                self.release(endpoint, False)
+                raise
+            response["endpoint"] = endpoint.name
+            if "error" in response:
+                self.release(endpoint, False)
+                logger.warning(f"Dify服务 {endpoint.name} 请求失败: {response['error']}")
+                continue
+            if response.get("status") == "streaming":
+                with self._condition:
+                    self._streams[id(response["response"])] = (endpoint, started)
+            else:
+                self.release(endpoint, True, time.monotonic() - started)
+            break
+        return response
+
+    def read_stream(self, response, max_chars: Optional[int] = None,
+                    deadline: Optional[float] = None,
+                    on_event: Optional[Callable[[StreamEvent], None]] = None,
+                    stop_at_max_chars: bool = False) -> Dict[str, Any]:
+        """
+        读取send_chat_message返回的流式响应，参数和返回值与DifyAPI.read_stream相同；
+        读完后结束本次请求，以收到第一段回答的延迟作为服务的延迟；因deadline停止读取时不计入成功或失败
+        """
+        with self._condition:
+            endpoint, started = self._streams.pop(id(response), (None, None))
+        client = endpoint.client if endpoint is not None else self.endpoints[0].client
+        result = None
+        try:
+            result = client.read_stream(response, max_chars=max_chars, deadline=deadline, on_event=on_event,
+                                        stop_at_max_chars=stop_at_max_chars)
+            return result
+        finally:
+            if endpoint is not None:
+                success = result is not None and result["error"] is None
+                if (not success and result is not None and result["timeout"]
+                        and deadline is not None and current_time() >= deadline):
+                    success = None
+                latency = None
+                if success:
+                    latency = (result["first_chunk_at"] or time.monotonic()) - started
+                self.release(endpoint, success, latency)
+
+    def get_streaming_response(self, response, max_chars: Optional[int] = None) -> str:
+        """处理流式响应数据，出错时返回"错误: "开头的文本"""
+        result = self.read_stream(response, max_chars)
+        if result["error"] is not None:
+            return f"错误: {result['error']}"
+        return result["answer"]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict]: {服务名称: {"state", "outstanding", "latency": 延迟EWMA, "ok", "failed", "ejections"}}
+        """
+        with self._condition:
+            now = self._clock()
+            return {
+                endpoint.name: {
+                    "state": endpoint.state(now),
+                    "outstanding": endpoint.outstanding,
+                    "latency": None if endpoint.latency is None else round(endpoint.latency, 4),
+                    "ok": endpoint.ok,
+                    "failed": endpoint.failed,
+                    "ejections": endpoint.ejections,
+                }
+                for endpoint in self.endpoints
+            }
+
+    def _score(self, endpoint: DifyEndpoint) -> Tuple[float, float]:
+        """选择服务的排序键，越小越优先；还没有延迟数据的服务按已知的最低延迟计算，调用方需持有锁"""
+        latency = endpoint.latency
+        if latency is None:
+            known = [other.latency for other in self.endpoints if other.latency is not None]
+            latency = min(known) if known else 0.0
+        if self.strategy == STRATEGY_LATENCY:
+            return latency * (endpoint.outstanding + 1), endpoint.outstanding
+        return endpoint.outstanding, latency
+
+    def _all_ejected(self) -> bool:
+        """是否所有服务都已被摘除"""
+        with self._condition:
+            now = self._clock()
+            return all(endpoint.state(now) == STATE_EJECTED for endpoint in self.endpoints)
+
+    def _eject(self, endpoint: DifyEndpoint):
+        """摘除服务，调用方需持有锁"""
+        endpoint.eject_seconds = min(self.max_eject_seconds,
+                                     endpoint.eject_seconds * 2 if endpoint.eject_seconds else self.initial_eject_seconds)
+        endpoint.ejected_until = self._clock() + endpoint.eject_seconds
+        endpoint.ejections += 1
+        logger.warning(f"Dify服务 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，"
+                       f"摘除 {endpoint.eject_seconds:.0f} 秒")
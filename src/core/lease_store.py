@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多实例协调存储
+多个机器人实例共用同一个@消息流时，通过共享的SQLite(WAL)文件按消息ID领取带过期时间的租约：
+领取成功的实例负责处理该消息并在处理期间定期续租，处理结束后标记完成；
+实例崩溃后租约过期，其他实例用保存的消息内容重新领取处理
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core.sqlite_store import SQLiteStore
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def default_owner() -> str:
+    """默认的实例标识：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseStore(SQLiteStore):
+    """
+    基于SQLite的消息租约
+
+    - claim: 消息未完成且没有有效租约(或租约属于本实例)时领取，一条语句完成，多进程间原子
+    - 后台线程每 lease_seconds/3 秒为本实例持有的租约续租
+    - complete: 标记完成，之后任何实例都不会再领取
+    - reclaim_expired: 领取其他实例过期未完成的租约，返回领取时保存的消息内容
+    - 同一条消息被领取超过max_claims次（多次导致实例崩溃）后标记完成，不再处理
+
+    时间使用time.time()，多个主机共用时需要时钟基本同步
+    """
+
+    def __init__(self,
+                 path: str,
+                 owner: Optional[str] = None,
+                 lease_seconds: float = 60,
+                 max_claims: int = 3,
+                 heartbeat: bool = True,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path (str): 共享的SQLite文件路径，所有实例使用同一个文件
+            owner (str, optional): 本实例的标识，默认为"主机名-进程号"
+            lease_seconds (float, optional): 租约有效期(秒)，实例停止续租后经过这么久其他实例才能接手. 默认为60.
+            max_claims (int, optional): 同一条消息最多被领取的次数. 默认为3.
+            heartbeat (bool, optional): 是否启动续租线程. 默认为True.
+            clock (Callable, optional): 时钟函数，默认为time.time
+        """
+        super().__init__(path, timeout=30)
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.max_claims = max(1, max_claims)
+        self._clock = clock
+        self.claimed = 0
+        self.rejected = 0
+        self.reclaimed = 0
+        self.lost = 0
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_leases ("
+            "message_id INTEGER PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "done INTEGER NOT NULL DEFAULT 0, claims INTEGER NOT NULL DEFAULT 1, "
+            "updated_at REAL NOT NULL, payload TEXT)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_message_leases_expiry ON message_leases(done, expires_at)"
+        )
+
+        # 本实例正在处理的消息，续租线程只为这些消息续租
+        self._held = set()
+        self._stopped = threading.Event()
+        self._thread = None
+        if heartbeat:
+            self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+            self._thread.start()
+
+    def claim(self, message_id: int, payload: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        领取一条消息
+
+        Args:
+            message_id (int): @消息ID
+            payload (Dict, optional): 消息内容，租约过期后其他实例用它重新处理；None时保留已保存的内容
+
+        Returns:
+            bool: 是否领取成功。消息已完成或其他实例持有有效租约时返回False
+        """
+        message_id = int(message_id)
+        now = self._clock()
+        data = json.dumps(payload, ensure_ascii=False) if payload is not None else None
+        with self._lock:
+            claimed = self._conn.execute(
+                "INSERT INTO message_leases (message_id, owner, expires_at, updated_at, payload) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET "
+                "claims = claims + (owner != excluded.owner), owner = excluded.owner, "
+                "expires_at = excluded.expires_at, updated_at = excluded.updated_at, "
+                "payload = COALESCE(excluded.payload, payload) "
+                "WHERE done = 0 AND (owner = excluded.owner OR expires_at < ?)",
+                (message_id, self.owner, now + self.lease_seconds, now, data, now)
+            ).rowcount > 0
+            if claimed:
+                self._held.add(message_id)
+                self.claimed += 1
+            else:
+                self.rejected += 1
+        return claimed
+
+    def reclaim_expired(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        领取租约已过期且未完成的消息（持有的实例已停止续租）
+
+        Args:
+            limit (int, optional): 最多领取的条数. 默认为20.
+
+        Returns:
+            List[Dict[str, Any]]: 领取到的消息内容，没有保存内容的消息不会被领取
+        """
+        now = self._clock()
+        with self._lock:
+            with self._transaction(immediate=True) as conn:
+                rows = conn.execute(
+                    "SELECT message_id, owner, claims, payload FROM message_leases "
+                    "WHERE done = 0 AND expires_at < ? AND payload IS NOT NULL "
+                    "ORDER BY message_id LIMIT ?",
+                    (now, limit)
+                ).fetchall()
+                abandoned = [row for row in rows if row[2] >= self.max_claims]
+                taken = [row for row in rows if row[2] < self.max_claims]
+                conn.executemany(
+                    "UPDATE message_leases SET done = 1, updated_at = ? WHERE message_id = ?",
+                    [(now, row[0]) for row in abandoned]
+                )
+                conn.executemany(
+                    "UPDATE message_leases SET owner = ?, expires_at = ?, updated_at = ?, claims = claims + 1 "
+                    "WHERE message_id = ?",
+                    [(self.owner, now + self.lease_seconds, now, row[0]) for row in taken]
+                )
+            self._held.update(row[0] for row in taken)
+            self.reclaimed += len(taken)
+
+        for message_id, owner, claims, _ in abandoned:
+            logger.error(f"@消息 {message_id} 已被领取 {claims} 次仍未完成，不再处理")
+        for message_id, owner, _, _ in taken:
+            logger.warning(f"实例 {owner} 持有的@消息 {message_id} 租约已过期，由本实例接手")
+        return [json.loads(row[3]) for row in taken]
+
+    def renew(self) -> int:
+        """
+        为本实例持有的租约续租
+
+        Returns:
+            int: 续租成功的条数，续租失败（已被其他实例接手）的消息不再续租
+        """
+        now = self._clock()
+        with self._lock:
+            held = list(self._held)
+            if not held:
+                return 0
+            renewed = set()
+            for start in range(0, len(held), 500):
+                chunk = held[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                self._conn.execute(
+                    f"UPDATE message_leases SET expires_at = ?, updated_at = ? "
+                    f"WHERE owner = ? AND done = 0 AND message_id IN ({placeholders})",
+                    [now + self.lease_seconds, now, self.owner] + chunk
+                )
+                renewed.update(row[0] for row in self._conn.execute(
+                    f"SELECT message_id FROM message_leases "
+                    f"WHERE owner = ? AND done = 0 AND message_id IN ({placeholders})",
+                    [self.owner] + chunk
+                ))
+            lost = self._held - renewed
+            self._held -= lost
+            self.lost += len(lost)
+        for message_id in lost:
+            logger.warning(f"@消息 {message_id} 的租约已被其他实例接手")
+        return len(renewed)
+
+    def complete(self, message_id: int) -> bool:
+        """
+        标记消息处理完成（无论成功与否），之后任何实例都不会再领取
+
+        Returns:
+            bool: 是否仍持有该租约，False表示超时后已被其他实例接手
+        """
+        message_id = int(message_id)
+        with self._lock:
+            self._held.discard(message_id)
+            return self._conn.execute(
+                "UPDATE message_leases SET done = 1, updated_at = ?, payload = NULL "
+                "WHERE message_id = ? AND owner = ? AND done = 0",
+                (self._clock(), message_id, self.owner)
+            ).rowcount > 0
+
+    def release(self, message_id: int):
+        """放弃租约，其他实例可以立即领取（如本实例的流水线已满）"""
+        message_id = int(message_id)
+        with self._lock:
+            self._held.discard(message_id)
+            self._conn.execute(
+                "UPDATE message_leases SET expires_at = 0, claims = MAX(claims - 1, 0), updated_at = ? "
+                "WHERE message_id = ? AND owner = ? AND done = 0",
+                (self._clock(), message_id, self.owner)
+            )
+
+    def is_done(self, message_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT done FROM message_leases WHERE message_id = ?", (int(message_id),)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def prune(self, max_age: float = 7 * 86400) -> int:
+        """删除完成超过max_age秒的记录"""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM message_leases WHERE done = 1 AND updated_at < ?", (self._clock() - max_age,)
+            ).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: {"owner", "held": 持有的租约数, "claimed": 领取成功次数,
+            "rejected": 已完成或由其他实例持有而未领取的次数, "reclaimed": 接手其他实例过期租约的次数,
+            "lost": 续租时发现已被其他实例接手的次数}
+        """
+        with self._lock:
+            held = len(self._held)
+        return {"owner": self.owner, "held": held, "claimed": self.claimed, "rejected": self.rejected,
+                "reclaimed": self.reclaimed, "lost": self.lost}
+
+    def close(self, timeout: float = 5):
+        """停止续租线程并关闭数据库，未完成的租约过期后由其他实例接手"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        super().close()
+
+    def _heartbeat(self):
+        """续租线程主循环"""
+        interval = max(0.05, self.lease_seconds / 3)
+        while not self._stopped.wait(interval):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"续租时发生异常: {str(e)}")
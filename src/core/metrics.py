@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+运行指标
+提供线程安全的计数器(Counter)、仪表(Gauge)和直方图(Histogram)，按Prometheus文本格式输出，
+并可在本地启动一个HTTP服务：/metrics 返回Prometheus格式的指标，/stats 返回各组件统计的JSON。
+只依赖标准库，不需要安装prometheus_client
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 默认的耗时分桶(秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Dify核查深度的分桶
+DEPTH_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+
+# 从@到回复的耗时分桶(秒)，包含发件箱排队和重试的时间
+END_TO_END_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    """指标基类，按标签值分别保存数据"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, label_values: Sequence[Any]) -> LabelValues:
+        if len(label_values) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(label_values)}")
+        return tuple(str(value) for value in label_values)
+
+    def collect(self) -> List[str]:
+        """输出指标的Prometheus文本行（含HELP和TYPE）"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, *label_values: Any, amount: float = 1):
+        """
+        增加计数
+
+        Args:
+            *label_values: 标签值，顺序与labelnames一致
+            amount (float, optional): 增加量，不能为负. 默认为1.
+        """
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *label_values: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(label_values), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，如队列深度、进行中的请求数"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def set(self, value: float, *label_values: Any):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, *label_values: Any, amount: float = 1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *label_values: Any, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(label_values), 0.0)
+
+    @contextmanager
+    def track(self, *label_values: Any) -> Iterator[None]:
+        """进入时加1，退出时减1，用于统计进行中的请求数"""
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    分桶直方图
+
+    每个桶统计小于等于上界的观测次数（输出时累加），另外记录观测值之和与次数
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if bound != math.inf)) + (math.inf,)
+        # {标签值: [各桶计数..., 观测值之和, 观测次数]}
+        self._values: Dict[LabelValues, List[float]] = {}
+        if not self.labelnames:
+            self._values[()] = self._empty()
+
+    def _empty(self) -> List[float]:
+        return [0] * len(self.buckets) + [0.0, 0]
+
+    def observe(self, value: float, *label_values: Any):
+        """
+        记录一次观测
+
+        Args:
+            value (float): 观测值，如耗时(秒)
+            *label_values: 标签值，顺序与labelnames一致
+        """
+        key = self._key(label_values)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = self._empty()
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values: Any) -> Iterator[None]:
+        """记录代码块的耗时(秒)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, *label_values)
+
+    def snapshot(self, *label_values: Any) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: {"count": 观测次数, "sum": 观测值之和}
+        """
+        with self._lock:
+            data = self._values.get(self._key(label_values)) or self._empty()
+            return {"count": data[-1], "sum": data[-2]}
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(data)) for key, data in self._values.items())
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{labels} {data[-1]}")
+        return lines
+
+
+class Registry:
+    """
+    指标注册表
+
+    输出前会依次调用已注册的刷新函数，用于在抓取时更新队列深度等按需读取的仪表
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._hooks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def add_hook(self, hook: Callable[[], None]):
+        """注册抓取前调用的刷新函数"""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[], None]):
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def render(self) -> str:
+        """以Prometheus文本格式输出所有指标"""
+        with self._lock:
+            hooks = list(self._hooks)
+            metrics = list(self._metrics.values())
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"刷新指标时发生异常: {str(e)}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# 默认注册表，机器人的指标都注册在这里
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# 机器人的运行指标
+POLL_SECONDS = histogram("fakebot_poll_seconds", "拉取@信息的耗时(秒)")
+DIFY_FIRST_TOKEN_SECONDS = histogram("fakebot_dify_first_token_seconds", "从请求Dify到收到第一段回答的耗时(秒)")
+DIFY_SECONDS = histogram("fakebot_dify_seconds", "一次Dify核查的总耗时(秒)")
+REPLY_POST_SECONDS = histogram("fakebot_reply_post_seconds", "单次发送回复请求的耗时(秒)")
+END_TO_END_SECONDS = histogram("fakebot_end_to_end_seconds", "从被@到回复发送成功的耗时(秒)",
+                               buckets=END_TO_END_BUCKETS)
+MESSAGES_TOTAL = counter("fakebot_messages_total",
+                         "@消息数，result为processed/failed/deduped/cached/stale/skipped，cached为复用已有核查结果的消息，"
+                         "stale为超过新鲜度时限而放弃的消息，skipped为本地分流判断为不回复的消息，"
+                         "parked为上游不可用而暂存、稍后重试的消息",
+                         ["result"])
+QUEUE_DEPTH = gauge("fakebot_queue_depth", "流水线各阶段未完成的任务数", ["stage"])
+OUTBOX_PENDING = gauge("fakebot_outbox_pending", "发件箱中待发送的回复数")
+DIFY_INFLIGHT = gauge("fakebot_dify_inflight", "进行中的Dify请求数")
+DIFY_TOKENS_TOTAL = counter("fakebot_dify_tokens_total", "Dify消耗的token数", ["kind"])
+DIFY_PRICE_TOTAL = counter("fakebot_dify_price_total", "Dify费用", ["currency"])
+DIFY_ENDPOINT_TOTAL = counter("fakebot_dify_endpoint_total", "各Dify服务的请求结果数，result为ok/failed",
+                              ["endpoint", "result"])
+DIFY_DEPTH = histogram("fakebot_dify_depth", "每次调用Dify选择的核查深度", buckets=DEPTH_BUCKETS)
+TRIAGE_TOTAL = counter("fakebot_triage_total", "本地分流结果数，decision为skip/template/escalate，reason为判断依据",
+                       ["decision", "reason"])
+REPLY_ACCOUNT_TOTAL = counter("fakebot_reply_account_total",
+                              "各回复账号的发送结果数，result为sent/throttled/failed", ["account", "result"])
+CIRCUIT_STATE = gauge("fakebot_circuit_state", "各上游熔断器的状态，0为closed，1为half_open，2为open", ["upstream"])
+CIRCUIT_OPENED_TOTAL = counter("fakebot_circuit_opened_total", "各上游熔断器打开的次数", ["upstream"])
+PARKED_MESSAGES = gauge("fakebot_parked_messages", "因上游不可用而暂存的@消息数")
+
+
+def record_dify_usage(usage: Optional[Dict[str, Any]]):
+    """累计Dify message_end中metadata.usage的token数和费用"""
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            DIFY_TOKENS_TOTAL.inc(kind, amount=int(tokens))
+    try:
+        price = float(usage.get("total_price") or 0)
+    except (TypeError, ValueError):
+        price = 0.0
+    if price > 0:
+        DIFY_PRICE_TOTAL.inc(usage.get("currency") or "USD", amount=price)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.server.registry.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/stats":
+            stats = self.server.stats() if self.server.stats is not None else {}
+            body = json.dumps(stats, ensure_ascii=False, default=str).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(f"指标服务 {self.address_string()} {format % args}")
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """在后台线程中提供 /metrics 和 /stats 的HTTP服务"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, registry: Registry = REGISTRY,
+                 stats: Optional[Callable[[], Dict[str, Any]]] = None):
+        """
+        Args:
+            host (str, optional): 监听地址，默认只监听本机. 默认为"127.0.0.1".
+            port (int, optional): 监听端口，0表示随机端口. 默认为9108.
+            registry (Registry, optional): 输出的指标注册表. 默认为REGISTRY.
+            stats (Callable, optional): 返回/stats内容的函数
+        """
+        super().__init__((host, port), _Handler)
+        self.registry = registry
+        self.stats = stats
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self._thread.start()
+        logger.info(f"指标服务已启动: http://{self.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def close(self):
+        """停止服务并释放端口"""
+        if self._thread.is_alive():
+            self.shutdown()
+            self._thread.join(timeout=5)
+        self.server_close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+暂存的@消息
+上游熔断或请求失败时，@消息不标记为已处理，而是连同消息内容暂存到SQLite(WAL)中，
+上游恢复后由主循环取出重新派发；进程重启后暂存的消息继续保留
+"""
+
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core.sqlite_store import SQLiteStore
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class ParkingLot(SQLiteStore):
+    """
+    按上游暂存@消息
+
+    - park: 暂存一条消息，因上游失败而暂存的次数超过max_parks后返回False，由调用方放弃处理
+    - take: 取出某个上游的暂存消息重新派发，取出的消息仍保留记录，处理结束后用done删除
+    - 进程崩溃时已取出但未处理结束的消息，下次启动时恢复为暂存状态
+    """
+
+    def __init__(self, path: str, max_parks: int = 5, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path (str): SQLite数据库文件路径
+            max_parks (int, optional): 同一条消息因上游失败而暂存的最多次数，熔断期间未发出请求的暂存不计入. 默认为5.
+            clock (Callable, optional): 时钟函数，默认为time.time
+        """
+        super().__init__(path)
+        self.max_parks = max(1, max_parks)
+        self._clock = clock
+        self.parked = 0
+        self.resumed = 0
+        self.abandoned = 0
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parked_messages ("
+            "message_id INTEGER PRIMARY KEY, upstream TEXT NOT NULL, payload TEXT NOT NULL, "
+            "failures INTEGER NOT NULL DEFAULT 0, parked INTEGER NOT NULL DEFAULT 1, "
+            "parked_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parked_messages_upstream "
+            "ON parked_messages(upstream, parked, failures, parked_at)"
+        )
+        # 上次运行时已取出但未处理结束的消息
+        restored = self._conn.execute("UPDATE parked_messages SET parked = 1 WHERE parked = 0").rowcount
+        if restored:
+            logger.info(f"恢复了 {restored} 条上次运行时未处理完的暂存@消息")
+
+    def park(self, message_id: int, message: Dict[str, Any], upstream: str, failed: bool = True) -> bool:
+        """
+        暂存一条消息
+
+        Args:
+            message_id (int): @消息ID
+            message (Dict[str, Any]): 消息内容，重新派发时使用
+            upstream (str): 不可用的上游名称
+            failed (bool, optional): 是否实际请求了上游并失败，False表示熔断期间没有发出请求. 默认为True.
+
+        Returns:
+            bool: 是否已暂存，失败次数超过max_parks时删除记录并返回False
+        """
+        message_id = int(message_id)
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO parked_messages (message_id, upstream, payload, failures, parked_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET upstream = excluded.upstream, "
+                "failures = failures + excluded.failures, parked = 1, updated_at = excluded.updated_at",
+                (message_id, upstream, json.dumps(message, ensure_ascii=False), int(failed), now, now)
+            )
+            failures = self._conn.execute(
+                "SELECT failures FROM parked_messages WHERE message_id = ?", (message_id,)
+            ).fetchone()[0]
+            if failures > self.max_parks:
+                self._conn.execute("DELETE FROM parked_messages WHERE message_id = ?", (message_id,))
+                self.abandoned += 1
+                return False
+            self.parked += 1
+        return True
+
+    def take(self, upstream: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        取出某个上游的暂存消息，失败次数少的优先，其次按暂存先后，避免探测总是落在同一条消息上
+
+        Args:
+            upstream (str): 上游名称
+            limit (int, optional): 最多取出的条数. 默认为20.
+
+        Returns:
+            List[Dict[str, Any]]: 消息内容
+        """
+        if limit <= 0:
+            return []
+        now = self._clock()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, payload FROM parked_messages WHERE upstream = ? AND parked = 1 "
+                "ORDER BY failures, parked_at LIMIT ?",
+                (upstream, limit)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE parked_messages SET parked = 0, updated_at = ? WHERE message_id = ?",
+                [(now, row[0]) for row in rows]
+            )
+            self.resumed += len(rows)
+        return [json.loads(row[1]) for row in rows]
+
+    def done(self, message_id: int):
+        """消息处理结束(成功或放弃)，删除暂存记录"""
+        with self._lock:
+            self._conn.execute("DELETE FROM parked_messages WHERE message_id = ?", (int(message_id),))
+
+    def is_parked(self, message_id: int) -> bool:
+        """消息是否有暂存记录(包括已取出正在重新处理的)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM parked_messages WHERE message_id = ?", (int(message_id),)
+            ).fetchone()
+        return row is not None
+
+    def count(self, upstream: Optional[str] = None) -> int:
+        """暂存中(未取出)的消息数"""
+        with self._lock:
+            if upstream is None:
+                return self._conn.execute("SELECT COUNT(*) FROM parked_messages WHERE parked = 1").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM parked_messages WHERE parked = 1 AND upstream = ?", (upstream,)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: {"waiting": 各上游暂存中的消息数, "parked": 暂存次数,
+            "resumed": 取出重新派发的次数, "abandoned": 失败次数过多而放弃的消息数}
+        """
+        with self._lock:
+            waiting = dict(self._conn.execute(
+                "SELECT upstream, COUNT(*) FROM parked_messages WHERE parked = 1 GROUP BY upstream"
+            ).fetchall())
+        return {"waiting": waiting, "parked": self.parked, "resumed": self.resumed, "abandoned": self.abandoned}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分阶段处理流水线
+将@消息的处理拆分为多个独立阶段（解析目标 → Dify核查 → 发送回复），
+每个阶段有自己的工作线程和有界队列，慢阶段不会占用其他阶段的并发名额
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from src.core.deadline import current_time
+from src.core.worker_pool import WorkerPool, DoneCallback
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """
+    由多个WorkerPool串联而成的流水线
+
+    每个阶段的处理函数签名为 handler(job, deadline) -> bool，
+    返回True时任务进入下一阶段，返回False时任务在该阶段结束。
+    下一阶段队列已满时，上一阶段的工作线程会阻塞等待（最多到任务截止时间），
+    从而把压力逐级传回入口，入口队列满时submit返回False。
+    """
+
+    def __init__(self, name: str = "pipeline", deadline: float = 900):
+        """
+        Args:
+            name (str, optional): 流水线名称，用于日志和线程名. 默认为"pipeline".
+            deadline (float, optional): 默认的单任务处理时限(秒)，覆盖所有阶段. 默认为900.
+        """
+        self.name = name
+        self.deadline = deadline
+        self._stages: List[Tuple[str, WorkerPool]] = []
+        self._pending: Set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    def add_stage(self,
+                  name: str,
+                  handler: Callable[[Any, float], bool],
+                  workers: int = 1,
+                  queue_size: int = 50,
+                  priority: Optional[Callable[[Any], float]] = None) -> "Pipeline":
+        """
+        追加一个处理阶段
+
+        Args:
+            name (str): 阶段名称
+            handler (Callable): 阶段处理函数，参数为(任务数据, 截止时间戳)
+            workers (int, optional): 该阶段的工作线程数. 默认为1.
+            queue_size (int, optional): 该阶段的队列容量. 默认为50.
+            priority (Callable, optional): 该阶段队列的优先级函数，参数为任务数据，值越大越先处理；None表示先进先出
+
+        Returns:
+            Pipeline: 自身，便于链式调用
+        """
+        pool = WorkerPool(
+            handler=handler,
+            max_workers=workers,
+            max_pending=queue_size,
+            deadline=self.deadline,
+            name=f"{self.name}-{name}",
+            priority=priority
+        )
+        self._stages.append((name, pool))
+        return self
+
+    def submit(self, key: Hashable, job: Any, on_done: Optional[DoneCallback] = None,
+               deadline: Optional[float] = None) -> bool:
+        """
+        提交任务到第一个阶段
+
+        Args:
+            key (Hashable): 任务键，如消息ID
+            job (Any): 在各阶段之间传递的任务数据
+            on_done (DoneCallback, optional): 任务离开流水线时的回调（成功走完所有阶段或在某一阶段结束）
+            deadline (float, optional): 截止时间戳，默认为当前时间加上默认时限
+
+        Returns:
+            bool: 是否已接收任务（重复提交或入口队列已满时返回False）
+        """
+        if not self._stages:
+            raise ValueError("流水线没有任何处理阶段")
+
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        if deadline is None:
+            deadline = current_time() + self.deadline
+
+        if not self._stages[0][1].submit(key, job, on_done=self._make_callback(0, job, on_done, deadline),
+                                      deadline=deadline):
+            with self._lock:
+                self._pending.discard(key)
+            return False
+        return True
+
+    def is_pending(self, key: Hashable) -> bool:
+        """任务是否仍在流水线中"""
+        with self._lock:
+            return key in self._pending
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        获取各阶段的队列深度
+
+        Returns:
+            Dict[str, Dict[str, int]]: {阶段名: {"queued": 排队数, "active": 执行中数量, "pending": 未完成总数}}
+        """
+        return {name: pool.stats() for name, pool in self._stages}
+
+    def format_stats(self) -> str:
+        """以紧凑的文本格式输出各阶段队列深度，便于写入日志"""
+        return ", ".join(
+            f"{name}={stage['queued']}+{stage['active']}"
+            for name, stage in self.stats().items()
+        )
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None):
+        """
+        按阶段顺序停止流水线，前一阶段排空后再停止后一阶段
+
+        Args:
+            wait (bool, optional): 是否等待已接收的任务处理完毕. 默认为True.
+            timeout (float, optional): 整体等待的最长时间(秒)，None表示一直等待
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        for _, pool in self._stages:
+            remaining = None if end_time is None else max(0.0, end_time - time.time())
+            pool.shutdown(wait=wait, timeout=remaining)
+
+    def _make_callback(self, index: int, job: Any, on_done: Optional[DoneCallback],
+                       deadline: float) -> DoneCallback:
+        """生成第index阶段的完成回调：成功则转入下一阶段，否则结束任务"""
+
+        def callback(key: Hashable, success: bool):
+            if success and index + 1 < len(self._stages):
+                next_name, next_pool = self._stages[index + 1]
+                forwarded = next_pool.submit(
+                    key, job,
+                    on_done=self._make_callback(index + 1, job, on_done, deadline),
+                    deadline=deadline,
+                    block=True
+                )
+                if forwarded:
+                    return
+                logger.warning(f"[{self.name}] 任务 {key} 无法进入阶段 {next_name}，放弃处理")
+                success = False
+
+            # 先回调再释放任务键，与WorkerPool保持一致
+            try:
+                if on_done is not None:
+                    on_done(key, success)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        return callback
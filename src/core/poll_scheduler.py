@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自适应轮询间隔
+根据最近的@消息到达速率在最小/最大间隔之间调整轮询间隔：
+有新@时立即加快，空闲时逐渐放慢，出错或触发风控时退避
+"""
+
+import logging
+import math
+import time
+from typing import Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# B站风控/限流相关错误码
+RISK_CONTROL_CODES = {
+    -412,  # 请求被拦截
+    -352,  # 风控校验失败
+    -509,  # 请求过于频繁
+    -799,  # 请求过于频繁，请稍后再试
+}
+
+
+class AdaptivePollScheduler:
+    """
+    轮询间隔控制器
+
+    - 到达速率: 以半衰期half_life对每次轮询观察到的新消息数做指数加权平均(条/秒)
+    - 正常间隔: target_per_poll / 速率，即平均每次轮询拉到target_per_poll条新消息，限制在[min, max]内
+    - 有新@后的hot_window秒内使用最小间隔，方便快速响应同一视频下的连续@；
+      最小间隔默认与原来的固定轮询间隔(10秒)相同，热度期间的请求数不会多于固定间隔轮询
+    - 出错时间隔翻倍，风控错误码直接退避到risk_backoff
+    """
+
+    def __init__(self,
+                 min_interval: float = 10,
+                 max_interval: float = 60,
+                 initial_interval: float = 10,
+                 half_life: float = 600,
+                 target_per_poll: float = 0.5,
+                 hot_window: float = 120,
+                 risk_backoff: float = 300):
+        """
+        Args:
+            min_interval (float, optional): 最小轮询间隔(秒). 默认为10.
+            max_interval (float, optional): 空闲和普通错误时的最大轮询间隔(秒). 默认为60.
+            initial_interval (float, optional): 启动时的轮询间隔(秒). 默认为10.
+            half_life (float, optional): 到达速率的半衰期(秒). 默认为600.
+            target_per_poll (float, optional): 期望平均每次轮询拉到的新消息数. 默认为0.5.
+            hot_window (float, optional): 收到新@后保持最小间隔的时长(秒). 默认为120.
+            risk_backoff (float, optional): 触发风控错误码后的等待时间(秒)，可以超过max_interval. 默认为300.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.half_life = half_life
+        self.target_per_poll = target_per_poll
+        self.hot_window = hot_window
+        self.risk_backoff = risk_backoff
+
+        self.rate = 0.0  # 条/秒
+        self.interval = self._clamp(initial_interval)
+        self.consecutive_errors = 0
+        self._last_poll: Optional[float] = None
+        self._last_arrival: Optional[float] = None
+
+    def record_poll(self, new_count: int, now: Optional[float] = None) -> float:
+        """
+        记录一次成功的轮询
+
+        Args:
+            new_count (int): 本次轮询拉到的新消息数
+            now (float, optional): 当前时间(单调时钟)，默认为time.monotonic()
+
+        Returns:
+            float: 下一次轮询前应等待的秒数
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_poll is not None:
+            elapsed = max(now - self._last_poll, 1e-3)
+            # 按实际经过的时间计算衰减系数，轮询间隔不同也能得到一致的速率估计
+            alpha = 1 - math.exp(-math.log(2) * elapsed / self.half_life)
+            self.rate += alpha * (new_count / elapsed - self.rate)
+        self._last_poll = now
+        if new_count > 0:
+            self._last_arrival = now
+        self.consecutive_errors = 0
+
+        if self._last_arrival is not None and now - self._last_arrival < self.hot_window:
+            interval, reason = self.min_interval, "最近有新@"
+        elif self.rate > 0:
+            interval, reason = self._clamp(self.target_per_poll / self.rate), f"到达速率 {self.rate * 3600:.1f} 条/小时"
+        else:
+            interval, reason = self.max_interval, "空闲"
+
+        return self._update(interval, reason, new_count)
+
+    def record_error(self, code: Optional[int] = None, now: Optional[float] = None) -> float:
+        """
+        记录一次失败的轮询
+
+        Args:
+            code (int, optional): B站返回的错误码，None表示网络等其他错误
+            now (float, optional): 当前时间(单调时钟)，默认为time.monotonic()
+
+        Returns:
+            float: 下一次轮询前应等待的秒数
+        """
+        self._last_poll = time.monotonic() if now is None else now
+        self.consecutive_errors += 1
+
+        if code in RISK_CONTROL_CODES:
+            interval = max(self.risk_backoff, self.interval)
+            reason = f"触发风控(错误码 {code})"
+        else:
+            interval = self._clamp(self.interval * 2)
+            reason = f"连续 {self.consecutive_errors} 次出错" + (f"(错误码 {code})" if code is not None else "")
+
+        return self._update(interval, reason, 0)
+
+    def _update(self, interval: float, reason: str, new_count: int) -> float:
+        """更新间隔并记录调整原因，间隔明显变化时用INFO级别"""
+        previous = self.interval
+        self.interval = interval
+        message = (f"轮询间隔 {previous:.1f}s -> {interval:.1f}s, 原因: {reason}, "
+                   f"本次新消息 {new_count} 条, 估计速率 {self.rate * 3600:.1f} 条/小时")
+        if abs(interval - previous) >= max(1.0, previous * 0.25):
+            logger.info(message)
+        else:
+            logger.debug(message)
+        return interval
+
+    def _clamp(self, interval: float) -> float:
+        return min(self.max_interval, max(self.min_interval, interval))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@消息优先级和新鲜度时限
+被@很久的消息和热门视频下刚被@的消息不应平等竞争Dify的并发：
+优先级按被@的时间计算，同一评论区近期被@的次数和已有缓存的核查结果折算为额外的新鲜度；
+超过新鲜度时限的消息按配置直接放弃或降到最低优先级
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 过期消息的处理方式
+STALE_DROP = "drop"            # 放弃，不再调用Dify
+STALE_DOWNGRADE = "downgrade"  # 继续处理，但排在所有未过期消息之后
+
+# 降级后扣减的优先级，远大于任何实际的时间差
+DOWNGRADE_PENALTY = 1e9
+
+
+class MentionPrioritizer:
+    """
+    计算@消息的优先级，值越大越先处理
+
+    优先级 = 被@的时间戳 + hot_weight × 同一评论区近期的其他@数 + (已有缓存结果时)cached_weight，
+    即同一评论区每多一条@相当于晚被@hot_weight秒。只与被@的时间有关而不随当前时间变化，
+    因此任务入队时计算一次即可
+    """
+
+    def __init__(self,
+                 freshness: Optional[float] = 1800,
+                 stale_policy: str = STALE_DROP,
+                 hot_weight: float = 60,
+                 hot_window: float = 600,
+                 cached_weight: float = 600,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            freshness (float, optional): 新鲜度时限(秒)，被@超过这么久仍未回复的消息视为过期，None表示不限制. 默认为1800.
+            stale_policy (str, optional): 过期消息的处理方式 STALE_DROP / STALE_DOWNGRADE. 默认为STALE_DROP.
+            hot_weight (float, optional): 同一评论区每多一条近期的@折算的新鲜度(秒). 默认为60.
+            hot_window (float, optional): 统计同一评论区@数的时间窗口(秒). 默认为600.
+            cached_weight (float, optional): 已有缓存核查结果时折算的新鲜度(秒)，这类消息不需要调用Dify. 默认为600.
+            clock (Callable, optional): 时钟函数，默认为time.time
+        """
+        if stale_policy not in (STALE_DROP, STALE_DOWNGRADE):
+            raise ValueError(f"未知的过期消息处理方式: {stale_policy}")
+        self.freshness = freshness
+        self.stale_policy = stale_policy
+        self.hot_weight = hot_weight
+        self.hot_window = hot_window
+        self.cached_weight = cached_weight
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._subjects: Dict[Any, Deque[float]] = {}
+        self.dropped = 0
+        self.downgraded = 0
+
+    def observe(self, message: Dict[str, Any]):
+        """记录一条新拉取到的@消息，用于统计同一评论区的热度"""
+        subject_id = message.get("item", {}).get("subject_id")
+        if not subject_id:
+            return
+        now = self._clock()
+        with self._lock:
+            self._subjects.setdefault(subject_id, deque()).append(now)
+            self._trim(now)
+
+    def heat(self, subject_id: Any) -> int:
+        """同一评论区在时间窗口内被@的次数"""
+        if not subject_id:
+            return 0
+        with self._lock:
+            self._trim(self._clock())
+            return len(self._subjects.get(subject_id, ()))
+
+    def is_stale(self, message: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """是否已超过新鲜度时限"""
+        at_time = message.get("at_time")
+        if self.freshness is None or not at_time:
+            return False
+        now = self._clock() if now is None else now
+        return now - at_time > self.freshness
+
+    def deadline(self, message: Dict[str, Any], default: float) -> float:
+        """
+        消息的处理截止时间：放弃过期消息时不超过新鲜度时限
+
+        Args:
+            message (Dict): @消息
+            default (float): 默认的截止时间戳
+
+        Returns:
+            float: 截止时间戳，超过后流水线放弃该消息的剩余阶段
+        """
+        at_time = message.get("at_time")
+        if self.freshness is None or self.stale_policy != STALE_DROP or not at_time:
+            return default
+        return min(default, at_time + self.freshness)
+
+    def score(self, message: Dict[str, Any], cached: bool = False) -> float:
+        """
+        计算优先级
+
+        Args:
+            message (Dict): @消息
+            cached (bool, optional): 是否已有缓存的核查结果. 默认为False.
+
+        Returns:
+            float: 优先级，值越大越先处理
+        """
+        at_time = message.get("at_time") or self._clock()
+        heat = self.heat(message.get("item", {}).get("subject_id"))
+        score = at_time + self.hot_weight * max(0, heat - 1)
+        if cached:
+            score += self.cached_weight
+        if self.stale_policy == STALE_DOWNGRADE and self.is_stale(message):
+            with self._lock:
+                self.downgraded += 1
+            score -= DOWNGRADE_PENALTY
+        return score
+
+    def record_dropped(self):
+        with self._lock:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"dropped": 因过期放弃的消息数, "downgraded": 因过期降级的次数, "subjects": 近期被@的评论区数}
+        """
+        with self._lock:
+            self._trim(self._clock())
+            return {"dropped": self.dropped, "downgraded": self.downgraded, "subjects": len(self._subjects)}
+
+    def _trim(self, now: float):
+        """清理时间窗口之外的记录，调用方需持有锁"""
+        cutoff = now - self.hot_window
+        for subject_id in list(self._subjects):
+            times = self._subjects[subject_id]
+            while times and times[0] < cutoff:
+                times.popleft()
+            if not times:
+                del self._subjects[subject_id]
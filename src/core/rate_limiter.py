@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+令牌桶限流
+按固定速率补充令牌，允许一定的突发；触发风控时可以暂停发放令牌一段时间
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+
+    - 每秒补充rate个令牌，最多积累capacity个
+    - pause(seconds)在指定时间内不发放令牌，用于风控退避
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数
+            capacity (float, optional): 令牌桶容量，即允许的最大突发数. 默认为1.
+            clock (Callable, optional): 时钟函数，默认为time.monotonic
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        尝试取出令牌
+
+        Returns:
+            float: 0表示已取出，否则为还需等待的秒数（此时不取出令牌）
+        """
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None,
+                sleep: Callable[[float], None] = time.sleep) -> bool:
+        """
+        阻塞直到取出令牌
+
+        Args:
+            tokens (float, optional): 需要的令牌数. 默认为1.
+            timeout (float, optional): 最长等待时间(秒)，None表示一直等待
+            sleep (Callable, optional): 等待函数，可替换为可中断的等待
+
+        Returns:
+            bool: 是否取出令牌
+        """
+        end_time = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if end_time is not None:
+                remaining = end_time - self._clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            sleep(wait)
+
+    def pause(self, seconds: float):
+        """在seconds秒内不发放令牌，并清空已积累的令牌"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流量录制
+把每次轮询拿到的原始@消息响应和Dify的原始流式事件追加写入gzip压缩的JSONL归档
+(traffic_YYYYMMDD_NNN.jsonl.gz，按日期和大小轮换)，用 tools/replay.py 以加速的虚拟时钟回放
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from src.core.tracing import TraceWriter
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 记录类型
+KIND_POLL = "poll"  # 一次@消息接口的原始响应
+KIND_DIFY = "dify"  # 一次Dify请求的查询内容和原始事件
+
+
+class TrafficRecorder(TraceWriter):
+    """
+    流量归档写入器
+
+    与TraceWriter一样在后台线程中批量写入，文件用gzip压缩，
+    每天从序号000开始，当前文件超过max_bytes后换下一个序号
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, **kwargs: Any):
+        """
+        Args:
+            directory (str): 归档目录
+            max_bytes (int, optional): 单个归档文件的大小上限(压缩后字节数). 默认为64MB.
+            **kwargs: 见TraceWriter
+        """
+        self.max_bytes = max_bytes
+        self._day = ""
+        self._part = 0
+        kwargs.setdefault("prefix", "traffic")
+        super().__init__(directory, **kwargs)
+
+    def path_for(self, timestamp: float) -> str:
+        day = time.strftime("%Y%m%d", time.localtime(timestamp))
+        if day != self._day:
+            self._day = day
+            self._part = 0
+        while True:
+            path = os.path.join(self.directory, f"{self.prefix}_{day}_{self._part:03d}.jsonl.gz")
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_bytes:
+                return path
+            self._part += 1
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        # 每批追加一个gzip成员，gzip.open读取时会自动连接
+        files: Dict[str, List[str]] = {}
+        for record in batch:
+            files.setdefault(self.path_for(record.get("ts", time.time())), []).append(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            )
+        for path, lines in files.items():
+            try:
+                with gzip.open(path, "at", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                self.written += len(lines)
+            except OSError as e:
+                self.dropped += len(lines)
+                logger.error(f"写入流量归档失败: {str(e)}")
+
+
+# 当前使用的录制器，未配置时record不做任何事
+_recorder: Optional[TrafficRecorder] = None
+
+
+def configure(recorder: Optional[TrafficRecorder]):
+    """设置全局录制器，None表示关闭"""
+    global _recorder
+    _recorder = recorder
+
+
+def is_recording() -> bool:
+    return _recorder is not None
+
+
+def record(kind: str, **data: Any):
+    """写入一条录制记录（未配置录制器时忽略）"""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.emit({"kind": kind, "ts": round(time.time(), 4), **data})
+
+
+def read_archive(paths: List[str]) -> List[Dict[str, Any]]:
+    """
+    读取归档文件中的所有记录，按时间排序
+
+    Args:
+        paths (List[str]): 归档文件路径，.gz结尾的按gzip读取
+
+    Returns:
+        List[Dict[str, Any]]: 记录列表，跳过无法解析的行（如写入中断的最后一行）
+    """
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except (OSError, EOFError) as e:
+            # 进程被中断时最后一个gzip成员可能不完整，保留已读出的记录
+            logger.warning(f"读取归档 {path} 时出错: {str(e)}")
+    records.sort(key=lambda record: record.get("ts", 0))
+    return records
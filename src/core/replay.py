@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流量回放
+用加速的虚拟时钟把录制的@消息按原来的到达时间依次送入流水线，
+Dify请求按查询内容返回录制的原始事件，事件之间的间隔同样按倍速缩短
+"""
+
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.api.bilibili import parse_at_messages
+from src.api.dify import StreamCollector, StreamEvent
+from src.core.recorder import KIND_DIFY, KIND_POLL
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """从start开始、以speed倍速前进的虚拟时钟"""
+
+    def __init__(self, start: float, speed: float = 10):
+        """
+        Args:
+            start (float): 虚拟时钟的起始时间戳，一般为录制开始的时间
+            speed (float, optional): 倍速. 默认为10.
+        """
+        self.start = start
+        self.speed = max(speed, 1e-6)
+        self._real_start = time.monotonic()
+
+    def time(self) -> float:
+        """当前虚拟时间戳"""
+        return self.start + (time.monotonic() - self._real_start) * self.speed
+
+    def sleep(self, seconds: float):
+        """等待虚拟时间seconds秒"""
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def sleep_until(self, timestamp: float):
+        """等待到虚拟时间timestamp"""
+        self.sleep(timestamp - self.time())
+
+
+def extract_mentions(records: List[Dict[str, Any]]) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    从录制的轮询响应中取出@消息及其第一次被拉取到的时间
+
+    机器人启动前已有的消息（@时间早于第一次轮询）在初始化时被标记为已处理，不参与回放
+
+    Returns:
+        List[Tuple[float, Dict]]: [(拉取时间戳, 解析后的@消息)]，按拉取时间排序
+    """
+    polls = [record for record in records if record.get("kind") == KIND_POLL]
+    if not polls:
+        return []
+    started = polls[0]["ts"]
+    seen: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+    for record in polls:
+        for message in parse_at_messages(record.get("response") or {"code": -1, "message": ""}):
+            if message["id"] in seen or message["at_time"] < int(started):
+                continue
+            seen[message["id"]] = (record["ts"], message)
+    return sorted(seen.values(), key=lambda item: (item[0], item[1]["at_time"], item[1]["id"]))
+
+
+class ReplayDifyAPI:
+    """
+    按查询内容返回录制结果的Dify客户端，接口与DifyAPI的send_chat_message/read_stream一致
+
+    同一查询录制了多次时使用第一次的结果，没有录制的查询返回错误；read_stream的deadline为虚拟时间戳
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], clock: VirtualClock):
+        self.clock = clock
+        self.exchanges: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            if record.get("kind") == KIND_DIFY:
+                self.exchanges.setdefault(record.get("query", ""), record)
+        self.calls = 0
+        self.missing = 0
+
+    def send_chat_message(self, query: str, timeout: Any = None, **kwargs: Any) -> Dict[str, Any]:
+        self.calls += 1
+        record = self.exchanges.get(query)
+        if record is None:
+            self.missing += 1
+            return {"error": f"录制中没有该查询: {query}"}
+        if "error" in record:
+            return {"error": record["error"]}
+        started = self.clock.time()
+        if "response" in record:
+            self.clock.sleep(record.get("elapsed", 0))
+            return record["response"]
+        return {"status": "streaming", "response": {"started": started, "events": record.get("events", [])}}
+
+    def read_stream(self, response: Dict[str, Any], max_chars: Optional[int] = None,
+                    deadline: Optional[float] = None,
+                    on_event: Optional[Callable[[StreamEvent], None]] = None,
+                    stop_at_max_chars: bool = False) -> Dict[str, Any]:
+        collector = StreamCollector(max_chars, stop_at_max_chars)
+        for offset, data in response["events"]:
+            at = response["started"] + offset
+            # 与DifyAPI.read_stream一致，截止时间按虚拟时钟计算
+            if deadline is not None and at > deadline:
+                self.clock.sleep_until(deadline)
+                if not collector.truncated:
+                    collector.error = "超过处理截止时间"
+                    collector.timed_out = True
+                break
+            self.clock.sleep_until(at)
+            event = StreamEvent(data.get("event", "message"), data)
+            if on_event is not None:
+                on_event(event)
+            if not collector.feed(event):
+                break
+        return collector.result()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+持久化回复发件箱
+核查结果先写入SQLite(WAL)再由后台线程发送，发送失败按错误码分类处理：
+可重试的错误按带抖动的指数退避延后重试，评论区类型不对时换类型重发，无法恢复的错误直接放弃；
+发送速率由令牌桶限制，触发风控时暂停发送；配置了回复账号池时按账号分别限流，
+某个账号触发风控后只冷却该账号并立即换账号重发；B站熔断期间不发送也不消耗发送次数。
+重启后未发送的回复会继续发送
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.api.bilibili import send_reply_comment
+from src.core import tracing
+from src.core.account_pool import AccountPool, ReplyAccount
+from src.core.circuit_breaker import CircuitBreaker
+from src.core.metrics import END_TO_END_SECONDS, REPLY_POST_SECONDS
+from src.core.poll_scheduler import RISK_CONTROL_CODES
+from src.core.rate_limiter import TokenBucket
+from src.core.sqlite_store import SQLiteStore
+from src.core.uri_resolver import TYPE_DYNAMIC, TYPE_VIDEO
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 回复结果分类
+REPLY_OK = "ok"                    # 发送成功
+REPLY_RETRY = "retry"              # 稍后重试
+REPLY_RATE_LIMITED = "rate_limited"  # 触发风控，暂停发送后重试
+REPLY_SWITCH_TYPE = "switch_type"  # 换用动态评论区类型立即重试
+REPLY_FATAL = "fatal"              # 无法恢复，放弃
+
+# 评论区类型不对时返回的错误码
+SWITCH_TYPE_CODES = {
+    12002,  # 评论区已关闭
+    12009,  # 评论主体的type不合法
+}
+
+# 重试也不会成功的错误码
+FATAL_CODES = {
+    -101,   # 账号未登录
+    -111,   # csrf校验失败
+    -400,   # 请求错误
+    -403,   # 权限不足
+    -404,   # 无此项
+    12016,  # 包含敏感内容
+    12022,  # 评论已被删除
+    12025,  # 评论字数过多
+    12035,  # 被UP主拉黑
+    12051,  # 重复评论
+}
+
+# 需要验证码，与风控错误码一样暂停发送
+CAPTCHA_CODE = 12015
+
+# 回复结果对B站熔断器的意义：风控和请求失败算作上游故障，换评论区类型与上游健康无关
+BREAKER_OUTCOMES = {
+    REPLY_OK: True,
+    REPLY_FATAL: True,
+    REPLY_RETRY: False,
+    REPLY_RATE_LIMITED: False,
+}
+
+
+def classify_reply_result(code: Optional[int], type_id: int = TYPE_VIDEO) -> str:
+    """
+    根据B站返回的错误码对回复结果分类
+
+    Args:
+        code (int, optional): 返回的错误码，None表示请求异常（网络错误、超时等）
+        type_id (int, optional): 本次使用的评论区类型. 默认为视频.
+
+    Returns:
+        str: REPLY_OK / REPLY_RETRY / REPLY_RATE_LIMITED / REPLY_SWITCH_TYPE / REPLY_FATAL
+    """
+    if code == 0:
+        return REPLY_OK
+    if code is None:
+        return REPLY_RETRY
+    if code in SWITCH_TYPE_CODES:
+        return REPLY_SWITCH_TYPE if type_id == TYPE_VIDEO else REPLY_FATAL
+    if code in RISK_CONTROL_CODES or code == CAPTCHA_CODE:
+        return REPLY_RATE_LIMITED
+    if code in FATAL_CODES:
+        return REPLY_FATAL
+    return REPLY_RETRY
+
+
+def backoff_delay(attempts: int, base_delay: float, max_delay: float) -> float:
+    """
+    带抖动的指数退避：第n次失败后等待 [d/2, d) 秒，d = min(max_delay, base_delay * 2^(n-1))
+    """
+    delay = min(max_delay, base_delay * (2 ** max(0, attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ReplyOutbox(SQLiteStore):
+    """
+    回复发件箱
+
+    enqueue写入一条待发送回复后立即返回，后台线程按到期时间从小顶堆中取出发送。
+    堆中只保存 (到期时间, 消息ID)，回复内容在发送时从数据库读取
+    """
+
+    def __init__(self,
+                 path: str,
+                 send: Callable[..., Dict[str, Any]] = send_reply_comment,
+                 bucket: Optional[TokenBucket] = None,
+                 max_attempts: int = 3,
+                 base_delay: float = 60,
+                 max_delay: float = 1800,
+                 max_age: float = 86400,
+                 risk_backoff: float = 300,
+                 on_result: Optional[Callable[[int, bool], None]] = None,
+                 accounts: Optional[AccountPool] = None,
+                 claim: Optional[Callable[[int], bool]] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 start: bool = True):
+        """
+        Args:
+            path (str): SQLite文件路径，":memory:"表示只在内存中保存
+            send (Callable, optional): 发送函数，参数同send_reply_comment
+            bucket (TokenBucket, optional): 发送限流，默认为每6秒1条、突发3条
+            max_attempts (int, optional): 最多发送次数（换评论区类型不计入）. 默认为3.
+            base_delay (float, optional): 第一次重试前的等待时间(秒). 默认为60.
+            max_delay (float, optional): 重试等待时间上限(秒). 默认为1800.
+            max_age (float, optional): 回复入队后的最长保留时间(秒)，超过后放弃. 默认为86400.
+            risk_backoff (float, optional): 触发风控后暂停发送的时间(秒). 默认为300.
+            on_result (Callable, optional): 回复最终成功或放弃时的回调 (消息ID, 是否成功)
+            accounts (AccountPool, optional): 回复账号池，设置后按账号限流并忽略bucket
+            claim (Callable, optional): 每次发送前确认本实例仍负责该消息 (消息ID) -> bool，
+                返回False时丢弃该回复（已由其他实例接手），见LeaseStore.claim
+            breaker (CircuitBreaker, optional): B站熔断器，打开期间回复留在发件箱中，不发送也不计入发送次数
+            start (bool, optional): 是否立即启动发送线程. 默认为True.
+        """
+        super().__init__(path)
+        self.send = send
+        self.bucket = bucket or TokenBucket(rate=1 / 6, capacity=3)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.risk_backoff = risk_backoff
+        self.on_result = on_result
+        self.accounts = accounts
+        self.claim = claim
+        self.breaker = breaker
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reply_outbox ("
+            "message_id INTEGER PRIMARY KEY, oid INTEGER NOT NULL, type_id INTEGER NOT NULL, "
+            "root INTEGER NOT NULL, parent INTEGER NOT NULL, content TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, "
+            "last_error TEXT, mentioned_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(reply_outbox)")}
+        if "mentioned_at" not in columns:
+            self._conn.execute("ALTER TABLE reply_outbox ADD COLUMN mentioned_at REAL")
+
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._heap: List[Tuple[float, int]] = [
+            (due, message_id) for message_id, due in
+            self._conn.execute("SELECT message_id, next_attempt_at FROM reply_outbox").fetchall()
+        ]
+        heapq.heapify(self._heap)
+        if self._heap:
+            logger.info(f"发件箱中有 {len(self._heap)} 条待发送回复")
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name="reply-outbox", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, message_id: int, target: Dict[str, int], content: str,
+                mentioned_at: Optional[float] = None) -> bool:
+        """
+        写入一条待发送回复
+
+        Args:
+            message_id (int): @消息ID，同一条消息只会入队一次
+            target (Dict[str, int]): 回复目标 {"oid", "type_id", "root", "parent"}
+            content (str): 回复内容
+            mentioned_at (float, optional): 被@的时间戳，用于统计从@到回复的耗时
+
+        Returns:
+            bool: 是否新写入（已在发件箱中时返回False）
+        """
+        now = time.time()
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO reply_outbox "
+                "(message_id, oid, type_id, root, parent, content, next_attempt_at, created_at, mentioned_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (int(message_id), target["oid"], target["type_id"], target["root"], target["parent"],
+                 content, now, now, mentioned_at or None)
+            ).rowcount > 0
+        if inserted:
+            self._schedule(int(message_id), now)
+        return inserted
+
+    def process_due(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        发送一条已到期的回复（不等待令牌）
+
+        Args:
+            now (float, optional): 当前时间戳，默认为time.time()
+
+        Returns:
+            Optional[float]: 距离下一条回复到期的秒数，0表示还有已到期的回复，发件箱为空时为None
+        """
+        now = time.time() if now is None else now
+        with self._cond:
+            if not self._heap:
+                return None
+            due, message_id = self._heap[0]
+            if due > now:
+                return due - now
+            if self.breaker is not None and not self.breaker.allow():
+                # 熔断期间不发送，回复留在发件箱中
+                return max(1.0, self.breaker.retry_after())
+            if self.accounts is not None:
+                account, wait = self.accounts.acquire()
+            else:
+                account, wait = None, self.bucket.try_acquire()
+            if wait > 0:
+                if self.breaker is not None:
+                    self.breaker.record(None)
+                return wait
+            heapq.heappop(self._heap)
+        category = None
+        try:
+            category = self._attempt(message_id, now, account)
+        finally:
+            if self.breaker is not None:
+                self.breaker.record(BREAKER_OUTCOMES.get(category))
+        return 0.0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"pending": 待发送数, "sent": 已发送数, "failed": 放弃数, "retried": 重试次数}
+        """
+        with self._cond:
+            pending = len(self._heap)
+        return {"pending": pending, "sent": self.sent, "failed": self.failed, "retried": self.retried}
+
+    def close(self, timeout: float = 5):
+        """停止发送线程并关闭数据库，未发送的回复保留到下次启动"""
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        super().close()
+
+    def _schedule(self, message_id: int, due: float):
+        with self._cond:
+            heapq.heappush(self._heap, (due, message_id))
+            self._cond.notify()
+
+    def _run(self):
+        """发送线程主循环"""
+        while not self._stopped.is_set():
+            try:
+                wait = self.process_due()
+            except Exception as e:
+                logger.error(f"发件箱处理回复时发生异常: {str(e)}")
+                wait = 1.0
+            if wait == 0:
+                continue
+            with self._cond:
+                if not self._stopped.is_set():
+                    self._cond.wait(timeout=wait)
+
+    def _attempt(self, message_id: int, now: float, account: Optional[ReplyAccount] = None) -> Optional[str]:
+        """
+        发送一条回复并根据结果更新发件箱，account为账号池分配的发送账号
+
+        Returns:
+            Optional[str]: 回复结果分类，没有发送时为None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT oid, type_id, root, parent, content, attempts, created_at, mentioned_at FROM reply_outbox "
+                "WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        oid, type_id, root, parent, content, attempts, created_at, mentioned_at = row
+        
+        if self.claim is not None and not self.claim(message_id):
+            with self._lock:
+                self._conn.execute("DELETE FROM reply_outbox WHERE message_id = ?", (message_id,))
+            logger.warning(f"回复 {message_id} 已由其他实例接手，本实例不再发送")
+            return None
+
+        if now - created_at > self.max_age:
+            self._finish(message_id, False, f"入队超过 {self.max_age:.0f} 秒仍未发送成功")
+            return None
+
+        code, error = None, ""
+        started = time.monotonic()
+        try:
+            kwargs = {}
+            if account is not None and account.credentials is not None:
+                kwargs["account"] = account.credentials
+            result = self.send(oid=oid, message=content, root=root, parent=parent, type_id=type_id, **kwargs)
+            code, error = result.get("code"), result.get("message", "")
+        except Exception as e:
+            error = str(e)
+        duration = time.monotonic() - started
+        REPLY_POST_SECONDS.observe(duration)
+        category = classify_reply_result(code, type_id)
+        if account is not None:
+            self.accounts.report(account, category == REPLY_OK, category == REPLY_RATE_LIMITED)
+        tracing.emit({
+            "kind": tracing.KIND_REPLY,
+            "message_id": message_id,
+            "ts": round(time.time(), 4),
+            "attempt": attempts + 1,
+            "type_id": type_id,
+            "code": code,
+            "result": category,
+            "account": account.name if account is not None else None,
+            "wait": round(max(0.0, now - created_at), 4),
+            "dur": round(duration, 4),
+        })
+
+        if category == REPLY_OK:
+            if mentioned_at:
+                END_TO_END_SECONDS.observe(max(0.0, time.time() - mentioned_at))
+            self._finish(message_id, True)
+        elif category == REPLY_SWITCH_TYPE:
+            logger.info(f"回复 {message_id} 返回错误码 {code}，改用动态评论区类型重试")
+            self._reschedule(message_id, attempts, now, f"{code} {error}", type_id=TYPE_DYNAMIC)
+        elif category == REPLY_FATAL:
+            self._finish(message_id, False, f"错误码 {code}: {error}")
+        elif category == REPLY_RATE_LIMITED and account is not None and len(self.accounts) > 1:
+            # 只有该账号被限制，冷却该账号后立即换账号重发，不计入发送次数
+            logger.info(f"回复 {message_id} 使用账号 {account.name} 触发风控(错误码 {code})，换账号重发")
+            self.retried += 1
+            self._reschedule(message_id, attempts, now, f"{code} {error}")
+        else:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                self._finish(message_id, False, f"已发送 {attempts} 次, 最后一次错误: {code} {error}")
+                return category
+            if category == REPLY_RATE_LIMITED and account is None:
+                logger.warning(f"发送回复触发风控(错误码 {code})，暂停发送 {self.risk_backoff:.0f} 秒")
+                self.bucket.pause(self.risk_backoff)
+            delay = backoff_delay(attempts, self.base_delay, self.max_delay)
+            logger.warning(f"回复 {message_id} 发送失败({code} {error})，{delay:.0f} 秒后第 {attempts + 1} 次发送")
+            self.retried += 1
+            self._reschedule(message_id, attempts, now + delay, f"{code} {error}")
+        return category
+
+    def _reschedule(self, message_id: int, attempts: int, due: float, error: str,
+                    type_id: Optional[int] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE reply_outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, "
+                "type_id = COALESCE(?, type_id) WHERE message_id = ?",
+                (attempts, due, error, type_id, message_id)
+            )
+        self._schedule(message_id, due)
+
+    def _finish(self, message_id: int, success: bool, error: str = ""):
+        with self._lock:
+            self._conn.execute("DELETE FROM reply_outbox WHERE message_id = ?", (message_id,))
+        if success:
+            self.sent += 1
+            logger.info(f"回复 {message_id} 发送成功")
+        else:
+            self.failed += 1
+            logger.error(f"回复 {message_id} 发送失败，已放弃: {error}")
+        if self.on_result is not None:
+            try:
+                self.on_result(message_id, success)
+            except Exception as e:
+                logger.error(f"发件箱回调发生异常: {str(e)}")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SQLite持久化存储的公共部分
+已处理消息、核查结果缓存、相似说法索引、回复发件箱、消息租约和暂存消息都使用同样的连接方式：
+自动提交模式、WAL日志、一个锁串行访问，需要原子写入多条记录时显式开始事务
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class SQLiteStore:
+    """
+    用一个锁在多个线程中共用的SQLite连接，各存储继承后通过self._lock和self._conn访问数据库
+
+    - 连接为自动提交模式(isolation_level=None)，每条语句单独提交；需要原子写入多条记录时持有锁并使用_transaction
+    - WAL日志，synchronous=NORMAL：提交只追加日志，由SQLite批量fsync
+    - 数据库文件所在的目录不存在时自动创建，path为":memory:"时使用内存数据库
+    """
+
+    def __init__(self, path: Optional[str], timeout: float = 5.0):
+        """
+        Args:
+            path (str, optional): SQLite数据库文件路径，None表示不打开数据库(只在内存中保存数据的存储)
+            timeout (float, optional): 数据库被其他连接锁定时等待的最长时间(秒). 默认为5.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path is None:
+            return
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        """关闭数据库"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        在一个事务中执行，正常退出时提交，抛出异常时回滚；调用方需持有锁
+
+        Args:
+            immediate (bool, optional): 是否在开始时就获取写锁(BEGIN IMMEDIATE)，
+                避免多个进程先读后写时互相等待. 默认为False.
+        """
+        self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield self._conn
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+单条@消息的处理时间线
+每条@消息分配一个trace ID，记录各阶段(解析目标、Dify核查、发送回复等)的开始时间和耗时，
+处理结束后以紧凑的JSONL格式写入 log/trace_YYYYMMDD.jsonl。
+写文件由后台线程完成，处理线程只把记录放入队列；用 tools/trace_report.py 汇总各阶段耗时分位数
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 记录类型
+KIND_MESSAGE = "message"  # 一条@消息在流水线中的处理过程
+KIND_POLL = "poll"        # 一次轮询
+KIND_REPLY = "reply"      # 发件箱的一次发送
+
+
+def _round(seconds: float) -> float:
+    return round(seconds, 4)
+
+
+class Trace:
+    """
+    一条@消息的时间线
+
+    span按开始顺序保存为 {"name", "start"(相对开始时间的秒数), "dur"(耗时秒数)}，
+    嵌套的span带有"parent"字段。同一时间只会有一个线程处理同一条消息，因此不需要加锁
+    """
+
+    def __init__(self, message_id: int, mentioned_at: Optional[float] = None):
+        """
+        Args:
+            message_id (int): @消息ID
+            mentioned_at (float, optional): 被@的时间戳，用于计算拉取到消息时已经过去的时间
+        """
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.message_id = message_id
+        self.started_at = time.time()
+        self.mentioned_at = mentioned_at or None
+        self.spans: List[Dict[str, Any]] = []
+        self._start = time.monotonic()
+        self._stack: List[str] = []
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """
+        记录代码块的耗时，返回的字典可以在代码块中补充属性
+
+        Args:
+            name (str): 阶段名
+            **attrs: 附加属性
+        """
+        record: Dict[str, Any] = {"name": name, "start": _round(time.monotonic() - self._start)}
+        if self._stack:
+            record["parent"] = self._stack[-1]
+        record.update(attrs)
+        self.spans.append(record)
+        self._stack.append(name)
+        started = time.monotonic()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["dur"] = _round(time.monotonic() - started)
+            self._stack.pop()
+
+    def to_record(self, success: bool) -> Dict[str, Any]:
+        """生成写入JSONL的记录"""
+        record = {
+            "kind": KIND_MESSAGE,
+            "trace": self.trace_id,
+            "message_id": self.message_id,
+            "ts": _round(self.started_at),
+            "ok": success,
+            "dur": _round(time.monotonic() - self._start),
+            "spans": self.spans,
+        }
+        if self.mentioned_at:
+            record["lag"] = _round(max(0.0, self.started_at - self.mentioned_at))
+        return record
+
+
+def trace_span(trace: Optional[Trace], name: str, **attrs: Any) -> ContextManager:
+    """trace为None时返回空的上下文管理器，便于在可选追踪的代码中使用"""
+    if trace is None:
+        return nullcontext({})
+    return trace.span(name, **attrs)
+
+
+class TraceWriter:
+    """
+    在后台线程中批量追加写入JSONL
+
+    emit只把记录放入有界队列，队列已满时丢弃记录并计数，不会阻塞处理线程；
+    文件按日期命名，每天一个
+    """
+
+    def __init__(self, directory: str, prefix: str = "trace", flush_interval: float = 1.0,
+                 max_queue: int = 10000):
+        """
+        Args:
+            directory (str): 输出目录
+            prefix (str, optional): 文件名前缀，文件名为 {prefix}_YYYYMMDD.jsonl. 默认为"trace".
+            flush_interval (float, optional): 最长写入间隔(秒). 默认为1.0.
+            max_queue (int, optional): 队列容量. 默认为10000.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def path_for(self, timestamp: float) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{time.strftime('%Y%m%d', time.localtime(timestamp))}.jsonl")
+
+    def emit(self, record: Dict[str, Any]):
+        """放入一条记录，不等待写入"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"written": 已写入数, "dropped": 丢弃数, "queued": 待写入数}
+        """
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+    def close(self, timeout: float = 5):
+        """写完队列中的记录后停止写入线程"""
+        while True:
+            try:
+                self._queue.put(None, timeout=timeout)
+                break
+            except queue.Full:
+                self.dropped += 1
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+        self._thread.join(timeout=timeout)
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [record for record in batch if record is not None]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        files: Dict[str, List[str]] = {}
+        for record in batch:
+            path = self.path_for(record.get("ts", time.time()))
+            files.setdefault(path, []).append(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            )
+        for path, lines in files.items():
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                self.written += len(lines)
+            except OSError as e:
+                self.dropped += len(lines)
+                logger.error(f"写入处理时间线失败: {str(e)}")
+
+
+# 当前使用的写入器，未配置时emit不做任何事
+_writer: Optional[TraceWriter] = None
+
+
+def configure(writer: Optional[TraceWriter]):
+    """设置全局写入器，None表示关闭"""
+    global _writer
+    _writer = writer
+
+
+def emit(record: Dict[str, Any]):
+    """写入一条记录（未配置写入器时忽略）"""
+    writer = _writer
+    if writer is not None:
+        writer.emit(record)
+
+
+def finish(trace: Optional[Trace], success: bool):
+    """结束一条@消息的时间线并写入"""
+    if trace is not None:
+        emit(trace.to_record(success))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地分流
+调用Dify深度核查之前，先用规则和轻量的本地文本分类器判断@消息是否值得核查：
+- skip: 垃圾广告、只有表情或符号等，不回复
+- template: 内容太短、打招呼、开放式提问等没有可核查说法的消息，回复固定模板
+- escalate: 可能包含事实性说法，交给Dify核查
+
+规则只处理把握较大的情况，其余默认交给Dify；配置了分类器模型(tools/triage_eval.py train 训练)时，
+分类器对规则未命中的消息给出足够确定的skip/template判断才会生效
+"""
+
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 分流结果
+TRIAGE_SKIP = "skip"
+TRIAGE_TEMPLATE = "template"
+TRIAGE_ESCALATE = "escalate"
+TRIAGE_DECISIONS = (TRIAGE_SKIP, TRIAGE_TEMPLATE, TRIAGE_ESCALATE)
+
+# 模板回复
+DEFAULT_TEMPLATES = {
+    "too_short": "内容太短，没有找到可以核查的说法。请在包含具体说法的评论下@我~",
+    "chitchat": "你好，我是真假核查机器人，请在包含具体说法（如新闻、传言、数据）的评论下@我~",
+    "question": "这条评论是一个提问，没有包含可以核查的说法，暂时无法判断真假~",
+    "no_claim": "这条评论没有包含可以核查的事实性说法，暂时无法判断真假~",
+}
+
+# 表情([doge])、空白和标点，不计入有效字数
+_NOISE_PATTERN = re.compile(r"\[[^\[\]]{1,10}\]|[\s\W_]+", re.UNICODE)
+# 垃圾广告：只认带号码的联系方式和引导领取的话术，“兼职”“返利”等词和链接也常出现在需要核查的传言里
+_SPAM_PATTERN = re.compile(
+    r"((微信|威信|薇信|[vVwW][xX]|[vV]信|[qQＱ]{2}群?|扣扣)\s*号?\s*[:：]?\s*[A-Za-z0-9_-]*\d{5,}|"
+    r"(加[微威薇]信?|加[vV]|加群|私信|扫码)\S{0,4}领取)",
+    re.IGNORECASE
+)
+# 链接常指向需要核查的报道或传言出处
+_LINK_PATTERN = re.compile(r"https?://", re.IGNORECASE)
+# 打招呼和无内容的附和
+_CHITCHAT_PATTERN = re.compile(
+    r"^(你好|您好|hello|hi|哈+|h+|6+|签到|打卡|来了|前排|沙发|第一|顶)$",
+    re.IGNORECASE
+)
+# 开放式疑问词
+_OPEN_QUESTION_PATTERN = re.compile(r"(什么|怎么|为什么|为啥|咋|哪|谁|多少|几[个岁年次])")
+_QUESTION_END_PATTERN = re.compile(r"[?？吗呢嘛]\s*(\[[^\[\]]{1,10}\])?\s*$")
+# 说明标题中可能有可核查说法的词，命中后不按提问或太短处理
+_CLAIM_PATTERN = re.compile(
+    r"(听说|据说|传言|谣言|网传|研究|专家|科学家|官方|证实|辟谣|报道|新闻|数据|统计|调查|宣布|"
+    r"真的假的|是真的吗|是不是真的|真的吗|导致|致癌|治愈|有害|\d+(\.\d+)?\s*[%％]|百分之)"
+)
+
+
+class TriageResult(NamedTuple):
+    """
+    分流结果
+
+    decision: TRIAGE_SKIP / TRIAGE_TEMPLATE / TRIAGE_ESCALATE
+    reason: 判断依据，规则名称或classifier
+    reply: 模板回复内容，只有template时不为空
+    """
+    decision: str
+    reason: str
+    reply: str = ""
+
+
+def message_texts(message: Dict[str, Any]) -> Tuple[str, str]:
+    """取出@消息的标题和@所在评论的内容"""
+    item = message.get("item", {})
+    return item.get("title", "") or "", item.get("source_content") or item.get("content", "") or ""
+
+
+def effective_length(text: str) -> int:
+    """去掉表情、空白和标点后的字数"""
+    return len(_NOISE_PATTERN.sub("", text))
+
+
+def text_features(title: str, content: str = "") -> List[str]:
+    """
+    分类器使用的特征：标题的单字和相邻两字，以及评论内容去掉@昵称后的单字和相邻两字(加"c:"前缀)
+    """
+    features = []
+    for prefix, text in (("", title), ("c:", re.sub(r"@\S+", "", content))):
+        chars = _NOISE_PATTERN.sub("", text.lower())
+        features.extend(prefix + char for char in chars)
+        features.extend(prefix + chars[i:i + 2] for i in range(len(chars) - 1))
+    return features
+
+
+class NaiveBayesClassifier:
+    """
+    多项式朴素贝叶斯文本分类器，只依赖标准库，模型可保存为JSON
+    """
+
+    def __init__(self, alpha: float = 1.0):
+        """
+        Args:
+            alpha (float, optional): 拉普拉斯平滑系数. 默认为1.0.
+        """
+        self.alpha = alpha
+        self.label_counts: Dict[str, int] = {}
+        self.feature_counts: Dict[str, Dict[str, int]] = {}
+        self.totals: Dict[str, int] = {}
+        self.vocabulary: set = set()
+
+    def train(self, samples: Iterable[Tuple[List[str], str]]) -> "NaiveBayesClassifier":
+        """
+        用 (特征列表, 标签) 训练，可多次调用累加样本
+
+        Returns:
+            NaiveBayesClassifier: 自身
+        """
+        for features, label in samples:
+            self.label_counts[label] = self.label_counts.get(label, 0) + 1
+            counts = self.feature_counts.setdefault(label, {})
+            for feature, count in Counter(features).items():
+                counts[feature] = counts.get(feature, 0) + count
+                self.totals[label] = self.totals.get(label, 0) + count
+                self.vocabulary.add(feature)
+        return self
+
+    def predict_proba(self, features: List[str]) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: 各标签的后验概率，未训练时为空
+        """
+        total_samples = sum(self.label_counts.values())
+        if not total_samples:
+            return {}
+        vocabulary_size = len(self.vocabulary) or 1
+        log_probs = {}
+        for label, count in self.label_counts.items():
+            counts = self.feature_counts.get(label, {})
+            denominator = self.totals.get(label, 0) + self.alpha * vocabulary_size
+            score = math.log(count / total_samples)
+            for feature in features:
+                if feature in self.vocabulary:
+                    score += math.log((counts.get(feature, 0) + self.alpha) / denominator)
+            log_probs[label] = score
+        highest = max(log_probs.values())
+        exp = {label: math.exp(score - highest) for label, score in log_probs.items()}
+        norm = sum(exp.values())
+        return {label: value / norm for label, value in exp.items()}
+
+    def predict(self, features: List[str]) -> Tuple[Optional[str], float]:
+        """
+        Returns:
+            Tuple[Optional[str], float]: (概率最高的标签, 概率)，未训练时为 (None, 0)
+        """
+        proba = self.predict_proba(features)
+        if not proba:
+            return None, 0.0
+        label = max(proba, key=proba.get)
+        return label, proba[label]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"alpha": self.alpha, "label_counts": self.label_counts, "feature_counts": self.feature_counts}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NaiveBayesClassifier":
+        model = cls(alpha=data.get("alpha", 1.0))
+        model.label_counts = dict(data.get("label_counts", {}))
+        model.feature_counts = {label: dict(counts) for label, counts in data.get("feature_counts", {}).items()}
+        for label, counts in model.feature_counts.items():
+            model.totals[label] = sum(counts.values())
+            model.vocabulary.update(counts)
+        return model
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "NaiveBayesClassifier":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+class Triage:
+    """
+    @消息分流：先按规则判断，规则未命中时参考分类器，都不确定时交给Dify
+    """
+
+    def __init__(self,
+                 min_chars: int = 3,
+                 classifier: Optional[NaiveBayesClassifier] = None,
+                 threshold: float = 0.9,
+                 templates: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            min_chars (int, optional): 标题去掉表情和标点后少于这么多字时回复模板，中文说法五六个字就能说清，不宜过大. 默认为3.
+            classifier (NaiveBayesClassifier, optional): 分类器，None表示只使用规则
+            threshold (float, optional): 分类器判断为skip/template所需的最低概率. 默认为0.9.
+            templates (Dict[str, str], optional): 覆盖默认的模板回复，键为 too_short/chitchat/question/no_claim
+        """
+        self.min_chars = min_chars
+        self.classifier = classifier
+        self.threshold = threshold
+        self.templates = dict(DEFAULT_TEMPLATES)
+        self.templates.update(templates or {})
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def classify(self, message: Dict[str, Any]) -> TriageResult:
+        """
+        判断一条@消息的处理方式
+
+        Args:
+            message (Dict): 解析后的@消息
+
+        Returns:
+            TriageResult: 分流结果
+        """
+        result = self._classify(*message_texts(message))
+        with self._lock:
+            self._counts[result.decision] += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: 各分流结果的消息数
+        """
+        with self._lock:
+            return {decision: self._counts.get(decision, 0) for decision in TRIAGE_DECISIONS}
+
+    def _template(self, reason: str) -> TriageResult:
+        return TriageResult(TRIAGE_TEMPLATE, reason, self.templates.get(reason, DEFAULT_TEMPLATES["no_claim"]))
+
+    def _classify(self, title: str, content: str) -> TriageResult:
+        stripped = title.strip()
+        if not stripped:
+            return TriageResult(TRIAGE_SKIP, "empty")
+        if _SPAM_PATTERN.search(title) or _SPAM_PATTERN.search(content):
+            return TriageResult(TRIAGE_SKIP, "spam")
+        length = effective_length(stripped)
+        if length == 0:
+            return TriageResult(TRIAGE_SKIP, "no_text")
+        if _LINK_PATTERN.search(title) or _LINK_PATTERN.search(content):
+            return TriageResult(TRIAGE_ESCALATE, "link")
+
+        if not _CLAIM_PATTERN.search(stripped):
+            if _CHITCHAT_PATTERN.match(_NOISE_PATTERN.sub("", stripped)):
+                return self._template("chitchat")
+            if length < self.min_chars:
+                return self._template("too_short")
+            if _OPEN_QUESTION_PATTERN.search(stripped) and _QUESTION_END_PATTERN.search(stripped):
+                return self._template("question")
+
+            if self.classifier is not None:
+                label, probability = self.classifier.predict(text_features(title, content))
+                if label == TRIAGE_SKIP and probability >= self.threshold:
+                    return TriageResult(TRIAGE_SKIP, "classifier")
+                if label == TRIAGE_TEMPLATE and probability >= self.threshold:
+                    return self._template("no_claim")._replace(reason="classifier")
+        return TriageResult(TRIAGE_ESCALATE, "default")
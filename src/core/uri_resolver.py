@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@消息链接解析
+用预编译的正则一次解析网页链接(https://www.bilibili.com/video/BV...)和客户端链接
+(bilibili://video/<oid>?comment_root_id=...&comment_secondary_id=...)，得到评论区对象和评论ID
+"""
+
+import logging
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+from src.core.bvid import bv_to_av
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 评论区类型
+TYPE_VIDEO = 1
+TYPE_ARTICLE = 12
+TYPE_DYNAMIC = 17
+
+_URI_PATTERN = re.compile(
+    r"^(?:"
+    # 客户端链接: bilibili://video/<oid>、bilibili://following/detail/<id>、bilibili://article/<id>
+    r"bilibili://(?:(?P<native_video>video)|(?P<native_dynamic>following/detail|opus/detail)|(?P<native_article>article))"
+    r"/(?P<native_id>\d+)"
+    r"|"
+    # 网页链接: /video/BV.../av.../数字、/read/cv...、/opus/...，以及t.bilibili.com/<id>等路径中的第一个数字段
+    r"(?:https?:)?//(?P<host>[^/?#]+)"
+    r"(?:/video/(?:(?P<bvid>[Bb][Vv]1[0-9A-Za-z]{9})|av(?P<video_aid>\d+)|(?P<video_id>\d+))"
+    r"|/av(?P<aid>\d+)"
+    r"|/read/(?:mobile/)?cv(?P<cv>\d+)"
+    r"|/opus/(?P<opus>\d+)"
+    r"|/(?P<path_id>\d+)(?=[/?#]|$))?"
+    r")[^?#]*(?:\?(?P<query>[^#]*))?"
+)
+
+_QUERY_PATTERN = re.compile(r"(?:^|&)(subject_id|oid|business_id|comment_root_id|comment_secondary_id)=(\d+)")
+
+
+class UriTarget(NamedTuple):
+    """链接中解析出的回复目标，无法确定的字段为0"""
+    oid: int
+    type_id: int
+    root: int
+    parent: int
+
+
+EMPTY_TARGET = UriTarget(0, 0, 0, 0)
+
+
+@lru_cache(maxsize=4096)
+def resolve_uri(uri: str) -> UriTarget:
+    """
+    解析@消息中的uri或native_uri
+
+    oid的优先级: 查询参数subject_id > 路径中的ID(BV号在本地解码) > 查询参数oid > 查询参数business_id
+
+    Args:
+        uri (str): 网页链接或bilibili://客户端链接
+
+    Returns:
+        UriTarget: 解析结果，无法识别时各字段为0
+    """
+    if not uri:
+        return EMPTY_TARGET
+    match = _URI_PATTERN.match(uri)
+    if match is None:
+        return EMPTY_TARGET
+    groups = match.groupdict()
+
+    params = {}
+    if groups["query"]:
+        for key, value in _QUERY_PATTERN.findall(groups["query"]):
+            params.setdefault(key, int(value))
+
+    type_id = 0
+    path_oid = 0
+    if groups["native_id"]:
+        path_oid = int(groups["native_id"])
+        type_id = TYPE_VIDEO if groups["native_video"] else TYPE_DYNAMIC if groups["native_dynamic"] else TYPE_ARTICLE
+    elif groups["bvid"]:
+        path_oid = bv_to_av(groups["bvid"]) or 0
+        type_id = TYPE_VIDEO
+    elif groups["video_aid"] or groups["video_id"] or groups["aid"]:
+        path_oid = int(groups["video_aid"] or groups["video_id"] or groups["aid"])
+        type_id = TYPE_VIDEO
+    elif groups["cv"]:
+        path_oid = int(groups["cv"])
+        type_id = TYPE_ARTICLE
+    elif groups["opus"] or groups["path_id"]:
+        path_oid = int(groups["opus"] or groups["path_id"])
+        if groups["opus"] or groups["host"] == "t.bilibili.com":
+            type_id = TYPE_DYNAMIC
+
+    oid = params.get("subject_id") or path_oid or params.get("oid") or params.get("business_id") or 0
+    root = params.get("comment_root_id", 0)
+    parent = params.get("comment_secondary_id", 0) or root
+    return UriTarget(oid, type_id, root, parent)
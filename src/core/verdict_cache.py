@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+核查结果缓存
+以 (评论区对象ID, 归一化后的查询内容) 为键缓存Dify的核查结果，
+支持过期时间、LRU容量限制、磁盘持久化，以及相同请求的合并（同一时间只发起一次Dify调用）
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.core.sqlite_store import SQLiteStore
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 归一化时去掉的字符：空白和各类标点符号
+_STRIP_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_claim(text: str) -> str:
+    """
+    归一化查询内容：全角转半角、英文转小写、去掉空白和标点
+
+    Args:
+        text (str): 原始查询内容，如视频标题
+
+    Returns:
+        str: 归一化后的内容
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _STRIP_PATTERN.sub("", text)
+
+
+def make_cache_key(subject_id: Any, query: str) -> str:
+    """生成缓存键: "评论区对象ID:归一化查询内容\""""
+    return f"{subject_id}:{normalize_claim(query)}"
+
+
+class _Flight:
+    """一次进行中的计算，相同键的并发请求等待同一个结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class VerdictCache(SQLiteStore):
+    """
+    线程安全的核查结果缓存
+
+    内存中用OrderedDict维护LRU顺序，写入时同步到SQLite文件，重启后加载未过期的结果
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 86400, max_entries: int = 5000):
+        """
+        Args:
+            path (str, optional): SQLite持久化文件路径，为空时只在内存中缓存
+            ttl (float, optional): 缓存有效期(秒). 默认为86400.
+            max_entries (int, optional): 最大缓存条数，超过后淘汰最久未使用的结果. 默认为5000.
+        """
+        super().__init__(path or None)
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        if self._conn is not None:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._load()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存结果，并更新其LRU位置"""
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key: str, answer: str):
+        """写入缓存结果"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (answer, expires_at)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, answer, expires_at) VALUES (?, ?, ?)",
+                    (key, answer, expires_at)
+                )
+                if evicted:
+                    self._conn.executemany("DELETE FROM verdicts WHERE key = ?", [(k,) for k in evicted])
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[str]],
+                       timeout: Optional[float] = None) -> Optional[str]:
+        """
+        读取缓存，未命中时计算并写入；同一个键的并发调用只会执行一次compute
+
+        Args:
+            key (str): 缓存键
+            compute (Callable): 计算结果的函数，返回None表示失败（失败结果不缓存）
+            timeout (float, optional): 等待其他线程计算结果的最长时间(秒)，None表示一直等待
+
+        Returns:
+            Optional[str]: 结果，失败或等待超时时返回None
+
+        Raises:
+            Exception: compute抛出的异常，等待同一个结果的调用也抛出该异常
+        """
+        with self._lock:
+            answer = self._get_locked(key)
+            if answer is not None:
+                self.hits += 1
+                return answer
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            if not flight.event.wait(timeout):
+                logger.warning(f"等待相同请求的核查结果超时: {key}")
+                return None
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+            if flight.result is not None:
+                self.put(key, flight.result)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: {"hits": 命中数, "misses": 未命中数, "coalesced": 合并的请求数, "size": 缓存条数}
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "size": len(self._entries),
+            }
+
+    def _get_locked(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        answer, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return answer
+
+    def _load(self):
+        """清理过期结果，并按写入顺序加载最近的max_entries条"""
+        now = time.time()
+        self._conn.execute("DELETE FROM verdicts WHERE expires_at <= ?", (now,))
+        rows = self._conn.execute(
+            "SELECT key, answer, expires_at FROM verdicts ORDER BY expires_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, answer, expires_at in reversed(rows):
+            self._entries[key] = (answer, expires_at)
+        logger.info(f"已加载 {len(rows)} 条核查结果缓存")
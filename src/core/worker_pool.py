@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+有界工作线程池
+用于并发处理@消息，避免一次耗时的Dify深度搜索阻塞整个轮询循环
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from src.core.deadline import current_time, record_timeout
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 任务完成回调: (任务键, 是否成功)
+DoneCallback = Callable[[Hashable, bool], None]
+
+
+class WorkerPool:
+    """
+    固定线程数、有界等待队列的工作池
+
+    - 同一个任务键在排队或执行期间只会被接收一次
+    - 每个任务带有截止时间，超过截止时间仍未开始的任务直接判为失败
+    - 任务完成后先调用回调，再释放任务键，调用方可以在回调中安全地标记已处理
+    - 设置priority时按优先级从高到低取任务，相同优先级按提交顺序
+    """
+
+    def __init__(self,
+                 handler: Callable[[Any, float], bool],
+                 max_workers: int = 4,
+                 max_pending: int = 50,
+                 deadline: float = 900,
+                 name: str = "worker",
+                 priority: Optional[Callable[[Any], float]] = None):
+        """
+        Args:
+            handler (Callable): 任务处理函数，参数为(任务数据, 截止时间戳)，返回是否成功
+            max_workers (int, optional): 工作线程数. 默认为4.
+            max_pending (int, optional): 等待队列容量. 默认为50.
+            deadline (float, optional): 默认的单任务处理时限(秒). 默认为900.
+            name (str, optional): 线程池名称，用于日志和线程名. 默认为"worker".
+            priority (Callable, optional): 计算任务优先级的函数，参数为任务数据，值越大越先处理；None表示先进先出
+        """
+        self.name = name
+        self.handler = handler
+        self.deadline = deadline
+        self.priority = priority
+        # 队列元素为 (-优先级, 提交序号, 任务键, 任务数据, 回调, 截止时间)
+        queue_class = queue.PriorityQueue if priority is not None else queue.Queue
+        self._queue: "queue.Queue" = queue_class(maxsize=max(1, max_pending))
+        self._sequence = itertools.count()
+        self._pending: Set[Hashable] = set()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+        for i in range(max(1, max_workers)):
+            thread = threading.Thread(target=self._worker_loop, name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self,
+               key: Hashable,
+               item: Any,
+               on_done: Optional[DoneCallback] = None,
+               deadline: Optional[float] = None,
+               block: bool = False) -> bool:
+        """
+        提交任务
+
+        Args:
+            key (Hashable): 任务键，如消息ID
+            item (Any): 任务数据
+            on_done (DoneCallback, optional): 任务结束回调
+            deadline (float, optional): 截止时间戳，默认为当前时间加上默认时限
+            block (bool, optional): 队列已满时是否阻塞等待（最多等到截止时间）. 默认为False.
+
+        Returns:
+            bool: 是否已接收任务（重复提交或队列已满时返回False）
+        """
+        if self._stopped.is_set():
+            return False
+
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        if deadline is None:
+            deadline = current_time() + self.deadline
+
+        rank = 0.0
+        if self.priority is not None:
+            try:
+                rank = -float(self.priority(item))
+            except Exception as e:
+                logger.error(f"[{self.name}] 计算任务 {key} 的优先级时发生异常: {str(e)}")
+        entry = (rank, next(self._sequence), key, item, on_done, deadline)
+        try:
+            if block:
+                self._queue.put(entry, timeout=max(0.0, deadline - current_time()))
+            else:
+                self._queue.put(entry, block=False)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(key)
+            return False
+        return True
+
+    def is_pending(self, key: Hashable) -> bool:
+        """任务是否正在排队或执行中"""
+        with self._lock:
+            return key in self._pending
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取线程池状态
+
+        Returns:
+            Dict[str, int]: {"queued": 排队数, "active": 执行中数量, "pending": 未完成总数}
+        """
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "active": self._active,
+                "pending": len(self._pending),
+            }
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None):
+        """
+        停止线程池
+
+        Args:
+            wait (bool, optional): 是否等待已接收的任务处理完毕. 默认为True.
+            timeout (float, optional): 等待的最长时间(秒)，None表示一直等待
+        """
+        if wait:
+            end_time = None if timeout is None else time.time() + timeout
+            while self.stats()["pending"] > 0:
+                if end_time is not None and time.time() >= end_time:
+                    logger.warning(f"[{self.name}] 等待任务完成超时，仍有 {self.stats()['pending']} 个任务未完成")
+                    break
+                time.sleep(0.1)
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while not self._stopped.is_set():
+            try:
+                _, _, key, item, on_done, deadline = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with self._lock:
+                self._active += 1
+
+            success = False
+            start_time = time.time()
+            try:
+                if current_time() >= deadline:
+                    record_timeout(f"{self.name}:queued")
+                    logger.warning(f"[{self.name}] 任务 {key} 排队超过截止时间，放弃处理")
+                else:
+                    success = bool(self.handler(item, deadline))
+                    if current_time() > deadline:
+                        logger.warning(f"[{self.name}] 任务 {key} 超过截止时间完成，耗时 {time.time() - start_time:.1f} 秒")
+            except Exception as e:
+                logger.error(f"[{self.name}] 处理任务 {key} 时发生异常: {str(e)}")
+            finally:
+                # 先回调再释放任务键，保证调用方不会在两者之间重复提交
+                if on_done is not None:
+                    try:
+                        on_done(key, success)
+                    except Exception as e:
+                        logger.error(f"[{self.name}] 任务 {key} 的完成回调发生异常: {str(e)}")
+                with self._lock:
+                    self._active -= 1
+                    self._pending.discard(key)
+                self._queue.task_done()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+B站和Dify接口的本地模拟服务
+在进程内启动真实的HTTP服务，可以设置响应延迟、错误率和流式输出的分段间隔，
+用于测试机器人在并发和上游变慢时的表现，以及 tools/load_test.py 压测
+
+- FakeBilibiliServer: /x/msgfeed/at(游标翻页)、/x/v2/reply/add(限流时返回-509)、/x/web-interface/view
+- FakeDifyServer: /chat-messages(blocking和streaming两种模式)
+- bot_config_patches/run_bot/wait_until: 让机器人主循环连接模拟服务运行的集成测试辅助函数
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import bot
+from src.core.bvid import av_to_bv, bv_to_av
+from src.core.rate_limiter import TokenBucket
+
+# 固定延迟(秒)或 (最小值, 最大值) 之间的随机延迟
+Latency = Union[float, Tuple[float, float]]
+
+# 生成标题用的汉字，随机组合的标题之间几乎没有相同的字符二元组，不会被相似说法索引复用
+TITLE_CHARS = "据说喝某种茶可以治愈所有疾病专家称明天地震将发生在多个城市吃这种水果能长寿科学家证实手机辐射致癌"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.server.count(url.path)
+        self.server.sleep(self.server.latency)
+        if self.server.error_rate and self.server.random.random() < self.server.error_rate:
+            self.server.count("error")
+            self.send_json({"code": -500, "message": "服务器错误"}, status=500)
+            return
+        self.server.handle(self, method, url.path, query, body)
+
+    def send_json(self, data: Dict[str, Any], status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+class FakeServer(ThreadingHTTPServer):
+    """模拟服务基类，在后台线程中处理请求"""
+
+    daemon_threads = True
+
+    def __init__(self, latency: Latency = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency (Latency, optional): 每个请求开始处理前的延迟(秒). 默认为0.
+            error_rate (float, optional): 返回HTTP 500的概率. 默认为0.
+            seed (int, optional): 随机数种子
+        """
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread.is_alive():
+            self.shutdown()
+            self._thread.join(timeout=5)
+        self.server_close()
+
+    def count(self, name: str):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def sleep(self, latency: Latency):
+        if isinstance(latency, tuple):
+            with self.lock:
+                latency = self.random.uniform(*latency)
+        if latency > 0:
+            time.sleep(latency)
+
+    def handle(self, handler: _Handler, method: str, path: str, query: Dict[str, str], body: bytes):
+        handler.send_json({"code": -404, "message": "啥都木有"}, status=404)
+
+
+class FakeBilibiliServer(FakeServer):
+    """
+    模拟B站@消息和评论接口
+
+    add_mention生成的@消息带有subject_id和source_id，机器人的回复按parent(即source_id)对应到@消息
+    """
+
+    def __init__(self, reply_rate: Optional[float] = None, reply_burst: int = 5, **kwargs):
+        """
+        Args:
+            reply_rate (float, optional): 每秒允许发送的回复数，超过后返回-509，None表示不限制
+            reply_burst (int, optional): 回复允许的突发数. 默认为5.
+            **kwargs: 见FakeServer
+        """
+        super().__init__(**kwargs)
+        self.reply_bucket = TokenBucket(rate=reply_rate, capacity=reply_burst) if reply_rate else None
+        self.items: List[Dict[str, Any]] = []
+        self.mentioned_at: Dict[int, float] = {}
+        self.replies: Dict[int, Dict[str, Any]] = {}
+        self.rejected = 0
+        self._next_id = 1000000
+
+    def add_mention(self, title: Optional[str] = None, aid: Optional[int] = None) -> int:
+        """
+        添加一条@消息（最新的排在最前面）
+
+        Args:
+            title (str, optional): 视频标题，默认随机生成
+            aid (int, optional): 视频AV号，默认按消息ID生成
+
+        Returns:
+            int: @消息ID，也是被@的评论ID(source_id)
+        """
+        with self.lock:
+            self._next_id += 1
+            message_id = self._next_id
+            aid = aid or 100000 + message_id % 50000
+            if title is None:
+                title = "".join(self.random.choice(TITLE_CHARS) for _ in range(16))
+            now = time.time()
+            self.items.insert(0, {
+                "id": message_id,
+                "user": {"mid": message_id % 10000, "nickname": f"用户{message_id}", "avatar": ""},
+                "item": {
+                    "type": "reply",
+                    "business_id": 1,
+                    "title": title,
+                    "content": "@FakeDetection 帮忙看看",
+                    "source_content": "@FakeDetection 帮忙看看",
+                    "uri": f"https://www.bilibili.com/video/{av_to_bv(aid)}",
+                    "native_uri": f"bilibili://video/{aid}?comment_root_id={message_id}&comment_secondary_id={message_id}",
+                    "subject_id": aid,
+                    "target_id": message_id,
+                    "source_id": message_id,
+                },
+                "at_time": int(now),
+            })
+            self.mentioned_at[message_id] = now
+        return message_id
+
+    def handle(self, handler: _Handler, method: str, path: str, query: Dict[str, str], body: bytes):
+        if method == "GET" and path == "/x/msgfeed/at":
+            handler.send_json(self._at_page(int(query.get("ps", 20)), int(query.get("id", 0))))
+        elif method == "POST" and path == "/x/v2/reply/add":
+            handler.send_json(self._reply({key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}))
+        elif method == "GET" and path == "/x/web-interface/view":
+            aid = bv_to_av(query.get("bvid", ""))
+            if aid is None:
+                handler.send_json({"code": -400, "message": "请求错误"})
+            else:
+                handler.send_json({"code": 0, "message": "0", "data": {"aid": aid, "bvid": query["bvid"]}})
+        else:
+            super().handle(handler, method, path, query, body)
+
+    def _at_page(self, page_size: int, cursor_id: int) -> Dict[str, Any]:
+        with self.lock:
+            start = 0
+            if cursor_id:
+                start = next((i + 1 for i, item in enumerate(self.items) if item["id"] == cursor_id), len(self.items))
+            page = self.items[start:start + page_size]
+            is_end = start + page_size >= len(self.items)
+        return {
+            "code": 0,
+            "message": "0",
+            "data": {
+                "cursor": {"id": page[-1]["id"] if page else 0,
+                           "time": page[-1]["at_time"] if page else 0,
+                           "is_end": is_end},
+                "items": page,
+            },
+        }
+
+    def _reply(self, form: Dict[str, str]) -> Dict[str, Any]:
+        if self.reply_bucket is not None and self.reply_bucket.try_acquire() > 0:
+            with self.lock:
+                self.rejected += 1
+            return {"code": -509, "message": "请求过于频繁，请稍后再试"}
+        parent = int(form.get("parent", 0))
+        with self.lock:
+            if parent in self.replies:
+                return {"code": 12051, "message": "重复评论，请勿刷屏"}
+            rpid = 5000000 + len(self.replies)
+            self.replies[parent] = {"rpid": rpid, "time": time.time(), "oid": int(form.get("oid", 0)),
+                                    "type": int(form.get("type", 1)), "message": form.get("message", "")}
+        return {"code": 0, "message": "0", "data": {"rpid": rpid, "rpid_str": str(rpid)}}
+
+    def reply_latencies(self) -> List[float]:
+        """每条已回复的@消息从被@到收到回复的时间(秒)"""
+        with self.lock:
+            return [reply["time"] - self.mentioned_at[parent]
+                    for parent, reply in self.replies.items() if parent in self.mentioned_at]
+
+
+class FakeDifyServer(FakeServer):
+    """
+    模拟Dify的chat-messages接口
+
+    streaming模式下，开始处理前等待latency，然后每隔chunk_interval发送一段回答，最后发送message_end。
+    请求的inputs带有depth时，段数和token数按depth相对Dify应用默认深度(3)的比例缩放，模拟迭代搜索轮数的影响
+    """
+
+    def __init__(self, chunks: int = 5, chunk_interval: Latency = 0.0, **kwargs):
+        """
+        Args:
+            chunks (int, optional): 默认深度下回答分成的段数. 默认为5.
+            chunk_interval (Latency, optional): 两段回答之间的间隔(秒). 默认为0.
+            **kwargs: 见FakeServer
+        """
+        super().__init__(**kwargs)
+        self.chunks = max(1, chunks)
+        self.chunk_interval = chunk_interval
+        self.inflight = 0
+        self.max_inflight = 0
+        self.depths: List[Optional[int]] = []
+
+    def handle(self, handler: _Handler, method: str, path: str, query: Dict[str, str], body: bytes):
+        if method != "POST" or not path.endswith("/chat-messages"):
+            super().handle(handler, method, path, query, body)
+            return
+        payload = json.loads(body or b"{}")
+        depth = (payload.get("inputs") or {}).get("depth")
+        chunks = self.chunks if not depth else max(1, round(self.chunks * int(depth) / 3))
+        pieces = [f"关于“{payload.get('query', '')}”"] + [f"，第{i}条依据" for i in range(1, chunks)]
+        usage = {"prompt_tokens": 100, "completion_tokens": 20 * chunks, "total_tokens": 100 + 20 * chunks,
+                 "total_price": "0.0001", "currency": "USD", "latency": 0.0}
+        with self.lock:
+            self.depths.append(depth)
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            if payload.get("response_mode") == "streaming":
+                self._stream(handler, pieces, usage)
+            else:
+                handler.send_json({"event": "message", "message_id": "fake", "conversation_id": "",
+                                   "answer": "".join(pieces), "metadata": {"usage": usage}})
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    def _stream(self, handler: _Handler, pieces: List[str], usage: Dict[str, Any]):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    self.sleep(self.chunk_interval)
+                event = {"event": "message", "message_id": "fake", "conversation_id": "", "answer": piece}
+                handler.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                handler.wfile.flush()
+            end = {"event": "message_end", "message_id": "fake", "conversation_id": "", "metadata": {"usage": usage}}
+            handler.wfile.write(f"data: {json.dumps(end)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端读够字数后提前断开
+            pass
+
+
+def bot_config_patches(bilibili: FakeBilibiliServer, dify: FakeDifyServer, data_dir: str,
+                       bilibili_config: Optional[Dict[str, Any]] = None,
+                       dify_config: Optional[Dict[str, Any]] = None,
+                       system_config: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """
+    让机器人连接模拟服务、数据文件写入data_dir、缩短轮询间隔并放宽回复限流的配置补丁，由调用方start/stop
+
+    Args:
+        bilibili (FakeBilibiliServer): B站模拟服务
+        dify (FakeDifyServer): Dify模拟服务
+        data_dir (str): 数据文件目录
+        bilibili_config (Dict, optional): 额外覆盖的BILIBILI_CONFIG
+        dify_config (Dict, optional): 额外覆盖的DIFY_CONFIG
+        system_config (Dict, optional): 额外覆盖的SYSTEM_CONFIG
+
+    Returns:
+        List: patch.dict补丁
+    """
+    return [
+        patch.dict(bot.BILIBILI_CONFIG, {
+            "API_BASE": bilibili.base_url, "SESSDATA": "test", "BILI_JCT": "test",
+            "CHECK_INTERVAL": 0.1, "MIN_CHECK_INTERVAL": 0.1, "MAX_CHECK_INTERVAL": 0.1,
+            "REPLY_RATE_PER_MINUTE": 6000, "REPLY_BURST": 10, **(bilibili_config or {}),
+        }),
+        patch.dict(bot.DIFY_CONFIG, {"API_URL": f"{dify.base_url}/v1", "API_KEY": "test", **(dify_config or {})}),
+        patch.dict(bot.SYSTEM_CONFIG, {"DATA_DIR": data_dir, "DEBUG_MODE": False, "METRICS_PORT": None,
+                                       "TRACE_ENABLED": False, **(system_config or {})}),
+    ]
+
+
+@contextmanager
+def run_bot(startup: float = 0.5, timeout: float = 30) -> Iterator[threading.Thread]:
+    """
+    在后台线程运行bot.main，等待startup秒完成初始化(之前的@消息被标记为已处理)后交给调用方，
+    退出时停止机器人并等待主循环结束
+
+    Args:
+        startup (float, optional): 等待初始化的时间(秒). 默认为0.5.
+        timeout (float, optional): 等待主循环结束的最长时间(秒). 默认为30.
+
+    Yields:
+        threading.Thread: 运行主循环的线程，退出后可检查是否已结束
+    """
+    stop = threading.Event()
+    with patch("bot.setup_logging", return_value=logging.getLogger("FakeDetectionBot")):
+        runner = threading.Thread(target=bot.main, kwargs={"stop_event": stop}, daemon=True)
+        runner.start()
+        try:
+            time.sleep(startup)
+            yield runner
+        finally:
+            stop.set()
+            runner.join(timeout=timeout)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 15, interval: float = 0.05) -> bool:
+    """等待condition成立，超时返回False"""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复账号池的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.api.bilibili import get_bilibili_session, send_reply_comment
+from src.api.http_session import close_sessions
+from src.core.account_pool import AccountPool, MAIN_ACCOUNT, STRATEGY_LEAST_THROTTLED
+from src.core.reply_outbox import ReplyOutbox
+
+TARGET = {"oid": 1, "type_id": 1, "root": 2, "parent": 3}
+ACCOUNTS = [
+    {"NAME": "a", "SESSDATA": "sess_a", "BILI_JCT": "jct_a"},
+    {"NAME": "b", "SESSDATA": "sess_b", "BILI_JCT": "jct_b"},
+]
+
+
+class TestAccountPool(unittest.TestCase):
+    """测试账号选择和冷却"""
+
+    def setUp(self):
+        self.now = [100.0]
+
+    def make_pool(self, accounts=ACCOUNTS, **kwargs):
+        return AccountPool(accounts, rate=1, burst=1, cooldown=60, clock=lambda: self.now[0], **kwargs)
+
+    def test_default_main_account(self):
+        """没有配置回复账号时使用主账号"""
+        pool = self.make_pool([])
+        account, wait = pool.acquire()
+        self.assertEqual(account.name, MAIN_ACCOUNT)
+        self.assertIsNone(account.credentials)
+
+    def test_lru_rotation(self):
+        """轮流使用各账号，都没有令牌时返回最短等待时间"""
+        pool = self.make_pool()
+        first, _ = pool.acquire()
+        self.now[0] += 0.1
+        second, _ = pool.acquire()
+        self.assertEqual({first.name, second.name}, {"a", "b"})
+        account, wait = pool.acquire()
+        self.assertIsNone(account)
+        self.assertAlmostEqual(wait, 0.9)
+
+    def test_throttled_account_cools_down(self):
+        """触发风控的账号冷却期间不再分配"""
+        pool = self.make_pool()
+        account, _ = pool.acquire()
+        pool.report(account, success=False, throttled=True)
+        for _ in range(3):
+            self.now[0] += 1
+            other, _ = pool.acquire()
+            self.assertNotEqual(other.name, account.name)
+            pool.report(other, success=True)
+        self.now[0] += 60
+        names = set()
+        for _ in range(2):
+            self.now[0] += 1
+            names.add(pool.acquire()[0].name)
+        self.assertEqual(names, {"a", "b"})
+        self.assertEqual(pool.stats()[account.name], {"sent": 0, "throttled": 1, "failed": 0})
+        self.assertEqual(pool.stats()[other.name]["sent"], 3)
+
+    def test_least_throttled(self):
+        """least_throttled策略优先使用触发风控次数少的账号"""
+        pool = self.make_pool(strategy=STRATEGY_LEAST_THROTTLED)
+        pool.accounts[1].throttled = 2
+        for _ in range(3):
+            self.now[0] += 1
+            self.assertEqual(pool.acquire()[0].name, "a")
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            AccountPool([{"NAME": "a", "SESSDATA": "x"}])
+        with self.assertRaises(ValueError):
+            AccountPool(ACCOUNTS + [ACCOUNTS[0]])
+        with self.assertRaises(ValueError):
+            AccountPool(ACCOUNTS, strategy="random")
+
+
+class TestOutboxWithAccounts(unittest.TestCase):
+    """测试发件箱按账号发送"""
+
+    def test_switch_account_on_risk_control(self):
+        """一个账号触发风控后立即换账号重发，不计入发送次数"""
+        calls = []
+
+        def send(**kwargs):
+            calls.append(kwargs["account"]["NAME"])
+            return {"code": -509 if len(calls) == 1 else 0, "message": "", "data": {}}
+
+        pool = AccountPool(ACCOUNTS, rate=1000, burst=10, cooldown=60)
+        results = []
+        outbox = ReplyOutbox(":memory:", send=send, accounts=pool, max_attempts=1, start=False,
+                             on_result=lambda message_id, success: results.append((message_id, success)))
+        outbox.enqueue(1, TARGET, "回复")
+        self.assertEqual(outbox.process_due(), 0)
+        self.assertEqual(outbox.process_due(), 0)
+        outbox.close()
+
+        self.assertEqual(results, [(1, True)])
+        self.assertEqual(len(set(calls)), 2)
+        self.assertEqual(pool.stats()[calls[0]]["throttled"], 1)
+        self.assertEqual(pool.stats()[calls[1]]["sent"], 1)
+
+    def test_main_account_sends_without_credentials(self):
+        """主账号发送时不传account参数"""
+        calls = []
+        outbox = ReplyOutbox(":memory:", send=lambda **kwargs: calls.append(kwargs) or {"code": 0},
+                             accounts=AccountPool([], rate=1000, burst=10), start=False)
+        outbox.enqueue(1, TARGET, "回复")
+        outbox.process_due()
+        outbox.close()
+        self.assertNotIn("account", calls[0])
+
+
+class TestAccountRequests(unittest.TestCase):
+    """测试回复账号的会话和csrf"""
+
+    def tearDown(self):
+        close_sessions()
+
+    @patch.dict("src.api.bilibili.BILIBILI_CONFIG", {"SESSDATA": "main", "BILI_JCT": "main_jct"})
+    def test_account_session_and_csrf(self):
+        close_sessions()
+        self.assertIn("SESSDATA=main;", get_bilibili_session().headers["Cookie"])
+        self.assertIn("SESSDATA=sess_a;", get_bilibili_session(ACCOUNTS[0]).headers["Cookie"])
+        with patch("src.api.bilibili.get_bilibili_session") as mock_session:
+            mock_session.return_value.post.return_value = MagicMock(**{"json.return_value": {"code": 0}})
+            send_reply_comment(1, "a")
+            send_reply_comment(1, "a", account=ACCOUNTS[0])
+        csrfs = [call.kwargs["data"]["csrf"] for call in mock_session.return_value.post.call_args_list]
+        self.assertEqual(csrfs, ["main_jct", "jct_a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
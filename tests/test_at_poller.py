@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@消息增量轮询的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.at_poller import AtPoller, AtFeedError
+
+
+class MemoryStore:
+    """只实现get_meta/set_meta的内存存储"""
+
+    def __init__(self):
+        self.meta = {}
+
+    def get_meta(self, key, default=None):
+        return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+
+
+class FakeFeed:
+    """按游标分页返回@消息的模拟接口，消息按时间从新到旧排列"""
+
+    def __init__(self, count):
+        self.items = []
+        self.calls = []
+        self.add(count)
+
+    def add(self, count):
+        start = len(self.items)
+        new_items = [{"id": 1000 + i, "at_time": 1700000000 + i, "item": {}, "user": {}}
+                     for i in range(start, start + count)]
+        self.items = list(reversed(new_items)) + self.items
+
+    def __call__(self, page_size=20, cursor_id=0, cursor_time=0):
+        self.calls.append((page_size, cursor_id))
+        start = 0
+        if cursor_id:
+            start = next(i for i, item in enumerate(self.items) if item["id"] == cursor_id) + 1
+        page = self.items[start:start + page_size]
+        return {
+            "code": 0,
+            "data": {
+                "cursor": {"id": page[-1]["id"] if page else 0,
+                           "time": page[-1]["at_time"] if page else 0,
+                           "is_end": start + page_size >= len(self.items)},
+                "items": page
+            }
+        }
+
+
+class TestAtPoller(unittest.TestCase):
+    """测试基于游标的增量轮询"""
+
+    def test_initialize_skips_existing(self):
+        """测试首次运行将现有消息设为高水位"""
+        feed = FakeFeed(3)
+        poller = AtPoller(MemoryStore(), fetch=feed)
+        self.assertEqual(len(poller.initialize()), 3)
+        self.assertEqual(poller.poll(), [])
+        # 没有新消息时只下载探测页
+        self.assertEqual(feed.calls[-1], (5, 0))
+
+    def test_burst_is_drained_oldest_first(self):
+        """测试突发的大量消息通过翻页完整拉取"""
+        feed = FakeFeed(3)
+        poller = AtPoller(MemoryStore(), probe_page_size=5, page_size=20, fetch=feed)
+        poller.initialize()
+
+        feed.add(47)
+        messages = poller.poll()
+        self.assertEqual([m["id"] for m in messages], list(range(1003, 1050)))
+        self.assertEqual(len(feed.calls), 5)
+
+    def test_advance_and_resume(self):
+        """测试高水位只随派发推进，并在重新创建后继续"""
+        store = MemoryStore()
+        feed = FakeFeed(1)
+        poller = AtPoller(store, fetch=feed)
+        poller.initialize()
+
+        feed.add(4)
+        messages = poller.poll()
+        poller.advance(messages[0])
+        poller.advance(messages[1])
+
+        poller = AtPoller(store, fetch=feed)
+        self.assertEqual(poller.initialize(), [])
+        self.assertEqual([m["id"] for m in poller.poll()], [1003, 1004])
+
+    def test_advance_on_completion(self):
+        """测试高水位只推进到最早一条进行中的消息之前，停止时未处理完的消息重新创建后再次拉取"""
+        store = MemoryStore()
+        feed = FakeFeed(1)
+        poller = AtPoller(store, fetch=feed)
+        poller.initialize()
+
+        feed.add(4)
+        messages = poller.poll()
+        for message in messages[:3]:
+            poller.begin(message)
+        poller.cancel(messages[2]["id"])
+        poller.complete(messages[1]["id"])
+        self.assertEqual(poller.high_water, (1700000000, 1000))
+        # 进行中和已处理完的消息不再返回，派发失败的消息重新返回
+        self.assertEqual([m["id"] for m in poller.poll()], [1003, 1004])
+
+        poller.complete(messages[0]["id"])
+        self.assertEqual(poller.high_water, (1700000002, 1002))
+
+        poller.begin(messages[2])
+        poller.advance(messages[3])
+        self.assertEqual(poller.high_water, (1700000002, 1002))
+
+        # 停止时1003仍在排队，1004已处理完
+        poller = AtPoller(store, fetch=feed)
+        self.assertEqual([m["id"] for m in poller.poll()], [1003, 1004])
+
+    def test_error_code(self):
+        """测试接口返回错误码时抛出异常"""
+        poller = AtPoller(MemoryStore(), fetch=lambda **kwargs: {"code": -412, "message": "请求被拦截"})
+        with self.assertRaises(AtFeedError) as ctx:
+            poller.poll()
+        self.assertEqual(ctx.exception.code, -412)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -82,10 +82,11 @@ class TestBilibiliAPI(unittest.TestCase):
             }
         }
     
-    @patch('src.api.bilibili.requests.get')
-    def test_get_at_messages(self, mock_get):
+    @patch('src.api.bilibili.get_bilibili_session')
+    def test_get_at_messages(self, mock_session):
         """测试获取@信息函数"""
         # 设置mock对象的返回值
+        mock_get = mock_session.return_value.get
         mock_get.return_value = MockResponse(self.mock_api_response)
         
         # 调用测试函数
@@ -96,18 +97,18 @@ class TestBilibiliAPI(unittest.TestCase):
         self.assertEqual(len(result["data"]["items"]), 2)
         self.assertFalse(result["data"]["has_more"])
         
-        # 验证requests.get被正确调用
+        # 验证会话的get方法被正确调用
         mock_get.assert_called_once()
         args, kwargs = mock_get.call_args
         self.assertIn("https://api.bilibili.com/x/msgfeed/at", args[0])
         self.assertIn("headers", kwargs)
     
-    @patch('src.api.bilibili.requests.get')
-    def test_get_at_messages_error(self, mock_get):
+    @patch('src.api.bilibili.get_bilibili_session')
+    def test_get_at_messages_error(self, mock_session):
         """测试获取@信息失败的情况"""
         # 设置mock对象返回错误响应
         error_response = {"code": -101, "message": "账号未登录"}
-        mock_get.return_value = MockResponse(error_response)
+        mock_session.return_value.get.return_value = MockResponse(error_response)
         
         # 调用测试函数
         result = get_at_messages()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+BV号与AV号互转的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.bvid import av_to_bv, bv_to_av
+
+# 来自 log/response.json 中真实@消息的 (BV号, subject_id)
+KNOWN_PAIRS = [
+    ("BV1Xb5LzUEqa", 114477504664240),
+    ("BV1hcVPzLEm3", 114450023587340),
+    ("BV1kb4y1C7fp", 631394223),
+    ("BV1iW411576V", 22439092),
+    ("BV1zs411E78f", 27176872),
+]
+
+
+class TestBvid(unittest.TestCase):
+    """测试BV号编解码"""
+
+    def test_known_pairs(self):
+        """测试已知的BV号/AV号对应关系"""
+        for bvid, aid in KNOWN_PAIRS:
+            self.assertEqual(bv_to_av(bvid), aid)
+            self.assertEqual(av_to_bv(aid), bvid)
+
+    def test_invalid(self):
+        """测试格式不正确的输入"""
+        self.assertIsNone(bv_to_av("BV123456"))
+        self.assertIsNone(bv_to_av("BV1Xb5LzUEq0"))
+        with self.assertRaises(ValueError):
+            av_to_bv(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游熔断器和暂存消息的单元测试
+使用unittest框架进行测试
+"""
+
+import logging
+import unittest
+import sys
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.http_session import close_sessions
+from src.core.circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, protect, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+)
+from src.core.parking_lot import ParkingLot
+from src.core.rate_limiter import TokenBucket
+from src.core.reply_outbox import ReplyOutbox
+from src.core.verdict_cache import VerdictCache
+from tests.fake_servers import FakeBilibiliServer, FakeDifyServer, bot_config_patches, run_bot, wait_until
+
+TARGET = {"oid": 1, "type_id": 1, "root": 2, "parent": 3}
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """测试熔断器的状态切换"""
+
+    def setUp(self):
+        self.now = [1000.0]
+
+    def make(self, **kwargs):
+        return CircuitBreaker("test", failure_rate=0.5, min_requests=4, window=60, open_seconds=30,
+                              clock=lambda: self.now[0], **kwargs)
+
+    def test_open_on_failure_rate(self):
+        """请求数达到min_requests且失败率达到阈值时打开，打开期间拒绝请求"""
+        breaker = self.make()
+        for success in (True, False, True):
+            self.assertTrue(breaker.allow())
+            breaker.record(success)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        breaker.record(False)
+        self.assertEqual(breaker.state, STATE_OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 30)
+        stats = breaker.stats()
+        self.assertEqual((stats["opened"], stats["rejected"]), (1, 1))
+
+    def test_window_expiry(self):
+        """超过时间窗口的失败不再计入"""
+        breaker = self.make()
+        for _ in range(3):
+            breaker.record(False)
+        self.now[0] += 61
+        breaker.record(False)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertEqual(breaker.stats()["requests"], 1)
+
+    def test_half_open_probe(self):
+        """到期后只放行一个探测请求，探测失败时熔断时长加倍，成功则恢复"""
+        breaker = self.make()
+        for _ in range(4):
+            breaker.record(False)
+        self.now[0] += 30
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, STATE_OPEN)
+        self.assertEqual(breaker.retry_after(), 60)
+
+        self.now[0] += 60
+        self.assertTrue(breaker.allow())
+        breaker.record(None)  # 与上游健康无关的结果只释放探测名额
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+        # 恢复后熔断时长重置
+        for _ in range(4):
+            breaker.record(False)
+        self.assertEqual(breaker.retry_after(), 30)
+
+    def test_protect(self):
+        breaker = self.make(half_open_requests=1)
+        for _ in range(4):
+            with protect(breaker, "test") as call:
+                call["ok"] = False
+        with self.assertRaises(CircuitOpenError) as raised:
+            with protect(breaker, "test"):
+                pass
+        self.assertFalse(raised.exception.attempted)
+
+        # 请求中抛出其他异常时释放探测名额
+        self.now[0] += 30
+        with self.assertRaises(ValueError):
+            with protect(breaker, "test"):
+                raise ValueError()
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+        with protect(None, "test") as call:
+            call["ok"] = False
+
+
+class TestParkingLot(unittest.TestCase):
+    """测试暂存消息"""
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.data_dir.name, "parked.db")
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    def test_park_take_done(self):
+        parking = ParkingLot(self.path, max_parks=2)
+        parking.park(1, {"id": 1}, "dify")
+        parking.park(2, {"id": 2}, "dify", failed=False)
+        parking.park(3, {"id": 3}, "other")
+        self.assertEqual(parking.count("dify"), 2)
+
+        # 失败次数少的优先
+        self.assertEqual(parking.take("dify", 1), [{"id": 2}])
+        self.assertEqual(parking.count("dify"), 1)
+        self.assertTrue(parking.is_parked(2))
+        parking.done(2)
+        self.assertFalse(parking.is_parked(2))
+
+        # 失败次数超过max_parks后放弃，未发出请求的暂存不计入
+        self.assertTrue(parking.park(1, {"id": 1}, "dify"))
+        self.assertTrue(parking.park(1, {"id": 1}, "dify", failed=False))
+        self.assertFalse(parking.park(1, {"id": 1}, "dify"))
+        self.assertFalse(parking.is_parked(1))
+        self.assertEqual(parking.stats()["abandoned"], 1)
+        parking.close()
+
+    def test_restore_after_restart(self):
+        """已取出但未处理结束的消息在重启后恢复为暂存"""
+        parking = ParkingLot(self.path)
+        parking.park(1, {"id": 1, "item": {"title": "传言"}}, "dify")
+        self.assertEqual(len(parking.take("dify")), 1)
+        parking.close()
+
+        parking = ParkingLot(self.path)
+        self.assertEqual(parking.take("dify"), [{"id": 1, "item": {"title": "传言"}}])
+        parking.close()
+
+
+class TestOutboxBreaker(unittest.TestCase):
+    """测试B站熔断期间发件箱暂停发送"""
+
+    def test_hold_replies_while_open(self):
+        calls = []
+        codes = [-412, -412]
+
+        def send(**kwargs):
+            calls.append(kwargs)
+            return {"code": codes.pop(0) if codes else 0, "message": ""}
+
+        now = [1000.0]
+        breaker = CircuitBreaker("bilibili", min_requests=2, open_seconds=300, clock=lambda: now[0])
+        results = []
+        outbox = ReplyOutbox(":memory:", send=send, bucket=TokenBucket(rate=1000, capacity=100), base_delay=0,
+                             max_delay=0, max_attempts=3, breaker=breaker, start=False,
+                             on_result=lambda message_id, success: results.append((message_id, success)))
+        outbox.bucket.pause = lambda seconds: None
+        outbox.enqueue(1, TARGET, "回复1")
+        outbox.enqueue(2, TARGET, "回复2")
+        self.assertEqual(outbox.process_due(), 0)
+        self.assertEqual(outbox.process_due(), 0)
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+        # 熔断期间不发送，回复留在发件箱中
+        self.assertGreaterEqual(outbox.process_due(), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(outbox.stats()["pending"], 2)
+
+        # 恢复后发送，熔断期间没有消耗发送次数
+        now[0] += 300
+        while outbox.stats()["pending"]:
+            self.assertEqual(outbox.process_due(), 0)
+        outbox.close()
+        self.assertEqual(sorted(results), [(1, True), (2, True)])
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+
+class TestBotWithBreaker(unittest.TestCase):
+    """测试Dify故障期间@消息暂存，恢复后全部回复"""
+
+    def setUp(self):
+        self.bilibili = FakeBilibiliServer().start()
+        self.dify = FakeDifyServer(chunks=2, chunk_interval=0.01, error_rate=1.0).start()
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.patches = bot_config_patches(
+            self.bilibili, self.dify, self.data_dir.name,
+            dify_config={"CLAIM_INDEX_ENABLED": False},
+            system_config={"CIRCUIT_BREAKERS": {"dify": {"min_requests": 2, "open_seconds": 0.5}}}
+        )
+        for p in self.patches:
+            p.start()
+        close_sessions()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        close_sessions()
+        self.bilibili.close()
+        self.dify.close()
+        self.data_dir.cleanup()
+
+    def test_park_and_resume(self):
+        """Dify连续失败后熔断，失败和熔断期间的@消息暂存而不是标记为已处理，恢复后重新派发并全部回复"""
+        with run_bot() as runner:
+            mentions = [self.bilibili.add_mention(title=title) for title in
+                        ("听说喝咖啡会致癌", "吃鸡蛋会让胆固醇升高", "微波炉加热会破坏营养", "熬夜会导致脱发")]
+            wait_until(lambda: self.dify.requests.get("/v1/chat-messages", 0) >= 2, interval=0.01)
+            self.dify.error_rate = 0.0
+            wait_until(lambda: len(self.bilibili.replies) >= len(mentions))
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(sorted(self.bilibili.replies), sorted(mentions))
+
+
+class CoalescingDifyClient:
+    """等到第二条相同的消息合并到这次调用后才返回给定的结果"""
+
+    def __init__(self, cache, response):
+        self.cache = cache
+        self.response = response
+        self.calls = 0
+
+    def send_chat_message(self, **kwargs):
+        self.calls += 1
+        wait_until(lambda: self.cache.stats()["coalesced"] == 1, interval=0.01)
+        return dict(self.response)
+
+
+class TestCoalescedOutcome(unittest.TestCase):
+    """测试合并到同一次Dify调用的消息得到发起调用的消息的结果"""
+
+    def run_pair(self, response):
+        cache = VerdictCache()
+        client = CoalescingDifyClient(cache, response)
+        pipeline = bot.build_pipeline(client, logging.getLogger("test"), verdict_cache=cache,
+                                      dify_breaker=CircuitBreaker("dify", min_requests=100))
+        jobs, done = {}, {}
+        with patch.object(bot, "resolve_reply_target", return_value=dict(TARGET)):
+            for message_id in (1, 2):
+                jobs[message_id] = {"message": {"id": message_id, "item": {"title": "听说喝咖啡会致癌"}}}
+                pipeline.submit(message_id, jobs[message_id], on_done=done.__setitem__, deadline=time.time() + 30)
+            wait_until(lambda: len(done) == 2)
+        pipeline.shutdown()
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(done, {1: False, 2: False})
+        return [jobs[message_id]["parked"] for message_id in (1, 2)]
+
+    def test_failed_call_counts_for_both(self):
+        """Dify请求失败时两条消息都暂存并计入失败次数"""
+        parked = self.run_pair({"error": "500 Server Error", "timeout": False})
+        self.assertEqual([error.attempted for error in parked], [True, True])
+
+    def test_unattempted_call_not_counted(self):
+        """发起调用的消息没有请求Dify(并发名额已满)时，合并的消息暂存但不计入失败次数"""
+        parked = self.run_pair({"error": "所有Dify服务都已达到并发上限", "timeout": False, "saturated": True})
+        self.assertEqual([error.attempted for error in parked], [False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
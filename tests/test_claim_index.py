@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+相似说法索引的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.claim_index import ClaimIndex, claim_markers, claim_shingles
+
+
+class TestClaimIndex(unittest.TestCase):
+    """测试相似说法索引功能"""
+
+    def setUp(self):
+        self.index = ClaimIndex(":memory:", threshold=0.8)
+        self.index.add("听说最新研究表明，长期用蓝牙耳机可能导致脑癌", "结论: 没有可靠证据")
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_clickbait_prefix_and_punctuation(self):
+        """测试加前缀、换标点后仍能找到"""
+        self.assertEqual(claim_shingles("震惊！蓝牙"), claim_shingles("蓝牙"))
+        match = self.index.lookup("震惊！！听说最新研究表明长期用蓝牙耳机可能导致脑癌")
+        self.assertIsNotNone(match)
+        self.assertEqual(match["verdict"], "结论: 没有可靠证据")
+
+    def test_negation_and_numbers(self):
+        """否定词或数字不同的说法结论可能相反，不复用"""
+        self.index.add("研究表明长期用蓝牙耳机会导致脑癌", "结论: 错误")
+        self.assertIsNone(self.index.lookup("研究表明长期用蓝牙耳机不会导致脑癌"))
+        self.assertEqual(self.index.lookup("研究表明，长期用蓝牙耳机会导致脑癌！")["verdict"], "结论: 错误")
+
+        self.index.add("今年一季度GDP增长了5.2%", "结论: 属实")
+        self.assertIsNone(self.index.lookup("今年一季度GDP增长了15.2%"))
+        self.assertIsNotNone(self.index.lookup("今年一季度GDP增长了5.2％"))
+        self.assertEqual(claim_markers("并非没有5.2%"), (("并非", "没"), ("5.2",)))
+
+    def test_unrelated_claim(self):
+        """测试不相关的说法不会被复用"""
+        self.assertIsNone(self.index.lookup("特斯拉不是没有语音控制和语音互联，只是没有开放"))
+        self.assertEqual(self.index.stats(), {"hits": 0, "misses": 1})
+
+    def test_persistence_and_max_age(self):
+        """测试持久化和过期清理"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "claims.db")
+            index = ClaimIndex(path)
+            index.add("约基奇在球队是一个体系组织发牌者", "属实")
+            index.close()
+
+            index = ClaimIndex(path)
+            self.assertEqual(index.lookup("约基奇在球队是一个体系组织发牌者！！！")["verdict"], "属实")
+            index.max_age = -1
+            self.assertIsNone(index.lookup("约基奇在球队是一个体系组织发牌者"))
+            self.assertEqual(index.prune(), 1)
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
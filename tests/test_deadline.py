@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+处理时限与超时统计的单元测试
+使用本地socket模拟卡住的服务端
+"""
+
+import socket
+import threading
+import time
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.api.dify import DifyAPI
+from src.core.deadline import DeadlineExceeded, stage_timeout, timeout_stats
+
+
+class StalledServer:
+    """接受连接后发送prefix，然后一直不再发送数据"""
+
+    def __init__(self, prefix: bytes = b""):
+        self.prefix = prefix
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.connections = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            conn.recv(65536)
+            conn.sendall(self.prefix)
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.sock.close()
+
+
+class TestDeadline(unittest.TestCase):
+    """测试阶段超时计算和卡住的连接"""
+
+    def test_stage_timeout(self):
+        """测试阶段超时取上限和剩余时限中较小的一个"""
+        timeouts = {"reply_post": 15}
+        self.assertEqual(stage_timeout("reply_post", None, timeouts), 15)
+        self.assertLessEqual(stage_timeout("reply_post", time.time() + 5, timeouts), 5)
+        self.assertLessEqual(stage_timeout("dify_idle", time.time() + 100, reserve=90), 10)
+
+        before = timeout_stats().get("resolve", 0)
+        with self.assertRaises(DeadlineExceeded):
+            stage_timeout("resolve", time.time() - 1)
+        self.assertEqual(timeout_stats()["resolve"], before + 1)
+
+    def test_stalled_dify_stream(self):
+        """测试流式响应中途卡住时按读取超时结束"""
+        chunk = b'data: {"event": "message", "answer": "partial"}\n\n'
+        server = StalledServer(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+            + b"%x\r\n" % len(chunk) + chunk + b"\r\n"
+        )
+        try:
+            with patch.dict("src.api.dify.DIFY_CONFIG", {"API_KEY": "test-key"}):
+                client = DifyAPI()
+            client.base_url = f"http://127.0.0.1:{server.port}"
+            start = time.time()
+            response = client.send_chat_message("问题", timeout=(1, 0.3))
+            result = client.read_stream(response["response"])
+            self.assertLess(time.time() - start, 3)
+            self.assertTrue(result["timeout"])
+            self.assertEqual(result["answer"], "partial")
+        finally:
+            server.close()
+
+    def test_stalled_dify_connect(self):
+        """测试服务端不返回响应头时请求超时"""
+        server = StalledServer()
+        try:
+            with patch.dict("src.api.dify.DIFY_CONFIG", {"API_KEY": "test-key"}):
+                client = DifyAPI()
+            client.base_url = f"http://127.0.0.1:{server.port}"
+            response = client.send_chat_message("问题", timeout=(1, 0.3))
+            self.assertTrue(response["timeout"])
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
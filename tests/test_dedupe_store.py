@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+已处理消息存储的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.dedupe_store import ProcessedMessageStore
+
+
+class TestProcessedMessageStore(unittest.TestCase):
+    """测试已处理消息存储功能"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "processed_messages.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_add_and_reopen(self):
+        """测试写入的记录在重新打开后仍然存在"""
+        store = ProcessedMessageStore(self.db_path)
+        store.add(801198424817665)
+        store.update([1, 2, 2, 3])
+        self.assertIn(801198424817665, store)
+        self.assertNotIn(4, store)
+        self.assertEqual(len(store), 4)
+        store.close()
+
+        store = ProcessedMessageStore(self.db_path)
+        self.assertIn(2, store)
+        self.assertEqual(len(store), 4)
+        store.close()
+
+    def test_migrate_legacy_json(self):
+        """测试导入旧版JSON文件"""
+        legacy_path = os.path.join(self.tmp_dir.name, "processed_messages.json")
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            json.dump([56302468, 801572523466757], f)
+
+        store = ProcessedMessageStore(self.db_path, legacy_json_path=legacy_path)
+        self.assertIn(56302468, store)
+        self.assertIn(801572523466757, store)
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertTrue(os.path.exists(legacy_path + ".migrated"))
+        store.close()
+
+    def test_compact_retention(self):
+        """测试按保留天数清理旧记录"""
+        store = ProcessedMessageStore(self.db_path)
+        store.add(1)
+        store._conn.execute("UPDATE processed_messages SET processed_at = 0 WHERE id = 1")
+        store.add(2)
+
+        self.assertEqual(store.compact(retention_days=0), 0)
+        self.assertEqual(store.compact(retention_days=30), 1)
+        self.assertNotIn(1, store)
+        self.assertIn(2, store)
+        store.close()
+
+    def test_meta(self):
+        """测试附加键值信息的读写"""
+        store = ProcessedMessageStore(self.db_path)
+        self.assertIsNone(store.get_meta("cursor"))
+        store.set_meta("cursor", "123")
+        self.assertEqual(store.get_meta("cursor"), "123")
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
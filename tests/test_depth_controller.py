@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自适应核查深度的单元测试
+使用unittest框架进行测试
+"""
+
+import logging
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.dify import DifyAPI
+from src.api.http_session import close_sessions
+from src.core.depth_controller import DepthController
+from tests.fake_servers import FakeDifyServer
+
+USAGE = {"total_tokens": 300, "total_price": "0.003", "currency": "USD"}
+
+
+class TestDepthController(unittest.TestCase):
+    """测试深度选择"""
+
+    def setUp(self):
+        self.now = [1000.0]
+
+    def make(self, **kwargs):
+        kwargs.setdefault("target_latency", 60)
+        return DepthController(min_depth=1, max_depth=5, default_depth=3, workers=2,
+                               clock=lambda: self.now[0], **kwargs)
+
+    def test_default_before_samples(self):
+        self.assertEqual(self.make().choose(100), 3)
+
+    def test_backlog_makes_shallow(self):
+        """空闲时深查，积压时浅查，保证排在后面的消息也在目标耗时内完成"""
+        controller = self.make()
+        controller.record(3, 30)  # 每轮10秒
+        self.assertEqual(controller.choose(0), 5)
+        self.assertEqual(controller.choose(2), 3)     # 60 / (2 × 10) = 3
+        self.assertEqual(controller.choose(100), 1)
+        stats = controller.stats()
+        self.assertEqual(stats["choices"], {1: 1, 3: 1, 5: 1})
+        self.assertEqual(stats["limited_by_latency"], 2)
+
+    def test_token_budget(self):
+        """剩余预算平均分给积压的消息，预算用完时使用最小深度"""
+        controller = self.make(target_latency=1e6, token_budget=3000)
+        controller.record(3, 3, USAGE)  # 每轮100 token
+        self.assertEqual(controller.spent(), (300, 0.003))
+        self.assertEqual(controller.choose(0), 5)
+        self.assertEqual(controller.choose(6), 3)     # 2700 / 7 / 100 = 3
+        for _ in range(9):
+            controller.record(3, 3, USAGE)
+        self.assertEqual(controller.choose(0), 1)
+        self.assertGreaterEqual(controller.stats()["limited_by_budget"], 2)
+
+        # 超过滚动窗口的消耗不再计入
+        self.now[0] += 3601
+        self.assertEqual(controller.spent(), (0, 0))
+        self.assertEqual(controller.choose(0), 5)
+
+    def test_price_budget(self):
+        controller = self.make(target_latency=1e6, price_budget=0.01)
+        controller.record(3, 3, USAGE)  # 每轮0.001
+        self.assertEqual(controller.choose(1), 3)     # 0.007 / 2 / 0.001 = 3
+
+    def test_estimate_without_usage(self):
+        """没读到message_end时按每轮消耗的估计值计入预算，还没有估计值时不计入"""
+        controller = self.make(token_budget=3000)
+        controller.record(3, 3, estimate=True)
+        self.assertEqual(controller.spent(), (0, 0))
+        controller.record(3, 3, USAGE)  # 每轮100 token
+        controller.record(2, 2, estimate=True)
+        self.assertEqual(controller.spent(), (500, 0.005))
+        controller.record(2, 2)
+        self.assertEqual(controller.spent(), (500, 0.005))
+
+    def test_invalid_range(self):
+        with self.assertRaises(ValueError):
+            DepthController(min_depth=3, max_depth=2)
+
+
+class TestVerifyWithDepth(unittest.TestCase):
+    """测试核查时把深度传给Dify并记录耗时和用量"""
+
+    def setUp(self):
+        self.dify = FakeDifyServer(chunks=3).start()
+        self.patch = patch.dict(bot.DIFY_CONFIG, {"API_URL": f"{self.dify.base_url}/v1", "API_KEY": "test"})
+        self.patch.start()
+        close_sessions()
+
+    def tearDown(self):
+        self.patch.stop()
+        close_sessions()
+        self.dify.close()
+
+    def test_depth_sent_and_recorded(self):
+        controller = DepthController(max_depth=5, default_depth=2)
+        message = {"id": 1, "item": {"title": "听说喝咖啡会致癌"}}
+        answer = bot.verify_message(message, DifyAPI(), logging.getLogger("test"),
+                                    depth_controller=controller, backlog=3)
+        self.assertTrue(answer)
+        self.assertEqual(self.dify.depths, [2])
+        self.assertEqual(controller.spent()[0], 100 + 20 * 2)
+        self.assertIsNotNone(controller.stats()["seconds_per_level"])
+
+        bot.verify_message(message, DifyAPI(), logging.getLogger("test"))
+        self.assertEqual(self.dify.depths, [2, None])
+
+    def test_truncated_answer_recorded(self):
+        """回答超过回复字数上限时仍读取到message_end，用量计入预算"""
+        controller = DepthController(max_depth=5, default_depth=3)
+        message = {"id": 1, "item": {"title": "听说喝咖啡会致癌"}}
+        with patch.object(bot, "REPLY_MAX_LENGTH", 10):
+            answer = bot.verify_message(message, DifyAPI(), logging.getLogger("test"),
+                                        depth_controller=controller)
+        self.assertTrue(answer)
+        self.assertNotIn("第2条依据", answer)
+        self.assertEqual(controller.spent()[0], 100 + 20 * 3)
+
+    def test_stop_at_reply_limit(self):
+        """配置STOP_AT_REPLY_LIMIT时超过回复字数上限立即停止读取，按估计的消耗计入预算"""
+        controller = DepthController(max_depth=5, default_depth=3)
+        message = {"id": 1, "item": {"title": "听说喝咖啡会致癌"}}
+        bot.verify_message(message, DifyAPI(), logging.getLogger("test"), depth_controller=controller)
+        self.assertEqual(controller.spent()[0], 100 + 20 * 3)
+        with patch.object(bot, "REPLY_MAX_LENGTH", 10), patch.dict(bot.DIFY_CONFIG, {"STOP_AT_REPLY_LIMIT": True}):
+            answer = bot.verify_message(message, DifyAPI(), logging.getLogger("test"),
+                                        depth_controller=controller)
+        self.assertTrue(answer)
+        self.assertNotIn("第2条依据", answer)
+        # 按第一次调用每轮的消耗估计
+        self.assertAlmostEqual(controller.spent()[0], (100 + 20 * 3) * (1 + self.dify.depths[-1] / 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
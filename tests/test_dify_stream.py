@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dify流式响应解析的单元测试
+使用unittest框架进行测试
+"""
+
+import json
+import unittest
+import sys
+import os
+import time
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.api.dify import DifyAPI, StreamCollector, iter_stream_events
+
+
+def sse(event: dict) -> bytes:
+    return f"data: {json.dumps(event, ensure_ascii=False)}".encode("utf-8")
+
+
+class MockStreamResponse:
+    """模拟requests的流式响应，记录读取了多少行"""
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+        self.closed = False
+
+    def iter_lines(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+USAGE = {"total_tokens": 120, "total_price": "0.001", "currency": "USD", "latency": 1.5}
+
+LINES = [
+    sse({"event": "workflow_started", "data": {}}),
+    b"",
+    b"event: ping",
+    sse({"event": "message", "answer": "这条说法", "message_id": "m1", "conversation_id": "c1"}),
+    sse({"event": "message", "answer": "不属实"}),
+    sse({"event": "workflow_finished", "data": {"status": "succeeded"}}),
+    sse({"event": "message_end", "message_id": "m1", "metadata": {"usage": USAGE}}),
+]
+
+
+class TestDifyStream(unittest.TestCase):
+    """测试流式事件解析和结果累积"""
+
+    def setUp(self):
+        with patch("src.api.dify.get_session"):
+            self.client = DifyAPI()
+
+    def test_typed_events(self):
+        """测试事件类型和忽略非data行"""
+        events = [event.event for event in iter_stream_events(LINES)]
+        self.assertEqual(events, ["workflow_started", "message", "message", "workflow_finished", "message_end"])
+
+    def test_read_stream(self):
+        """测试读取完整回答和用量信息"""
+        response = MockStreamResponse(LINES)
+        result = self.client.read_stream(response)
+        self.assertEqual(result["answer"], "这条说法不属实")
+        self.assertEqual(result["usage"], USAGE)
+        self.assertEqual(result["conversation_id"], "c1")
+        self.assertFalse(result["truncated"])
+        self.assertTrue(response.closed)
+
+    def test_stop_at_max_chars(self):
+        """测试回答超过上限后停止读取"""
+        lines = [sse({"event": "message", "answer": "长" * 10}) for _ in range(100)]
+        response = MockStreamResponse(lines)
+        result = self.client.read_stream(response, max_chars=25, stop_at_max_chars=True)
+        self.assertTrue(result["truncated"])
+        self.assertEqual(len(result["answer"]), 30)
+        self.assertEqual(response.read, 3)
+        self.assertTrue(response.closed)
+
+    def test_read_to_end_after_max_chars(self):
+        """测试回答超过上限后不再保存后续片段，但读取到message_end取得用量"""
+        lines = [sse({"event": "message", "answer": "长" * 10}) for _ in range(100)]
+        lines.append(sse({"event": "message_end", "message_id": "m1", "metadata": {"usage": USAGE}}))
+        response = MockStreamResponse(lines)
+        result = self.client.read_stream(response, max_chars=25)
+        self.assertTrue(result["truncated"])
+        self.assertEqual(len(result["answer"]), 30)
+        self.assertEqual(result["usage"], USAGE)
+        self.assertIsNone(result["error"])
+        self.assertEqual(response.read, 101)
+        self.assertTrue(response.closed)
+
+    def test_deadline_after_max_chars(self):
+        """测试到达截止时间时停止读取，回答已超过上限时不算出错"""
+        lines = [sse({"event": "message", "answer": "长" * 10}) for _ in range(100)]
+        response = MockStreamResponse(lines)
+        result = self.client.read_stream(response, max_chars=5, deadline=time.time() - 1)
+        self.assertTrue(result["truncated"])
+        self.assertIsNone(result["error"])
+        self.assertIsNone(result["usage"])
+        self.assertEqual(response.read, 1)
+
+        result = self.client.read_stream(MockStreamResponse(lines), max_chars=25, deadline=time.time() - 1)
+        self.assertEqual(result["error"], "超过处理截止时间")
+        self.assertTrue(result["timeout"])
+
+    def test_error_and_replace(self):
+        """测试错误事件和内容替换"""
+        response = MockStreamResponse([sse({"event": "error", "code": "quota", "message": "额度不足"})])
+        self.assertEqual(self.client.get_streaming_response(response), "错误: quota 额度不足")
+
+        collector = StreamCollector()
+        for event in iter_stream_events([sse({"event": "message", "answer": "原文"}),
+                                         sse({"event": "message_replace", "answer": "已替换"})]):
+            collector.feed(event)
+        self.assertEqual(collector.result()["answer"], "已替换")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dify服务池的单元测试
+使用unittest框架进行测试
+"""
+
+import logging
+import unittest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.http_session import close_sessions
+from src.core.endpoint_pool import (
+    EndpointPool, STATE_EJECTED, STATE_HEALTHY, STATE_PROBING, STRATEGY_LATENCY
+)
+from src.core.circuit_breaker import CircuitBreaker, STATE_CLOSED, UpstreamUnavailable
+from tests.fake_servers import FakeDifyServer
+
+
+def endpoint(name, max_concurrency=None):
+    return {"NAME": name, "API_URL": f"http://{name}/v1", "API_KEY": "key", "MAX_CONCURRENCY": max_concurrency}
+
+
+class TestEndpointSelection(unittest.TestCase):
+    """测试服务选择、并发上限和摘除"""
+
+    def setUp(self):
+        self.now = [1000.0]
+
+    def make(self, endpoints, **kwargs):
+        return EndpointPool(endpoints, client_factory=lambda url, key: None, clock=lambda: self.now[0], **kwargs)
+
+    def test_least_outstanding(self):
+        pool = self.make([endpoint("a"), endpoint("b")])
+        first, second = pool.acquire(), pool.acquire()
+        self.assertNotEqual(first.name, second.name)
+        pool.release(first, True, 1.0)
+        self.assertIs(pool.acquire(), first)
+
+    def test_latency_strategy(self):
+        """按延迟EWMA和进行中的请求数选择"""
+        pool = self.make([endpoint("slow"), endpoint("fast")], strategy=STRATEGY_LATENCY)
+        slow, fast = pool.endpoints
+        slow.latency, fast.latency = 3.0, 1.0
+        self.assertIs(pool.acquire(), fast)   # 1 × 1 < 3 × 1
+        self.assertIs(pool.acquire(), fast)   # 1 × 2 < 3 × 1
+        self.assertIs(pool.acquire(), slow)   # 1 × 3 = 3 × 1，进行中的请求少的优先
+        self.assertIs(pool.acquire(), fast)   # 1 × 3 < 3 × 2
+
+    def test_concurrency_cap(self):
+        """达到并发上限的服务不再分配，全部达到上限时等待其他请求结束"""
+        pool = self.make([endpoint("a", max_concurrency=1)])
+        first = pool.acquire()
+        self.assertIsNone(pool.acquire(timeout=0.05))
+        threading.Timer(0.05, pool.release, args=(first, True)).start()
+        self.assertIs(pool.acquire(timeout=5), first)
+
+    def test_eject_and_probe(self):
+        """连续失败后摘除，到期后只放行一个探测请求，探测失败时加倍摘除时长"""
+        pool = self.make([endpoint("a"), endpoint("b")], eject_after=2, eject_seconds=30)
+        a, b = pool.endpoints
+        for _ in range(2):
+            self.assertIs(pool.acquire(), a)
+            pool.release(a, False)
+        self.assertEqual(a.state(self.now[0]), STATE_EJECTED)
+        self.assertEqual(pool.stats()["a"]["ejections"], 1)
+        self.assertIs(pool.acquire(), b)
+        self.assertIs(pool.acquire(), b)
+
+        self.now[0] += 31
+        self.assertEqual(a.state(self.now[0]), STATE_PROBING)
+        self.assertIs(pool.acquire(), a)
+        self.assertFalse(a.available(self.now[0]))
+        self.assertIs(pool.acquire(), b)
+        pool.release(a, False)
+        self.assertEqual(a.eject_seconds, 60)
+
+        self.now[0] += 61
+        self.assertIs(pool.acquire(), a)
+        pool.release(a, True, 0.5)
+        self.assertEqual(a.state(self.now[0]), STATE_HEALTHY)
+        self.assertEqual(a.latency, 0.5)
+
+    def test_all_ejected(self):
+        pool = self.make([endpoint("a")], eject_after=1)
+        pool.release(pool.acquire(), False)
+        self.assertIsNone(pool.acquire(timeout=5))
+        self.assertIn("error", pool.send_chat_message("传言"))
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            self.make([])
+        with self.assertRaises(ValueError):
+            self.make([endpoint("a"), endpoint("a")])
+        with self.assertRaises(ValueError):
+            self.make([{"NAME": "a", "API_URL": "http://a"}])
+
+
+class TestEndpointPoolClient(unittest.TestCase):
+    """测试服务池作为Dify客户端使用"""
+
+    def setUp(self):
+        self.healthy = FakeDifyServer(chunks=2).start()
+        self.broken = FakeDifyServer(chunks=2, error_rate=1.0).start()
+        close_sessions()
+
+    def tearDown(self):
+        close_sessions()
+        self.healthy.close()
+        self.broken.close()
+
+    def test_failover(self):
+        """失败的请求换健康的服务重试，失败的服务被摘除后不再分配请求"""
+        pool = EndpointPool([
+            {"NAME": "broken", "API_URL": f"{self.broken.base_url}/v1", "API_KEY": "key"},
+            {"NAME": "healthy", "API_URL": f"{self.healthy.base_url}/v1", "API_KEY": "key"},
+        ], eject_after=2, eject_seconds=60)
+        for i in range(8):
+            response = pool.send_chat_message(query=f"传言{i}")
+            self.assertEqual(response["endpoint"], "healthy")
+            self.assertIn(f"传言{i}", pool.read_stream(response["response"])["answer"])
+        self.assertEqual(self.broken.requests.get("/v1/chat-messages"), 2)
+        stats = pool.stats()
+        self.assertEqual(stats["broken"]["state"], STATE_EJECTED)
+        self.assertEqual(stats["healthy"]["ok"], 8)
+        self.assertEqual(stats["healthy"]["outstanding"], 0)
+        self.assertIsNotNone(stats["healthy"]["latency"])
+
+    def test_deadline_stop_is_neutral(self):
+        """调用方的处理时限用完而停止读取不计入失败，不会摘除服务"""
+        slow = FakeDifyServer(chunks=20, chunk_interval=0.05).start()
+        try:
+            pool = EndpointPool([{"NAME": "slow", "API_URL": f"{slow.base_url}/v1", "API_KEY": "key"}],
+                                eject_after=1)
+            for i in range(3):
+                response = pool.send_chat_message(query=f"传言{i}")
+                result = pool.read_stream(response["response"], deadline=time.time() + 0.1)
+                self.assertTrue(result["timeout"])
+            stats = pool.stats()["slow"]
+            self.assertEqual(stats["state"], STATE_HEALTHY)
+            self.assertEqual((stats["ok"], stats["failed"], stats["outstanding"]), (0, 0, 0))
+            self.assertNotIn("error", pool.send_chat_message(query="传言"))
+        finally:
+            slow.close()
+
+    def test_saturation_not_counted_as_failure(self):
+        """核查线程多于服务的并发上限时，没等到名额的请求不计入熔断器和服务的失败"""
+        slow = FakeDifyServer(chunks=5, chunk_interval=0.05).start()
+        try:
+            pool = EndpointPool([{"NAME": "slow", "API_URL": f"{slow.base_url}/v1", "API_KEY": "key",
+                                  "MAX_CONCURRENCY": 1}], eject_after=1, acquire_timeout=0.05)
+            breaker = CircuitBreaker("dify", failure_rate=0.5, min_requests=1)
+            answers, errors = [], []
+
+            def worker(i):
+                message = {"id": i, "item": {"title": f"传言{i}"}}
+                try:
+                    answers.append(bot.verify_message(message, pool, logging.getLogger("test"), breaker=breaker))
+                except UpstreamUnavailable as error:
+                    errors.append(error)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(answers), 1)
+            self.assertTrue(answers[0])
+            self.assertEqual(len(errors), 3)
+            self.assertFalse(any(error.attempted for error in errors))
+            self.assertEqual(breaker.state, STATE_CLOSED)
+            self.assertEqual(slow.requests.get("/v1/chat-messages"), 1)
+            stats = pool.stats()["slow"]
+            self.assertEqual((stats["state"], stats["ok"], stats["failed"]), (STATE_HEALTHY, 1, 0))
+        finally:
+            slow.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+使用本地模拟服务的集成测试
+通过真实的HTTP请求运行机器人主循环
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.bilibili import get_at_messages, parse_at_messages, send_reply_comment
+from src.api.http_session import close_sessions
+from tests.fake_servers import FakeBilibiliServer, FakeDifyServer, bot_config_patches, run_bot, wait_until
+
+
+class TestFakeServers(unittest.TestCase):
+    """测试模拟服务和机器人主循环"""
+
+    def setUp(self):
+        self.bilibili = FakeBilibiliServer(reply_rate=1, reply_burst=1).start()
+        self.dify = FakeDifyServer(chunks=3, chunk_interval=0.01).start()
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.patches = bot_config_patches(self.bilibili, self.dify, self.data_dir.name)
+        for p in self.patches:
+            p.start()
+        close_sessions()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        close_sessions()
+        self.bilibili.close()
+        self.dify.close()
+        self.data_dir.cleanup()
+
+    def test_feed_paging_and_reply_limit(self):
+        """msgfeed按游标翻页，回复超过限流时返回-509"""
+        ids = [self.bilibili.add_mention() for _ in range(5)]
+        first = get_at_messages(page_size=3)
+        self.assertEqual([m["id"] for m in parse_at_messages(first)], ids[:-4:-1])
+        cursor = first["data"]["cursor"]
+        second = get_at_messages(page_size=3, cursor_id=cursor["id"], cursor_time=cursor["time"])
+        self.assertEqual([m["id"] for m in parse_at_messages(second)], ids[1::-1])
+        self.assertTrue(second["data"]["cursor"]["is_end"])
+
+        self.assertEqual(send_reply_comment(oid=1, message="a", root=ids[0], parent=ids[0])["code"], 0)
+        self.assertEqual(send_reply_comment(oid=1, message="b", root=ids[1], parent=ids[1])["code"], -509)
+        self.assertEqual(self.bilibili.rejected, 1)
+
+    def test_bot_main_replies_to_new_mentions(self):
+        """机器人主循环只回复启动后的新@消息，回复内容来自Dify流式输出"""
+        self.bilibili.reply_bucket = None
+        old_id = self.bilibili.add_mention()
+        with run_bot() as runner:
+            new_ids = [self.bilibili.add_mention(title=f"第{i}个传言是真的吗") for i in range(3)]
+            wait_until(lambda: len(self.bilibili.replies) >= 3)
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(sorted(self.bilibili.replies), sorted(new_ids))
+        self.assertNotIn(old_id, self.bilibili.replies)
+        self.assertIn("第0个传言是真的吗", self.bilibili.replies[new_ids[0]]["message"])
+        self.assertEqual(self.dify.requests.get("/v1/chat-messages"), 3)
+
+    def test_queued_mentions_refetched_after_restart(self):
+        """停止时还在排队的@消息不推进拉取高水位，重新启动后再次拉取并回复"""
+        self.bilibili.reply_bucket = None
+        self.dify.chunk_interval = 0.5
+        titles = ("听说喝咖啡会致癌", "吃鸡蛋会让胆固醇升高", "微波炉加热会破坏营养")
+        with patch.dict(bot.BILIBILI_CONFIG, {"SHUTDOWN_TIMEOUT": 0, "PIPELINE_STAGES": {"verify": {"workers": 1}}}):
+            with run_bot():
+                ids = [self.bilibili.add_mention(title=title) for title in titles]
+                wait_until(lambda: self.dify.requests.get("/v1/chat-messages", 0) >= 1, interval=0.01)
+            self.assertEqual(self.dify.requests.get("/v1/chat-messages"), 1)
+            self.assertFalse(set(ids[1:]) & set(self.bilibili.replies))
+
+            self.dify.chunk_interval = 0.01
+            with run_bot():
+                wait_until(lambda: set(ids[1:]) <= set(self.bilibili.replies))
+        self.assertTrue(set(ids[1:]) <= set(self.bilibili.replies))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+共享HTTP会话的单元测试
+使用本地HTTP服务验证连接复用统计
+"""
+
+import unittest
+import sys
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.api import http_session
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """返回固定JSON并保持连接的请求处理器"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"code": 0}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.seen_headers.append(dict(self.headers))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPSession(unittest.TestCase):
+    """测试共享会话的连接复用和公共请求头"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        self.server.seen_headers = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def tearDown(self):
+        http_session.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        """测试多次请求复用同一个连接，并正确统计"""
+        session = http_session.get_session("test", lambda: {"Cookie": "SESSDATA=abc"})
+        for _ in range(5):
+            self.assertEqual(session.get(self.url).json(), {"code": 0})
+
+        self.assertIs(http_session.get_session("test"), session)
+        self.assertEqual(http_session.connection_stats()["test"], {"requests": 5, "new_connections": 1, "reused": 4})
+        self.assertTrue(all(headers.get("Cookie") == "SESSDATA=abc" for headers in self.server.seen_headers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多实例消息租约的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.bilibili import get_at_messages, parse_at_messages
+from src.api.http_session import close_sessions
+from src.core.lease_store import LeaseStore
+from src.core.reply_outbox import ReplyOutbox
+from tests.fake_servers import FakeBilibiliServer, FakeDifyServer, bot_config_patches, run_bot, wait_until
+
+MESSAGE = {"id": 1, "at_time": 100, "item": {"title": "传言"}}
+
+
+class TestLeaseStore(unittest.TestCase):
+    """测试租约的领取、续租、过期和完成"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "coordination.db")
+        self.now = [1000.0]
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def make_store(self, owner, **kwargs):
+        store = LeaseStore(self.path, owner=owner, lease_seconds=60, heartbeat=False,
+                           clock=lambda: self.now[0], **kwargs)
+        self.stores.append(store)
+        return store
+
+    def test_claim_is_exclusive(self):
+        """同一条消息只有一个实例能领取，完成后不能再领取"""
+        a, b = self.make_store("a"), self.make_store("b")
+        self.assertTrue(a.claim(1, MESSAGE))
+        self.assertFalse(b.claim(1, MESSAGE))
+        self.assertTrue(a.claim(1))
+        self.assertTrue(a.complete(1))
+        self.assertTrue(b.is_done(1))
+        self.now[0] += 3600
+        self.assertFalse(b.claim(1, MESSAGE))
+        self.assertEqual(b.reclaim_expired(), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        """停止续租的租约过期后由其他实例接手，原实例续租时发现已失去租约"""
+        a, b = self.make_store("a"), self.make_store("b")
+        a.claim(1, MESSAGE)
+        self.now[0] += 30
+        self.assertEqual(a.renew(), 1)
+        self.now[0] += 61
+        self.assertEqual(b.reclaim_expired(), [MESSAGE])
+        self.assertEqual(b.reclaim_expired(), [])
+        self.assertEqual(a.renew(), 0)
+        self.assertEqual(a.stats()["lost"], 1)
+        self.assertFalse(a.complete(1))
+        self.assertTrue(b.complete(1))
+
+    def test_release_and_max_claims(self):
+        """放弃的租约可以立即被领取；领取次数过多的消息不再处理"""
+        a, b = self.make_store("a", max_claims=2), self.make_store("b", max_claims=2)
+        a.claim(1, MESSAGE)
+        a.release(1)
+        self.assertTrue(b.claim(1))
+        self.now[0] += 61
+        self.assertEqual(a.reclaim_expired(), [MESSAGE])
+        self.now[0] += 61
+        self.assertEqual(b.reclaim_expired(), [])
+        self.assertTrue(a.is_done(1))
+
+    def test_concurrent_claims(self):
+        """多个连接同时领取时每条消息只被领取一次"""
+        stores = [self.make_store(f"instance{i}") for i in range(4)]
+        claimed = {store.owner: [] for store in stores}
+
+        def worker(store):
+            for message_id in range(200):
+                if store.claim(message_id, {"id": message_id}):
+                    claimed[store.owner].append(message_id)
+
+        threads = [threading.Thread(target=worker, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        all_claimed = sorted(message_id for ids in claimed.values() for message_id in ids)
+        self.assertEqual(all_claimed, list(range(200)))
+
+    def test_outbox_drops_reply_taken_over(self):
+        """发件箱发送前确认租约，已被其他实例接手的回复不再发送"""
+        a, b = self.make_store("a"), self.make_store("b")
+        a.claim(1, MESSAGE)
+        calls = []
+        outbox = ReplyOutbox(":memory:", send=lambda **kwargs: calls.append(kwargs) or {"code": 0},
+                             claim=a.claim, start=False)
+        outbox.enqueue(1, {"oid": 1, "type_id": 1, "root": 1, "parent": 1}, "回复")
+        self.now[0] += 61
+        b.reclaim_expired()
+        outbox.process_due()
+        self.assertEqual(calls, [])
+        self.assertEqual(outbox.stats()["pending"], 0)
+        outbox.close()
+
+
+class TestInstanceId(unittest.TestCase):
+    """测试实例标识和本实例数据文件的路径"""
+
+    def test_single_instance(self):
+        with patch.dict(bot.SYSTEM_CONFIG, {"COORDINATION_DB": None, "DATA_DIR": "/data"}):
+            self.assertIsNone(bot.instance_id())
+            self.assertEqual(bot.instance_path("reply_outbox.db"), os.path.join("/data", "reply_outbox.db"))
+
+    def test_requires_instance_id(self):
+        """多实例运行时必须配置INSTANCE_ID，重启后文件名不变"""
+        with patch.dict(bot.SYSTEM_CONFIG, {"COORDINATION_DB": "coordination.db", "INSTANCE_ID": None}):
+            with self.assertRaises(ValueError):
+                bot.instance_id()
+        with patch.dict(bot.SYSTEM_CONFIG, {"COORDINATION_DB": "coordination.db", "INSTANCE_ID": "host/a",
+                                            "DATA_DIR": "/data"}):
+            self.assertEqual(bot.instance_path("reply_outbox.db"), os.path.join("/data", "reply_outbox_host_a.db"))
+
+
+class TestBotWithLeases(unittest.TestCase):
+    """测试机器人主循环使用共享租约"""
+
+    def setUp(self):
+        self.bilibili = FakeBilibiliServer().start()
+        self.dify = FakeDifyServer(chunks=2, chunk_interval=0.01).start()
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.coordination = os.path.join(self.data_dir.name, "coordination.db")
+        self.patches = bot_config_patches(self.bilibili, self.dify, self.data_dir.name, system_config={
+            "COORDINATION_DB": self.coordination, "INSTANCE_ID": "main", "LEASE_SECONDS": 1,
+        })
+        for p in self.patches:
+            p.start()
+        close_sessions()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        close_sessions()
+        self.bilibili.close()
+        self.dify.close()
+        self.data_dir.cleanup()
+
+    def test_takes_over_expired_and_skips_claimed(self):
+        """接手已崩溃实例的消息，跳过其他实例正在处理的消息"""
+        orphan_id = self.bilibili.add_mention()
+        orphan = parse_at_messages(get_at_messages(page_size=1))[0]
+        dead = LeaseStore(self.coordination, owner="dead", lease_seconds=0.5, heartbeat=False)
+        dead.claim(orphan_id, orphan)
+        dead.close()
+        alive = LeaseStore(self.coordination, owner="alive", lease_seconds=1)
+
+        try:
+            with run_bot() as runner:
+                taken_id = self.bilibili.add_mention()
+                alive.claim(taken_id, {"id": taken_id})
+                new_id = self.bilibili.add_mention()
+                wait_until(lambda: len(self.bilibili.replies) >= 2)
+                time.sleep(0.5)
+        finally:
+            alive.close()
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(sorted(self.bilibili.replies), sorted([orphan_id, new_id]))
+        self.assertTrue(os.path.exists(os.path.join(self.data_dir.name, "reply_outbox_main.db")))
+        store = LeaseStore(self.coordination, owner="check", heartbeat=False)
+        self.assertTrue(store.is_done(orphan_id))
+        self.assertTrue(store.is_done(new_id))
+        self.assertFalse(store.is_done(taken_id))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
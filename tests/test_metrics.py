@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+运行指标和指标服务的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import json
+import urllib.request
+import urllib.error
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.metrics import (
+    Counter, Gauge, Histogram, Registry, MetricsServer, record_dify_usage,
+    DIFY_TOKENS_TOTAL, DIFY_PRICE_TOTAL
+)
+
+
+class TestMetrics(unittest.TestCase):
+    """指标类型测试"""
+
+    def test_counter_with_labels(self):
+        """带标签的计数器分别累计，且不能减少"""
+        counter = Counter("test_messages_total", "消息数", ["result"])
+        counter.inc("processed")
+        counter.inc("processed", amount=2)
+        counter.inc("failed")
+        self.assertEqual(counter.value("processed"), 3)
+        self.assertEqual(counter.value("deduped"), 0)
+        with self.assertRaises(ValueError):
+            counter.inc("processed", amount=-1)
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+        lines = counter.collect()
+        self.assertIn("# TYPE test_messages_total counter", lines)
+        self.assertIn('test_messages_total{result="failed"} 1', lines)
+        self.assertIn('test_messages_total{result="processed"} 3', lines)
+
+    def test_gauge_track(self):
+        """track在代码块执行期间加1"""
+        gauge = Gauge("test_inflight", "进行中的请求数")
+        with gauge.track():
+            self.assertEqual(gauge.value(), 1)
+            with gauge.track():
+                self.assertEqual(gauge.value(), 2)
+        self.assertEqual(gauge.value(), 0)
+        gauge.set(5)
+        self.assertIn("test_inflight 5", gauge.collect())
+
+    def test_histogram_buckets(self):
+        """直方图输出累计的分桶计数、总和与次数"""
+        histogram = Histogram("test_seconds", "耗时", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        lines = histogram.collect()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("test_seconds_count 4", lines)
+        self.assertEqual(histogram.snapshot()["sum"], 4.25)
+
+    def test_label_escaping(self):
+        """标签值中的引号和换行会被转义"""
+        gauge = Gauge("test_escape", "转义", ["name"])
+        gauge.set(1, 'a"b\nc')
+        self.assertIn('test_escape{name="a\\"b\\nc"} 1', gauge.collect())
+
+    def test_record_dify_usage(self):
+        """按metadata.usage累计token数和费用"""
+        prompt = DIFY_TOKENS_TOTAL.value("prompt")
+        price = DIFY_PRICE_TOTAL.value("RMB")
+        record_dify_usage({"prompt_tokens": 120, "completion_tokens": 30, "total_price": "0.0015", "currency": "RMB"})
+        record_dify_usage({"total_price": "无效"})
+        record_dify_usage(None)
+        self.assertEqual(DIFY_TOKENS_TOTAL.value("prompt") - prompt, 120)
+        self.assertAlmostEqual(DIFY_PRICE_TOTAL.value("RMB") - price, 0.0015)
+
+
+class TestMetricsServer(unittest.TestCase):
+    """指标服务测试"""
+
+    def setUp(self):
+        self.registry = Registry()
+        self.depth = self.registry.register(Gauge("test_queue_depth", "队列深度", ["stage"]))
+        self.queued = {"verify": 3}
+        self.registry.add_hook(lambda: self.depth.set(self.queued["verify"], "verify"))
+        self.server = MetricsServer(port=0, registry=self.registry,
+                                    stats=lambda: {"outbox": {"pending": 2}}).start()
+        self.base = f"http://127.0.0.1:{self.server.port}"
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_metrics_endpoint(self):
+        """/metrics在抓取时调用刷新函数"""
+        with urllib.request.urlopen(f"{self.base}/metrics", timeout=5) as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            body = response.read().decode("utf-8")
+        self.assertIn('test_queue_depth{stage="verify"} 3', body)
+
+        self.queued["verify"] = 7
+        with urllib.request.urlopen(f"{self.base}/metrics", timeout=5) as response:
+            self.assertIn('test_queue_depth{stage="verify"} 7', response.read().decode("utf-8"))
+
+    def test_stats_endpoint(self):
+        """/stats返回统计JSON，其他路径返回404"""
+        with urllib.request.urlopen(f"{self.base}/stats", timeout=5) as response:
+            self.assertEqual(json.loads(response.read()), {"outbox": {"pending": 2}})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(f"{self.base}/other", timeout=5)
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分阶段处理流水线的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    """测试流水线功能"""
+
+    def test_stages_in_order(self):
+        """测试任务依次经过所有阶段"""
+        results = {}
+
+        pipeline = Pipeline(name="test")
+        pipeline.add_stage("a", lambda job, deadline: job["trace"].append("a") or True)
+        pipeline.add_stage("b", lambda job, deadline: job["trace"].append("b") or True)
+
+        job = {"trace": []}
+        self.assertTrue(pipeline.submit(1, job, on_done=lambda key, ok: results.update({key: ok})))
+        pipeline.shutdown(wait=True, timeout=5)
+
+        self.assertEqual(job["trace"], ["a", "b"])
+        self.assertEqual(results, {1: True})
+        self.assertFalse(pipeline.is_pending(1))
+
+    def test_stage_failure_stops_job(self):
+        """测试某一阶段失败后不再进入后续阶段"""
+        results = {}
+        reached = []
+
+        pipeline = Pipeline(name="test")
+        pipeline.add_stage("a", lambda job, deadline: False)
+        pipeline.add_stage("b", lambda job, deadline: reached.append(job) or True)
+
+        pipeline.submit(1, {}, on_done=lambda key, ok: results.update({key: ok}))
+        pipeline.shutdown(wait=True, timeout=5)
+
+        self.assertEqual(reached, [])
+        self.assertEqual(results, {1: False})
+
+    def test_slow_stage_does_not_block_earlier_stage(self):
+        """测试慢阶段积压时前一阶段继续处理，并可通过stats观察队列深度"""
+        release = threading.Event()
+        first_stage_done = threading.Semaphore(0)
+
+        def first(job, deadline):
+            first_stage_done.release()
+            return True
+
+        pipeline = Pipeline(name="test")
+        pipeline.add_stage("fast", first, workers=1, queue_size=10)
+        pipeline.add_stage("slow", lambda job, deadline: release.wait(5), workers=1, queue_size=10)
+
+        for key in range(3):
+            pipeline.submit(key, {})
+        for _ in range(3):
+            self.assertTrue(first_stage_done.acquire(timeout=5))
+        for _ in range(100):
+            if pipeline.stats()["slow"]["pending"] == 3:
+                break
+            time.sleep(0.02)
+
+        stats = pipeline.stats()
+        self.assertEqual(stats["slow"]["pending"], 3)
+        self.assertEqual(stats["fast"]["pending"], 0)
+
+        release.set()
+        pipeline.shutdown(wait=True, timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
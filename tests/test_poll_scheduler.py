@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自适应轮询间隔的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.poll_scheduler import AdaptivePollScheduler
+
+
+class TestAdaptivePollScheduler(unittest.TestCase):
+    """测试轮询间隔的调整"""
+
+    def setUp(self):
+        self.scheduler = AdaptivePollScheduler(min_interval=3, max_interval=60, initial_interval=10,
+                                               hot_window=120, risk_backoff=300)
+
+    def test_idle_backs_off_to_max(self):
+        """测试空闲时放慢到最大间隔"""
+        self.assertEqual(self.scheduler.record_poll(0, now=0), 60)
+        self.assertEqual(self.scheduler.record_poll(0, now=60), 60)
+
+    def test_arrival_speeds_up(self):
+        """测试收到新@后立即加快，热度过后逐渐放慢"""
+        now = 0
+        self.scheduler.record_poll(0, now=now)
+        now += 60
+        self.assertEqual(self.scheduler.record_poll(2, now=now), 3)
+        now += 3
+        self.assertEqual(self.scheduler.record_poll(0, now=now), 3)
+
+        intervals = []
+        while now < 3600:
+            interval = self.scheduler.record_poll(0, now=now)
+            intervals.append(interval)
+            now += interval
+        self.assertGreater(intervals[-1], 3)
+        self.assertEqual(intervals, sorted(intervals))
+
+    def test_errors_back_off(self):
+        """测试出错时间隔翻倍，风控错误码直接退避"""
+        self.assertEqual(self.scheduler.record_error(now=0), 20)
+        self.assertEqual(self.scheduler.record_error(now=20), 40)
+        self.assertEqual(self.scheduler.record_error(now=60), 60)
+        self.assertEqual(self.scheduler.record_error(-412, now=120), 300)
+        self.assertEqual(self.scheduler.consecutive_errors, 4)
+
+        self.scheduler.record_poll(0, now=420)
+        self.assertEqual(self.scheduler.consecutive_errors, 0)
+
+
+class TestPollRequestCount(unittest.TestCase):
+    """测试默认配置下的请求次数不多于固定10秒轮询"""
+
+    BASELINE_INTERVAL = 10
+
+    def simulate(self, scheduler, arrivals, duration):
+        """按scheduler给出的间隔轮询duration秒，返回每次轮询的时间"""
+        polls = []
+        now, last = 0.0, -1.0
+        while now < duration:
+            polls.append(now)
+            new_count = sum(1 for at in arrivals if last < at <= now)
+            last = now
+            now += scheduler.record_poll(new_count, now=now)
+        return polls
+
+    def test_bursty_trace_not_above_baseline(self):
+        """突发的@期间和整体的请求次数都不多于固定间隔轮询"""
+        bursts = [300, 1500, 1560, 2900]
+        arrivals = [start + offset for start in bursts for offset in range(0, 20, 2)]
+        duration = 3600
+        polls = self.simulate(AdaptivePollScheduler(), arrivals, duration)
+        baseline = duration / self.BASELINE_INTERVAL
+        self.assertLessEqual(len(polls), baseline)
+        for start in bursts:
+            in_window = [t for t in polls if start <= t < start + 120]
+            self.assertLessEqual(len(in_window), 120 / self.BASELINE_INTERVAL + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@消息优先级和新鲜度时限的单元测试
+使用unittest框架进行测试
+"""
+
+import logging
+import time
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.core.dedupe_store import ProcessedMessageStore
+from src.core.priority import MentionPrioritizer, STALE_DOWNGRADE
+from tests.fake_servers import wait_until
+
+NOW = 1760000000.0
+
+
+def mention(age, subject_id=1):
+    return {"id": int(age), "at_time": int(NOW - age), "item": {"subject_id": subject_id, "title": "传言"}}
+
+
+class TestMentionPrioritizer(unittest.TestCase):
+    """测试优先级计算"""
+
+    def setUp(self):
+        self.now = [NOW]
+
+    def make(self, **kwargs):
+        kwargs.setdefault("freshness", 1800)
+        return MentionPrioritizer(hot_weight=60, hot_window=600, cached_weight=600,
+                                  clock=lambda: self.now[0], **kwargs)
+
+    def test_fresh_first(self):
+        """新被@的消息优先"""
+        prioritizer = self.make()
+        self.assertGreater(prioritizer.score(mention(10)), prioritizer.score(mention(100)))
+
+    def test_hot_subject_and_cached(self):
+        """同一评论区被@多次、已有缓存结果的消息可以排在稍新的消息之前"""
+        prioritizer = self.make()
+        for _ in range(3):
+            prioritizer.observe(mention(200, subject_id=2))
+        prioritizer.observe(mention(100, subject_id=3))
+        self.assertEqual(prioritizer.heat(2), 3)
+        self.assertGreater(prioritizer.score(mention(200, subject_id=2)), prioritizer.score(mention(100, subject_id=3)))
+        self.assertGreater(prioritizer.score(mention(500), cached=True), prioritizer.score(mention(100)))
+
+        self.now[0] += 601
+        self.assertEqual(prioritizer.heat(2), 0)
+        self.assertEqual(prioritizer.stats()["subjects"], 0)
+
+    def test_drop_deadline(self):
+        """放弃过期消息时处理时限不超过新鲜度时限"""
+        prioritizer = self.make()
+        self.assertTrue(prioritizer.is_stale(mention(1801)))
+        self.assertFalse(prioritizer.is_stale(mention(1000)))
+        self.assertEqual(prioritizer.deadline(mention(1000), NOW + 900), NOW + 800)
+        self.assertEqual(prioritizer.deadline(mention(10), NOW + 900), NOW + 900)
+
+    def test_downgrade(self):
+        """降级的过期消息排在所有未过期消息之后，处理时限不变"""
+        prioritizer = self.make(stale_policy=STALE_DOWNGRADE)
+        self.assertLess(prioritizer.score(mention(1801), cached=True), prioritizer.score(mention(1799)))
+        self.assertEqual(prioritizer.deadline(mention(1801), NOW + 900), NOW + 900)
+        self.assertEqual(prioritizer.stats()["downgraded"], 1)
+
+    def test_no_freshness_limit(self):
+        prioritizer = self.make(freshness=None)
+        self.assertFalse(prioritizer.is_stale(mention(86400)))
+        self.assertEqual(prioritizer.deadline(mention(86400), NOW + 900), NOW + 900)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            MentionPrioritizer(stale_policy="ignore")
+
+
+class TestStaleInPipeline(unittest.TestCase):
+    """测试在流水线中排队时超过新鲜度时限的消息"""
+
+    def test_expired_while_queued_is_stale(self):
+        """排队期间超过新鲜度时限而被放弃的消息计为stale，未过期的失败消息仍计为failed"""
+        store = ProcessedMessageStore(":memory:")
+        results = {}
+        with patch.dict(bot.BILIBILI_CONFIG, {"FRESHNESS_DEADLINE": 60, "STALE_POLICY": "drop"}), \
+                patch.dict(bot.DIFY_CONFIG, {"TRIAGE_ENABLED": False}), \
+                patch.object(bot, "resolve_reply_target", side_effect=lambda *args: time.sleep(0.5) or {"oid": 1}):
+            dispatcher = bot.build_dispatcher(None, logging.getLogger("test"), store,
+                                              on_finished=results.__setitem__)
+            dispatcher.dispatch({"id": 1, "at_time": time.time() - 59.7, "item": {"title": "听说喝咖啡会致癌"}})
+            wait_until(lambda: 1 in results)
+            dispatcher.pipeline.shutdown()
+        dispatcher.on_message_done(2, False, job={"message": {"id": 2, "at_time": time.time(), "item": {}}})
+        store.close()
+        self.assertEqual(results, {1: "stale", 2: "failed"})
+        self.assertEqual(dispatcher.prioritizer.stats()["dropped"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流量录制和回放的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import glob
+import json
+import tempfile
+import time
+from unittest.mock import patch
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+import bot
+from src.api.dify import DifyAPI
+from src.core import recorder
+from src.core.deadline import configure_clock
+from src.core.endpoint_pool import EndpointPool, STATE_HEALTHY
+from src.core.recorder import TrafficRecorder, read_archive
+from src.core.replay import ReplayDifyAPI, VirtualClock, extract_mentions
+from tools.replay import replay
+
+START = 1760000000.0
+
+
+def poll_record(ts, *items):
+    """构造一条录制的轮询响应，items为 (消息ID, @时间, 标题)，按从新到旧排列"""
+    return {
+        "kind": recorder.KIND_POLL,
+        "ts": ts,
+        "response": {"code": 0, "message": "0", "data": {"items": [
+            {"id": message_id, "at_time": at_time, "user": {"mid": 1, "nickname": "用户"},
+             "item": {"type": "reply", "title": title, "subject_id": 100, "source_id": message_id,
+                      "target_id": message_id}}
+            for message_id, at_time, title in items
+        ]}},
+    }
+
+
+def dify_record(ts, query, answer):
+    return {
+        "kind": recorder.KIND_DIFY,
+        "ts": ts,
+        "query": query,
+        "events": [[0.5, {"event": "message", "answer": answer[:2]}],
+                   [1.0, {"event": "message", "answer": answer[2:]}],
+                   [1.5, {"event": "message_end", "metadata": {"usage": {"total_tokens": 10}}}]],
+    }
+
+
+RECORDS = [
+    poll_record(START, (1, int(START) - 100, "启动前的消息")),
+    poll_record(START + 10, (3, int(START) + 9, "传言二"), (2, int(START) + 5, "传言一"), (1, int(START) - 100, "启动前的消息")),
+    dify_record(START + 11, "传言一", "传言一是假的"),
+    dify_record(START + 11, "传言二", "传言二是真的"),
+    poll_record(START + 20, (3, int(START) + 9, "传言二"), (2, int(START) + 5, "传言一")),
+]
+
+
+class TestTrafficRecorder(unittest.TestCase):
+    """测试流量归档"""
+
+    def test_rotation_and_read(self):
+        """超过大小上限后换下一个文件，读取时合并并按时间排序"""
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TrafficRecorder(tmp, max_bytes=200, flush_interval=0.01)
+            recorder.configure(writer)
+            try:
+                for i in range(20):
+                    recorder.record(recorder.KIND_POLL, response={"code": 0, "data": {"items": [], "n": i}})
+                    time.sleep(0.005)
+            finally:
+                recorder.configure(None)
+                writer.close()
+            recorder.record(recorder.KIND_POLL, response={})
+
+            paths = sorted(glob.glob(os.path.join(tmp, "traffic_*.jsonl.gz")))
+            self.assertGreater(len(paths), 1)
+            records = read_archive(paths)
+            self.assertEqual([record["response"]["data"]["n"] for record in records], list(range(20)))
+
+    def test_read_truncated_archive(self):
+        """最后一个gzip成员不完整时保留已读出的记录"""
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TrafficRecorder(tmp)
+            writer.emit({"kind": "poll", "ts": START, "response": {}})
+            writer.close()
+            path = glob.glob(os.path.join(tmp, "*.gz"))[0]
+            with open(path, "ab") as f:
+                f.write(b"\x1f\x8b\x08\x00broken")
+            self.assertEqual(len(read_archive([path])), 1)
+
+
+class VirtualStreamResponse:
+    """每段回答之间经过1秒虚拟时间的流式响应"""
+
+    def __init__(self, clock, answers):
+        self.clock = clock
+        self.answers = answers
+        self.closed = False
+
+    def iter_lines(self):
+        for answer in self.answers:
+            self.clock.sleep(1)
+            yield f"data: {json.dumps({'event': 'message', 'answer': answer})}".encode("utf-8")
+        yield b'data: {"event": "message_end", "metadata": {}}'
+
+    def close(self):
+        self.closed = True
+
+
+class VirtualStreamClient(DifyAPI):
+    """返回VirtualStreamResponse的Dify客户端，读取仍走DifyAPI.read_stream"""
+
+    def __init__(self, clock, api_url, api_key):
+        super().__init__(api_url, api_key)
+        self.clock = clock
+
+    def send_chat_message(self, **kwargs):
+        return {"status": "streaming", "response": VirtualStreamResponse(self.clock, ["一", "二", "三", "四", "五"])}
+
+
+class TestReplay(unittest.TestCase):
+    """测试回放"""
+
+    def test_extract_mentions(self):
+        """启动前已有的消息不回放，每条消息只取第一次被拉取的时间"""
+        mentions = extract_mentions(RECORDS)
+        self.assertEqual([(ts, message["id"]) for ts, message in mentions], [(START + 10, 2), (START + 10, 3)])
+
+    def test_replay_dify_stream(self):
+        """按倍速重放Dify事件，没有录制的查询返回错误"""
+        clock = VirtualClock(start=START, speed=100)
+        dify = ReplayDifyAPI(RECORDS, clock)
+        response = dify.send_chat_message(query="传言一")
+        started = time.monotonic()
+        result = dify.read_stream(response["response"], max_chars=100)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(result["answer"], "传言一是假的")
+        self.assertEqual(result["usage"], {"total_tokens": 10})
+        self.assertIn("error", dify.send_chat_message(query="没有录制"))
+        self.assertEqual(dify.missing, 1)
+
+    def test_replay_stream_deadline(self):
+        """截止时间按虚拟时钟计算，到达后停止读取"""
+        clock = VirtualClock(start=START, speed=100)
+        dify = ReplayDifyAPI(RECORDS, clock)
+        response = dify.send_chat_message(query="传言一")
+        result = dify.read_stream(response["response"], deadline=clock.time() + 0.8)
+        self.assertEqual(result["error"], "超过处理截止时间")
+        self.assertTrue(result["timeout"])
+        self.assertEqual(result["answer"], "传言")
+
+    def test_dify_client_deadline_on_virtual_clock(self):
+        """DifyAPI和服务池按配置的虚拟时钟判断流式响应的截止时间，停止读取不计入服务失败"""
+        clock = VirtualClock(start=START, speed=100)
+        configure_clock(clock.time)
+        try:
+            pool = EndpointPool([{"NAME": "replay", "API_URL": "http://replay/v1", "API_KEY": "key"}], eject_after=1,
+                                client_factory=lambda url, key: VirtualStreamClient(clock, url, key))
+            response = pool.send_chat_message(query="传言一")
+            result = pool.read_stream(response["response"], deadline=clock.time() + 2.5)
+        finally:
+            configure_clock(None)
+        self.assertEqual(result["answer"], "一二三")
+        self.assertEqual(result["error"], "超过处理截止时间")
+        self.assertTrue(result["timeout"])
+        self.assertTrue(response["response"].closed)
+        stats = pool.stats()["replay"]
+        self.assertEqual((stats["state"], stats["ok"], stats["failed"]), (STATE_HEALTHY, 0, 0))
+
+    def test_replay_pipeline(self):
+        """回放的消息经过流水线得到录制的回答"""
+        result = replay(RECORDS, speed=100, drain=10)
+        self.assertEqual(result["mentions"], 2)
+        self.assertEqual(result["replies"], 2)
+        self.assertEqual(result["dify_calls"], 2)
+        self.assertEqual(result["dify_missing"], 0)
+        self.assertGreaterEqual(result["latency"]["max"], 1.5)
+
+    def test_replay_uses_bot_wiring(self):
+        """回放与线上使用相同的本地分流，处理时限按虚拟时钟计算"""
+        slow = dify_record(START + 11, "传言二", "传言二是真的")
+        slow["events"][-1][0] = 10
+        records = [
+            poll_record(START),
+            poll_record(START + 10, (3, int(START) + 9, "加微信领取福利资料"), (2, int(START) + 5, "传言二")),
+            slow,
+        ]
+        with patch.dict(bot.DIFY_CONFIG, {"TRIAGE_ENABLED": True}), \
+                patch.dict(bot.BILIBILI_CONFIG, {"MESSAGE_DEADLINE": 20}):
+            result = replay(records, speed=100, drain=10)
+        self.assertEqual(result["skipped"], 1)
+        self.assertEqual(result["dify_calls"], 1)
+        # 为发送回复预留15秒后只剩5秒虚拟时间，读不到10秒处的message_end
+        self.assertEqual(result["failed"], 1)
+        self.assertEqual(result["replies"], 0)
+
+    def test_replay_runtime_in_memory(self):
+        """回放使用bot.build_runtime创建的组件，不在数据目录中留下任何文件"""
+        records = [poll_record(START), poll_record(START + 1, (1, int(START), "传言一")),
+                   dify_record(START + 2, "传言一", "传言一是假的")]
+        with tempfile.TemporaryDirectory() as data_dir, \
+                patch.dict(bot.SYSTEM_CONFIG, {"DATA_DIR": data_dir, "TRACE_ENABLED": True}), \
+                patch("bot.build_runtime", wraps=bot.build_runtime) as build_runtime:
+            result = replay(records, speed=100, drain=10)
+            self.assertEqual(os.listdir(data_dir), [])
+        self.assertEqual(result["replies"], 1)
+        build_runtime.assert_called_once()
+        self.assertFalse(build_runtime.call_args.kwargs["persistent"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复发件箱和令牌桶的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import sqlite3
+import tempfile
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.metrics import END_TO_END_SECONDS
+from src.core.rate_limiter import TokenBucket
+from src.core.reply_outbox import (
+    ReplyOutbox, classify_reply_result, backoff_delay,
+    REPLY_OK, REPLY_RETRY, REPLY_RATE_LIMITED, REPLY_SWITCH_TYPE, REPLY_FATAL
+)
+
+TARGET = {"oid": 1, "type_id": 1, "root": 2, "parent": 3}
+
+
+class FakeSender:
+    """按顺序返回预设错误码的发送函数"""
+
+    def __init__(self, *codes):
+        self.codes = list(codes)
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        code = self.codes.pop(0) if self.codes else 0
+        if isinstance(code, Exception):
+            raise code
+        return {"code": code, "message": "", "data": {"rpid": 1}}
+
+
+class TestTokenBucket(unittest.TestCase):
+    """测试令牌桶"""
+
+    def test_rate_and_pause(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 1.0)
+        now[0] = 1.0
+        self.assertEqual(bucket.try_acquire(), 0)
+        bucket.pause(10)
+        self.assertAlmostEqual(bucket.try_acquire(), 10.0)
+        now[0] = 12.0
+        self.assertEqual(bucket.try_acquire(), 0)
+
+
+class TestReplyOutbox(unittest.TestCase):
+    """测试回复发件箱"""
+
+    def make_outbox(self, sender, path=":memory:", **kwargs):
+        kwargs.setdefault("bucket", TokenBucket(rate=1000, capacity=100))
+        results = []
+        outbox = ReplyOutbox(path, send=sender, base_delay=10, max_delay=100, start=False,
+                             on_result=lambda message_id, success: results.append((message_id, success)), **kwargs)
+        return outbox, results
+
+    def test_classify(self):
+        """测试错误码分类"""
+        self.assertEqual(classify_reply_result(0), REPLY_OK)
+        self.assertEqual(classify_reply_result(None), REPLY_RETRY)
+        self.assertEqual(classify_reply_result(12002, 1), REPLY_SWITCH_TYPE)
+        self.assertEqual(classify_reply_result(12002, 17), REPLY_FATAL)
+        self.assertEqual(classify_reply_result(-412), REPLY_RATE_LIMITED)
+        self.assertEqual(classify_reply_result(12051), REPLY_FATAL)
+        self.assertEqual(classify_reply_result(-500), REPLY_RETRY)
+        for attempts in range(1, 10):
+            delay = backoff_delay(attempts, 10, 100)
+            self.assertGreaterEqual(delay, min(100, 10 * 2 ** (attempts - 1)) / 2)
+            self.assertLessEqual(delay, 100)
+
+    def test_switch_type_then_backoff(self):
+        """测试换评论区类型后按退避时间重试"""
+        sender = FakeSender(12002, -500, 0)
+        outbox, results = self.make_outbox(sender)
+        self.assertTrue(outbox.enqueue(100, TARGET, "回复"))
+        self.assertFalse(outbox.enqueue(100, TARGET, "回复"))
+        now = time.time()
+
+        self.assertEqual(outbox.process_due(now), 0)
+        self.assertEqual(sender.calls[-1]["type_id"], 1)
+        self.assertEqual(outbox.process_due(now), 0)
+        self.assertEqual(sender.calls[-1]["type_id"], 17)
+
+        wait = outbox.process_due(now)
+        self.assertGreaterEqual(wait, 5)
+        self.assertEqual(outbox.process_due(now + 10), 0)
+        self.assertEqual(results, [(100, True)])
+        self.assertEqual(outbox.stats(), {"pending": 0, "sent": 1, "failed": 0, "retried": 1})
+        outbox.close()
+
+    def test_fatal_and_max_attempts(self):
+        """测试无法恢复的错误和重试次数用完"""
+        sender = FakeSender(12051, ConnectionError("reset"), ConnectionError("reset"))
+        outbox, results = self.make_outbox(sender, max_attempts=2)
+        outbox.enqueue(1, TARGET, "a")
+        outbox.enqueue(2, TARGET, "b")
+        now = time.time()
+        outbox.process_due(now)
+        outbox.process_due(now)
+        outbox.process_due(now + 100)
+        self.assertEqual(results, [(1, False), (2, False)])
+        self.assertEqual(len(sender.calls), 3)
+        outbox.close()
+
+    def test_rate_limited_pauses_bucket(self):
+        """测试风控错误码暂停发送"""
+        outbox, _ = self.make_outbox(FakeSender(-412), risk_backoff=300)
+        outbox.enqueue(1, TARGET, "a")
+        outbox.process_due()
+        self.assertGreater(outbox.bucket.try_acquire(), 200)
+        outbox.close()
+
+    def test_durable_and_background_send(self):
+        """测试重启后继续发送未发送的回复"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "outbox.db")
+            outbox, _ = self.make_outbox(FakeSender(), path)
+            outbox.enqueue(7, TARGET, "持久化")
+            outbox.close()
+
+            sender = FakeSender()
+            outbox = ReplyOutbox(path, send=sender, bucket=TokenBucket(rate=1000, capacity=100))
+            deadline = time.time() + 5
+            while not sender.calls and time.time() < deadline:
+                time.sleep(0.01)
+            outbox.close()
+            self.assertEqual(sender.calls[0]["message"], "持久化")
+            self.assertEqual(outbox.stats()["pending"], 0)
+
+    def test_upgrade_and_end_to_end_latency(self):
+        """测试旧版发件箱补充mentioned_at列，发送成功后记录从@到回复的耗时"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "outbox.db")
+            conn = sqlite3.connect(path)
+            conn.execute(
+                "CREATE TABLE reply_outbox ("
+                "message_id INTEGER PRIMARY KEY, oid INTEGER NOT NULL, type_id INTEGER NOT NULL, "
+                "root INTEGER NOT NULL, parent INTEGER NOT NULL, content TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, "
+                "last_error TEXT)"
+            )
+            conn.close()
+
+            outbox, results = self.make_outbox(FakeSender(), path)
+            before = END_TO_END_SECONDS.snapshot()
+            outbox.enqueue(8, TARGET, "a", mentioned_at=time.time() - 30)
+            outbox.process_due()
+            outbox.close()
+            after = END_TO_END_SECONDS.snapshot()
+            self.assertEqual(results, [(8, True)])
+            self.assertEqual(after["count"] - before["count"], 1)
+            self.assertGreaterEqual(after["sum"] - before["sum"], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
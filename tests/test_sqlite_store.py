@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SQLite存储公共部分的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.sqlite_store import SQLiteStore
+
+
+class TestSQLiteStore(unittest.TestCase):
+    """测试连接、事务和关闭"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_creates_directory_with_wal(self):
+        """数据库所在目录不存在时自动创建，使用WAL日志"""
+        path = os.path.join(self.tmp_dir.name, "sub", "store.db")
+        store = SQLiteStore(path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(store._conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        store.close()
+
+    def test_transaction_rollback(self):
+        """事务中抛出异常时回滚全部写入，正常退出时提交"""
+        store = SQLiteStore(":memory:")
+        store._conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+        with self.assertRaises(RuntimeError):
+            with store._lock, store._transaction() as conn:
+                conn.execute("INSERT INTO items (id) VALUES (1)")
+                raise RuntimeError("boom")
+        with store._lock, store._transaction(immediate=True) as conn:
+            conn.executemany("INSERT INTO items (id) VALUES (?)", [(2,), (3,)])
+        self.assertEqual([row[0] for row in store._conn.execute("SELECT id FROM items ORDER BY id")], [2, 3])
+        store.close()
+
+    def test_without_path(self):
+        """path为None时不打开数据库，close可以重复调用"""
+        store = SQLiteStore(None)
+        self.assertIsNone(store._conn)
+        store.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
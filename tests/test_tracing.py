@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+处理时间线和汇总工具的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import json
+import glob
+import tempfile
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core import tracing
+from src.core.tracing import Trace, TraceWriter, trace_span
+from tools.trace_report import collect, percentile, read_records, summarize
+
+
+class TestTrace(unittest.TestCase):
+    """测试时间线记录"""
+
+    def test_nested_spans(self):
+        """嵌套的span带有parent，异常会记录在span中"""
+        trace = Trace(42, mentioned_at=1)
+        with trace.span("verify") as span:
+            span["ok"] = True
+            with trace.span("dify_stream"):
+                pass
+        with self.assertRaises(ValueError):
+            with trace.span("post"):
+                raise ValueError("失败")
+
+        record = trace.to_record(False)
+        self.assertEqual(record["message_id"], 42)
+        self.assertEqual(len(record["trace"]), 16)
+        self.assertGreater(record["lag"], 0)
+        names = [(span["name"], span.get("parent")) for span in record["spans"]]
+        self.assertEqual(names, [("verify", None), ("dify_stream", "verify"), ("post", None)])
+        self.assertTrue(record["spans"][0]["ok"])
+        self.assertEqual(record["spans"][2]["error"], "ValueError")
+
+    def test_trace_span_without_trace(self):
+        """没有时间线时trace_span不做任何事"""
+        with trace_span(None, "resolve") as span:
+            span["ok"] = True
+
+    def test_writer(self):
+        """后台线程写入紧凑的JSONL，关闭前写完队列中的记录"""
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TraceWriter(tmp, flush_interval=0.05)
+            tracing.configure(writer)
+            try:
+                trace = Trace(1)
+                with trace.span("resolve"):
+                    pass
+                tracing.finish(trace, True)
+                tracing.emit({"kind": tracing.KIND_POLL, "ts": trace.started_at, "dur": 0.1, "gap": 5})
+            finally:
+                tracing.configure(None)
+                writer.close()
+            tracing.emit({"kind": tracing.KIND_POLL})
+
+            paths = glob.glob(os.path.join(tmp, "trace_*.jsonl"))
+            self.assertEqual(len(paths), 1)
+            with open(paths[0], "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertNotIn(", ", lines[0])
+            self.assertEqual(json.loads(lines[0])["spans"][0]["name"], "resolve")
+            self.assertEqual(writer.stats(), {"written": 2, "dropped": 0, "queued": 0})
+
+
+class TestTraceReport(unittest.TestCase):
+    """测试时间线汇总"""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 90), 3)
+
+    def test_collect_waits(self):
+        """顶层span之间的空档记为排队时间，嵌套span不参与计算"""
+        records = [
+            {"kind": "message", "ok": True, "dur": 5.0, "lag": 2.0, "spans": [
+                {"name": "resolve", "start": 0.5, "dur": 0.5},
+                {"name": "verify", "start": 2.0, "dur": 2.5},
+                {"name": "dify_stream", "start": 2.1, "dur": 2.0, "parent": "verify"},
+                {"name": "post", "start": 4.5, "dur": 0.5},
+            ]},
+            {"kind": "poll", "dur": 0.2, "gap": 10},
+            {"kind": "reply", "result": "retry", "wait": 1.0, "dur": 0.3},
+        ]
+        samples = collect(records)
+        self.assertEqual(samples["resolve.wait"], [0.5])
+        self.assertEqual(samples["verify.wait"], [1.0])
+        self.assertEqual(samples["post.wait"], [0.0])
+        self.assertNotIn("dify_stream.wait", samples)
+        self.assertEqual(samples["poll.gap"], [10])
+        self.assertEqual(samples["outbox.reply_post"], [0.3])
+
+        failed = collect(records, failed_only=True)
+        self.assertNotIn("message.total", failed)
+        self.assertEqual(failed["outbox.wait"], [1.0])
+
+        rows = summarize(samples)
+        self.assertEqual(rows[0]["stage"], "poll.gap")
+
+    def test_read_records_skips_broken_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace_20260101.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('{"kind":"poll","dur":0.1}\n\n{"kind":"po')
+            self.assertEqual(list(read_records([path])), [{"kind": "poll", "dur": 0.1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
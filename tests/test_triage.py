@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地分流的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.api.http_session import close_sessions
+from src.core.triage import (
+    NaiveBayesClassifier, Triage, TRIAGE_ESCALATE, TRIAGE_SKIP, TRIAGE_TEMPLATE, text_features
+)
+from tests.fake_servers import FakeBilibiliServer, FakeDifyServer, bot_config_patches, run_bot, wait_until
+from tools.triage_eval import evaluate, predict
+
+
+def mention(title, content="@FakeDetection 帮忙看看"):
+    return {"id": 1, "item": {"title": title, "source_content": content}}
+
+
+# 规则不处理的消息，只能由分类器判断
+SAMPLES = [
+    ({"title": "今天去公园散步拍了好多照片", "content": ""}, TRIAGE_TEMPLATE),
+    ({"title": "今天做了一顿好吃的晚饭", "content": ""}, TRIAGE_TEMPLATE),
+    ({"title": "今天的照片好看吗大家", "content": ""}, TRIAGE_TEMPLATE),
+    ({"title": "吃鸡蛋会让胆固醇升高", "content": ""}, TRIAGE_ESCALATE),
+    ({"title": "喝咖啡会让人脱水", "content": ""}, TRIAGE_ESCALATE),
+    ({"title": "吃香蕉会让血糖升高", "content": ""}, TRIAGE_ESCALATE),
+]
+
+
+def train_samples():
+    return [(text_features(sample["title"], sample["content"]), label) for sample, label in SAMPLES]
+
+
+class TestTriageRules(unittest.TestCase):
+    """测试规则分流"""
+
+    def setUp(self):
+        self.triage = Triage()
+
+    def test_skip(self):
+        """空标题、只有表情和广告不回复"""
+        self.assertEqual(self.triage.classify(mention("")).reason, "empty")
+        self.assertEqual(self.triage.classify(mention("[doge][doge]！")).reason, "no_text")
+        for title in ("加微信领取福利资料", "想赚钱的看过来 vx: abc123456", "QQ群 12345678 每天分享"):
+            result = self.triage.classify(mention(title))
+            self.assertEqual(result, (TRIAGE_SKIP, "spam", ""), title)
+
+    def test_rumours_with_ad_words_or_links(self):
+        """带站外链接或“兼职”“返利”等词的传言不按广告处理，交给Dify"""
+        for title in ("新华社报道 https://www.news.cn/2026/a.html 称明年起延迟退休",
+                      "网传https://weibo.com/123 某地发生爆炸",
+                      "兼职打工人的工资被拖欠属实吗，官方回应了",
+                      "返利网的活动是骗局"):
+            self.assertEqual(self.triage.classify(mention(title)).decision, TRIAGE_ESCALATE, title)
+        result = self.triage.classify(mention("这个视频里的新闻是真的吗", "@FakeDetection 看 https://example.com/a"))
+        self.assertEqual(result, (TRIAGE_ESCALATE, "link", ""))
+
+    def test_template(self):
+        """打招呼、太短和开放式提问回复模板"""
+        for title, reason in (("你好", "chitchat"), ("哈哈哈哈", "chitchat"), ("短片", "too_short"),
+                              ("这个视频讲的是什么？", "question")):
+            result = self.triage.classify(mention(title))
+            self.assertEqual(result.decision, TRIAGE_TEMPLATE, title)
+            self.assertEqual(result.reason, reason, title)
+            self.assertTrue(result.reply)
+
+    def test_escalate(self):
+        """有说法线索或规则不确定时交给Dify"""
+        for title in ("听说喝咖啡会致癌", "网传", "吃鸡蛋真的会让胆固醇升高吗", "今天的视频拍得很好看"):
+            self.assertEqual(self.triage.classify(mention(title)).decision, TRIAGE_ESCALATE, title)
+        self.assertEqual(self.triage.stats(), {TRIAGE_SKIP: 0, TRIAGE_TEMPLATE: 0, TRIAGE_ESCALATE: 4})
+
+    def test_short_claims(self):
+        """五六个字的说法照常核查，不按太短处理"""
+        for title in ("地球是平的", "月球上有水", "特朗普死了", "盐能杀毒"):
+            self.assertEqual(self.triage.classify(mention(title)).decision, TRIAGE_ESCALATE, title)
+
+    def test_custom_template(self):
+        triage = Triage(templates={"chitchat": "你好呀"})
+        self.assertEqual(triage.classify(mention("你好")).reply, "你好呀")
+
+
+class TestClassifier(unittest.TestCase):
+    """测试朴素贝叶斯分类器"""
+
+    def test_predict_and_round_trip(self):
+        model = NaiveBayesClassifier().train(train_samples())
+        label, probability = model.predict(text_features("今天去公园拍了照片"))
+        self.assertEqual(label, TRIAGE_TEMPLATE)
+        self.assertGreater(probability, 0.5)
+        self.assertEqual(NaiveBayesClassifier().predict(["a"]), (None, 0.0))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.json")
+            model.save(path)
+            loaded = NaiveBayesClassifier.load(path)
+        features = text_features("吃鸡蛋会让血压升高")
+        self.assertEqual(loaded.predict(features), model.predict(features))
+
+    def test_threshold(self):
+        """分类器只在规则未命中且足够确定时生效"""
+        model = NaiveBayesClassifier().train(train_samples())
+        result = Triage(classifier=model, threshold=0.5).classify(mention("今天去公园拍了照片"))
+        self.assertEqual(result, (TRIAGE_TEMPLATE, "classifier", result.reply))
+        self.assertTrue(result.reply)
+        self.assertEqual(Triage(classifier=model, threshold=1.0).classify(mention("今天去公园拍了照片")).decision,
+                         TRIAGE_ESCALATE)
+        self.assertEqual(Triage(classifier=model, threshold=0.5).classify(mention("听说今天去公园拍了照片")).decision,
+                         TRIAGE_ESCALATE)
+
+
+class TestEvaluate(unittest.TestCase):
+    """测试标注语料上的评估"""
+
+    def test_metrics(self):
+        samples = [{"title": "", "label": TRIAGE_SKIP},
+                   {"title": "你好", "label": TRIAGE_TEMPLATE},
+                   {"title": "听说喝咖啡会致癌", "label": TRIAGE_ESCALATE},
+                   {"title": "短片", "label": TRIAGE_ESCALATE}]
+        result = evaluate(samples, predict(samples))
+        self.assertEqual(result["samples"], 4)
+        self.assertEqual(result["accuracy"], 0.75)
+        self.assertEqual(result["missed_claims"], 1)
+        self.assertEqual(result["dify_saved"], 0.75)
+        self.assertEqual(result["classes"][TRIAGE_TEMPLATE]["precision"], 0.5)
+        self.assertEqual(result["classes"][TRIAGE_ESCALATE]["recall"], 0.5)
+        self.assertEqual(result["confusion"][TRIAGE_ESCALATE][TRIAGE_TEMPLATE], 1)
+
+    def test_cross_validation(self):
+        samples = [dict(sample, label=label) for sample, label in SAMPLES]
+        predictions = predict(samples, folds=3, threshold=0.5)
+        self.assertEqual(len(predictions), len(samples))
+        self.assertNotIn("", predictions)
+
+
+class TestBotWithTriage(unittest.TestCase):
+    """测试机器人主循环中的本地分流"""
+
+    def setUp(self):
+        self.bilibili = FakeBilibiliServer().start()
+        self.dify = FakeDifyServer(chunks=2, chunk_interval=0.01).start()
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.patches = bot_config_patches(self.bilibili, self.dify, self.data_dir.name, dify_config={
+            "TRIAGE_ENABLED": True, "TRIAGE_TEMPLATES": {"chitchat": "你好呀"},
+        })
+        for p in self.patches:
+            p.start()
+        close_sessions()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        close_sessions()
+        self.bilibili.close()
+        self.dify.close()
+        self.data_dir.cleanup()
+
+    def test_skip_and_template_without_dify(self):
+        """垃圾消息不回复，打招呼回复模板，只有可核查的消息调用Dify"""
+        with run_bot() as runner:
+            chitchat = self.bilibili.add_mention(title="你好")
+            spam = self.bilibili.add_mention(title="加微信领取福利资料")
+            claim = self.bilibili.add_mention(title="听说喝咖啡会致癌")
+            wait_until(lambda: len(self.bilibili.replies) >= 2)
+            time.sleep(0.5)
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(sorted(self.bilibili.replies), [chitchat, claim])
+        self.assertNotIn(spam, self.bilibili.replies)
+        self.assertEqual(self.bilibili.replies[chitchat]["message"], "你好呀")
+        self.assertEqual(self.dify.requests.get("/v1/chat-messages"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
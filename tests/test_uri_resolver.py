@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@消息链接解析的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import logging
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.uri_resolver import UriTarget, resolve_uri, TYPE_VIDEO, TYPE_ARTICLE, TYPE_DYNAMIC
+
+
+class TestUriResolver(unittest.TestCase):
+    """测试链接解析功能"""
+
+    def test_native_uri(self):
+        """测试客户端链接直接带有oid和评论ID"""
+        self.assertEqual(
+            resolve_uri("bilibili://video/800218604?page=0&comment_root_id=3690519331&comment_secondary_id=3744454471"),
+            UriTarget(800218604, TYPE_VIDEO, 3690519331, 3744454471)
+        )
+        self.assertEqual(
+            resolve_uri("bilibili://following/detail/279422751143337068"),
+            UriTarget(279422751143337068, TYPE_DYNAMIC, 0, 0)
+        )
+        # 只有根评论时，父评论就是根评论
+        self.assertEqual(resolve_uri("bilibili://video/1?comment_root_id=5").parent, 5)
+
+    def test_web_uri(self):
+        """测试网页链接的各种格式"""
+        cases = {
+            "https://www.bilibili.com/video/BV1Xb5LzUEqa": (114477504664240, TYPE_VIDEO),
+            "https://www.bilibili.com/video/BV1hcVPzLEm3?subject_id=1&page=0": (1, TYPE_VIDEO),
+            "https://www.bilibili.com/video/av114450023": (114450023, TYPE_VIDEO),
+            "https://www.bilibili.com/video/114450023": (114450023, TYPE_VIDEO),
+            "https://t.bilibili.com/123456?oid=114450023": (123456, TYPE_DYNAMIC),
+            "https://www.bilibili.com/read/cv12345": (12345, TYPE_ARTICLE),
+            "https://www.bilibili.com/?business_id=7": (7, 0),
+        }
+        for uri, (oid, type_id) in cases.items():
+            target = resolve_uri(uri)
+            self.assertEqual((target.oid, target.type_id), (oid, type_id), uri)
+
+    def test_unknown(self):
+        """测试无法识别的链接"""
+        self.assertEqual(resolve_uri(""), UriTarget(0, 0, 0, 0))
+        self.assertEqual(resolve_uri("https://www.bilibili.com/video/BV1Xb5LzUEq0").oid, 0)
+
+    def test_resolve_reply_target(self):
+        """测试消息字段缺失时从native_uri补齐回复目标"""
+        from bot import resolve_reply_target
+        message = {"item": {
+            "type": "reply", "subject_id": 0, "target_id": 0, "source_id": 0,
+            "uri": "https://www.bilibili.com/video/BV1fy4y1B7Yt",
+            "native_uri": "bilibili://video/800218604?page=0&comment_root_id=3690519331&comment_secondary_id=3744454471",
+        }}
+        self.assertEqual(
+            resolve_reply_target(message, logging.getLogger(__name__)),
+            {"oid": 800218604, "type_id": TYPE_VIDEO, "root": 3690519331, "parent": 3744454471}
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
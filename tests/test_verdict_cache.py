@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+核查结果缓存的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.verdict_cache import VerdictCache, make_cache_key, normalize_claim
+
+
+class TestVerdictCache(unittest.TestCase):
+    """测试核查结果缓存功能"""
+
+    def test_normalize_claim(self):
+        """测试查询内容的归一化"""
+        self.assertEqual(normalize_claim("“暂时不方便开”，后面再开！"), normalize_claim("暂时不方便开 后面再开"))
+        self.assertEqual(make_cache_key(1, "ＡＢＣ"), "1:abc")
+
+    def test_ttl_and_lru(self):
+        """测试过期和容量淘汰"""
+        cache = VerdictCache(ttl=0.05, max_entries=2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_persistence(self):
+        """测试重启后加载未过期的结果"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "verdict_cache.db")
+            cache = VerdictCache(path, max_entries=2)
+            for key in ["a", "b", "c"]:
+                cache.put(key, key.upper())
+            cache.close()
+
+            cache = VerdictCache(path, max_entries=2)
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("c"), "C")
+            cache.close()
+
+    def test_singleflight(self):
+        """测试并发的相同请求只计算一次，失败结果不缓存"""
+        cache = VerdictCache()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "结论"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["结论"] * 5)
+        self.assertEqual(cache.get_or_compute("k", compute), "结论")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "coalesced": 4, "size": 1})
+
+        self.assertIsNone(cache.get_or_compute("x", lambda: None))
+        self.assertIsNone(cache.get("x"))
+
+    def test_singleflight_error(self):
+        """测试计算抛出的异常同样抛给等待同一结果的调用"""
+        cache = VerdictCache()
+        joined = threading.Event()
+        errors = []
+
+        def compute():
+            joined.wait(5)
+            raise RuntimeError("上游不可用")
+
+        def call():
+            try:
+                cache.get_or_compute("k", compute)
+            except RuntimeError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        time.sleep(0.05)
+        follower = threading.Thread(target=call)
+        follower.start()
+        time.sleep(0.05)
+        joined.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(cache.stats()["coalesced"], 1)
+        self.assertIsNone(cache.get("k"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+工作线程池的单元测试
+使用unittest框架进行测试
+"""
+
+import unittest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# 导入待测试的模块
+from src.core.worker_pool import WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    """测试工作线程池功能"""
+
+    def test_concurrent_processing(self):
+        """测试慢任务不会阻塞其他任务"""
+        release = threading.Event()
+        done = []
+
+        def handler(item, deadline):
+            if item == "slow":
+                release.wait(5)
+            return True
+
+        pool = WorkerPool(handler, max_workers=2, max_pending=10, name="test")
+        pool.submit(1, "slow", on_done=lambda key, ok: done.append(key))
+        pool.submit(2, "fast", on_done=lambda key, ok: done.append(key))
+
+        for _ in range(50):
+            if 2 in done:
+                break
+            time.sleep(0.02)
+        self.assertEqual(done, [2])
+
+        release.set()
+        pool.shutdown(wait=True, timeout=5)
+        self.assertEqual(sorted(done), [1, 2])
+
+    def test_duplicate_submit(self):
+        """测试同一任务键在处理期间只会被接收一次"""
+        release = threading.Event()
+        calls = []
+
+        def handler(item, deadline):
+            calls.append(item)
+            release.wait(5)
+            return True
+
+        pool = WorkerPool(handler, max_workers=2, max_pending=10, name="test")
+        self.assertTrue(pool.submit(1, "a"))
+        self.assertFalse(pool.submit(1, "a"))
+        self.assertTrue(pool.is_pending(1))
+
+        release.set()
+        pool.shutdown(wait=True, timeout=5)
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(pool.is_pending(1))
+
+    def test_queue_full(self):
+        """测试等待队列已满时拒绝新任务"""
+        release = threading.Event()
+        pool = WorkerPool(lambda item, deadline: release.wait(5), max_workers=1, max_pending=1, name="test")
+        self.assertTrue(pool.submit(1, "a"))
+        time.sleep(0.1)  # 等待第一个任务被取走
+        self.assertTrue(pool.submit(2, "b"))
+        self.assertFalse(pool.submit(3, "c"))
+        self.assertFalse(pool.is_pending(3))
+
+        release.set()
+        pool.shutdown(wait=True, timeout=5)
+
+    def test_expired_deadline(self):
+        """测试超过截止时间的任务不再执行"""
+        calls = []
+        results = []
+        pool = WorkerPool(lambda item, deadline: calls.append(item) or True, max_workers=1, name="test")
+        pool.submit(1, "a", on_done=lambda key, ok: results.append(ok), deadline=time.time() - 1)
+        pool.shutdown(wait=True, timeout=5)
+
+        self.assertEqual(calls, [])
+        self.assertEqual(results, [False])
+
+    def test_priority_order(self):
+        """设置优先级时按优先级从高到低处理，相同优先级按提交顺序"""
+        release = threading.Event()
+        order = []
+
+        def handler(item, deadline):
+            if item["name"] == "block":
+                release.wait(5)
+            order.append(item["name"])
+            return True
+
+        pool = WorkerPool(handler, max_workers=1, max_pending=10, name="test",
+                          priority=lambda item: item["priority"])
+        pool.submit(0, {"name": "block", "priority": 0})
+        time.sleep(0.1)
+        for key, name, priority in [(1, "low", 1), (2, "high", 5), (3, "mid", 3), (4, "high2", 5)]:
+            pool.submit(key, {"name": name, "priority": priority})
+        release.set()
+        pool.shutdown(wait=True, timeout=5)
+        self.assertEqual(order, ["block", "high", "high2", "mid", "low"])
+
+
+if __name__ == '__main__':
+    unittest.main()
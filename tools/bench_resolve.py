@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复目标解析的性能测试
+用 log/response.json 中的真实@消息测量BV号解码、链接解析和回复目标解析每条消息的耗时
+用法: python tools/bench_resolve.py [response.json] [--rounds N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# 添加项目根目录到系统路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, ROOT)
+
+from bot import extract_video_oid, resolve_reply_target
+from src.api.bilibili import parse_at_messages
+from src.core.bvid import bv_to_av
+from src.core.uri_resolver import resolve_uri
+
+
+def bench(name: str, func, inputs, rounds: int):
+    """对每个输入调用func共rounds轮，打印平均耗时"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for value in inputs:
+            func(value)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(inputs) * rounds:>8} 次, 平均 {elapsed / (len(inputs) * rounds) * 1e6:8.2f} µs/次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回复目标解析性能测试")
+    parser.add_argument("response", nargs="?", default=os.path.join(ROOT, "log/response.json"))
+    parser.add_argument("--rounds", type=int, default=1000)
+    args = parser.parse_args()
+
+    with open(args.response, "r", encoding="utf-8") as f:
+        messages = parse_at_messages(json.load(f))
+    uris = [message["item"]["uri"] for message in messages if message["item"]["uri"]]
+    native_uris = [message["item"]["native_uri"] for message in messages if message["item"]["native_uri"]]
+    bvids = [uri.rstrip("/").rsplit("/", 1)[-1] for uri in uris if "/video/BV" in uri]
+    print(f"共 {len(messages)} 条消息, {len(uris)} 个uri, {len(native_uris)} 个native_uri, 其中 {len(bvids)} 个BV号")
+
+    # 消息中的subject_id等字段去掉后，回复目标只能从链接中解析
+    stripped = [dict(message, item=dict(message["item"], subject_id=0, target_id=0, source_id=0))
+                for message in messages]
+    silent = logging.getLogger("bench")
+    silent.disabled = True
+
+    bench("bv_to_av(无缓存)", lambda bvid: bv_to_av.__wrapped__(bvid), bvids, args.rounds)
+    bench("bv_to_av", bv_to_av, bvids, args.rounds)
+    bench("resolve_uri(uri,无缓存)", resolve_uri.__wrapped__, uris, args.rounds)
+    bench("resolve_uri(native,无缓存)", resolve_uri.__wrapped__, native_uris, args.rounds)
+    bench("resolve_uri", resolve_uri, uris + native_uris, args.rounds)
+    bench("extract_video_oid", extract_video_oid, uris, args.rounds)
+    bench("resolve_reply_target", lambda message: resolve_reply_target(message, silent), stripped, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+机器人压测
+在本地启动B站和Dify的模拟服务(tests/fake_servers.py)，按固定速率产生@消息，
+运行完整的 bot.main，统计回复吞吐量和从被@到收到回复的耗时分位数。
+数据文件写入临时目录，不会影响 log/ 下的数据
+用法: python tools/load_test.py --rate 5 --duration 30 --dify-latency 0.5 --chunk-interval 0.2
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# 添加项目根目录到系统路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, ROOT)
+
+import bot
+from src.api.http_session import close_sessions
+from tests.fake_servers import FakeBilibiliServer, FakeDifyServer
+from tools.trace_report import percentile
+
+
+def configure_bot(bilibili: FakeBilibiliServer, dify: FakeDifyServer, data_dir: str, args: argparse.Namespace):
+    """让机器人连接模拟服务，并缩短轮询间隔和重试等待"""
+    bot.BILIBILI_CONFIG.update(
+        API_BASE=bilibili.base_url,
+        SESSDATA="load-test",
+        BILI_JCT="load-test",
+        CHECK_INTERVAL=args.poll_interval,
+        MIN_CHECK_INTERVAL=args.poll_interval,
+        MAX_CHECK_INTERVAL=args.poll_interval,
+        REPLY_RATE_PER_MINUTE=args.reply_rate_per_minute,
+        REPLY_BURST=args.reply_burst,
+        RETRY_INTERVAL=1,
+        RETRY_MAX_INTERVAL=5,
+        RISK_CONTROL_BACKOFF=args.risk_backoff,
+    )
+    bot.DIFY_CONFIG.update(API_URL=f"{dify.base_url}/v1", API_KEY="load-test")
+    bot.SYSTEM_CONFIG.update(DATA_DIR=data_dir, DEBUG_MODE=False, METRICS_PORT=None)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    执行一次压测
+
+    Returns:
+        Dict[str, Any]: {"mentions", "replies", "rejected", "elapsed", "throughput", "latency": {p50/p90/p99/max},
+        "dify_max_inflight", "depths": {核查深度: 次数}, "requests"}
+    """
+    bilibili = FakeBilibiliServer(latency=args.bilibili_latency, error_rate=args.error_rate,
+                                  reply_rate=args.reply_limit, seed=args.seed).start()
+    dify = FakeDifyServer(latency=args.dify_latency, chunks=args.chunks, chunk_interval=args.chunk_interval,
+                          error_rate=args.error_rate, seed=args.seed).start()
+    stop = threading.Event()
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            configure_bot(bilibili, dify, data_dir, args)
+            runner = threading.Thread(target=bot.main, kwargs={"stop_event": stop}, name="bot-main", daemon=True)
+            runner.start()
+            # 等待机器人完成初始化，之前的消息会被标记为已处理
+            time.sleep(args.poll_interval * 2)
+
+            started = time.time()
+            total = int(args.rate * args.duration)
+            for i in range(total):
+                delay = started + i / args.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                bilibili.add_mention()
+
+            # 等待所有@消息都收到回复，或者超过排空时间
+            drain_end = time.time() + args.drain
+            while len(bilibili.replies) < total and time.time() < drain_end:
+                time.sleep(0.1)
+            elapsed = time.time() - started
+
+            stop.set()
+            runner.join(timeout=60)
+    finally:
+        stop.set()
+        bilibili.close()
+        dify.close()
+        close_sessions()
+
+    latencies = sorted(bilibili.reply_latencies())
+    result = {
+        "mentions": total,
+        "replies": len(latencies),
+        "rejected": bilibili.rejected,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency": {},
+        "dify_max_inflight": dify.max_inflight,
+        "depths": dict(sorted(Counter(str(depth) for depth in dify.depths).items())),
+        "requests": {**bilibili.requests, **{f"dify{path}": count for path, count in dify.requests.items()}},
+    }
+    if latencies:
+        result["latency"] = {f"p{p}": percentile(latencies, p) for p in (50, 90, 99)}
+        result["latency"]["max"] = latencies[-1]
+    return result
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    lines = [
+        f"@消息 {result['mentions']} 条, 回复 {result['replies']} 条, 被限流 {result['rejected']} 次",
+        f"耗时 {result['elapsed']:.1f} 秒, 吞吐量 {result['throughput']:.2f} 条/秒, "
+        f"Dify最大并发 {result['dify_max_inflight']}",
+    ]
+    if result["latency"]:
+        lines.append("从被@到回复(秒): " + ", ".join(f"{name}={value:.3f}" for name, value in result["latency"].items()))
+    if result["depths"]:
+        lines.append("核查深度: " + ", ".join(f"{depth}={count}" for depth, count in result["depths"].items()))
+    lines.append("请求数: " + ", ".join(f"{path}={count}" for path, count in sorted(result["requests"].items())))
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="用本地模拟服务压测机器人")
+    parser.add_argument("--rate", type=float, default=5, help="每秒产生的@消息数")
+    parser.add_argument("--duration", type=float, default=20, help="产生@消息的时长(秒)")
+    parser.add_argument("--drain", type=float, default=60, help="产生结束后等待回复的最长时间(秒)")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="机器人轮询间隔(秒)")
+    parser.add_argument("--dify-latency", type=float, default=0.5, help="Dify返回第一段回答前的延迟(秒)")
+    parser.add_argument("--chunks", type=int, default=5, help="Dify回答的段数")
+    parser.add_argument("--chunk-interval", type=float, default=0.1, help="Dify两段回答之间的间隔(秒)")
+    parser.add_argument("--bilibili-latency", type=float, default=0.02, help="B站接口的延迟(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回HTTP 500的概率")
+    parser.add_argument("--reply-limit", type=float, default=None, help="模拟服务每秒允许的回复数，超过返回-509")
+    parser.add_argument("--reply-rate-per-minute", type=float, default=6000, help="机器人每分钟发送回复数上限")
+    parser.add_argument("--reply-burst", type=int, default=50, help="机器人发送回复的突发数")
+    parser.add_argument("--risk-backoff", type=float, default=5, help="触发风控后暂停发送的时间(秒)")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    parser.add_argument("--verbose", action="store_true", help="输出机器人日志")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    # 先配置日志，bot.setup_logging不会再写入log目录下的日志文件
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    print(format_result(run(args)))
+
+
+if __name__ == "__main__":
+    main()
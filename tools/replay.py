@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流量回放
+读取 SYSTEM_CONFIG["RECORD_TRAFFIC"] 录制的归档(log/traffic/traffic_*.jsonl.gz)，
+用加速的虚拟时钟把@消息按原来的到达时间送入与线上相同的处理流水线(bot.build_runtime创建，
+包括本地分流、优先级、核查深度和熔断)，处理时限同样按虚拟时钟计算；
+Dify返回录制的原始事件，回复只在本地记录不会发送。已处理消息、核查缓存、相似说法索引和暂存消息只保存在内存中。
+输出回复数和虚拟时间下的处理耗时分位数，用同一份录制比较不同版本的表现
+用法: python tools/replay.py [归档文件...] [--speed 50] [--json]
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 添加项目根目录到系统路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, ROOT)
+
+import bot
+from src.core.deadline import configure_clock
+from src.core.rate_limiter import TokenBucket
+from src.core.recorder import read_archive
+from src.core.replay import ReplayDifyAPI, VirtualClock, extract_mentions
+from tools.trace_report import percentile
+
+
+def replay(records: List[Dict[str, Any]], speed: float = 10, drain: float = 60,
+           logger: Optional[logging.Logger] = None) -> Dict[str, Any]:
+    """
+    回放录制的流量
+
+    Args:
+        records (List[Dict]): read_archive读出的记录
+        speed (float, optional): 虚拟时钟倍速. 默认为10.
+        drain (float, optional): 送完所有@消息后等待处理完成的最长时间(秒，真实时间). 默认为60.
+        logger (logging.Logger, optional): 流水线使用的日志记录器
+
+    Returns:
+        Dict[str, Any]: {"mentions", "replies", "failed", "skipped": 本地分流跳过或过期放弃的消息数,
+        "dify_calls", "dify_missing", "wall_seconds", "virtual_seconds",
+        "latency": 拉取到回复的虚拟耗时分位数, "mention_latency": 被@到回复的虚拟耗时分位数}
+    """
+    logger = logger or logging.getLogger("FakeDetectionBot")
+    mentions = extract_mentions(records)
+    if not mentions:
+        return {"mentions": 0, "replies": 0, "failed": 0, "skipped": 0, "dify_calls": 0, "dify_missing": 0,
+                "wall_seconds": 0.0, "virtual_seconds": 0.0, "latency": {}, "mention_latency": {}}
+
+    clock = VirtualClock(start=mentions[0][0], speed=speed)
+    dify = ReplayDifyAPI(records, clock)
+    seen_at = {message["id"]: (ts, message["at_time"]) for ts, message in mentions}
+    replied_at: Dict[int, float] = {}
+    failed = []
+    skipped = []
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def on_reply(message_id: int, success: bool):
+        with lock:
+            if success:
+                replied_at[message_id] = clock.time()
+            else:
+                failed.append(message_id)
+        done.release()
+
+    def on_finished(message_id: int, result: str):
+        # 回复写入发件箱的消息在发送后才算结束
+        if result == "processed":
+            return
+        with lock:
+            (failed if result == "failed" else skipped).append(message_id)
+        done.release()
+
+    configure_clock(clock.time)
+    # 与main()相同的组件，存储只保存在内存中，不写时间线、不录制、不启动指标服务，回复只在本地记录
+    config = {**bot.SYSTEM_CONFIG, "TRACE_ENABLED": False, "RECORD_TRAFFIC": False, "COORDINATION_DB": None,
+              "METRICS_PORT": None}
+    runtime = bot.build_runtime(
+        config, logger, dify,
+        persistent=False,
+        send=lambda **kwargs: {"code": 0, "message": "0", "data": {"rpid": 0}},
+        bucket=TokenBucket(rate=1e9, capacity=1e9),
+        on_reply=on_reply,
+        on_finished=on_finished,
+        clock=clock.time
+    )
+    # 核查缓存按真实时间过期，有效期按倍速缩短
+    runtime.verdict_cache.ttl = bot.DIFY_CONFIG.get("VERDICT_CACHE_TTL", 86400) / speed
+    dispatcher = runtime.dispatcher
+    poll_interval = bot.BILIBILI_CONFIG.get("MIN_CHECK_INTERVAL", 3)
+
+    wall_start = time.monotonic()
+    try:
+        index = 0
+        while index < len(mentions):
+            ts = mentions[index][0]
+            batch = [message for at, message in mentions[index:] if at == ts]
+            index += len(batch)
+            clock.sleep_until(ts)
+            # 与主循环一样，先统计本批消息所在评论区的热度，再依次派发
+            for message in batch:
+                dispatcher.prioritizer.observe(message)
+            for message in batch:
+                if dispatcher.drop_if_stale(message):
+                    continue
+                while not dispatcher.dispatch(message):
+                    # 入口队列已满，与线上一样等到下一次轮询再派发
+                    clock.sleep(poll_interval)
+                    dispatcher.resume_parked()
+            dispatcher.resume_parked()
+        drain_end = time.monotonic() + drain
+        finished = 0
+        while finished < len(mentions) and time.monotonic() < drain_end:
+            if done.acquire(timeout=max(0.0, min(drain_end - time.monotonic(), poll_interval / clock.speed))):
+                finished += 1
+            else:
+                # 熔断恢复后重新派发暂存的消息
+                dispatcher.resume_parked()
+    finally:
+        runtime.close(timeout=drain)
+        configure_clock(None)
+
+    with lock:
+        latencies = sorted(at - seen_at[message_id][0] for message_id, at in replied_at.items())
+        mention_latencies = sorted(at - seen_at[message_id][1] for message_id, at in replied_at.items())
+        failed_count = len(failed)
+        skipped_count = len(skipped)
+    return {
+        "mentions": len(mentions),
+        "replies": len(latencies),
+        "failed": failed_count,
+        "skipped": skipped_count,
+        "dify_calls": dify.calls,
+        "dify_missing": dify.missing,
+        "wall_seconds": time.monotonic() - wall_start,
+        "virtual_seconds": clock.time() - clock.start,
+        "latency": summarize(latencies),
+        "mention_latency": summarize(mention_latencies),
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    result = {f"p{p}": percentile(values, p) for p in (50, 90, 99)}
+    result["max"] = values[-1]
+    return result
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    lines = [
+        f"@消息 {result['mentions']} 条, 回复 {result['replies']} 条, 失败 {result['failed']} 条, "
+        f"跳过 {result['skipped']} 条, "
+        f"Dify请求 {result['dify_calls']} 次(其中 {result['dify_missing']} 次没有录制)",
+        f"真实耗时 {result['wall_seconds']:.1f} 秒, 虚拟耗时 {result['virtual_seconds']:.1f} 秒",
+    ]
+    for name, label in (("latency", "拉取到回复"), ("mention_latency", "被@到回复")):
+        if result[name]:
+            lines.append(f"{label}(秒): " + ", ".join(f"{key}={value:.2f}" for key, value in result[name].items()))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="以加速的虚拟时钟回放录制的流量")
+    parser.add_argument("files", nargs="*", help="归档文件，默认为 log/traffic/traffic_*.jsonl.gz")
+    parser.add_argument("--speed", type=float, default=10, help="虚拟时钟倍速")
+    parser.add_argument("--drain", type=float, default=60, help="送完@消息后等待处理完成的最长时间(秒)")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    parser.add_argument("--verbose", action="store_true", help="输出流水线日志")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    paths = args.files or sorted(glob.glob(os.path.join(bot.data_path("traffic"), "traffic_*.jsonl.gz")))
+    if not paths:
+        print("没有找到流量归档")
+        return
+    result = replay(read_archive(paths), speed=args.speed, drain=args.drain)
+    print(json.dumps(result, ensure_ascii=False) if args.json else format_result(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+处理时间线汇总
+读取 log/trace_*.jsonl，按阶段输出耗时的分位数，用于定位回复变慢的原因
+（轮询间隔、解析目标、Dify排队和流式输出、发件箱排队和重试等）
+用法: python tools/trace_report.py [trace文件...] [--failed]
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# 添加项目根目录到系统路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, ROOT)
+
+from src.core.tracing import KIND_MESSAGE, KIND_POLL, KIND_REPLY
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法计算分位数，sorted_values需已排序且非空"""
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def read_records(paths: Iterable[str]) -> Iterable[Dict]:
+    """逐行读取JSONL记录，跳过无法解析的行（如写入中断的最后一行）"""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def collect(records: Iterable[Dict], failed_only: bool = False) -> Dict[str, List[float]]:
+    """
+    把记录整理为 {阶段名: [耗时(秒)...]}
+
+    - message: 各span的耗时；顶层span之间的空档记为"<阶段>.wait"（在流水线队列中等待的时间）；
+      "message.total"为整条消息的处理时间，"message.lag"为被@到开始处理之间的时间
+    - poll: "poll"为拉取耗时，"poll.gap"为两次轮询开始之间的间隔
+    - reply: "outbox.wait"为入队到本次发送的时间，"outbox.reply_post"为发送请求耗时
+    """
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for record in records:
+        kind = record.get("kind")
+        if kind == KIND_MESSAGE:
+            if failed_only and record.get("ok"):
+                continue
+            samples["message.total"].append(record.get("dur", 0.0))
+            if record.get("lag") is not None:
+                samples["message.lag"].append(record["lag"])
+            previous_end = 0.0
+            for span in record.get("spans", []):
+                if "dur" not in span:
+                    continue
+                samples[span["name"]].append(span["dur"])
+                if "parent" not in span:
+                    samples[f"{span['name']}.wait"].append(max(0.0, span["start"] - previous_end))
+                    previous_end = span["start"] + span["dur"]
+        elif kind == KIND_POLL and not failed_only:
+            if record.get("dur") is not None:
+                samples["poll"].append(record["dur"])
+            if record.get("gap") is not None:
+                samples["poll.gap"].append(record["gap"])
+        elif kind == KIND_REPLY:
+            if failed_only and record.get("result") == "ok":
+                continue
+            samples["outbox.wait"].append(record.get("wait", 0.0))
+            samples["outbox.reply_post"].append(record.get("dur", 0.0))
+    return samples
+
+
+def summarize(samples: Dict[str, List[float]]) -> List[Dict]:
+    """
+    Returns:
+        List[Dict]: 每个阶段一行 {"stage", "count", "p50", "p90", "p99", "max", "total"}，按总耗时从大到小排列
+    """
+    rows = []
+    for stage, values in samples.items():
+        if not values:
+            continue
+        values = sorted(values)
+        row = {"stage": stage, "count": len(values)}
+        for p in PERCENTILES:
+            row[f"p{p}"] = percentile(values, p)
+        row["max"] = values[-1]
+        row["total"] = sum(values)
+        rows.append(row)
+    rows.sort(key=lambda row: row["total"], reverse=True)
+    return rows
+
+
+def format_table(rows: List[Dict]) -> str:
+    # 表头的中文字符占两列宽度
+    header = f"{'阶段':<22} {'次数':>6}" + "".join(f" {'p' + str(p):>10}" for p in PERCENTILES) + f" {'max':>10} {'合计':>10}"
+    lines = [header]
+    for row in rows:
+        lines.append(
+            f"{row['stage']:<24} {row['count']:>8}"
+            + "".join(f" {row['p' + str(p)]:>10.3f}" for p in PERCENTILES)
+            + f" {row['max']:>10.3f} {row['total']:>12.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="按阶段汇总处理时间线的耗时分位数(秒)")
+    parser.add_argument("files", nargs="*", help="trace文件，默认为 log/trace_*.jsonl")
+    parser.add_argument("--failed", action="store_true", help="只统计处理失败的消息和发送失败的回复")
+    args = parser.parse_args(argv)
+
+    paths = args.files or sorted(glob.glob(os.path.join(ROOT, "log", "trace_*.jsonl")))
+    if not paths:
+        print("没有找到trace文件")
+        return
+    rows = summarize(collect(read_records(paths), failed_only=args.failed))
+    print(f"共 {len(paths)} 个文件")
+    print(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()
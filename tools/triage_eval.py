@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地分流的标注、训练和评估
+- export: 从录制的流量归档(log/traffic/)导出@消息，生成待标注的语料，label留空，predicted为当前的分流结果
+- train: 用标注好的语料训练朴素贝叶斯分类器，保存为模型文件(配置到 DIFY_CONFIG["TRIAGE_MODEL"])
+- eval: 在标注好的语料上输出各分流结果的精确率和召回率、混淆矩阵和节省的Dify调用比例，
+  --cv K 时按K折交叉验证训练分类器，避免在训练语料上评估
+
+语料为JSONL，每行 {"id", "title", "content", "label"}，label为 skip / template / escalate
+用法:
+    python tools/triage_eval.py export [归档文件...] -o corpus.jsonl
+    python tools/triage_eval.py train corpus.jsonl -o triage_model.json
+    python tools/triage_eval.py eval corpus.jsonl [--model triage_model.json | --cv 5] [--json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+# 添加项目根目录到系统路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, ROOT)
+
+from src.api.bilibili import parse_at_messages
+from src.core.recorder import KIND_POLL, read_archive
+from src.core.triage import (
+    NaiveBayesClassifier, Triage, TRIAGE_DECISIONS, TRIAGE_ESCALATE, text_features
+)
+
+
+def sample_message(sample: Dict[str, Any]) -> Dict[str, Any]:
+    """把语料中的一条样本转换为分流使用的@消息格式"""
+    return {"id": sample.get("id", 0), "item": {"title": sample.get("title", ""),
+                                                 "source_content": sample.get("content", "")}}
+
+
+def read_corpus(path: str) -> List[Dict[str, Any]]:
+    """读取语料，只保留标注了合法label的样本"""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                sample = json.loads(line)
+            except ValueError:
+                continue
+            if sample.get("label") in TRIAGE_DECISIONS:
+                samples.append(sample)
+    return samples
+
+
+def export_corpus(records: List[Dict[str, Any]], triage: Optional[Triage] = None) -> List[Dict[str, Any]]:
+    """
+    从录制的轮询响应中取出所有不重复的@消息，生成待标注的样本
+
+    Returns:
+        List[Dict]: [{"id", "title", "content", "label": "", "predicted"}]
+    """
+    triage = triage or Triage()
+    seen = set()
+    samples = []
+    for record in records:
+        if record.get("kind") != KIND_POLL:
+            continue
+        for message in parse_at_messages(record.get("response") or {"code": -1, "message": ""}):
+            if message["id"] in seen:
+                continue
+            seen.add(message["id"])
+            samples.append({
+                "id": message["id"],
+                "title": message["item"]["title"],
+                "content": message["item"].get("source_content") or message["item"].get("content", ""),
+                "label": "",
+                "predicted": triage.classify(message).decision,
+            })
+    return samples
+
+
+def train_classifier(samples: List[Dict[str, Any]]) -> NaiveBayesClassifier:
+    """用标注好的样本训练分类器"""
+    return NaiveBayesClassifier().train(
+        (text_features(sample.get("title", ""), sample.get("content", "")), sample["label"]) for sample in samples
+    )
+
+
+def evaluate(samples: List[Dict[str, Any]], predictions: List[str]) -> Dict[str, Any]:
+    """
+    计算分流效果
+
+    Args:
+        samples (List[Dict]): 标注好的样本
+        predictions (List[str]): 与样本一一对应的分流结果
+
+    Returns:
+        Dict[str, Any]: {"samples", "accuracy", "classes": {结果: {"precision", "recall", "support"}},
+        "confusion": {标注: {预测: 数量}}, "dify_saved": 未交给Dify的比例,
+        "missed_claims": 应该核查但没有交给Dify的样本数}
+    """
+    confusion = {label: {predicted: 0 for predicted in TRIAGE_DECISIONS} for label in TRIAGE_DECISIONS}
+    for sample, predicted in zip(samples, predictions):
+        confusion[sample["label"]][predicted] += 1
+
+    classes = {}
+    for decision in TRIAGE_DECISIONS:
+        true_positive = confusion[decision][decision]
+        predicted_count = sum(confusion[label][decision] for label in TRIAGE_DECISIONS)
+        support = sum(confusion[decision].values())
+        classes[decision] = {
+            "precision": true_positive / predicted_count if predicted_count else None,
+            "recall": true_positive / support if support else None,
+            "support": support,
+        }
+    total = len(samples)
+    correct = sum(confusion[decision][decision] for decision in TRIAGE_DECISIONS)
+    escalated = sum(confusion[label][TRIAGE_ESCALATE] for label in TRIAGE_DECISIONS)
+    return {
+        "samples": total,
+        "accuracy": correct / total if total else None,
+        "classes": classes,
+        "confusion": confusion,
+        "dify_saved": (total - escalated) / total if total else None,
+        "missed_claims": sum(confusion[TRIAGE_ESCALATE].values()) - confusion[TRIAGE_ESCALATE][TRIAGE_ESCALATE],
+    }
+
+
+def predict(samples: List[Dict[str, Any]], model: Optional[NaiveBayesClassifier] = None,
+            folds: int = 0, **kwargs: Any) -> List[str]:
+    """
+    对样本分流
+
+    Args:
+        samples (List[Dict]): 样本
+        model (NaiveBayesClassifier, optional): 分类器，None且folds为0时只使用规则
+        folds (int, optional): 大于1时按K折交叉验证，每折用其余样本训练的分类器. 默认为0.
+        **kwargs: 传给Triage的其他参数
+
+    Returns:
+        List[str]: 与样本一一对应的分流结果
+    """
+    if folds > 1:
+        predictions = [""] * len(samples)
+        for fold in range(folds):
+            training = [sample for index, sample in enumerate(samples) if index % folds != fold]
+            triage = Triage(classifier=train_classifier(training), **kwargs)
+            for index in range(fold, len(samples), folds):
+                predictions[index] = triage.classify(sample_message(samples[index])).decision
+        return predictions
+    triage = Triage(classifier=model, **kwargs)
+    return [triage.classify(sample_message(sample)).decision for sample in samples]
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    def percent(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 100:.1f}%"
+
+    lines = [
+        f"样本 {result['samples']} 条, 准确率 {percent(result['accuracy'])}, "
+        f"未调用Dify {percent(result['dify_saved'])}, 应核查但未交给Dify {result['missed_claims']} 条",
+        "",
+        f"{'结果':<10} {'精确率':>8} {'召回率':>8} {'样本数':>6}",
+    ]
+    for decision, metrics in result["classes"].items():
+        lines.append(f"{decision:<10} {percent(metrics['precision']):>8} {percent(metrics['recall']):>8} "
+                     f"{metrics['support']:>6}")
+    lines.extend(["", "混淆矩阵(行为标注，列为分流结果):",
+                  " " * 10 + " ".join(f"{decision:>9}" for decision in TRIAGE_DECISIONS)])
+    for label, row in result["confusion"].items():
+        lines.append(f"{label:<10}" + " ".join(f"{row[decision]:>9}" for decision in TRIAGE_DECISIONS))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地分流的标注、训练和评估")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="从流量归档导出待标注的语料")
+    export_parser.add_argument("files", nargs="*", help="归档文件，默认为 log/traffic/traffic_*.jsonl.gz")
+    export_parser.add_argument("-o", "--output", required=True, help="输出的语料文件")
+
+    train_parser = commands.add_parser("train", help="训练分类器")
+    train_parser.add_argument("corpus", help="标注好的语料文件")
+    train_parser.add_argument("-o", "--output", required=True, help="输出的模型文件")
+
+    eval_parser = commands.add_parser("eval", help="评估分流效果")
+    eval_parser.add_argument("corpus", help="标注好的语料文件")
+    eval_parser.add_argument("--model", help="分类器模型文件，不指定时只使用规则")
+    eval_parser.add_argument("--cv", type=int, default=0, help="K折交叉验证训练分类器")
+    eval_parser.add_argument("--threshold", type=float, default=0.9, help="分类器判断为skip/template所需的最低概率")
+    eval_parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        paths = args.files or sorted(glob.glob(os.path.join(ROOT, "log", "traffic", "traffic_*.jsonl.gz")))
+        samples = export_corpus(read_archive(paths))
+        with open(args.output, "w", encoding="utf-8") as f:
+            for sample in samples:
+                f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        print(f"已导出 {len(samples)} 条@消息到 {args.output}，请填写label后用于训练和评估")
+    elif args.command == "train":
+        samples = read_corpus(args.corpus)
+        train_classifier(samples).save(args.output)
+        print(f"已用 {len(samples)} 条样本训练分类器，保存到 {args.output}")
+    else:
+        samples = read_corpus(args.corpus)
+        model = NaiveBayesClassifier.load(args.model) if args.model else None
+        result = evaluate(samples, predict(samples, model, folds=args.cv, threshold=args.threshold))
+        print(json.dumps(result, ensure_ascii=False) if args.json else format_result(result))
+
+
+if __name__ == "__main__":
+    main()